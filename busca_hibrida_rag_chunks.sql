@@ -0,0 +1,19 @@
+-- ============================================================
+-- Busca híbrida (RAG_BACKEND=pg): tsvector armazenado em rag_chunks
+-- Execute este SQL no Postgres/Supabase antes de usar hybrid_search.py
+-- ============================================================
+
+-- 1. Coluna tsvector gerada e armazenada (não recalcula to_tsvector por linha
+--    a cada consulta)
+ALTER TABLE rag_chunks
+    ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('portuguese', coalesce(content, ''))) STORED;
+
+-- 2. Índice GIN sobre a coluna armazenada
+CREATE INDEX IF NOT EXISTS rag_chunks_content_tsv_idx
+    ON rag_chunks USING GIN (content_tsv);
+
+ANALYZE rag_chunks;
+
+-- Verificar
+SELECT count(*) AS chunks, count(content_tsv) AS com_tsv FROM rag_chunks;
@@ -8,6 +8,8 @@ import logging
 from typing import Dict, List, Optional, Any
 from datetime import datetime, timedelta
 
+from http_clients import get_http_clients
+
 logger = logging.getLogger(__name__)
 
 class CloudflareAPI:
@@ -29,7 +31,9 @@ class CloudflareAPI:
         url = f"{self.base_url}{endpoint}"
         
         try:
-            response = requests.request(method, url, headers=self.headers, **kwargs)
+            response = get_http_clients().request(
+                "cloudflare", method, url, headers=self.headers, **kwargs
+            )
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
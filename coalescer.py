@@ -0,0 +1,184 @@
+"""
+Agrupamento (debounce) de mensagens por remetente para o WhatsApp do ARIA-SDR
+
+Usuários de WhatsApp mandam várias mensagens curtas em sequência ("oi",
+"tudo bem?", "quero enviar 2000 emails"); cada uma disparava roteamento,
+RAG, LLM e uma resposta separada. O coalescer segura as mensagens de cada
+remetente por uma janela curta e entrega o lote inteiro de uma vez, para
+que a ARIA responda uma só vez com todo o contexto.
+
+- Janela deslizante: cada mensagem nova adia o envio em `window_s`, até no
+  máximo `max_wait_s` desde a primeira do lote
+- Envio imediato ao atingir `max_messages` mensagens ou `max_chars` caracteres
+- Memória limitada: no máximo `max_buffers` remetentes em espera; acima
+  disso o buffer mais antigo é enviado na hora
+- Lotes de um mesmo remetente são processados um depois do outro (um lote
+  enviado por tamanho não corre junto com o seguinte)
+- `add()` devolve um future que termina quando o lote do remetente foi
+  processado (a fila de webhooks usa isso para só então limpar o spool)
+- Métricas: mensagens recebidas, lotes, chamadas economizadas e motivo do envio
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+FlushFn = Callable[[str, list[Any]], Awaitable[Any]]
+
+
+class _Buffer:
+    __slots__ = ("items", "futures", "chars", "first_at", "timer")
+
+    def __init__(self, now: float):
+        self.items: list[Any] = []
+        self.futures: list[asyncio.Future] = []
+        self.chars = 0
+        self.first_at = now
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class MessageCoalescer:
+    """Buffers por chave (remetente) enviados em lote após uma janela de silêncio"""
+
+    def __init__(
+        self,
+        flush: FlushFn,
+        window_s: float = 1.5,
+        max_wait_s: float = 5.0,
+        max_messages: int = 5,
+        max_chars: int = 1000,
+        max_buffers: int = 10_000,
+    ):
+        self._flush_fn = flush
+        self.window_s = max(0.0, float(window_s))
+        self.max_wait_s = max(self.window_s, float(max_wait_s))
+        self.max_messages = max(1, int(max_messages))
+        self.max_chars = max(1, int(max_chars))
+        self.max_buffers = max(1, int(max_buffers))
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # dict preserva a ordem de criação: o primeiro é o buffer mais antigo
+        self._buffers: dict[str, _Buffer] = {}
+        self._tasks: set[asyncio.Task] = set()
+        # último lote despachado por remetente: o próximo espera por ele
+        self._chains: dict[str, asyncio.Task] = {}
+        # métricas
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.batches = 0
+        self.errors = 0
+        self.flush_reasons = {"window": 0, "max_wait": 0, "size": 0, "capacity": 0, "close": 0}
+
+    def _bind_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # novo event loop (ex.: testes com asyncio.run): estado anterior é descartado
+            self._loop = loop
+            self._buffers = {}
+            self._tasks = set()
+            self._chains = {}
+        return loop
+
+    def add(self, key: str, item: Any, size: int = 1) -> asyncio.Future:
+        """Adiciona `item` ao buffer de `key`; o future termina com o resultado do lote"""
+        loop = self._bind_loop()
+        now = loop.time()
+        buf = self._buffers.get(key)
+        if buf is None:
+            if len(self._buffers) >= self.max_buffers:
+                self._flush(next(iter(self._buffers)), "capacity")
+            buf = self._buffers[key] = _Buffer(now)
+        fut: asyncio.Future = loop.create_future()
+        buf.items.append(item)
+        buf.futures.append(fut)
+        buf.chars += max(0, int(size))
+        with self._lock:
+            self.messages += 1
+        if len(buf.items) >= self.max_messages or buf.chars >= self.max_chars:
+            self._flush(key, "size")
+            return fut
+        if buf.timer is not None:
+            buf.timer.cancel()
+        deadline = buf.first_at + self.max_wait_s
+        if now + self.window_s >= deadline:
+            buf.timer = loop.call_at(deadline, self._flush, key, "max_wait")
+        else:
+            buf.timer = loop.call_at(now + self.window_s, self._flush, key, "window")
+        return fut
+
+    def pending(self, key: str | None = None) -> int:
+        """Mensagens em espera (de um remetente ou no total)"""
+        if key is not None:
+            buf = self._buffers.get(key)
+            return len(buf.items) if buf else 0
+        return sum(len(b.items) for b in self._buffers.values())
+
+    def _flush(self, key: str, reason: str) -> None:
+        buf = self._buffers.pop(key, None)
+        if buf is None:
+            return
+        if buf.timer is not None:
+            buf.timer.cancel()
+        with self._lock:
+            self.batches += 1
+            self.flush_reasons[reason] += 1
+        task = asyncio.ensure_future(self._run(key, buf, self._chains.get(key)))
+        self._chains[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda t: self._chains.get(key) is t and self._chains.pop(key))
+
+    async def _run(self, key: str, buf: _Buffer, previous: asyncio.Task | None) -> None:
+        if previous is not None:
+            # ordem por remetente: o lote anterior (com sucesso ou não) termina antes
+            await asyncio.wait([previous])
+        try:
+            result = await self._flush_fn(key, buf.items)
+        except BaseException as e:
+            with self._lock:
+                self.errors += 1
+            logger.error("Falha ao processar lote de %d mensagens de %s: %s", len(buf.items), key, e)
+            for fut in buf.futures:
+                if not fut.done():
+                    if isinstance(e, asyncio.CancelledError):
+                        fut.cancel()
+                    else:
+                        fut.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for fut in buf.futures:
+            if not fut.done():
+                fut.set_result(result)
+
+    async def close(self) -> None:
+        """Envia todos os buffers pendentes e espera os lotes em andamento"""
+        if self._loop is not asyncio.get_running_loop():
+            return
+        for key in list(self._buffers):
+            self._flush(key, "close")
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            out: dict[str, Any] = {
+                "messages": self.messages,
+                "batches": self.batches,
+                "errors": self.errors,
+                "flush_reasons": dict(self.flush_reasons),
+                "window_ms": round(self.window_s * 1000, 2),
+                "max_wait_ms": round(self.max_wait_s * 1000, 2),
+                "max_messages": self.max_messages,
+            }
+        out["buffered_senders"] = len(self._buffers)
+        out["buffered_messages"] = self.pending()
+        flushed = out["messages"] - out["buffered_messages"]
+        out["calls_saved"] = max(0, flushed - out["batches"])
+        out["avg_batch_size"] = round(flushed / out["batches"], 2) if out["batches"] else 0.0
+        return out
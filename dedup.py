@@ -0,0 +1,239 @@
+"""
+Deduplicação idempotente dos webhooks do WhatsApp por message_id
+
+O Mindchat/Meta reenvia entregas que não receberam 200 a tempo; sem
+controle de `message_id` cada reenvio rodava de novo roteamento, RAG e LLM
+e o usuário recebia a resposta duplicada. O deduplicador descarta ids já
+vistos antes de qualquer trabalho.
+
+Camadas:
+- Janela exata em memória com duas gerações rotativas (memória limitada a
+  `max_entries`, ids expiram após `window_s`)
+- Backend compartilhado opcional para várias réplicas: tabela
+  `aria_webhook_dedup` via REST do Supabase ou Postgres direto
+  (ver deduplicacao_webhooks.sql)
+- Se o backend falhar a mensagem é processada (fail-open), com contador
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Protocol
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class DedupBackend(Protocol):
+    """Contrato mínimo de um backend compartilhado de deduplicação"""
+
+    def claim(self, message_id: str) -> bool:
+        """Registra o id; True se é a primeira vez que ele aparece"""
+        ...
+
+    def release(self, message_id: str) -> None:
+        """Desfaz o registro (a mensagem não foi aceita e será reenviada)"""
+        ...
+
+
+class SupabaseDedupBackend:
+    """Tabela `aria_webhook_dedup` via REST (insert com ignore-duplicates)"""
+
+    def __init__(self, base_url: str, key: str, table: str = "aria_webhook_dedup", timeout: float = 3):
+        self.url = f"{base_url.rstrip('/')}/rest/v1/{table}"
+        self.timeout = timeout
+        self.headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        }
+        self._session = requests.Session()
+
+    def claim(self, message_id: str) -> bool:
+        r = self._session.post(
+            self.url,
+            headers={**self.headers, "Prefer": "resolution=ignore-duplicates,return=representation"},
+            json={"id": message_id, "seen_at": datetime.now(timezone.utc).isoformat()},
+            timeout=self.timeout,
+        )
+        if r.status_code >= 300:
+            raise RuntimeError(f"aria_webhook_dedup insert failed: {r.status_code} -> {r.text}")
+        # linha ignorada (id já existente) volta como lista vazia
+        return bool(r.json())
+
+    def release(self, message_id: str) -> None:
+        self._session.delete(
+            self.url,
+            headers=self.headers,
+            params={"id": f"eq.{message_id}"},
+            timeout=self.timeout,
+        )
+
+    def close(self) -> None:
+        self._session.close()
+
+
+class PostgresDedupBackend:
+    """Mesma tabela via Postgres direto (pool de pg_pool.py)"""
+
+    def __init__(self, pool: Any, table: str = "aria_webhook_dedup"):
+        self.pool = pool
+        self.table = table
+
+    def claim(self, message_id: str) -> bool:
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                f"INSERT INTO {self.table} (id) VALUES (%s) ON CONFLICT (id) DO NOTHING RETURNING id",
+                (message_id,),
+            ).fetchone()
+            conn.commit()
+        return row is not None
+
+    def release(self, message_id: str) -> None:
+        with self.pool.connection() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE id = %s", (message_id,))
+            conn.commit()
+
+
+class MessageDeduplicator:
+    """Janela de ids recentes em memória na frente de um backend opcional.
+
+    - `window_s`: por quanto tempo um id repetido é descartado
+    - `max_entries`: teto de ids em memória (as duas gerações somadas)
+    """
+
+    def __init__(
+        self,
+        window_s: float = 86400,
+        max_entries: int = 100_000,
+        backend: DedupBackend | None = None,
+    ):
+        self.window_s = max(1.0, float(window_s))
+        self.max_entries = max(2, int(max_entries))
+        self.backend = backend
+        self._current: dict[str, float] = {}
+        self._previous: dict[str, float] = {}
+        self._rotated_at = time.monotonic()
+        self._mutex = threading.Lock()
+        self.checked = 0
+        self.suppressed = 0
+        self.rotations = 0
+        self.backend_errors = 0
+
+    def _rotate_if_needed(self, now: float) -> None:
+        if now - self._rotated_at >= self.window_s or len(self._current) >= self.max_entries // 2:
+            self._previous, self._current = self._current, {}
+            self._rotated_at = now
+            self.rotations += 1
+
+    def _seen_locally(self, message_id: str, now: float) -> bool:
+        seen_at = self._current.get(message_id)
+        if seen_at is None:
+            seen_at = self._previous.get(message_id)
+        return seen_at is not None and now - seen_at < self.window_s
+
+    def is_duplicate(self, message_id: str | None) -> bool:
+        """Marca o id como visto; True se ele já tinha sido visto na janela.
+
+        Ids vazios nunca são tratados como duplicados.
+        """
+        if not message_id:
+            return False
+        now = time.monotonic()
+        with self._mutex:
+            self.checked += 1
+            if self._seen_locally(message_id, now):
+                self.suppressed += 1
+                return True
+            self._rotate_if_needed(now)
+            self._current[message_id] = now
+        if self.backend is None:
+            return False
+        try:
+            first = self.backend.claim(message_id)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning(f"Backend de deduplicação indisponível: {e}")
+            return False
+        if not first:
+            with self._mutex:
+                self.suppressed += 1
+            return True
+        return False
+
+    async def ais_duplicate(self, message_id: str | None) -> bool:
+        if self.backend is None:
+            return self.is_duplicate(message_id)
+        return await asyncio.to_thread(self.is_duplicate, message_id)
+
+    def forget(self, message_id: str | None) -> None:
+        """Esquece o id (mensagem recusada ou falhou antes de ser aceita)"""
+        if not message_id:
+            return
+        with self._mutex:
+            self._current.pop(message_id, None)
+            self._previous.pop(message_id, None)
+        if self.backend is not None:
+            try:
+                self.backend.release(message_id)
+            except Exception as e:
+                self.backend_errors += 1
+                logger.warning(f"Backend de deduplicação indisponível (release): {e}")
+
+    async def aforget(self, message_id: str | None) -> None:
+        if self.backend is None:
+            self.forget(message_id)
+        else:
+            await asyncio.to_thread(self.forget, message_id)
+
+    def close(self) -> None:
+        """Fecha a conexão do backend (o pool Postgres é fechado por quem o criou)"""
+        close = getattr(self.backend, "close", None)
+        if close is not None:
+            close()
+
+    def stats(self) -> dict[str, Any]:
+        with self._mutex:
+            entries = len(self._current) + len(self._previous)
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "window_s": self.window_s,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "checked": self.checked,
+            "suppressed": self.suppressed,
+            "rotations": self.rotations,
+            "backend_errors": self.backend_errors,
+        }
+
+
+def build_deduplicator_from_env(pg_pool_factory: Any = None) -> MessageDeduplicator:
+    """Cria o deduplicador a partir de WEBHOOK_DEDUP_* (memory | supabase | pg)"""
+    kind = os.getenv("WEBHOOK_DEDUP_BACKEND", "memory").strip().lower()
+    backend: DedupBackend | None = None
+    if kind == "supabase":
+        url = os.getenv("SUPABASE_URL", "")
+        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+        if url and key:
+            backend = SupabaseDedupBackend(url, key)
+        else:
+            logger.warning("WEBHOOK_DEDUP_BACKEND=supabase sem SUPABASE_URL/KEY; usando só memória")
+    elif kind == "pg":
+        if pg_pool_factory is not None:
+            try:
+                backend = PostgresDedupBackend(pg_pool_factory())
+            except Exception as e:
+                logger.warning(f"WEBHOOK_DEDUP_BACKEND=pg indisponível ({e}); usando só memória")
+        else:
+            logger.warning("WEBHOOK_DEDUP_BACKEND=pg sem DATABASE_URL; usando só memória")
+    return MessageDeduplicator(
+        window_s=float(os.getenv("WEBHOOK_DEDUP_WINDOW_S", "86400")),
+        max_entries=int(os.getenv("WEBHOOK_DEDUP_MAX", "100000")),
+        backend=backend,
+    )
@@ -0,0 +1,16 @@
+-- ============================================================
+-- Deduplicação de webhooks do WhatsApp entre réplicas (dedup.py)
+-- Necessário só com WEBHOOK_DEDUP_BACKEND=supabase ou pg
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS aria_webhook_dedup (
+    id TEXT PRIMARY KEY,              -- message_id do WhatsApp (wamid...)
+    seen_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS aria_webhook_dedup_seen_at_idx ON aria_webhook_dedup (seen_at);
+
+-- Limpeza periódica (ex.: pg_cron diário); manter acima de WEBHOOK_DEDUP_WINDOW_S
+-- SELECT cron.schedule('aria_webhook_dedup_cleanup', '0 4 * * *',
+--     $$DELETE FROM aria_webhook_dedup WHERE seen_at < NOW() - INTERVAL '7 days'$$);
+DELETE FROM aria_webhook_dedup WHERE seen_at < NOW() - INTERVAL '7 days';
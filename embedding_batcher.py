@@ -0,0 +1,132 @@
+"""
+Micro-batching de embeddings de consulta para o RAG do ARIA-SDR
+
+Em pico, várias chamadas simultâneas de /assist/routing e /rag/query pediam
+um `embeddings.create` de uma entrada cada. O batcher junta os textos que
+chegam numa janela curta (ou até encher o lote), faz uma única chamada com
+todas as entradas e devolve a cada chamador o seu vetor.
+
+- EMBEDDING_BATCH_WINDOW_MS: espera máxima para juntar o lote (padrão 5)
+- EMBEDDING_BATCH_MAX: entradas por chamada (padrão 64; a API aceita 2048)
+- Textos repetidos no mesmo lote são enviados uma vez só
+- Métricas: lotes, taxa de preenchimento e atraso adicionado pela fila
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+EmbedMany = Callable[[list[str]], Awaitable[list[list[float]]]]
+
+OPENAI_MAX_INPUTS = 2048
+
+
+class EmbeddingBatcher:
+    """Fila assíncrona que agrupa pedidos de embedding em chamadas em lote"""
+
+    def __init__(self, embed_many: EmbedMany, max_batch: int = 64, window_ms: float = 5.0):
+        self._embed_many = embed_many
+        self.max_batch = max(1, min(int(max_batch), OPENAI_MAX_INPUTS))
+        self.window = max(0.0, float(window_ms)) / 1000
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pending: list[tuple[str, asyncio.Future, float]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        # métricas
+        self._lock = threading.Lock()
+        self._delays: deque[float] = deque(maxlen=1024)
+        self.requests = 0
+        self.batches = 0
+        self.inputs_sent = 0
+        self.errors = 0
+
+    def _bind_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # novo event loop (ex.: testes com asyncio.run): estado anterior é descartado
+            self._loop = loop
+            self._pending = []
+            self._timer = None
+            self._tasks = set()
+        return loop
+
+    async def embed(self, text: str) -> list[float]:
+        loop = self._bind_loop()
+        fut: asyncio.Future = loop.create_future()
+        self._pending.append((text, fut, time.perf_counter()))
+        with self._lock:
+            self.requests += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[: self.max_batch], self._pending[self.max_batch :]
+        if self._pending and self._loop is not None:
+            self._timer = self._loop.call_later(0, self._flush)
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future, float]]) -> None:
+        started = time.perf_counter()
+        unique = list(dict.fromkeys(text for text, _, _ in batch))
+        with self._lock:
+            self.batches += 1
+            self.inputs_sent += len(unique)
+            self._delays.extend((started - t0) * 1000 for _, _, t0 in batch)
+        try:
+            vectors = await self._embed_many(unique)
+            if len(vectors) != len(unique):
+                raise RuntimeError(f"Lote de embeddings incompleto: {len(vectors)} de {len(unique)}")
+        except BaseException as e:
+            with self._lock:
+                self.errors += 1
+            for _, fut, _ in batch:
+                if not fut.done():
+                    if isinstance(e, asyncio.CancelledError):
+                        fut.cancel()
+                    else:
+                        fut.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        by_text = dict(zip(unique, vectors, strict=True))
+        for text, fut, _ in batch:
+            if not fut.done():
+                fut.set_result(by_text[text])
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            delays = sorted(self._delays)
+            batches, sent = self.batches, self.inputs_sent
+            out: dict[str, Any] = {
+                "requests": self.requests,
+                "batches": batches,
+                "inputs_sent": sent,
+                "errors": self.errors,
+                "max_batch": self.max_batch,
+                "window_ms": round(self.window * 1000, 2),
+            }
+        out["avg_batch_size"] = round(sent / batches, 2) if batches else 0.0
+        out["fill_rate"] = round(sent / (batches * self.max_batch), 3) if batches else 0.0
+        out["calls_saved"] = max(0, self.requests - batches)
+        if delays:
+            out["queue_delay_ms_avg"] = round(sum(delays) / len(delays), 2)
+            out["queue_delay_ms_p95"] = round(delays[int(0.95 * (len(delays) - 1))], 2)
+        return out
@@ -0,0 +1,146 @@
+"""
+Cache de embeddings de consulta para o RAG do ARIA-SDR
+
+Perguntas de WhatsApp se repetem muito ("como funciona", "qual o preço"), e
+cada uma custava uma chamada `embeddings.create`. A chave do cache é o texto
+normalizado + EMBEDDING_MODEL + EMBEDDING_DIM.
+
+Camadas:
+- LRU em memória com vetores float32 compactos (`array('f')`, 4 bytes/dim)
+- SQLite opcional em disco (sobrevive a restarts)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+_WS_RE = re.compile(r"\s+")
+_EDGE_PUNCT = " \t\n\r?!.,;:…\"'"
+
+
+def normalize_query(text: str) -> str:
+    """Normaliza a pergunta para fins de cache (caixa, espaços, pontuação das bordas)"""
+    t = unicodedata.normalize("NFKC", text or "").casefold()
+    t = _WS_RE.sub(" ", t)
+    return t.strip(_EDGE_PUNCT)
+
+
+class EmbeddingCache:
+    """LRU float32 em memória + tier opcional em SQLite"""
+
+    def __init__(
+        self,
+        model: str,
+        dim: int,
+        max_entries: int = 4096,
+        disk_path: str | None = None,
+    ):
+        self.model = model
+        self.dim = int(dim)
+        self.max_entries = max(1, int(max_entries))
+        self._mem: OrderedDict[str, array] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db: sqlite3.Connection | None = None
+        if disk_path:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vec BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def key(self, text: str) -> str:
+        base = f"{self.model}|{self.dim}|{normalize_query(text)}"
+        return hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> list[float] | None:
+        k = self.key(text)
+        with self._lock:
+            vec = self._mem.get(k)
+            if vec is not None:
+                self._mem.move_to_end(k)
+                self.hits += 1
+                return vec.tolist()
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vec FROM query_embeddings WHERE key = ? AND model = ? AND dim = ?",
+                    (k, self.model, self.dim),
+                ).fetchone()
+                if row is not None:
+                    vec = array("f")
+                    vec.frombytes(row[0])
+                    self._remember(k, vec)
+                    self.disk_hits += 1
+                    return vec.tolist()
+            self.misses += 1
+            return None
+
+    def put(self, text: str, embedding: list[float]) -> None:
+        if len(embedding) != self.dim:
+            return
+        k = self.key(text)
+        vec = array("f", embedding)
+        with self._lock:
+            self._remember(k, vec)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO query_embeddings (key, model, dim, vec, created_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (k, self.model, self.dim, vec.tobytes(), time.time()),
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(f"Falha ao gravar embedding em disco: {e}")
+
+    def _remember(self, k: str, vec: array) -> None:
+        self._mem[k] = vec
+        self._mem.move_to_end(k)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM query_embeddings")
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "model": self.model,
+            "dim": self.dim,
+            "entries": len(self._mem),
+            "max_entries": self.max_entries,
+            "memory_bytes": len(self._mem) * self.dim * 4,
+            "disk": self._db is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
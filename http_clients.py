@@ -0,0 +1,321 @@
+"""
+Clientes HTTP compartilhados para as integrações externas do ARIA-SDR
+
+Cada integração (rag, mindchat, cloudflare) tem um `requests.Session` e um
+`httpx.AsyncClient` próprios, com pool de conexões keep-alive, HTTP/2 quando
+o pacote `h2` está instalado, timeout padrão e política de retry/backoff.
+
+Configuração por integração via ambiente (NAME em maiúsculas):
+- HTTP_<NAME>_TIMEOUT: timeout padrão em segundos
+- HTTP_<NAME>_RETRIES: tentativas extras em erro de conexão / status transitório
+- HTTP_<NAME>_POOL_SIZE: conexões máximas por host
+- HTTP_<NAME>_HTTP2: true/false (cliente assíncrono)
+
+POST só é repetido em falha de conexão (a requisição não saiu), exceto nas
+integrações em que o POST é idempotente (RPC de busca do RAG).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+@dataclass
+class HttpPolicy:
+    """Pool, timeout e retry de uma integração"""
+
+    timeout: float = 10.0
+    retries: int = 2
+    backoff_factor: float = 0.3
+    retry_statuses: tuple[int, ...] = RETRY_STATUSES
+    retry_methods: tuple[str, ...] = ("GET", "HEAD", "OPTIONS")
+    pool_size: int = 20
+    keepalive: int = 10
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls, name: str, base: HttpPolicy | None = None) -> HttpPolicy:
+        base = base or cls()
+        prefix = f"HTTP_{name.upper()}_"
+        http2 = os.getenv(prefix + "HTTP2")
+        pool_size = max(1, int(os.getenv(prefix + "POOL_SIZE", str(base.pool_size))))
+        return cls(
+            timeout=float(os.getenv(prefix + "TIMEOUT", str(base.timeout))),
+            retries=int(os.getenv(prefix + "RETRIES", str(base.retries))),
+            backoff_factor=base.backoff_factor,
+            retry_statuses=base.retry_statuses,
+            retry_methods=base.retry_methods,
+            pool_size=pool_size,
+            keepalive=min(base.keepalive, pool_size),
+            http2=(http2.lower() == "true") if http2 else base.http2,
+        )
+
+
+DEFAULT_POLICIES: dict[str, HttpPolicy] = {
+    # RPC match_aria_chunks / RAG remoto: POST de leitura, pode repetir
+    "rag": HttpPolicy(
+        timeout=30, retry_methods=("GET", "POST"), pool_size=100, keepalive=20
+    ),
+    "mindchat": HttpPolicy(timeout=10),
+    "cloudflare": HttpPolicy(timeout=15, pool_size=4, keepalive=4),
+}
+
+
+@dataclass
+class _Metrics:
+    requests: int = 0
+    errors: int = 0
+    retries: int = 0
+    in_flight: int = 0
+    total_ms: float = 0.0
+    by_status: dict[str, int] = field(default_factory=dict)
+
+
+class HttpClientRegistry:
+    """Registro central de clientes HTTP por integração"""
+
+    def __init__(self, policies: dict[str, HttpPolicy] | None = None):
+        self._base_policies = dict(DEFAULT_POLICIES)
+        if policies:
+            self._base_policies.update(policies)
+        self._policies: dict[str, HttpPolicy] = {}
+        self._sessions: dict[str, requests.Session] = {}
+        self._async_clients: dict[str, httpx.AsyncClient] = {}
+        self._metrics: dict[str, _Metrics] = {}
+        self._lock = threading.Lock()
+
+    def policy(self, name: str) -> HttpPolicy:
+        with self._lock:
+            if name not in self._policies:
+                self._policies[name] = HttpPolicy.from_env(name, self._base_policies.get(name))
+            return self._policies[name]
+
+    def _m(self, name: str) -> _Metrics:
+        with self._lock:
+            return self._metrics.setdefault(name, _Metrics())
+
+    # ---------------------------
+    # Clientes
+    # ---------------------------
+
+    def session(self, name: str) -> requests.Session:
+        """`requests.Session` com pool por host e Retry da integração"""
+        pol = self.policy(name)
+        with self._lock:
+            sess = self._sessions.get(name)
+            if sess is None:
+                sess = requests.Session()
+                retries = Retry(
+                    total=pol.retries,
+                    backoff_factor=pol.backoff_factor,
+                    status_forcelist=list(pol.retry_statuses),
+                    allowed_methods=list(pol.retry_methods),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=pol.keepalive,
+                    pool_maxsize=pol.pool_size,
+                    max_retries=retries,
+                )
+                sess.mount("http://", adapter)
+                sess.mount("https://", adapter)
+                self._sessions[name] = sess
+            return sess
+
+    def async_client(self, name: str) -> httpx.AsyncClient:
+        """`httpx.AsyncClient` com limites de pool, keep-alive e HTTP/2 opcional"""
+        pol = self.policy(name)
+        with self._lock:
+            cli = self._async_clients.get(name)
+            if cli is None:
+                cli = httpx.AsyncClient(
+                    http2=pol.http2 and HTTP2_AVAILABLE,
+                    timeout=pol.timeout,
+                    limits=httpx.Limits(
+                        max_connections=pol.pool_size,
+                        max_keepalive_connections=pol.keepalive,
+                    ),
+                )
+                self._async_clients[name] = cli
+            return cli
+
+    # ---------------------------
+    # Requisições com métricas
+    # ---------------------------
+
+    def request(self, name: str, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """Requisição síncrona (retry feito pelo adapter do urllib3)"""
+        kwargs.setdefault("timeout", self.policy(name).timeout)
+        m = self._m(name)
+        m.requests += 1
+        m.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            resp = self.session(name).request(method, url, **kwargs)
+            m.by_status[str(resp.status_code)] = m.by_status.get(str(resp.status_code), 0) + 1
+            return resp
+        except requests.RequestException:
+            m.errors += 1
+            raise
+        finally:
+            m.in_flight -= 1
+            m.total_ms += (time.perf_counter() - t0) * 1000
+
+    async def arequest(
+        self, name: str, method: str, url: str, retries: int | None = None, **kwargs: Any
+    ) -> httpx.Response:
+        """Requisição assíncrona com retry/backoff da integração.
+
+        `retries` substitui o número de retentativas da política (0 quando quem
+        chama já tem a sua própria retentativa, ex.: outbound.py).
+        """
+        pol = self.policy(name)
+        max_retries = pol.retries if retries is None else max(0, int(retries))
+        client = self.async_client(name)
+        method = method.upper()
+        retry_any = method in pol.retry_methods
+        m = self._m(name)
+        m.requests += 1
+        m.in_flight += 1
+        t0 = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    resp = await client.request(method, url, **kwargs)
+                    if not (retry_any and resp.status_code in pol.retry_statuses) or attempt >= max_retries:
+                        m.by_status[str(resp.status_code)] = m.by_status.get(str(resp.status_code), 0) + 1
+                        return resp
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                    # requisição não chegou a sair: sempre seguro repetir
+                    if attempt >= max_retries:
+                        m.errors += 1
+                        raise
+                except httpx.TransportError:
+                    if not retry_any or attempt >= max_retries:
+                        m.errors += 1
+                        raise
+                m.retries += 1
+                await asyncio.sleep(pol.backoff_factor * (2**attempt))
+                attempt += 1
+        finally:
+            m.in_flight -= 1
+            m.total_ms += (time.perf_counter() - t0) * 1000
+
+    # ---------------------------
+    # Métricas e ciclo de vida
+    # ---------------------------
+
+    def stats(self) -> dict[str, Any]:
+        names = set(self._metrics) | set(self._sessions) | set(self._async_clients)
+        out: dict[str, Any] = {}
+        for name in sorted(names):
+            m = self._metrics.get(name) or _Metrics()
+            pol = self.policy(name)
+            out[name] = {
+                "requests": m.requests,
+                "errors": m.errors,
+                "retries": m.retries,
+                "in_flight": m.in_flight,
+                "avg_ms": round(m.total_ms / m.requests, 1) if m.requests else 0.0,
+                "by_status": dict(m.by_status),
+                "pool_size": pol.pool_size,
+                "timeout": pol.timeout,
+                "http2": pol.http2 and HTTP2_AVAILABLE,
+                "sync_pools": _sync_pool_stats(self._sessions.get(name)),
+                "async_pool": _async_pool_stats(self._async_clients.get(name)),
+            }
+        return out
+
+    def close(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for sess in sessions:
+            sess.close()
+
+    async def aclose(self) -> None:
+        self.close()
+        with self._lock:
+            clients = list(self._async_clients.values())
+            self._async_clients.clear()
+        for cli in clients:
+            try:
+                await cli.aclose()
+            except Exception as e:
+                logger.warning(f"Falha ao fechar cliente HTTP: {e}")
+
+
+def _sync_pool_stats(sess: requests.Session | None) -> list[dict[str, Any]]:
+    if sess is None:
+        return []
+    out = []
+    for adapter in {id(a): a for a in sess.adapters.values()}.values():
+        manager = getattr(adapter, "poolmanager", None)
+        if manager is None:
+            continue
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            out.append(
+                {
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "idle": pool.pool.qsize() if pool.pool is not None else 0,
+                }
+            )
+    return out
+
+
+def _async_pool_stats(cli: httpx.AsyncClient | None) -> dict[str, Any] | None:
+    if cli is None:
+        return None
+    # httpcore não expõe API pública de métricas do pool
+    try:
+        conns = cli._transport._pool.connections  # type: ignore[attr-defined]
+        return {
+            "connections": len(conns),
+            "idle": sum(1 for c in conns if c.is_idle()),
+        }
+    except Exception:
+        return {}
+
+
+_registry: HttpClientRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_http_clients() -> HttpClientRegistry:
+    """Registro global (criado no startup da API, fechado no shutdown)"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = HttpClientRegistry()
+        return _registry
+
+
+async def close_http_clients() -> None:
+    global _registry
+    with _registry_lock:
+        registry, _registry = _registry, None
+    if registry is not None:
+        await registry.aclose()
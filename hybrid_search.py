@@ -0,0 +1,198 @@
+"""
+Busca híbrida (FTS + vetor) com fusão RRF no Postgres para o RAG_BACKEND=pg
+
+Uma única consulta por pergunta: as CTEs trabalham só com ids e posições dos
+candidatos de cada lista, a Reciprocal Rank Fusion é feita no servidor e
+`content` só é lido para o top-k final. O FTS usa a coluna armazenada
+`content_tsv` (ver busca_hibrida_rag_chunks.sql).
+
+O embedding é enviado uma única vez; com o pacote `pgvector` (opcional)
+registrado na conexão ele vai em formato binário em vez de literal de texto.
+
+Configuração via ambiente:
+- RAG_PG_CANDIDATES: candidatos por lista antes da fusão (padrão 50)
+- RAG_RRF_K: constante k da RRF, score = Σ 1/(k + posição) (padrão 60)
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import logging
+import os
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+PGVECTOR_AVAILABLE = importlib.util.find_spec("pgvector") is not None
+
+
+@dataclass
+class HybridSearchConfig:
+    candidates: int = 50
+    rrf_k: int = 60
+
+    @classmethod
+    def from_env(cls) -> HybridSearchConfig:
+        return cls(
+            candidates=max(1, int(os.getenv("RAG_PG_CANDIDATES", "50"))),
+            rrf_k=max(1, int(os.getenv("RAG_RRF_K", "60"))),
+        )
+
+
+def build_hybrid_sql(binary_vector: bool) -> str:
+    """SQL da busca; `%(emb)` aparece várias vezes mas vira um único parâmetro"""
+    emb = "%(emb)b" if binary_vector else "%(emb)s::vector"
+    return f"""
+    with vec as (
+        select id, rank() over (order by embedding <=> {emb}) as rnk
+        from rag_chunks
+        order by embedding <=> {emb}
+        limit %(candidates)s
+    ),
+    fts as (
+        select id, rank() over (order by ts_rank(content_tsv, query) desc) as rnk
+        from rag_chunks, websearch_to_tsquery('portuguese', %(question)s) query
+        where content_tsv @@ query
+        order by ts_rank(content_tsv, query) desc
+        limit %(candidates)s
+    ),
+    fused as (
+        select coalesce(vec.id, fts.id) as id,
+               coalesce(1.0 / (%(rrf_k)s + vec.rnk), 0.0)
+             + coalesce(1.0 / (%(rrf_k)s + fts.rnk), 0.0) as score
+        from vec full outer join fts on vec.id = fts.id
+        order by score desc
+        limit %(k)s
+    )
+    select c.id, c.document_id, c.heading, c.content, fused.score
+    from fused join rag_chunks c on c.id = fused.id
+    order by fused.score desc, c.id
+"""
+
+
+HYBRID_SQL_BINARY = build_hybrid_sql(binary_vector=True)
+HYBRID_SQL_TEXT = build_hybrid_sql(binary_vector=False)
+
+
+# ---------------------------
+# Tipos pgvector por conexão
+# ---------------------------
+
+def register_vector_types(conn: Any) -> None:
+    """`configure` do pool: registra o dumper binário do pgvector, se instalado"""
+    if not PGVECTOR_AVAILABLE:
+        return
+    try:
+        from pgvector.psycopg import register_vector  # type: ignore
+
+        register_vector(conn)
+    except Exception as e:
+        logger.warning(f"pgvector não registrado; embedding vai como texto: {e}")
+
+
+async def register_vector_types_async(conn: Any) -> None:
+    if not PGVECTOR_AVAILABLE:
+        return
+    try:
+        from pgvector.psycopg import register_vector_async  # type: ignore
+
+        await register_vector_async(conn)
+    except Exception as e:
+        logger.warning(f"pgvector não registrado; embedding vai como texto: {e}")
+
+
+def _binary_vector_ready(conn: Any) -> bool:
+    if not PGVECTOR_AVAILABLE:
+        return False
+    try:
+        from pgvector import Vector  # type: ignore
+        from psycopg.adapt import PyFormat  # type: ignore
+
+        conn.adapters.get_dumper(Vector, PyFormat.BINARY)
+        return True
+    except Exception:
+        return False
+
+
+def vector_literal(emb: Sequence[float]) -> str:
+    """Literal texto do pgvector (fallback sem o pacote `pgvector`)"""
+    return "[" + ",".join(format(float(x), ".9g") for x in emb) + "]"
+
+
+def hybrid_query(
+    conn: Any,
+    question: str,
+    emb: Sequence[float],
+    k: int,
+    config: HybridSearchConfig | None = None,
+) -> tuple[str, dict[str, Any]]:
+    """(sql, params) para a conexão, escolhendo o envio binário quando possível"""
+    cfg = config or HybridSearchConfig()
+    if _binary_vector_ready(conn):
+        from pgvector import Vector  # type: ignore
+
+        sql, vector = HYBRID_SQL_BINARY, Vector(list(emb))
+    else:
+        sql, vector = HYBRID_SQL_TEXT, vector_literal(emb)
+    params = {
+        "emb": vector,
+        "question": question,
+        "candidates": max(cfg.candidates, k),
+        "rrf_k": cfg.rrf_k,
+        "k": max(1, k),
+    }
+    return sql, params
+
+
+def search(
+    conn: Any,
+    question: str,
+    emb: Sequence[float],
+    k: int,
+    config: HybridSearchConfig | None = None,
+) -> list[tuple]:
+    """Executa a busca (prepared statement) e devolve as linhas do top-k"""
+    sql, params = hybrid_query(conn, question, emb, k, config)
+    with conn.cursor() as cur:
+        cur.execute(sql, params, prepare=True)
+        return cur.fetchall() or []
+
+
+async def search_async(
+    conn: Any,
+    question: str,
+    emb: Sequence[float],
+    k: int,
+    config: HybridSearchConfig | None = None,
+) -> list[tuple]:
+    sql, params = hybrid_query(conn, question, emb, k, config)
+    async with conn.cursor() as cur:
+        await cur.execute(sql, params, prepare=True)
+        return await cur.fetchall() or []
+
+
+def rrf_fuse(
+    rankings: Sequence[Sequence[Any]], rrf_k: int = 60, k: int = 5
+) -> list[tuple[Any, float]]:
+    """Mesma fusão do SQL em Python: score = Σ 1/(rrf_k + posição) por lista.
+
+    Referência para benchmarks/testes offline (scripts/benchmark_rag.py).
+    """
+    scores: dict[Any, float] = {}
+    for ranking in rankings:
+        for pos, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (rrf_k + pos)
+    return sorted(scores.items(), key=lambda kv: -kv[1])[: max(0, k)]
+
+
+def format_results(rows: Sequence[tuple]) -> tuple[str | None, list[dict]]:
+    """(contexto numerado, refs) no formato usado pelo /assist/routing"""
+    context_text = ""
+    refs: list[dict] = []
+    for i, row in enumerate(rows, 1):
+        _id, doc, heading, content, _score = row
+        context_text += f"[{i}] {heading or ''}\n{content or ''}\n---\n"
+        refs.append({"i": i, "title": str(doc or ""), "uri": ""})
+    return context_text or None, refs
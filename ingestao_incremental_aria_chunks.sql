@@ -0,0 +1,39 @@
+-- ============================================================
+-- Ingestão incremental: hash de conteúdo + chave única em aria_chunks
+-- Execute este SQL no Postgres/Supabase antes de rodar os scripts de
+-- ingestão (scripts/ingest_faqs.py, scripts/ingest_rag_supabase.py)
+-- ============================================================
+
+-- 1. Colunas usadas pela ingestão (tabelas criadas por supabase_schema.sql
+--    não têm source/doc_id/chunk_index)
+ALTER TABLE aria_chunks ADD COLUMN IF NOT EXISTS source TEXT;
+ALTER TABLE aria_chunks ADD COLUMN IF NOT EXISTS doc_id TEXT;
+ALTER TABLE aria_chunks ADD COLUMN IF NOT EXISTS chunk_index INT;
+ALTER TABLE aria_chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- 2. Remove duplicatas deixadas por ingestões antigas (POST sem on_conflict),
+--    mantendo a linha mais recente de cada (source, doc_id, chunk_index)
+DELETE FROM aria_chunks a
+USING aria_chunks b
+WHERE a.source IS NOT DISTINCT FROM b.source
+  AND a.doc_id = b.doc_id
+  AND a.chunk_index = b.chunk_index
+  AND (a.created_at, a.id) < (b.created_at, b.id);
+
+-- 3. Chave única usada no upsert (on_conflict=source,doc_id,chunk_index)
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'aria_chunks_source_doc_chunk_key'
+    ) THEN
+        ALTER TABLE aria_chunks
+            ADD CONSTRAINT aria_chunks_source_doc_chunk_key UNIQUE (source, doc_id, chunk_index);
+    END IF;
+END $$;
+
+ANALYZE aria_chunks;
+
+-- Verificar
+SELECT source, count(DISTINCT doc_id) AS docs, count(*) AS chunks, count(content_hash) AS com_hash
+FROM aria_chunks
+GROUP BY source;
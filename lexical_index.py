@@ -0,0 +1,277 @@
+"""
+Índice léxico TF-IDF (sem rede) para o RAG do ARIA-SDR
+
+Serve o corpus de `docs/aria_vector_store` sem OpenAI nem Supabase: busca em
+milissegundos, útil como backend próprio (RAG_BACKEND=lexical), como fallback
+quando embeddings/Supabase estão lentos ou fora do ar, e como primeiro
+estágio barato (`top_rows`) antes de um reranking denso.
+
+Formato seguro (sem pickle): índice invertido em .npy (lidos com memory-map
+e allow_pickle=False) + vocabulário/idf/chunks em JSON:
+- lexical_meta.json: parâmetros, vocabulário, idf e chunks
+- lexical_indptr.npy, lexical_rows.npy, lexical_weights.npy: listas de
+  postings por termo (matriz TF-IDF normalizada em formato CSC)
+
+Mesmos parâmetros do TfidfVectorizer que gerou tfidf_index.pkl (acentos
+removidos, unigramas + bigramas, min_df=2, max_df=0.9, idf suavizado, L2),
+sem depender de scikit-learn.
+
+Regerar a partir dos PDFs da pasta:
+    python lexical_index.py --dir docs/aria_vector_store --from-pdfs
+ou a partir do chunks.jsonl já existente:
+    python lexical_index.py --dir docs/aria_vector_store
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import re
+import sys
+import unicodedata
+from collections import Counter
+from collections.abc import Sequence
+from datetime import UTC, datetime
+from typing import Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "lexical_meta.json"
+INDPTR_FILE = "lexical_indptr.npy"
+ROWS_FILE = "lexical_rows.npy"
+WEIGHTS_FILE = "lexical_weights.npy"
+CHUNKS_FILE = "chunks.jsonl"
+
+_TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+
+
+def strip_accents(text: str) -> str:
+    """Equivalente ao strip_accents='unicode' do scikit-learn"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def analyze(text: str, ngram_max: int = 2) -> list[str]:
+    """Tokens (lowercase, sem acentos) + n-gramas de palavras até `ngram_max`"""
+    tokens = _TOKEN_RE.findall(strip_accents((text or "").lower()))
+    terms = list(tokens)
+    for n in range(2, ngram_max + 1):
+        terms.extend(" ".join(tokens[i : i + n]) for i in range(len(tokens) - n + 1))
+    return terms
+
+
+class LexicalIndex:
+    """Índice invertido TF-IDF normalizado (cosseno = produto escalar)"""
+
+    def __init__(
+        self,
+        vocabulary: dict[str, int],
+        idf: np.ndarray,
+        indptr: np.ndarray,
+        rows: np.ndarray,
+        weights: np.ndarray,
+        chunks: list[dict[str, Any]],
+        ngram_max: int = 2,
+        version: str = "",
+    ):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.indptr = indptr
+        self.rows = rows
+        self.weights = weights
+        self.chunks = chunks
+        self.ngram_max = ngram_max
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    # ---------------------------
+    # Construção
+    # ---------------------------
+
+    @classmethod
+    def build(
+        cls,
+        chunks: Sequence[dict[str, Any]],
+        ngram_max: int = 2,
+        min_df: int = 2,
+        max_df: float = 0.9,
+    ) -> LexicalIndex:
+        chunks = list(chunks)
+        n_docs = len(chunks)
+        counts = [Counter(analyze(c.get("text") or "", ngram_max)) for c in chunks]
+        df: Counter[str] = Counter()
+        for c in counts:
+            df.update(c.keys())
+        max_count = max_df * n_docs
+        terms = sorted(t for t, d in df.items() if min_df <= d <= max_count)
+        vocabulary = {t: i for i, t in enumerate(terms)}
+        idf = np.array(
+            [math.log((1 + n_docs) / (1 + df[t])) + 1.0 for t in terms], dtype=np.float32
+        )
+
+        # TF-IDF por documento, normalizado (L2), depois transposto em postings
+        postings: list[list[tuple[int, float]]] = [[] for _ in terms]
+        for row, c in enumerate(counts):
+            entries = [(vocabulary[t], tf * float(idf[vocabulary[t]])) for t, tf in c.items() if t in vocabulary]
+            norm = math.sqrt(sum(w * w for _, w in entries)) or 1.0
+            for term_id, w in entries:
+                postings[term_id].append((row, w / norm))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        rows = np.fromiter((r for p in postings for r, _ in p), dtype=np.int32, count=int(indptr[-1]))
+        weights = np.fromiter((w for p in postings for _, w in p), dtype=np.float32, count=int(indptr[-1]))
+        version = datetime.now(UTC).strftime("%Y%m%dT%H%M%SZ")
+        return cls(vocabulary, idf, indptr, rows, weights, chunks, ngram_max, version)
+
+    # ---------------------------
+    # Persistência (npy + json, sem pickle)
+    # ---------------------------
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, INDPTR_FILE), self.indptr)
+        np.save(os.path.join(directory, ROWS_FILE), self.rows)
+        np.save(os.path.join(directory, WEIGHTS_FILE), self.weights)
+        terms = [""] * len(self.vocabulary)
+        for t, i in self.vocabulary.items():
+            terms[i] = t
+        meta = {
+            "format": 1,
+            "version": self.version,
+            "ngram_max": self.ngram_max,
+            "terms": terms,
+            "idf": [round(float(x), 6) for x in self.idf],
+            "chunks": self.chunks,
+        }
+        tmp = os.path.join(directory, META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, ensure_ascii=False)
+        os.replace(tmp, os.path.join(directory, META_FILE))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> LexicalIndex:
+        with open(os.path.join(directory, META_FILE), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        mode = "r" if mmap else None
+
+        def arr(name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, name), mmap_mode=mode, allow_pickle=False)
+
+        terms = meta["terms"]
+        return cls(
+            {t: i for i, t in enumerate(terms)},
+            np.asarray(meta["idf"], dtype=np.float32),
+            arr(INDPTR_FILE),
+            arr(ROWS_FILE),
+            arr(WEIGHTS_FILE),
+            meta["chunks"],
+            ngram_max=int(meta.get("ngram_max", 2)),
+            version=str(meta.get("version") or ""),
+        )
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, META_FILE))
+
+    # ---------------------------
+    # Busca
+    # ---------------------------
+
+    def scores(self, query: str) -> np.ndarray:
+        """Cosseno TF-IDF da consulta com todos os chunks (produto esparso)"""
+        out = np.zeros(len(self.chunks), dtype=np.float32)
+        counts = Counter(t for t in analyze(query, self.ngram_max) if t in self.vocabulary)
+        if not counts:
+            return out
+        q = {self.vocabulary[t]: tf * float(self.idf[self.vocabulary[t]]) for t, tf in counts.items()}
+        norm = math.sqrt(sum(w * w for w in q.values()))
+        for term_id, w in q.items():
+            start, end = int(self.indptr[term_id]), int(self.indptr[term_id + 1])
+            # cada chunk aparece no máximo uma vez por termo: soma vetorizada
+            out[self.rows[start:end]] += (w / norm) * self.weights[start:end]
+        return out
+
+    def top_rows(self, query: str, n: int = 20, min_score: float = 0.0) -> list[tuple[int, float]]:
+        """[(linha, score)] dos n melhores chunks; base para primeiro estágio"""
+        scores = self.scores(query)
+        n = min(int(n), len(scores))
+        if n <= 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > min_score]
+
+    def search(self, query: str, k: int = 5, min_score: float = 0.0) -> list[dict[str, Any]]:
+        """Top-k chunks com score (cosseno TF-IDF)"""
+        return [{**self.chunks[i], "score": s} for i, s in self.top_rows(query, k, min_score)]
+
+    def bundle(self, query: str, k: int = 5, min_score: float = 0.0) -> tuple[str | None, list[dict]]:
+        """(contexto numerado, refs) no formato do fetch_rag_bundle"""
+        context_text = ""
+        refs: list[dict] = []
+        for i, hit in enumerate(self.search(query, k, min_score), 1):
+            heading = hit.get("title") or ""
+            if hit.get("page"):
+                heading = f"{heading} (p. {hit['page']})"
+            context_text += f"[{i}] {heading}\n{hit.get('text') or ''}\n---\n"
+            refs.append({"i": i, "title": hit.get("title") or "", "uri": hit.get("source_file") or ""})
+        return context_text or None, refs
+
+
+# ---------------------------
+# Chunks a partir dos PDFs
+# ---------------------------
+
+
+def read_chunks(path: str) -> list[dict[str, Any]]:
+    with open(path, encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def chunks_from_pdfs(
+    directory: str, max_tokens: int = 200, overlap_tokens: int = 30, tags: Sequence[str] = ()
+) -> list[dict[str, Any]]:
+    """Extrai chunks (id `título|pN|cM`) de todos os PDFs da pasta.
+
+    Usa o chunker compartilhado da ingestão (scripts/chunking.py).
+    """
+    scripts = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts")
+    if scripts not in sys.path:
+        sys.path.append(scripts)
+    from chunking import chunk_records_from_pdfs  # type: ignore
+
+    return chunk_records_from_pdfs(directory, max_tokens, overlap_tokens, tags)
+
+
+def _main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Regera o índice léxico TF-IDF (formato seguro)")
+    parser.add_argument("--dir", default=os.getenv("RAG_LEXICAL_DIR", "docs/aria_vector_store"))
+    parser.add_argument("--from-pdfs", action="store_true", help="Reextrai chunks.jsonl dos PDFs da pasta")
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--overlap-tokens", type=int, default=30)
+    args = parser.parse_args()
+
+    chunks_path = os.path.join(args.dir, CHUNKS_FILE)
+    if args.from_pdfs:
+        chunks = chunks_from_pdfs(args.dir, args.max_tokens, args.overlap_tokens)
+        with open(chunks_path, "w", encoding="utf-8") as fh:
+            for c in chunks:
+                fh.write(json.dumps(c, ensure_ascii=False) + "\n")
+        print(f"{len(chunks)} chunks extraídos dos PDFs -> {chunks_path}")
+    else:
+        chunks = read_chunks(chunks_path)
+    index = LexicalIndex.build(chunks)
+    index.save(args.dir)
+    print(f"Índice léxico gravado em {args.dir}: {len(index)} chunks, {len(index.vocabulary)} termos")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,497 @@
+"""
+Índice vetorial local em memória para o RAG_BACKEND=local do ARIA-SDR
+
+O corpus de FAQ tem poucas dezenas/centenas de chunks: cabe inteiro em uma
+matriz NumPy contígua e o top-k sai de um único produto matriz–vetor, sem ida
+ao Supabase no caminho quente. Requer numpy (opcional no resto da API).
+
+- Carga: snapshot em disco (`RAG_LOCAL_SNAPSHOT`) ou leitura única da tabela
+  `aria_chunks` via REST do Supabase (gravando o snapshot em seguida)
+- Quantização opcional: float16 (metade da memória) ou int8 com escala por
+  linha (um quarto); o score é calculado em float32 por blocos de linhas
+- Snapshot lido com memory-map (páginas sob demanda, compartilhadas entre
+  workers do mesmo host)
+- Hot reload: quando a versão do corpus muda (rag_cache.CorpusVersion), o
+  índice novo é montado em segundo plano e trocado atomicamente
+
+Gerar snapshot: python local_index.py --out data/rag_index [--quantize int8]
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable, Sequence
+from typing import Any
+
+import numpy as np
+import requests
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATIONS = ("none", "float16", "int8")
+CHUNKS_TABLE = "aria_chunks"
+META_FILE = "meta.json"
+# linhas convertidas para float32 por vez no score de matrizes quantizadas
+_SCORE_BLOCK = 4096
+
+
+def _parse_embedding(value: Any) -> np.ndarray | None:
+    """pgvector via REST vem como texto "[0.1,...]"; aceita lista também"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class LocalVectorIndex:
+    """Matriz de embeddings normalizados + conteúdo/metadata por linha"""
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        rows: list[dict[str, Any]],
+        version: str = "0",
+        scales: np.ndarray | None = None,
+    ):
+        if matrix.ndim != 2 or matrix.shape[0] != len(rows):
+            raise ValueError(f"Matriz {matrix.shape} não corresponde a {len(rows)} linhas")
+        self.matrix = matrix
+        self.scales = scales
+        self.rows = rows
+        self.version = version
+        self.dim = int(matrix.shape[1])
+        by_source: dict[str, list[int]] = {}
+        for i, row in enumerate(rows):
+            source = row.get("source")
+            if source:
+                by_source.setdefault(str(source), []).append(i)
+        self._by_source = {s: np.asarray(ix, dtype=np.intp) for s, ix in by_source.items()}
+
+    @property
+    def quantize(self) -> str:
+        if self.matrix.dtype == np.int8:
+            return "int8"
+        if self.matrix.dtype == np.float16:
+            return "float16"
+        return "none"
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def build(
+        cls,
+        records: Sequence[dict[str, Any]],
+        version: str = "0",
+        quantize: str = "none",
+        dim: int | None = None,
+    ) -> LocalVectorIndex:
+        """Monta o índice a partir de linhas {id, content, metadata, source, embedding}"""
+        if quantize not in QUANTIZATIONS:
+            raise ValueError(f"Quantização inválida: {quantize}")
+        vectors: list[np.ndarray] = []
+        rows: list[dict[str, Any]] = []
+        for rec in records:
+            vec = _parse_embedding(rec.get("embedding"))
+            if vec is None or vec.ndim != 1 or (dim and vec.shape[0] != dim):
+                logger.warning(f"Chunk {rec.get('id')} ignorado: embedding ausente ou de dimensão errada")
+                continue
+            metadata = rec.get("metadata") or {}
+            rows.append(
+                {
+                    "id": rec.get("id"),
+                    "content": rec.get("content") or "",
+                    "metadata": metadata,
+                    "source": rec.get("source") or metadata.get("source"),
+                }
+            )
+            vectors.append(vec)
+        width = dim or (vectors[0].shape[0] if vectors else 0)
+        matrix = _normalize_rows(np.vstack(vectors)) if vectors else np.zeros((0, width), np.float32)
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        scales = None
+        if quantize == "float16":
+            matrix = matrix.astype(np.float16)
+        elif quantize == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            matrix = np.round(matrix / scales[:, None]).astype(np.int8)
+            scales = scales.astype(np.float32)
+        return cls(matrix, rows, version=version, scales=scales)
+
+    # ---------------------------
+    # Busca
+    # ---------------------------
+
+    def scores(self, query: Sequence[float] | np.ndarray) -> np.ndarray:
+        """Similaridade de cosseno de todas as linhas com a consulta"""
+        q = np.asarray(query, dtype=np.float32)
+        if q.shape != (self.dim,):
+            raise ValueError(f"Consulta com dimensão {q.shape} != {self.dim}")
+        norm = float(np.linalg.norm(q))
+        if norm:
+            q = q / norm
+        if self.matrix.dtype == np.float32:
+            return self.matrix @ q
+        out = np.empty(len(self.rows), dtype=np.float32)
+        for start in range(0, len(self.rows), _SCORE_BLOCK):
+            block = self.matrix[start : start + _SCORE_BLOCK].astype(np.float32)
+            out[start : start + len(block)] = block @ q
+        if self.scales is not None:
+            out *= self.scales
+        return out
+
+    def search(
+        self,
+        query: Sequence[float] | np.ndarray,
+        k: int = 5,
+        filter_source: str | None = None,
+    ) -> list[dict[str, Any]]:
+        """Top-k no formato do RPC match_aria_chunks (content, metadata, similarity)"""
+        if not self.rows or k <= 0:
+            return []
+        scores = self.scores(query)
+        candidates: np.ndarray | None = None
+        if filter_source:
+            candidates = self._by_source.get(filter_source)
+            if candidates is None:
+                return []
+            scores = scores[candidates]
+        k = min(int(k), len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        out = []
+        for j in top:
+            row = self.rows[int(candidates[j]) if candidates is not None else int(j)]
+            out.append(
+                {
+                    "id": row["id"],
+                    "content": row["content"],
+                    "metadata": row["metadata"],
+                    "similarity": float(scores[j]),
+                }
+            )
+        return out
+
+    # ---------------------------
+    # Snapshot em disco
+    # ---------------------------
+
+    def save(self, path: str) -> None:
+        """Grava o snapshot; `meta.json` é trocado por último (leitores nunca veem meio snapshot)"""
+        os.makedirs(path, exist_ok=True)
+        stamp = f"{int(time.time() * 1000)}"
+        vectors_file = f"vectors-{stamp}.npy"
+        np.save(os.path.join(path, vectors_file), self.matrix)
+        scales_file = None
+        if self.scales is not None:
+            scales_file = f"scales-{stamp}.npy"
+            np.save(os.path.join(path, scales_file), self.scales)
+        meta = {
+            "version": self.version,
+            "dim": self.dim,
+            "quantize": self.quantize,
+            "vectors": vectors_file,
+            "scales": scales_file,
+            "rows": self.rows,
+        }
+        previous = _snapshot_files(path)
+        tmp = os.path.join(path, f"{META_FILE}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, ensure_ascii=False)
+        os.replace(tmp, os.path.join(path, META_FILE))
+        # só os arquivos do snapshot substituído: outro worker pode estar gravando
+        # o seu ao mesmo tempo. Leitores com mmap aberto continuam válidos após unlink
+        for name in previous - {vectors_file, scales_file}:
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError:
+                pass
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> LocalVectorIndex:
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        mode = "r" if mmap else None
+        matrix = np.load(os.path.join(path, meta["vectors"]), mmap_mode=mode)
+        scales = None
+        if meta.get("scales"):
+            scales = np.load(os.path.join(path, meta["scales"]))
+        return cls(matrix, meta["rows"], version=str(meta.get("version") or "0"), scales=scales)
+
+    @staticmethod
+    def snapshot_version(path: str) -> str | None:
+        try:
+            with open(os.path.join(path, META_FILE), encoding="utf-8") as fh:
+                return str(json.load(fh).get("version") or "0")
+        except (OSError, ValueError):
+            return None
+
+
+def _snapshot_files(path: str) -> set[str]:
+    """Arquivos .npy referenciados pelo `meta.json` atual (vazio se não houver)"""
+    try:
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return set()
+    return {name for name in (meta.get("vectors"), meta.get("scales")) if name}
+
+
+def supabase_rows_fetcher(
+    base_url: str,
+    key: str,
+    table: str = CHUNKS_TABLE,
+    page_size: int = 1000,
+    timeout: float = 30,
+) -> Callable[[], list[dict[str, Any]]]:
+    """Lê todos os chunks com embedding via REST, em páginas ordenadas por id"""
+    url = f"{base_url.rstrip('/')}/rest/v1/{table}"
+    headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+
+    def fetch() -> list[dict[str, Any]]:
+        rows: list[dict[str, Any]] = []
+        with requests.Session() as session:
+            offset = 0
+            while True:
+                r = session.get(
+                    url,
+                    headers=headers,
+                    params={
+                        "select": "id,content,metadata,source,embedding",
+                        "embedding": "not.is.null",
+                        "order": "id",
+                        "limit": str(page_size),
+                        "offset": str(offset),
+                    },
+                    timeout=timeout,
+                )
+                if r.status_code >= 300:
+                    raise RuntimeError(f"Leitura de {table} falhou: {r.status_code} -> {r.text}")
+                page = r.json() or []
+                rows.extend(page)
+                if len(page) < page_size:
+                    return rows
+                offset += page_size
+
+    return fetch
+
+
+class LocalIndexManager:
+    """Mantém o índice atual e o recarrega quando a versão do corpus muda.
+
+    O caminho quente (`search`) nunca espera rede: a checagem de versão e a
+    remontagem rodam numa thread em segundo plano, no máximo a cada
+    `check_seconds`, e o índice antigo segue atendendo até a troca.
+    """
+
+    def __init__(
+        self,
+        snapshot_path: str | None = None,
+        fetch_rows: Callable[[], list[dict[str, Any]]] | None = None,
+        version: Callable[[], str] | None = None,
+        quantize: str = "none",
+        mmap: bool = True,
+        dim: int | None = None,
+        check_seconds: float = 30,
+    ):
+        if quantize not in QUANTIZATIONS:
+            raise ValueError(f"Quantização inválida: {quantize}")
+        self.snapshot_path = snapshot_path
+        self._fetch_rows = fetch_rows
+        self._version = version
+        self.quantize = quantize
+        self.mmap = mmap
+        self.dim = dim
+        self.check_seconds = check_seconds
+        self._index: LocalVectorIndex | None = None
+        self._load_lock = threading.Lock()
+        self._reloading = False
+        self._checked_at = time.monotonic()
+        self.reloads = 0
+        self.searches = 0
+        self.search_ms_total = 0.0
+        self.last_load_ms = 0.0
+        self.last_error: str | None = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._index is not None
+
+    def _current_version(self) -> str:
+        if self._version is None:
+            return "0"
+        try:
+            return self._version()
+        except Exception as e:
+            logger.warning(f"Versão do corpus indisponível: {e}")
+            return self._index.version if self._index is not None else "0"
+
+    def _build(self, version: str, prefer_snapshot: bool) -> LocalVectorIndex:
+        snap = self.snapshot_path
+        snap_version = LocalVectorIndex.snapshot_version(snap) if snap else None
+        if snap_version is not None and (
+            prefer_snapshot or self._fetch_rows is None or snap_version == version
+        ):
+            try:
+                return LocalVectorIndex.load(snap, mmap=self.mmap)
+            except (OSError, ValueError) as e:
+                # snapshot incompleto (ex.: trocado por outro worker durante a leitura)
+                if self._fetch_rows is None:
+                    raise
+                logger.warning(f"Snapshot do índice local ilegível, lendo do Supabase: {e}")
+        if self._fetch_rows is None:
+            raise RuntimeError("Sem snapshot local nem Supabase configurado para o índice local")
+        index = LocalVectorIndex.build(
+            self._fetch_rows(), version=version, quantize=self.quantize, dim=self.dim
+        )
+        if snap:
+            try:
+                index.save(snap)
+                if self.mmap:
+                    index = LocalVectorIndex.load(snap, mmap=True)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Snapshot do índice local não gravado: {e}")
+        return index
+
+    def load(self) -> LocalVectorIndex:
+        """Carga inicial (bloqueante); no-op se já carregado"""
+        with self._load_lock:
+            if self._index is None:
+                t0 = time.perf_counter()
+                version = self._current_version()
+                self._index = self._build(version, prefer_snapshot=True)
+                self.last_load_ms = (time.perf_counter() - t0) * 1000
+                self._checked_at = float("-inf")  # snapshot pode estar atrás do corpus
+                logger.info(
+                    f"Índice local carregado: {len(self._index)} chunks, dim={self._index.dim}, "
+                    f"{self._index.quantize}, versão {self._index.version} ({self.last_load_ms:.0f}ms)"
+                )
+            return self._index
+
+    def reload(self) -> bool:
+        """Remonta o índice se a versão do corpus mudou; devolve True se trocou"""
+        version = self._current_version()
+        current = self._index
+        if current is not None and current.version == version:
+            return False
+        if (
+            self._fetch_rows is None
+            and current is not None
+            and self.snapshot_path
+            and LocalVectorIndex.snapshot_version(self.snapshot_path) == current.version
+        ):
+            # só snapshot: espera um snapshot novo ser gerado
+            return False
+        t0 = time.perf_counter()
+        try:
+            index = self._build(version, prefer_snapshot=False)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning(f"Recarga do índice local falhou: {e}")
+            return False
+        self._index = index
+        self.reloads += 1
+        self.last_load_ms = (time.perf_counter() - t0) * 1000
+        self.last_error = None
+        logger.info(f"Índice local recarregado: versão {index.version}, {len(index)} chunks")
+        return True
+
+    def _maybe_reload_in_background(self) -> None:
+        if self._reloading or time.monotonic() - self._checked_at < self.check_seconds:
+            return
+        with self._load_lock:
+            if self._reloading:
+                return
+            self._reloading = True
+            self._checked_at = time.monotonic()
+
+        def run() -> None:
+            try:
+                self.reload()
+            finally:
+                self._reloading = False
+
+        threading.Thread(target=run, name="local-index-reload", daemon=True).start()
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int = 5,
+        filter_source: str | None = None,
+    ) -> list[dict[str, Any]]:
+        index = self._index or self.load()
+        self._maybe_reload_in_background()
+        t0 = time.perf_counter()
+        rows = index.search(query, k, filter_source)
+        self.searches += 1
+        self.search_ms_total += (time.perf_counter() - t0) * 1000
+        return rows
+
+    def stats(self) -> dict[str, Any]:
+        index = self._index
+        out: dict[str, Any] = {
+            "loaded": index is not None,
+            "reloads": self.reloads,
+            "searches": self.searches,
+            "search_ms_avg": round(self.search_ms_total / self.searches, 3) if self.searches else 0.0,
+            "last_load_ms": round(self.last_load_ms, 1),
+            "last_error": self.last_error,
+        }
+        if index is not None:
+            out.update(
+                {
+                    "chunks": len(index),
+                    "dim": index.dim,
+                    "quantize": index.quantize,
+                    "version": index.version,
+                    "matrix_bytes": int(index.matrix.nbytes),
+                    "mmap": isinstance(index.matrix, np.memmap),
+                }
+            )
+        return out
+
+
+def _main() -> None:
+    import argparse
+
+    from dotenv import load_dotenv  # pyright: ignore[reportMissingImports]
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Gera o snapshot do índice vetorial local")
+    parser.add_argument("--out", default=os.getenv("RAG_LOCAL_SNAPSHOT", "data/rag_index"))
+    parser.add_argument("--quantize", choices=QUANTIZATIONS, default=os.getenv("RAG_LOCAL_QUANTIZE", "none"))
+    parser.add_argument("--version", default=None, help="Versão do corpus gravada no snapshot")
+    args = parser.parse_args()
+
+    url = os.getenv("SUPABASE_URL", "")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+    if not (url and key):
+        raise SystemExit("Defina SUPABASE_URL e SUPABASE_SERVICE_ROLE_KEY")
+    version = args.version
+    if version is None:
+        from rag_cache import supabase_version_fetcher
+
+        try:
+            version = supabase_version_fetcher(url, key)() or "0"
+        except Exception as e:
+            print(f"Aviso: versão do corpus indisponível ({e}); usando 0")
+            version = "0"
+    index = LocalVectorIndex.build(supabase_rows_fetcher(url, key)(), version=version, quantize=args.quantize)
+    index.save(args.out)
+    print(f"Snapshot gravado em {args.out}: {len(index)} chunks, {index.quantize}, versão {version}")
+
+
+if __name__ == "__main__":
+    _main()
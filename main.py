@@ -1,6 +1,7 @@
 ﻿# main.py
 from __future__ import annotations
 
+import asyncio
 import hashlib
 import json
 import logging
@@ -8,17 +9,22 @@ import os
 import re
 import secrets
 import time
+from collections.abc import Awaitable, Callable, Mapping
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from typing import Any
 
+import httpx  # pyright: ignore[reportMissingImports]
 import requests  # pyright: ignore[reportMissingModuleSource]
 from dotenv import find_dotenv, load_dotenv  # pyright: ignore[reportMissingImports]
 from fastapi import Body, Depends, FastAPI, HTTPException, Request, Header  # pyright: ignore[reportMissingImports]
 from fastapi.responses import JSONResponse, PlainTextResponse  # pyright: ignore[reportMissingImports]
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer  # pyright: ignore[reportMissingImports]
 from pydantic import BaseModel
-from requests.adapters import HTTPAdapter  # pyright: ignore[reportMissingModuleSource]
-from urllib3.util.retry import Retry  # pyright: ignore[reportMissingImports]
+
+import hybrid_search
+from http_clients import close_http_clients, get_http_clients
+from routing_pipeline import Stage, run_stages
 
 # â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
 # Boot / Config
@@ -26,7 +32,17 @@ from urllib3.util.retry import Retry  # pyright: ignore[reportMissingImports]
 # Load .env without overriding existing process env (CI-friendly)
 load_dotenv(find_dotenv(), override=True)
 DEBUG = (os.getenv("API_DEBUG", "false") or "").lower() == "true"
-app = FastAPI(title="ARIA-SDR Endpoint", debug=DEBUG)
+
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    # Hooks definidos em "Lifecycle", no fim do módulo
+    await _on_startup()
+    yield
+    await _on_shutdown()
+
+
+app = FastAPI(title="ARIA-SDR Endpoint", debug=DEBUG, lifespan=_lifespan)
 
 # Configure CORS for frontend communication
 from fastapi.middleware.cors import CORSMiddleware
@@ -86,25 +102,13 @@ async def _unhandled_exc_handler(request: Request, exc: Exception):  # type: ign
     return JSONResponse(status_code=400, content={"detail": "unexpected_error"})
 
 
-# Session para RAG com retry/backoff
-_rag_session: requests.Session | None = None
+# Clientes HTTP compartilhados (pool/keep-alive/retry por integração; ver http_clients.py)
+def get_rag_session() -> requests.Session:
+    return get_http_clients().session("rag")
 
 
-def get_rag_session() -> requests.Session:
-    global _rag_session
-    if _rag_session is None:
-        s = requests.Session()
-        retries = Retry(
-            total=2,
-            backoff_factor=0.3,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["POST"],
-        )
-        adapter = HTTPAdapter(max_retries=retries)
-        s.mount("http://", adapter)
-        s.mount("https://", adapter)
-        _rag_session = s
-    return _rag_session
+def get_rag_async_client() -> httpx.AsyncClient:
+    return get_http_clients().async_client("rag")
 
 
 def require_auth(cred: HTTPAuthorizationCredentials = Depends(auth_scheme)) -> str:
@@ -152,15 +156,33 @@ class AssistResponse(BaseModel):
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ASSISTANT_ID = os.getenv("ASSISTANT_ID")
 ASSISTANT_TIMEOUT_SECONDS = float(os.getenv("ASSISTANT_TIMEOUT_SECONDS", "12"))
+# "stream" (eventos SSE do run, retorno antecipado) ou "poll" (runs.retrieve a cada 500 ms)
+ASSISTANT_RUN_MODE = os.getenv("ASSISTANT_RUN_MODE", "stream").strip().lower()
 CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
 
 try:
-    from openai import OpenAI  # type: ignore
+    from openai import AsyncOpenAI, OpenAI  # type: ignore
 
     client_assistant = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+    client_assistant_async = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 except Exception:  # pragma: no cover
     OpenAI = None  # type: ignore
+    AsyncOpenAI = None  # type: ignore
     client_assistant = None
+    client_assistant_async = None
+
+
+# Mapeamento app_thread_id -> assistant_thread_id (LRU + SQLite/Supabase)
+_thread_store = None
+
+
+def get_thread_store():
+    global _thread_store
+    if _thread_store is None:
+        from thread_store import build_thread_store_from_env
+
+        _thread_store = build_thread_store_from_env()
+    return _thread_store
 
 
 def wait_run(thread_id: str, run_id: str, timeout_seconds: float | None = None):
@@ -189,6 +211,148 @@ def last_assistant_message(thread_id: str) -> str:
     return ""
 
 
+async def wait_run_async(thread_id: str, run_id: str, timeout_seconds: float | None = None):
+    if client_assistant_async is None:
+        return None
+    loop = asyncio.get_running_loop()
+    deadline = (
+        loop.time() + timeout_seconds if timeout_seconds and timeout_seconds > 0 else None
+    )
+    while True:
+        run = await client_assistant_async.beta.threads.runs.retrieve(
+            thread_id=thread_id, run_id=run_id
+        )
+        if run.status in ("completed", "failed", "cancelled", "expired", "requires_action"):
+            return run
+        if deadline and loop.time() >= deadline:
+            return None
+        await asyncio.sleep(0.5)
+
+
+def _ms_since(t0: float) -> int:
+    return int((time.perf_counter() - t0) * 1000)
+
+
+async def stream_run_async(
+    thread_id: str,
+    timeout_seconds: float | None = None,
+    timings: dict[str, int] | None = None,
+    on_delta: Callable[[str], Awaitable[None]] | None = None,
+) -> str:
+    """Executa o run em modo streaming e retorna o texto do `thread.message.completed`.
+
+    Dispensa o polling de `runs.retrieve` e o `messages.list` final. Depois da
+    mensagem o stream é lido até o fim do run (`thread.run.completed` etc.):
+    fechar o stream não encerra o run, e a thread só aceita mensagens novas
+    sem run ativo. Em timeout, o run é cancelado no servidor e retorna "".
+    `on_delta` recebe cada trecho de texto assim que chega (SSE do
+    /agents/{agent_id}/runs).
+    """
+    if client_assistant_async is None or not ASSISTANT_ID:
+        return ""
+    timings = timings if timings is not None else {}
+    t0 = time.perf_counter()
+    run_id: str | None = None
+    parts: list[str] = []
+    message: str | None = None
+
+    async def _consume() -> str:
+        nonlocal run_id, message
+        stream = await client_assistant_async.beta.threads.runs.create(
+            thread_id=thread_id, assistant_id=ASSISTANT_ID, stream=True
+        )
+        try:
+            async for event in stream:
+                kind = getattr(event, "event", "")
+                data = getattr(event, "data", None)
+                if kind == "thread.run.created":
+                    run_id = getattr(data, "id", None)
+                elif kind == "thread.message.delta":
+                    if "first_token_ms" not in timings:
+                        timings["first_token_ms"] = _ms_since(t0)
+                    for block in getattr(data.delta, "content", None) or []:
+                        text = getattr(block, "text", None)
+                        if text is not None and getattr(text, "value", None):
+                            parts.append(text.value)
+                            if on_delta is not None:
+                                await on_delta(text.value)
+                elif kind == "thread.message.completed":
+                    texts = [
+                        b.text.value
+                        for b in (getattr(data, "content", None) or [])
+                        if getattr(b, "type", "") == "text"
+                    ]
+                    message = "".join(texts) or "".join(parts)
+                elif kind == "thread.run.completed":
+                    return message if message is not None else "".join(parts)
+                elif kind in (
+                    "thread.run.failed",
+                    "thread.run.cancelled",
+                    "thread.run.expired",
+                    "thread.run.requires_action",
+                    "error",
+                ):
+                    if message is None:
+                        log.warning("Assistant run terminou sem mensagem: %s", kind)
+                        return ""
+                    log.warning("Assistant run terminou com %s após a mensagem", kind)
+                    return message
+            return message if message is not None else "".join(parts)
+        finally:
+            try:
+                await stream.close()
+            except Exception:
+                pass
+
+    try:
+        if timeout_seconds and timeout_seconds > 0:
+            text = await asyncio.wait_for(_consume(), timeout_seconds)
+        else:
+            text = await _consume()
+    except asyncio.TimeoutError:
+        log.warning("Assistant run timeout após %ss (run=%s)", timeout_seconds, run_id)
+        if not run_id:
+            # timeout antes de `thread.run.created`: o run mais recente da thread é este
+            try:
+                runs = await client_assistant_async.beta.threads.runs.list(thread_id=thread_id, limit=1)
+                latest = runs.data[0] if runs.data else None
+                if latest is not None and latest.status in ("queued", "in_progress", "requires_action"):
+                    run_id = latest.id
+            except Exception as e:
+                log.warning("Falha ao localizar run da thread %s: %s", thread_id, e)
+        if run_id:
+            try:
+                await client_assistant_async.beta.threads.runs.cancel(
+                    thread_id=thread_id, run_id=run_id
+                )
+            except Exception as e:
+                log.warning("Falha ao cancelar run %s: %s", run_id, e)
+        return ""
+    finally:
+        timings["completion_ms"] = _ms_since(t0)
+    return text
+
+
+async def last_assistant_message_async(thread_id: str, run_id: str | None = None) -> str:
+    """Última resposta do Assistant na thread; com `run_id`, só a gerada por esse run.
+
+    Threads são reutilizadas entre mensagens: sem o filtro, um run sem resposta
+    devolveria a resposta do turno anterior.
+    """
+    if client_assistant_async is None:
+        return ""
+    msgs = await client_assistant_async.beta.threads.messages.list(thread_id=thread_id)
+    for m in msgs.data:
+        if run_id is not None and getattr(m, "run_id", None) != run_id:
+            continue
+        if getattr(m, "role", "") == "assistant":
+            try:
+                return m.content[0].text.value
+            except Exception:
+                continue
+    return ""
+
+
 # â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
 # Regras de negÃ³cio â€” triagem + volumetria
 # â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
@@ -287,16 +451,133 @@ class RagResponse(BaseModel):
     context: str
 
 
-def _embed(q: str) -> list[float]:
-    if OpenAI is None:
-        raise RuntimeError("SDK OpenAI nÃ£o disponÃ­vel")
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    vec = client.embeddings.create(model=EMBEDDING_MODEL, input=[q]).data[0].embedding
+# Clientes OpenAI compartilhados (um por processo, com pool de conexões próprio)
+_openai_client = None
+_openai_async_client = None
+
+
+def get_openai_client():
+    global _openai_client
+    if client_assistant is not None:
+        return client_assistant
+    if _openai_client is None:
+        if OpenAI is None:
+            raise RuntimeError("SDK OpenAI não disponível")
+        _openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
+
+
+def get_openai_async_client():
+    global _openai_async_client
+    if client_assistant_async is not None:
+        return client_assistant_async
+    if _openai_async_client is None:
+        if AsyncOpenAI is None:
+            raise RuntimeError("SDK OpenAI não disponível")
+        _openai_async_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return _openai_async_client
+
+
+# Cache de embeddings de consulta (LRU float32 + SQLite opcional)
+_embedding_cache = None
+
+
+def get_embedding_cache():
+    global _embedding_cache
+    if _embedding_cache is None:
+        from embedding_cache import EmbeddingCache
+
+        _embedding_cache = EmbeddingCache(
+            EMBEDDING_MODEL,
+            EMBEDDING_DIM,
+            max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "4096")),
+            disk_path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+        )
+    return _embedding_cache
+
+
+# Micro-batching de embeddings concorrentes (uma chamada para várias perguntas)
+EMBEDDING_BATCH_ENABLE = os.getenv("EMBEDDING_BATCH_ENABLE", "true").lower() == "true"
+_embedding_batcher = None
+# event loop da API (definido no startup): chamadas síncronas em threads do
+# pool também entram no lote
+_main_loop: asyncio.AbstractEventLoop | None = None
+
+
+async def _embed_many_async(texts: list[str]) -> list[list[float]]:
+    client = get_openai_async_client()
+    resp = await client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+
+
+def get_embedding_batcher():
+    global _embedding_batcher
+    if _embedding_batcher is None and EMBEDDING_BATCH_ENABLE:
+        from embedding_batcher import EmbeddingBatcher
+
+        _embedding_batcher = EmbeddingBatcher(
+            _embed_many_async,
+            max_batch=int(os.getenv("EMBEDDING_BATCH_MAX", "64")),
+            window_ms=float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5")),
+        )
+    return _embedding_batcher
+
+
+def _check_dim(vec: list[float]) -> list[float]:
     if len(vec) != EMBEDDING_DIM:
         raise RuntimeError(f"Embedding dim {len(vec)} != {EMBEDDING_DIM}")
     return vec
 
 
+def _embed(q: str) -> list[float]:
+    cache = get_embedding_cache()
+    cached = cache.get(q)
+    if cached is not None:
+        return cached
+    batcher = get_embedding_batcher()
+    loop = _main_loop
+    if batcher is not None and loop is not None and loop.is_running():
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not loop:
+            fut = asyncio.run_coroutine_threadsafe(batcher.embed(q), loop)
+            vec = _check_dim(fut.result(timeout=60))
+            cache.put(q, vec)
+            return vec
+    client = get_openai_client()
+    vec = _check_dim(client.embeddings.create(model=EMBEDDING_MODEL, input=[q]).data[0].embedding)
+    cache.put(q, vec)
+    return vec
+
+
+async def _embed_async(q: str) -> list[float]:
+    cache = get_embedding_cache()
+    cached = cache.get(q)
+    if cached is not None:
+        return cached
+    batcher = get_embedding_batcher()
+    if batcher is not None:
+        vec = await batcher.embed(q)
+    else:
+        client = get_openai_async_client()
+        resp = await client.embeddings.create(model=EMBEDDING_MODEL, input=[q])
+        vec = resp.data[0].embedding
+    _check_dim(vec)
+    cache.put(q, vec)
+    return vec
+
+
+@app.get("/rag/embeddings/stats")
+def rag_embedding_stats(_tok: str = Depends(require_auth)):
+    """Contadores do cache de embeddings de consulta e do micro-batching"""
+    stats = get_embedding_cache().stats()
+    if _embedding_batcher is not None:
+        stats["batcher"] = _embedding_batcher.stats()
+    return stats
+
+
 def _rpc_match(
     query_emb: list[float],
     k: int,
@@ -315,12 +596,108 @@ def _rpc_match(
     return r.json()
 
 
-@app.post("/rag/query", response_model=RagResponse)
-def rag_query(q: RagQueryIn, session: requests.Session = Depends(get_rag_session)):
-    question = (q.question or q.query or "").strip()
-    k = int(q.k or q.top_k or 5)
-    vec = _embed(question)
-    rows = _rpc_match(vec, k, q.filter_source, session)
+async def _rpc_match_async(
+    query_emb: list[float],
+    k: int,
+    filter_source: str | None,
+):
+    url = f"{SUPABASE_URL}/rest/v1/rpc/match_aria_chunks"
+    payload = {
+        "query_embedding": query_emb,
+        "match_count": int(k),
+        "filter_source": filter_source,
+    }
+    r = await get_http_clients().arequest("rag", "POST", url, headers=HEADERS_JSON, json=payload)
+    if r.status_code >= 300:
+        raise RuntimeError(f"RPC match failed: {r.status_code} -> {r.text}")
+    return r.json()
+
+
+# Cache de resultados do RAG (invalidado pela versão do corpus gravada na ingestão)
+RAG_CACHE_ENABLE = os.getenv("RAG_CACHE_ENABLE", "true").lower() == "true"
+RAG_CACHE_SEMANTIC = os.getenv("RAG_CACHE_SEMANTIC", "false").lower() == "true"
+_rag_cache = None
+_corpus_version = None
+
+
+def get_rag_cache():
+    global _rag_cache
+    if _rag_cache is None and RAG_CACHE_ENABLE:
+        from rag_cache import RagResultCache
+
+        _rag_cache = RagResultCache(
+            max_entries=int(os.getenv("RAG_CACHE_SIZE", "1024")),
+            ttl_seconds=float(os.getenv("RAG_CACHE_TTL_SECONDS", "3600")),
+            semantic=RAG_CACHE_SEMANTIC,
+            semantic_threshold=float(os.getenv("RAG_CACHE_SEMANTIC_THRESHOLD", "0.95")),
+        )
+    return _rag_cache
+
+
+def get_corpus_version():
+    global _corpus_version
+    if _corpus_version is None:
+        from rag_cache import CorpusVersion, file_version_fetcher, supabase_version_fetcher
+
+        version_file = os.getenv("RAG_CORPUS_VERSION_FILE", "")
+        if version_file:
+            fetch = file_version_fetcher(version_file)
+        elif SUPABASE_URL and SUPABASE_KEY:
+            fetch = supabase_version_fetcher(SUPABASE_URL, SUPABASE_KEY)
+        else:
+            fetch = None
+        _corpus_version = CorpusVersion(
+            fetch, refresh_seconds=float(os.getenv("RAG_CORPUS_VERSION_REFRESH_SECONDS", "30"))
+        )
+    return _corpus_version
+
+
+# Índice vetorial local (RAG_BACKEND=local); ver local_index.py
+_local_index = None
+
+
+def get_local_index():
+    global _local_index
+    if _local_index is None:
+        from local_index import LocalIndexManager, supabase_rows_fetcher
+
+        fetch = supabase_rows_fetcher(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
+        _local_index = LocalIndexManager(
+            snapshot_path=os.getenv("RAG_LOCAL_SNAPSHOT") or None,
+            fetch_rows=fetch,
+            version=lambda: get_corpus_version().current(),
+            quantize=os.getenv("RAG_LOCAL_QUANTIZE", "none").strip().lower(),
+            mmap=os.getenv("RAG_LOCAL_MMAP", "true").lower() == "true",
+            dim=EMBEDDING_DIM,
+            check_seconds=float(os.getenv("RAG_CORPUS_VERSION_REFRESH_SECONDS", "30")),
+        )
+    return _local_index
+
+
+def _match_rows(
+    query_emb: list[float],
+    k: int,
+    filter_source: str | None,
+    session: requests.Session | None = None,
+):
+    if RAG_BACKEND == "local":
+        return get_local_index().search(query_emb, k, filter_source)
+    return _rpc_match(query_emb, k, filter_source, session or get_rag_session())
+
+
+async def _match_rows_async(query_emb: list[float], k: int, filter_source: str | None):
+    if RAG_BACKEND == "local":
+        index = get_local_index()
+        if not index.loaded:
+            await asyncio.to_thread(index.load)
+        return index.search(query_emb, k, filter_source)
+    return await _rpc_match_async(query_emb, k, filter_source)
+
+
+# ——————————————————————————————————————————————————
+# Serviço RAG in-process (usado pelo /rag/query, roteamento e Mindchat)
+# ——————————————————————————————————————————————————
+def _rag_response(rows: list[dict[str, Any]]) -> RagResponse:
     hits = [
         RagHit(
             content=r.get("content", ""),
@@ -333,6 +710,79 @@ def rag_query(q: RagQueryIn, session: requests.Session = Depends(get_rag_session
     return RagResponse(hits=hits, context=context)
 
 
+def rag_search(
+    question: str,
+    k: int = 5,
+    filter_source: str | None = None,
+    session: requests.Session | None = None,
+) -> RagResponse:
+    """Busca vetorial (RPC match_aria_chunks ou índice local) sem passar por HTTP local"""
+    cache = get_rag_cache()
+    version = get_corpus_version().current() if cache else ""
+    if cache is not None:
+        # busca exata antes do embedding: hit não chama a API de embeddings
+        cached = cache.get("response", question, filter_source, k, version)
+        if cached is not None:
+            return cached
+    vec = _embed(question)
+    if cache is not None and cache.semantic:
+        cached = cache.similar("response", question, filter_source, k, version, vec)
+        if cached is not None:
+            return cached
+    rows = _match_rows(vec, k, filter_source, session)
+    resp = _rag_response(rows)
+    if cache is not None:
+        cache.put("response", question, filter_source, k, version, resp, embedding=vec)
+    return resp
+
+
+async def rag_search_async(
+    question: str,
+    k: int = 5,
+    filter_source: str | None = None,
+) -> RagResponse:
+    """Versão assíncrona de `rag_search` (embedding e RPC sem bloquear o event loop)"""
+    cache = get_rag_cache()
+    version = await get_corpus_version().acurrent() if cache else ""
+    if cache is not None:
+        cached = cache.get("response", question, filter_source, k, version)
+        if cached is not None:
+            return cached
+    vec = await _embed_async(question)
+    if cache is not None and cache.semantic:
+        cached = cache.similar("response", question, filter_source, k, version, vec)
+        if cached is not None:
+            return cached
+    rows = await _match_rows_async(vec, k, filter_source)
+    resp = _rag_response(rows)
+    if cache is not None:
+        cache.put("response", question, filter_source, k, version, resp, embedding=vec)
+    return resp
+
+
+@app.post("/rag/query", response_model=RagResponse)
+def rag_query(q: RagQueryIn, session: requests.Session = Depends(get_rag_session)):
+    question = (q.question or q.query or "").strip()
+    k = int(q.k or q.top_k or 5)
+    return rag_search(question, k, q.filter_source, session)
+
+
+@app.get("/rag/cache")
+def rag_cache_inspect(limit: int = 50, _tok: str = Depends(require_auth)):
+    """Estatísticas e entradas mais recentes do cache de resultados do RAG"""
+    cache = get_rag_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats(), "entries_recent": cache.inspect(limit)}
+
+
+@app.delete("/rag/cache")
+def rag_cache_flush(_tok: str = Depends(require_auth)):
+    """Esvazia o cache de resultados do RAG"""
+    cache = get_rag_cache()
+    return {"flushed": cache.clear() if cache is not None else 0}
+
+
 # â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
 # HeurÃ­stica para acionar RAG + cliente interno
 # â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
@@ -350,7 +800,10 @@ RAG_ENABLE = os.getenv("RAG_ENABLE", "true").lower() == "true"
 RAG_ENDPOINT = os.getenv("RAG_ENDPOINT", "http://127.0.0.1:8000/rag/query")
 RAG_DEFAULT_SOURCE = os.getenv("RAG_DEFAULT_SOURCE", "faq")
 
-# Optional alternative RAG backend: "rpc" (default via HTTP) or "pg" (direct Postgres hybrid)
+# RAG backend: "rpc" (default, Supabase RPC in-process), "local" (in-memory NumPy
+# index, see local_index.py), "lexical" (TF-IDF only, no network; lexical_index.py),
+# "pg" (direct Postgres hybrid) or "http" (remote /rag/query at RAG_ENDPOINT,
+# for split deployments)
 RAG_BACKEND = os.getenv("RAG_BACKEND", "rpc").strip().lower()
 DATABASE_URL = os.getenv("DATABASE_URL") or os.getenv("PG_DSN")
 
@@ -361,6 +814,7 @@ def fetch_rag_context(
     filter_source: str | None = RAG_DEFAULT_SOURCE,
     timeout: int = 12,
     session: requests.Session | None = None,
+    raise_errors: bool = False,
 ) -> str | None:
     payload = {"question": question, "k": int(k), "filter_source": filter_source}
     start = time.time()
@@ -380,135 +834,495 @@ def fetch_rag_context(
         return ctx
     except requests.Timeout:
         log.warning("RAG timeout after %ss", timeout)
+        if raise_errors:
+            raise
         return None
     except Exception as e:
         log.warning("RAG offline/erro: %s", e)
+        if raise_errors:
+            raise
         return None
 
 
-def _pg_hybrid_search(question: str, k: int = 12) -> tuple[str | None, list[dict]]:
-    """Optional direct-Postgres hybrid search (FTS + vector) using psycopg.
+async def fetch_rag_context_async(
+    question: str,
+    k: int = 5,
+    filter_source: str | None = RAG_DEFAULT_SOURCE,
+    timeout: int = 12,
+    raise_errors: bool = False,
+) -> str | None:
+    payload = {"question": question, "k": int(k), "filter_source": filter_source}
+    start = time.time()
+    try:
+        r = await get_http_clients().arequest(
+            "rag", "POST", RAG_ENDPOINT, json=payload, timeout=timeout
+        )
+        r.raise_for_status()
+        data = r.json() or {}
+        ctx = data.get("context") or None
+        log.debug(
+            "RAG context ok in %.2fs (k=%s, source=%s, size=%s)",
+            time.time() - start,
+            k,
+            filter_source,
+            len(ctx or ""),
+        )
+        return ctx
+    except httpx.TimeoutException:
+        log.warning("RAG timeout after %ss", timeout)
+        if raise_errors:
+            raise
+        return None
+    except Exception as e:
+        log.warning("RAG offline/erro: %s", e)
+        if raise_errors:
+            raise
+        return None
+
+
+# Pool de conexões Postgres (RAG_BACKEND=pg); ver pg_pool.py
+_pg_pool = None
+_pg_async_pool = None
+_pg_async_pool_lock = asyncio.Lock()
+
+# Busca híbrida em uma consulta (RRF no servidor); ver hybrid_search.py
+_pg_search_config = hybrid_search.HybridSearchConfig.from_env()
+
+
+def get_pg_pool():
+    global _pg_pool
+    if _pg_pool is None:
+        from pg_pool import PgPool, PgPoolConfig
+
+        pool = PgPool(
+            DATABASE_URL, PgPoolConfig.from_env(), on_connect=hybrid_search.register_vector_types
+        )
+        pool.open()
+        _pg_pool = pool
+    return _pg_pool
+
+
+async def get_pg_async_pool():
+    global _pg_async_pool
+    async with _pg_async_pool_lock:
+        if _pg_async_pool is None:
+            from pg_pool import AsyncPgPool, PgPoolConfig
+
+            pool = AsyncPgPool(
+                DATABASE_URL, PgPoolConfig.from_env(), on_connect=hybrid_search.register_vector_types_async
+            )
+            await pool.open()
+            _pg_async_pool = pool
+    return _pg_async_pool
 
-    Returns a tuple (context_text, refs). If unavailable or errors, returns (None, []).
+
+def _pg_hybrid_search(
+    question: str, k: int = 12, raise_errors: bool = False
+) -> tuple[str | None, list[dict]]:
+    """Optional direct-Postgres hybrid search (FTS + vector, RRF in SQL) using a psycopg pool.
+
+    Returns a tuple (context_text, refs). If unavailable or errors, returns (None, []);
+    with `raise_errors`, embedding/query errors propagate instead.
     """
     if not DATABASE_URL:
         return None, []
     try:
-        import psycopg  # type: ignore
-    except Exception:
-        log.debug("psycopg not installed; skipping PG hybrid search")
+        pool = get_pg_pool()
+    except ImportError:
+        log.debug("psycopg_pool not installed; skipping PG hybrid search")
         return None, []
 
-    # Embedding via OpenAI SDK if available
+    # Embedding via OpenAI SDK if available (cached)
     try:
         if OpenAI is None or not OPENAI_API_KEY:
             return None, []
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        emb = client.embeddings.create(model=EMBEDDING_MODEL, input=question).data[0].embedding
+        emb = _embed(question)
     except Exception as e:  # pragma: no cover
         log.warning("Embedding failed: %s", e)
+        if raise_errors:
+            raise
         return None, []
 
-    fts_rows: list[tuple] = []
-    vec_rows: list[tuple] = []
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                # FTS on content (Portuguese config); adjust to your schema
-                cur.execute(
-                    """
-                    select id, document_id, heading, content,
-                           0.0 as vscore,
-                           ts_rank(to_tsvector('portuguese', content), websearch_to_tsquery('portuguese', %s)) as ts_score
-                    from rag_chunks
-                    where to_tsvector('portuguese', content) @@ websearch_to_tsquery('portuguese', %s)
-                    order by ts_score desc
-                    limit 50
-                    """,
-                    (question, question),
-                )
-                fts_rows = cur.fetchall() or []
-
-                # Vector similarity (pgvector <=>). Assumes column name 'embedding'
-                cur.execute(
-                    """
-                    select id, document_id, heading, content,
-                           1 - (embedding <=> %s::vector) as vscore,
-                           0.0 as ts_score
-                    from rag_chunks
-                    order by embedding <=> %s::vector
-                    limit 50
-                    """,
-                    (emb, emb),
-                )
-                vec_rows = cur.fetchall() or []
+        with pool.connection() as conn:
+            rows = hybrid_search.search(conn, question, emb, k, _pg_search_config)
     except Exception as e:
         log.warning("PG hybrid query failed: %s", e)
+        if raise_errors:
+            raise
         return None, []
+    return hybrid_search.format_results(rows)
 
-    # Simple Reciprocal Rank Fusion-like merge
-    def rank_map(rows: list[tuple], key_index: int = 0) -> dict[Any, int]:
-        return {row[key_index]: i for i, row in enumerate(rows)}
-
-    r_fts = rank_map(fts_rows)
-    r_vec = rank_map(vec_rows)
-    combined: dict[Any, dict] = {}
-    for rows in (fts_rows, vec_rows):
-        for row in rows:
-            _id, _doc, heading, content, vscore, ts_score = row
-            if _id not in combined:
-                combined[_id] = {
-                    "heading": heading or "",
-                    "content": content or "",
-                    "vscore": float(vscore or 0.0),
-                    "ts_score": float(ts_score or 0.0),
-                    "source_title": str(_doc or ""),
-                    "uri": None,
-                }
-    # Compute fusion score 1/(k + rank)
-    for _id in combined.keys():
-        rf = r_fts.get(_id, 10_000)
-        rv = r_vec.get(_id, 10_000)
-        combined[_id]["fusion"] = (1.0 / (60 + rf)) + (1.0 / (60 + rv))
 
-    top_ids = sorted(combined.keys(), key=lambda i: combined[i]["fusion"], reverse=True)[: max(1, k)]
-    items = [combined[i] for i in top_ids]
+async def _pg_hybrid_search_async(
+    question: str, k: int = 12, raise_errors: bool = False
+) -> tuple[str | None, list[dict]]:
+    """Async version of `_pg_hybrid_search` (AsyncConnectionPool, no worker thread)."""
+    if not DATABASE_URL:
+        return None, []
+    try:
+        pool = await get_pg_async_pool()
+    except ImportError:
+        log.debug("psycopg_pool not installed; skipping PG hybrid search")
+        return None, []
+    try:
+        if AsyncOpenAI is None or not OPENAI_API_KEY:
+            return None, []
+        emb = await _embed_async(question)
+    except Exception as e:  # pragma: no cover
+        log.warning("Embedding failed: %s", e)
+        if raise_errors:
+            raise
+        return None, []
+
+    try:
+        async with pool.connection() as conn:
+            rows = await hybrid_search.search_async(conn, question, emb, k, _pg_search_config)
+    except Exception as e:
+        log.warning("PG hybrid query failed: %s", e)
+        if raise_errors:
+            raise
+        return None, []
+    return hybrid_search.format_results(rows)
+
+
+@app.get("/metrics/local-index")
+def local_index_metrics(_tok: str = Depends(require_auth)):
+    """Índice vetorial local: tamanho, quantização, versão e latência de busca"""
+    if _local_index is None:
+        return {"loaded": False}
+    return _local_index.stats()
+
+
+@app.get("/metrics/pg")
+def pg_metrics(_tok: str = Depends(require_auth)):
+    """Pool Postgres: conexões em uso, fila de espera e latência de aquisição"""
+    return {
+        "sync": _pg_pool.stats() if _pg_pool is not None else None,
+        "async": _pg_async_pool.stats() if _pg_async_pool is not None else None,
+    }
+
+
+def fetch_rag_context_local(
+    question: str,
+    k: int = 5,
+    filter_source: str | None = RAG_DEFAULT_SOURCE,
+    raise_errors: bool = False,
+) -> str | None:
+    """Contexto via serviço RAG in-process; erros viram None como no modo HTTP"""
+    start = time.time()
+    try:
+        ctx = rag_search(question, k, filter_source).context or None
+    except Exception as e:
+        log.warning("RAG offline/erro: %s", e)
+        if raise_errors:
+            raise
+        return None
+    log.debug("RAG context ok in %.2fs (k=%s, in-process)", time.time() - start, k)
+    return ctx
+
+
+async def fetch_rag_context_local_async(
+    question: str,
+    k: int = 5,
+    filter_source: str | None = RAG_DEFAULT_SOURCE,
+    raise_errors: bool = False,
+) -> str | None:
+    start = time.time()
+    try:
+        ctx = (await rag_search_async(question, k, filter_source)).context or None
+    except Exception as e:
+        log.warning("RAG offline/erro: %s", e)
+        if raise_errors:
+            raise
+        return None
+    log.debug("RAG context ok in %.2fs (k=%s, in-process)", time.time() - start, k)
+    return ctx
+
+
+# Índice léxico TF-IDF sem rede (docs/aria_vector_store); ver lexical_index.py
+RAG_LEXICAL_DIR = os.getenv("RAG_LEXICAL_DIR", "docs/aria_vector_store")
+RAG_LEXICAL_FALLBACK = os.getenv("RAG_LEXICAL_FALLBACK", "true").lower() == "true"
+RAG_LEXICAL_FALLBACK_TIMEOUT = float(os.getenv("RAG_LEXICAL_FALLBACK_TIMEOUT", "4"))
+RAG_LEXICAL_MIN_SCORE = float(os.getenv("RAG_LEXICAL_MIN_SCORE", "0.05"))
+_lexical_index = None
+_lexical_index_loaded = False
+
+
+def get_lexical_index():
+    """Índice léxico carregado uma vez; None se numpy ou os artefatos faltarem"""
+    global _lexical_index, _lexical_index_loaded
+    if not _lexical_index_loaded:
+        _lexical_index_loaded = True
+        directory = RAG_LEXICAL_DIR
+        if not os.path.isabs(directory):
+            directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
+        try:
+            from lexical_index import LexicalIndex
+
+            if LexicalIndex.exists(directory):
+                _lexical_index = LexicalIndex.load(directory)
+                log.info("Índice léxico carregado: %s chunks", len(_lexical_index))
+            else:
+                log.warning("Índice léxico não encontrado em %s (rode python lexical_index.py)", directory)
+        except Exception as e:
+            log.warning("Índice léxico indisponível: %s", e)
+    return _lexical_index
 
-    context_text = ""
-    refs: list[dict] = []
-    for i, c in enumerate(items, 1):
-        context_text += f"[{i}] {c['heading'] or ''}\n{c['content']}\n---\n"
-        refs.append({
-            "i": i,
-            "title": c.get("source_title") or "",
-            "uri": c.get("uri") or "",
-        })
 
-    return context_text or None, refs
+def lexical_bundle(question: str, k: int = 5) -> tuple[str | None, list[dict]]:
+    index = get_lexical_index()
+    if index is None:
+        return None, []
+    return index.bundle(question, max(1, k), RAG_LEXICAL_MIN_SCORE)
+
+
+def _lexical_fallback_enabled() -> bool:
+    return RAG_LEXICAL_FALLBACK and RAG_BACKEND != "lexical"
+
+
+def _fetch_rag_bundle_uncached(question: str, k: int) -> tuple[str | None, list[dict]]:
+    # erros sobem até fetch_rag_bundle: só falha (não "nenhum resultado") aciona o fallback léxico
+    if RAG_BACKEND == "lexical":
+        return lexical_bundle(question, k)
+    if RAG_BACKEND == "pg":
+        return _pg_hybrid_search(question, max(1, k), raise_errors=True)
+    if RAG_BACKEND == "http":
+        return fetch_rag_context(question, k, raise_errors=True), []
+    return fetch_rag_context_local(question, k, raise_errors=True), []
+
+
+def _fetch_rag_bundle_primary(question: str, k: int) -> tuple[str | None, list[dict]]:
+    cache = get_rag_cache()
+    if cache is None or RAG_BACKEND in ("rpc", "local", "lexical"):
+        # rpc/local: rag_search já consulta o cache de resultados
+        return _fetch_rag_bundle_uncached(question, k)
+    kind = f"bundle:{RAG_BACKEND}"
+    version = get_corpus_version().current()
+    cached = cache.get(kind, question, RAG_DEFAULT_SOURCE, k, version)
+    if cached is not None:
+        return cached
+    emb = None
+    if cache.semantic:
+        emb = _embed(question)
+        cached = cache.similar(kind, question, RAG_DEFAULT_SOURCE, k, version, emb)
+        if cached is not None:
+            return cached
+    ctx, refs = _fetch_rag_bundle_uncached(question, k)
+    if ctx:
+        cache.put(kind, question, RAG_DEFAULT_SOURCE, k, version, (ctx, refs), embedding=emb)
+    return ctx, refs
 
 
 def fetch_rag_bundle(question: str, k: int = 5) -> tuple[str | None, list[dict]]:
-    """Unified RAG fetch that supports RPC or Postgres backends.
+    """Unified RAG fetch that supports RPC/local index (in-process), Postgres, lexical or remote HTTP backends.
 
-    Returns (context, refs). Refs non-empty only for PG backend.
+    Returns (context, refs). Refs non-empty only for PG and lexical results.
+    If the backend fails (not when it simply finds nothing), falls back to the lexical index.
     """
+    try:
+        return _fetch_rag_bundle_primary(question, k)
+    except Exception as e:
+        log.warning("RAG backend %s falhou: %s", RAG_BACKEND, e)
+        if not _lexical_fallback_enabled():
+            return None, []
+    ctx, refs = lexical_bundle(question, k)
+    if ctx:
+        log.info("RAG: usando fallback léxico (backend %s indisponível)", RAG_BACKEND)
+    return ctx, refs
+
+
+async def _fetch_rag_bundle_uncached_async(question: str, k: int) -> tuple[str | None, list[dict]]:
+    if RAG_BACKEND == "lexical":
+        return lexical_bundle(question, k)
     if RAG_BACKEND == "pg":
-        return _pg_hybrid_search(question, max(1, k))
-    # default: RPC backend
-    return fetch_rag_context(question, k), []
+        return await _pg_hybrid_search_async(question, max(1, k), raise_errors=True)
+    if RAG_BACKEND == "http":
+        return await fetch_rag_context_async(question, k, raise_errors=True), []
+    return await fetch_rag_context_local_async(question, k, raise_errors=True), []
+
+
+async def _fetch_rag_bundle_primary_async(question: str, k: int) -> tuple[str | None, list[dict]]:
+    cache = get_rag_cache()
+    if cache is None or RAG_BACKEND in ("rpc", "local", "lexical"):
+        return await _fetch_rag_bundle_uncached_async(question, k)
+    kind = f"bundle:{RAG_BACKEND}"
+    version = await get_corpus_version().acurrent()
+    cached = cache.get(kind, question, RAG_DEFAULT_SOURCE, k, version)
+    if cached is not None:
+        return cached
+    emb = None
+    if cache.semantic:
+        try:
+            emb = await _embed_async(question)
+        except Exception as e:
+            log.warning("Embedding para cache semântico falhou: %s", e)
+        cached = cache.similar(kind, question, RAG_DEFAULT_SOURCE, k, version, emb)
+        if cached is not None:
+            return cached
+    ctx, refs = await _fetch_rag_bundle_uncached_async(question, k)
+    if ctx:
+        cache.put(kind, question, RAG_DEFAULT_SOURCE, k, version, (ctx, refs), embedding=emb)
+    return ctx, refs
+
+
+async def fetch_rag_bundle_async(question: str, k: int = 5) -> tuple[str | None, list[dict]]:
+    """Async version of `fetch_rag_bundle` used by the routing pipeline.
+
+    With the lexical fallback on, a backend that fails or is slower than
+    RAG_LEXICAL_FALLBACK_TIMEOUT is abandoned and the lexical index answers instead.
+    A backend that answers with no match is returned as is.
+    """
+    fallback = _lexical_fallback_enabled()
+    try:
+        primary = _fetch_rag_bundle_primary_async(question, k)
+        if fallback and RAG_LEXICAL_FALLBACK_TIMEOUT > 0:
+            return await asyncio.wait_for(primary, RAG_LEXICAL_FALLBACK_TIMEOUT)
+        return await primary
+    except asyncio.TimeoutError:
+        log.warning("RAG backend %s excedeu %ss", RAG_BACKEND, RAG_LEXICAL_FALLBACK_TIMEOUT)
+    except Exception as e:
+        log.warning("RAG backend %s falhou: %s", RAG_BACKEND, e)
+    if not fallback:
+        return None, []
+    ctx, refs = lexical_bundle(question, k)
+    if ctx:
+        log.info("RAG: usando fallback léxico (backend %s indisponível)", RAG_BACKEND)
+    return ctx, refs
 
 # â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
 # Endpoint principal
 # â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
 
+@asynccontextmanager
+async def _null_lock():
+    yield
+
+
+def _assist_debug(stage: str) -> None:
+    # Marcadores de progresso do routing; só grava em disco com API_DEBUG=true
+    if not DEBUG:
+        return
+    try:
+        with open("assist_debug.log", "a", encoding="utf-8") as _f:
+            _f.write(f"{stage}\n")
+    except Exception:
+        pass
+
+
+async def _assistant_reply_async(
+    user_text: str,
+    rag_ctx: str | None,
+    thread_id: str | None,
+    timings: dict[str, int] | None = None,
+    on_delta: Callable[[str], Awaitable[None]] | None = None,
+) -> tuple[str, str | None]:
+    """Executa o Assistant (se configurado) e devolve (reply_text, assistant_thread_id).
+
+    `timings` recebe a duração (ms) de cada fase do Assistant para o log de routing.
+    `on_delta` só é chamado no modo stream; no modo poll o texto chega inteiro.
+    """
+    if client_assistant_async is None or not ASSISTANT_ID:
+        return "", thread_id
+    timings = timings if timings is not None else {}
+    try:
+        system_rules = (
+            "VocÃª Ã© a ARIA. Responda em pt-BR. "
+            "Use APENAS o CONTEXTO quando fornecido; se faltar, diga que nÃ£o encontrou e ofereÃ§a encaminhar ao time."
+        )
+        prompt = (
+            system_rules
+            + (f"\n\nCONTEXTO:\n{rag_ctx}\n\n" if rag_ctx else "\n\n")
+            + f"PERGUNTA:\n{user_text}"
+        )
+        if not thread_id:
+            t_phase = time.perf_counter()
+            thread_id = (await client_assistant_async.beta.threads.create()).id
+            timings["create_thread_ms"] = _ms_since(t_phase)
+        th_id = thread_id
+        t_phase = time.perf_counter()
+        await client_assistant_async.beta.threads.messages.create(
+            thread_id=th_id, role="user", content=prompt
+        )
+        timings["post_message_ms"] = _ms_since(t_phase)
+        if ASSISTANT_RUN_MODE == "stream":
+            reply = await stream_run_async(th_id, ASSISTANT_TIMEOUT_SECONDS, timings, on_delta)
+            return reply, th_id
+        t_phase = time.perf_counter()
+        run = await client_assistant_async.beta.threads.runs.create(
+            thread_id=th_id, assistant_id=ASSISTANT_ID
+        )
+        finished = await wait_run_async(th_id, run.id, ASSISTANT_TIMEOUT_SECONDS)
+        if finished is None:
+            # run ainda ativo bloquearia as próximas mensagens da thread
+            log.warning("Assistant run timeout após %ss (run=%s)", ASSISTANT_TIMEOUT_SECONDS, run.id)
+            try:
+                await client_assistant_async.beta.threads.runs.cancel(thread_id=th_id, run_id=run.id)
+            except Exception as e:
+                log.warning("Falha ao cancelar run %s: %s", run.id, e)
+            timings["completion_ms"] = _ms_since(t_phase)
+            return "", th_id
+        reply = await last_assistant_message_async(th_id, run.id)
+        timings["completion_ms"] = _ms_since(t_phase)
+        return reply, th_id
+    except Exception:
+        return "", thread_id
+
+
+async def _chat_reply_async(
+    user_text: str,
+    rag_ctx: str,
+    on_delta: Callable[[str], Awaitable[None]] | None = None,
+) -> str:
+    """Chat Completions com o contexto RAG (usado quando não há Assistant).
+
+    Com `on_delta`, usa `stream=True` e repassa cada trecho conforme chega.
+    """
+    if AsyncOpenAI is None or not OPENAI_API_KEY:
+        return ""
+    try:
+        client = get_openai_async_client()
+        system_rules = (
+            "Você é a ARIA, assistente da AR Online. Fale SEMPRE em pt-BR, tom cordial e objetivo. "
+            "Siga LGPD: peça só o mínimo. Use APENAS as fontes fornecidas no CONTEXTO para responder. "
+            "Quando faltar base, diga que vai encaminhar para o time responsável."
+        )
+        messages = [
+            {"role": "system", "content": system_rules},
+            {"role": "user", "content": f"PERGUNTA:\n{user_text}\n\nCONTEXTO:\n{rag_ctx}"},
+        ]
+        if on_delta is None:
+            resp = await client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                temperature=0.2,
+            )
+            return (resp.choices[0].message.content or "").strip()
+        stream = await client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=0.2,
+            stream=True,
+        )
+        parts: list[str] = []
+        async for chunk in stream:
+            piece = chunk.choices[0].delta.content if chunk.choices else None
+            if piece:
+                parts.append(piece)
+                await on_delta(piece)
+        return "".join(parts).strip()
+    except Exception:
+        return ""
+
+
 @app.post("/webhook/assist/routing")
-def agno_webhook_routing(
+async def agno_webhook_routing(
     request: Request,
     payload: dict = Body(default_factory=dict),
     _tok: str = Depends(require_auth),
 ):
     """Webhook do Agno - redireciona para o endpoint principal"""
-    return assist_routing(request, payload, _tok)
+    return await assist_routing(request, payload, _tok)
 
 
 @app.post("/webhook/assist/routing/debug")
@@ -520,17 +1334,40 @@ def agno_webhook_routing_debug(
     log.info(f"Agno webhook debug received: {payload}")
     return {"status": "received", "payload": payload}
 @app.post("/assist/routing")
-def assist_routing(
+async def assist_routing(
     request: Request,
     payload: dict = Body(default_factory=dict),
     _tok: str = Depends(require_auth),
 ):
+    return await run_routing(payload, request.headers)
+
+
+RoutingEventHandler = Callable[[str, dict[str, Any]], Awaitable[None]]
+
+# Prazos por etapa do pipeline de routing (estouro = etapa degradada, não erro)
+RAG_STAGE_TIMEOUT_SECONDS = float(os.getenv("RAG_STAGE_TIMEOUT_SECONDS", "8"))
+THREAD_STAGE_TIMEOUT_SECONDS = float(os.getenv("THREAD_STAGE_TIMEOUT_SECONDS", "5"))
+
+
+async def run_routing(
+    payload: dict[str, Any] | None,
+    headers: Mapping[str, str] | None = None,
+    on_event: RoutingEventHandler | None = None,
+) -> AssistResponse:
+    """Núcleo do /assist/routing, chamável in-process (WhatsApp, Agent UI, Mindchat).
+
+    `headers` aceita X-Thread-Id / X-Trace-Id / X-Request-Id como no endpoint.
+    `on_event(nome, dados)` recebe eventos intermediários: "route" (após as
+    regras), "rag" (contexto recuperado) e "delta" (trechos da resposta).
+    """
+    headers = {str(k).lower(): v for k, v in (headers or {}).items()}
+    on_delta = None
+    if on_event is not None:
+
+        async def on_delta(piece: str) -> None:
+            await on_event("delta", {"content": piece})
     t0 = time.time()
-    try:
-        with open("assist_debug.log", "a", encoding="utf-8") as _f:
-            _f.write("enter\n")
-    except Exception:
-        pass
+    _assist_debug("enter")
     # Accept multiple possible input fields
     user_text = str(
         (payload or {}).get("input")
@@ -540,35 +1377,8 @@ def assist_routing(
     ).strip()
     v_in: dict[str, Any] = dict((payload or {}).get("variables") or {})
 
-    # 1) Regras determinÃ­sticas
-    route, vars_out, next_action = classify_route(user_text, v_in)
-    try:
-        with open("assist_debug.log", "a", encoding="utf-8") as _f:
-            _f.write("after_classify\n")
-    except Exception:
-        pass
-
-    # 2) RAG opcional
-    rag_ctx: str | None = None
-    rag_refs: list[dict] = []
-    need_rag = RAG_ENABLE and want_rag(user_text, v_in)
-    if need_rag:
-        rag_ctx, rag_refs = fetch_rag_bundle(user_text, k=5)
-    try:
-        with open("assist_debug.log", "a", encoding="utf-8") as _f:
-            _f.write("after_rag\n")
-    except Exception:
-        pass
-
-    if rag_ctx:
-        vars_out["need_rag"] = "true"
-        vars_out["rag_context"] = rag_ctx
-        if rag_refs:
-            vars_out["rag_refs"] = rag_refs
-
-    # 3) Thread (se usar Assistant)
-    # Precedence: header X-Thread-Id -> payload.thread_id -> fallback
-    x_thread_id = (request.headers.get("x-thread-id") or "").strip()  # type: ignore[attr-defined]
+    # Thread: precedence header X-Thread-Id -> payload.thread_id -> fallback
+    x_thread_id = (headers.get("x-thread-id") or "").strip()
     body_thread_id = str((payload or {}).get("thread_id") or "").strip()
 
     def ensure_thread_id(remetente: str, canal: str) -> str:
@@ -576,73 +1386,100 @@ def assist_routing(
         return "thrd_" + hashlib.sha256(base.encode()).hexdigest()[:24]
 
     app_thread_id = x_thread_id or body_thread_id
+    remetente = str(v_in.get("remetente") or "").strip()
+    canal = str(v_in.get("canal") or "").strip()
+    # Só ids estáveis são mapeados; o fallback aleatório nunca se repete
+    stable_thread = bool(app_thread_id)
     if not app_thread_id:
-        remetente = str(v_in.get("remetente") or "").strip()
-        canal = str(v_in.get("canal") or "").strip()
         if remetente and canal:
             app_thread_id = ensure_thread_id(remetente, canal)
+            stable_thread = True
         else:
             app_thread_id = (
                 f"thr_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}_{secrets.token_hex(2)}"
             )
-    assistant_thread_id: str | None = None
-    if client_assistant is not None:
-        try:
-            assistant_thread_id = client_assistant.beta.threads.create().id
-        except Exception:
-            assistant_thread_id = None
 
-    # 4) Assistant opcional
-    reply_text = ""
-    if client_assistant is not None and ASSISTANT_ID:
-        try:
-            system_rules = (
-                "VocÃª Ã© a ARIA. Responda em pt-BR. "
-                "Use APENAS o CONTEXTO quando fornecido; se faltar, diga que nÃ£o encontrou e ofereÃ§a encaminhar ao time."
-            )
-            prompt = (
-                system_rules
-                + (f"\n\nCONTEXTO:\n{rag_ctx}\n\n" if rag_ctx else "\n\n")
-                + f"PERGUNTA:\n{user_text}"
-            )
-            th_id = assistant_thread_id or client_assistant.beta.threads.create().id
-            client_assistant.beta.threads.messages.create(
-                thread_id=th_id, role="user", content=prompt
-            )
-            run = client_assistant.beta.threads.runs.create(
-                thread_id=th_id, assistant_id=ASSISTANT_ID
-            )
-            wait_run(th_id, run.id, ASSISTANT_TIMEOUT_SECONDS)
-            reply_text = last_assistant_message(th_id)
-            assistant_thread_id = th_id
-        except Exception:
-            reply_text = ""
-    # If not using Assistants, attempt Chat Completions with RAG context
-    if not reply_text and rag_ctx and OPENAI_API_KEY:
-        try:
-            client = OpenAI(api_key=OPENAI_API_KEY)
-            system_rules = (
-                "Você é a ARIA, assistente da AR Online. Fale SEMPRE em pt-BR, tom cordial e objetivo. "
-                "Siga LGPD: peça só o mínimo. Use APENAS as fontes fornecidas no CONTEXTO para responder. "
-                "Quando faltar base, diga que vai encaminhar para o time responsável."
-            )
-            messages = [
-                {"role": "system", "content": system_rules},
-                {"role": "user", "content": f"PERGUNTA:\n{user_text}\n\nCONTEXTO:\n{rag_ctx}"},
-            ]
-            resp = client.chat.completions.create(
-                model=CHAT_MODEL,
-                messages=messages,
-                temperature=0.2,
+    use_assistant = client_assistant_async is not None and bool(ASSISTANT_ID)
+    store = get_thread_store() if (use_assistant and stable_thread) else None
+    need_rag = RAG_ENABLE and want_rag(user_text, v_in)
+    phases: dict[str, int] = {}
+    stages_ms: dict[str, int] = {}
+    stage_errors: dict[str, str] = {}
+
+    # 1) Regras determinÃ­sticas (CPU puro, sem I/O)
+    async def stage_classify(_: dict[str, Any]):
+        result = classify_route(user_text, v_in)
+        if on_event is not None:
+            await on_event("route", {"route": result[0], "next_action": result[2]})
+        return result
+
+    # 2) RAG opcional (em paralelo com a thread)
+    async def stage_rag(_: dict[str, Any]) -> tuple[str | None, list[dict]]:
+        if not need_rag:
+            return None, []
+        ctx, refs = await fetch_rag_bundle_async(user_text, k=5)
+        if ctx and on_event is not None:
+            await on_event("rag", {"context": ctx, "refs": refs})
+        return ctx, refs
+
+    # 3) Thread do Assistant: mapeamento persistido ou thread nova
+    async def stage_thread(_: dict[str, Any]) -> str | None:
+        if not use_assistant:
+            return None
+        if store is not None:
+            found = await store.aget(app_thread_id)
+            if found:
+                return found
+        t_phase = time.perf_counter()
+        created = (await client_assistant_async.beta.threads.create()).id
+        phases["create_thread_ms"] = _ms_since(t_phase)
+        return created
+
+    # 4) LLM: começa assim que RAG e thread estiverem prontos
+    async def stage_reply(inputs: dict[str, Any]) -> tuple[str, str | None]:
+        rag_ctx, _refs = inputs["rag"]
+        thread_id = inputs["thread"]
+        text = ""
+        if use_assistant:
+            text, thread_id = await _assistant_reply_async(
+                user_text, rag_ctx, thread_id, phases, on_delta
             )
-            reply_text = (resp.choices[0].message.content or "").strip()
-        except Exception:
-            reply_text = reply_text or ""
-    try:
-        with open("assist_debug.log", "a", encoding="utf-8") as _f:
-            _f.write("after_assistant\n")
-    except Exception:
-        pass
+            if store is not None and thread_id:
+                if text:
+                    # grava também em reuso: renova updated_at (THREAD_MAX_IDLE_SECONDS)
+                    await store.aset(
+                        app_thread_id,
+                        thread_id,
+                        user_id=remetente or None,
+                        channel=canal or None,
+                    )
+                else:
+                    # falha/timeout pode deixar um run ativo na thread: a próxima mensagem usa outra
+                    await store.adelete(app_thread_id)
+        # If not using Assistants, attempt Chat Completions with RAG context
+        if not text and rag_ctx and OPENAI_API_KEY:
+            text = await _chat_reply_async(user_text, rag_ctx, on_delta)
+        return text, thread_id
+
+    stages = [
+        Stage("classify", stage_classify),
+        Stage("rag", stage_rag, timeout=RAG_STAGE_TIMEOUT_SECONDS, default=(None, [])),
+        Stage("thread", stage_thread, timeout=THREAD_STAGE_TIMEOUT_SECONDS),
+        Stage("reply", stage_reply, deps=("rag", "thread"), default=("", None)),
+    ]
+    # o lock cobre thread + run: a OpenAI rejeita mensagens com run ativo
+    async with store.lock(app_thread_id) if store else _null_lock():
+        results = await run_stages(stages, timings=stages_ms, errors=stage_errors)
+    _assist_debug("after_assistant")
+
+    route, vars_out, next_action = results["classify"] or classify_route(user_text, v_in)
+    rag_ctx, rag_refs = results["rag"]
+    reply_text, assistant_thread_id = results["reply"]
+    if rag_ctx:
+        vars_out["need_rag"] = "true"
+        vars_out["rag_context"] = rag_ctx
+        if rag_refs:
+            vars_out["rag_refs"] = rag_refs
 
     # 5) Fallback determinÃ­stico
     if not reply_text:
@@ -658,11 +1495,7 @@ def assist_routing(
             reply_text = "Certo! Informe uma estimativa do volume mensal (ex.: 50, 300, 1500) para sugerir o melhor caminho."
         else:
             reply_text = "Como posso te ajudar hoje?"
-    try:
-        with open("assist_debug.log", "a", encoding="utf-8") as _f:
-            _f.write("after_fallback\n")
-    except Exception:
-        pass
+    _assist_debug("after_fallback")
 
     # Expose thread ids in variables and response
     vars_out["thread_id"] = app_thread_id
@@ -670,9 +1503,7 @@ def assist_routing(
         vars_out["assistant_thread_id"] = assistant_thread_id
     # Structured JSON log for routing
     try:
-        x_trace_id = (
-            request.headers.get("x-trace-id") or request.headers.get("x-request-id") or ""
-        ).strip()
+        x_trace_id = (headers.get("x-trace-id") or headers.get("x-request-id") or "").strip()
         vol = str(
             vars_out.get("volume_num")
             or v_in.get("lead_volumetria")
@@ -691,17 +1522,16 @@ def assist_routing(
                     "volume": vol,
                     "fluxo_path": fluxo_path,
                     "dur_ms": dur_ms,
+                    "phases": phases,
+                    "stages_ms": stages_ms,
+                    **({"stage_errors": stage_errors} if stage_errors else {}),
                 },
                 ensure_ascii=False,
             )
         )
     except Exception:
         pass
-    try:
-        with open("assist_debug.log", "a", encoding="utf-8") as _f:
-            _f.write("before_return\n")
-    except Exception:
-        pass
+    _assist_debug("before_return")
 
     # Append Fontes section if we have refs
     try:
@@ -746,13 +1576,13 @@ def assist_routing(
 
 
 @app.post("/webhookassistrouting")
-def webhook_assist_routing(
+async def webhook_assist_routing(
     request: Request,
     payload: dict = Body(default_factory=dict),
     _tok: str = Depends(require_auth),
 ):
     # Simple alias to the main routing endpoint for compatibility
-    return assist_routing(request=request, payload=payload, _tok=_tok)
+    return await assist_routing(request=request, payload=payload, _tok=_tok)
 
 
 # â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
@@ -806,18 +1636,152 @@ def cloudflare_purge_cache(
         return {"success": False, "error": str(e)}
 
 
-# â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
-# WhatsApp Integration via Mindchat
-# â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
+# â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
+# WhatsApp Integration via Mindchat
+# â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”â€”
+
+# Envios ao Mindchat/WhatsApp: token bucket, ordem por destinatário,
+# retentativas no spool e dead letter; ver outbound.py
+OUTBOUND_ENABLE = os.getenv("OUTBOUND_ENABLE", "true").lower() == "true"
+_outbound_sender = None
+
+
+async def _mindchat_post(path: str, body: dict[str, Any], retries: int | None = None) -> httpx.Response:
+    headers = {
+        "Authorization": f"Bearer {MINDCHAT_API_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    return await get_http_clients().arequest(
+        "mindchat",
+        "POST",
+        f"{MINDCHAT_API_BASE_URL}{path}",
+        json=body,
+        headers=headers,
+        retries=retries,
+    )
+
+
+async def _deliver_mindchat(job: dict[str, Any], retries: int | None = None) -> dict[str, Any]:
+    """Um POST ao Mindchat; levanta DeliveryError (retentável em 429/5xx)"""
+    from outbound import DeliveryError, is_retryable_status
+
+    response = await _mindchat_post(job["path"], job["json"], retries=retries)
+    if 200 <= response.status_code < 300:
+        try:
+            data = response.json()
+        except ValueError:
+            data = response.text
+        return {"status": "success", "response": data}
+    raise DeliveryError(
+        f"{response.status_code} - {response.text}",
+        retryable=is_retryable_status(response.status_code),
+    )
+
+
+def get_outbound_sender():
+    global _outbound_sender
+    if _outbound_sender is None and OUTBOUND_ENABLE:
+        from outbound import OutboundSender
+        from webhook_queue import MemorySpool, SqliteSpool
+
+        spool_path = os.getenv("OUTBOUND_SPOOL", "tmp/aria_outbound.db")
+        _outbound_sender = OutboundSender(
+            _deliver_mindchat_once,
+            rate_per_s=float(os.getenv("OUTBOUND_RATE_PER_S", "20")),
+            burst=int(os.getenv("OUTBOUND_BURST", "20")),
+            workers=int(os.getenv("OUTBOUND_WORKERS", "8")),
+            max_queue=int(os.getenv("OUTBOUND_MAX_QUEUE", "10000")),
+            max_attempts=int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "5")),
+            backoff_s=float(os.getenv("OUTBOUND_BACKOFF_S", "1")),
+            max_backoff_s=float(os.getenv("OUTBOUND_MAX_BACKOFF_S", "60")),
+            spool=SqliteSpool(spool_path, table="outbound_spool") if spool_path else MemorySpool(),
+            dead_letter=SqliteSpool(spool_path, table="outbound_dead_letter") if spool_path else MemorySpool(),
+        )
+    return _outbound_sender
+
+
+async def _deliver_mindchat_once(job: dict[str, Any]) -> dict[str, Any]:
+    # o OutboundSender já faz retry/backoff e dead letter: sem retentativas aninhadas do http_clients
+    return await _deliver_mindchat(job, retries=0)
+
+
+async def send_via_outbound(recipient: str, path: str, body: dict[str, Any]) -> dict[str, Any]:
+    """Entrega o envio ao OutboundSender e retorna sem esperar o Mindchat.
+
+    Sem o sender ativo (desativado ou app sem lifespan) faz o POST direto.
+    """
+    sender = _outbound_sender
+    if sender is not None and sender.running:
+        from webhook_queue import QueueFull
+
+        try:
+            sender.submit(recipient, {"path": path, "json": body})
+            return {"status": "queued"}
+        except QueueFull as e:
+            log.error(f"Envio para {recipient} recusado: {e}")
+            return {"status": "error", "error": "outbound_queue_full"}
+    try:
+        return await _deliver_mindchat({"path": path, "json": body})
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
+
+
+@app.get("/metrics/outbound")
+def outbound_metrics(_tok: str = Depends(require_auth)):
+    """Envios ao Mindchat: fila, latência de envio, taxa de falha e dead letter"""
+    if _outbound_sender is None:
+        return {"running": False}
+    return _outbound_sender.stats()
+
+
+@app.get("/outbound/dead-letter")
+def outbound_dead_letter(limit: int = 100, _tok: str = Depends(require_auth)):
+    """Envios que esgotaram as tentativas (ou falharam de forma definitiva)"""
+    if _outbound_sender is None:
+        return {"items": []}
+    return {"items": _outbound_sender.dead_letters(limit)}
+
+
+@app.post("/outbound/dead-letter/requeue")
+async def outbound_dead_letter_requeue(_tok: str = Depends(require_auth)):
+    """Devolve a dead letter à fila de envio"""
+    if _outbound_sender is None or not _outbound_sender.running:
+        raise HTTPException(status_code=503, detail="outbound_disabled")
+    requeued = await _outbound_sender.requeue_dead_letters()
+    return {"requeued": requeued, "remaining": len(_outbound_sender.dead_letter)}
+
+
+# Deduplicação por message_id dos webhooks do WhatsApp; ver dedup.py
+WEBHOOK_DEDUP_ENABLE = os.getenv("WEBHOOK_DEDUP_ENABLE", "true").lower() == "true"
+_webhook_dedup = None
+
+
+def get_webhook_dedup():
+    global _webhook_dedup
+    if _webhook_dedup is None and WEBHOOK_DEDUP_ENABLE:
+        from dedup import build_deduplicator_from_env
+
+        _webhook_dedup = build_deduplicator_from_env(get_pg_pool if DATABASE_URL else None)
+    return _webhook_dedup
+
+
+@app.get("/metrics/webhook-dedup")
+def webhook_dedup_metrics(_tok: str = Depends(require_auth)):
+    """Deduplicação de webhooks: ids em memória e reenvios descartados"""
+    if _webhook_dedup is None:
+        return {"enabled": False}
+    return _webhook_dedup.stats()
+
 
 @app.post("/whatsapp/webhook")
-def whatsapp_webhook(
+async def whatsapp_webhook(
     request: Request,
     payload: dict = Body(default_factory=dict),
     _tok: str = Depends(require_auth)
 ):
     """Webhook para receber mensagens do WhatsApp via Mindchat"""
     
+    dedup = None
     try:
         # Extrair dados da mensagem
         message_data = {
@@ -831,77 +1795,64 @@ def whatsapp_webhook(
         
         log.info(f"WhatsApp message received: {message_data}")
         
+        # Reenvio de uma mensagem já recebida: nada a fazer
+        dedup = get_webhook_dedup()
+        if dedup is not None and await dedup.ais_duplicate(message_data["message_id"]):
+            log.info(f"Mensagem WhatsApp duplicada ignorada: {message_data['message_id']}")
+            return {"status": "duplicate", "message_id": message_data["message_id"]}
+        
         # Processar com ARIA
-        response = process_aria_message(message_data)
+        response = await process_aria_message(message_data)
         
         # Enviar resposta via Mindchat
-        send_whatsapp_response(response, message_data["from"])
+        await send_whatsapp_response(response, message_data["from"])
         
         return {"status": "processed", "message_id": message_data["message_id"]}
         
     except Exception as e:
         log.error(f"Erro no webhook WhatsApp: {e}")
+        # falhou antes de responder: o próximo reenvio deve ser processado
+        if dedup is not None:
+            await dedup.aforget(message_data["message_id"])
         return {"status": "error", "error": str(e)}
 
 
-def process_aria_message(message_data: dict) -> dict:
+async def process_aria_message(message_data: dict) -> dict:
     """Processa mensagem usando lógica da ARIA"""
     
     try:
         # Usar o mesmo endpoint de routing
+        # remetente+canal geram um thread_id estável: o Assistant reaproveita a thread
         routing_payload = {
             "channel": "whatsapp",
             "sender": message_data["from"],
             "user_text": message_data["message"],
-            "thread_id": f"wa_{message_data['from']}_{int(time.time())}"
+            "variables": {"remetente": message_data["from"], "canal": "whatsapp"},
         }
         
-        # Chamar endpoint interno
-        from fastapi.testclient import TestClient
-        client = TestClient(app)
-        
-        response = client.post(
-            "/assist/routing",
-            json=routing_payload,
-            headers={"Authorization": f"Bearer {API_TOKEN}"}
-        )
-        
-        return response.json()
+        response = await run_routing(routing_payload)
+        return response.model_dump()
         
     except Exception as e:
         log.error(f"Erro ao processar mensagem ARIA: {e}")
         return {"reply_text": "Desculpe, ocorreu um erro ao processar sua mensagem."}
 
 
-def send_whatsapp_response(response: dict, to_number: str):
+async def send_whatsapp_response(response: dict, to_number: str):
     """Envia resposta via Mindchat WhatsApp API"""
     
-    try:
-        mindchat_payload = {
-            "to": to_number,
-            "message": response.get("reply_text", "Desculpe, não entendi sua mensagem."),
-            "type": "text"
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {MINDCHAT_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(  # pyright: ignore[reportAssignmentType]
-            f"{MINDCHAT_API_BASE_URL}/api/whatsapp/send",
-            json=mindchat_payload,
-            headers=headers,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            log.info(f"Resposta WhatsApp enviada para {to_number}")
-        else:
-            log.error(f"Erro ao enviar WhatsApp: {response.status_code} - {response.text}")
-            
-    except Exception as e:
-        log.error(f"Erro ao enviar WhatsApp: {e}")
+    mindchat_payload = {
+        "to": to_number,
+        "message": response.get("reply_text", "Desculpe, não entendi sua mensagem."),
+        "type": "text"
+    }
+    
+    result = await send_via_outbound(to_number, "/api/whatsapp/send", mindchat_payload)
+    
+    if result["status"] == "error":
+        log.error(f"Erro ao enviar WhatsApp: {result['error']}")
+    else:
+        log.info(f"Resposta WhatsApp {'enfileirada' if result['status'] == 'queued' else 'enviada'} para {to_number}")
 
 
 @app.get("/whatsapp/status")
@@ -915,10 +1866,11 @@ def whatsapp_status(_tok: str = Depends(require_auth)):
             "Content-Type": "application/json"
         }
         
-        response = requests.get(
+        response = get_http_clients().request(
+            "mindchat",
+            "GET",
             f"{MINDCHAT_API_BASE_URL}/api/whatsapp/status",
             headers=headers,
-            timeout=10
         )
         
         if response.status_code == 200:
@@ -949,6 +1901,12 @@ def healthz():
     return {"ok": True}
 
 
+@app.get("/metrics/http")
+def http_metrics(_tok: str = Depends(require_auth)):
+    """Uso dos pools HTTP por integração (requisições, retries, conexões)"""
+    return get_http_clients().stats()
+
+
 @app.get("/agents")
 def get_agents():
     """Retorna lista de agentes disponíveis para a interface Agent UI"""
@@ -983,12 +1941,18 @@ def get_sessions(
     return []
 
 
+# Intervalo dos comentários SSE de keep-alive (proxies derrubam conexões ociosas)
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+
+def _sse(data: dict[str, Any]) -> str:
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.post("/agents/{agent_id}/runs")
 async def agent_run(agent_id: str, request: Request):
-    """Executa o agente e retorna resposta"""
+    """Executa o agente e transmite a resposta (SSE) conforme os tokens chegam"""
     from fastapi.responses import StreamingResponse
-    import json
-    import requests
     
     try:
         body = await request.json()
@@ -997,64 +1961,80 @@ async def agent_run(agent_id: str, request: Request):
         
         if not message:
             async def error_stream():
-                yield f"data: {json.dumps({'error': 'Message is required'})}\n\n"
+                yield _sse({'error': 'Message is required'})
             return StreamingResponse(error_stream(), media_type="text/event-stream")
         
         log.info(f"Processing message from agent_run: {message}")
         
-        # Processar mensagem através da lógica de routing
-        try:
-            # Chamar o endpoint de routing via HTTP interno
-            routing_payload = {
-                "user_text": message,
-                "variables": {},
-                "thread_id": session_id
-            }
-            
-            # Fazer chamada HTTP interna com autenticação
-            response = requests.post(
-                "http://localhost:7777/assist/routing",
-                json=routing_payload,
-                headers={"Authorization": f"Bearer {API_TOKEN}"},
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Routing API returned status {response.status_code}")
-            
-            routing_result = response.json()
-            response_text = routing_result.get("reply_text", "Desculpe, não consegui processar sua mensagem.")
-            route = routing_result.get("route", "unknown")
-            
-            log.info(f"Route: {route}, Response generated")
-            
-            # Retornar resposta em formato de streaming
-            async def response_stream():
-                # Enviar evento de início
-                yield f"data: {json.dumps({'event': 'workflow_started', 'run_id': session_id or 'default'})}\n\n"
-                
-                # Enviar conteúdo
-                yield f"data: {json.dumps({'event': 'run_response', 'content': response_text})}\n\n"
-                
-                # Enviar evento de conclusão
-                yield f"data: {json.dumps({'event': 'workflow_completed', 'content': response_text, 'messages': [{'role': 'user', 'content': message}, {'role': 'assistant', 'content': response_text}]})}\n\n"
-            
-            return StreamingResponse(response_stream(), media_type="text/event-stream")
-            
-        except Exception as e:
-            log.error(f"Error processing message: {e}")
-            import traceback
-            traceback.print_exc()
-            async def error_stream():
-                yield f"data: {json.dumps({'event': 'run_response', 'content': 'Desculpe, ocorreu um erro ao processar sua mensagem.'})}\n\n"
-            return StreamingResponse(error_stream(), media_type="text/event-stream")
+        routing_payload = {
+            "user_text": message,
+            "variables": {},
+            "thread_id": session_id
+        }
+        run_id = session_id or "default"
+        events: asyncio.Queue[tuple[str, dict[str, Any]]] = asyncio.Queue()
+
+        async def on_event(name: str, data: dict[str, Any]) -> None:
+            await events.put((name, data))
+
+        async def produce() -> None:
+            try:
+                result = await run_routing(routing_payload, on_event=on_event)
+                await events.put(("done", {"result": result}))
+            except Exception as e:
+                log.error(f"Error processing message: {e}")
+                await events.put(("failed", {}))
+
+        async def response_stream():
+            task = asyncio.create_task(produce())
+            streamed = ""
+            try:
+                yield _sse({'event': 'workflow_started', 'run_id': run_id})
+                while True:
+                    try:
+                        name, data = await asyncio.wait_for(events.get(), SSE_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield ": heartbeat\n\n"
+                        continue
+                    if name == "route":
+                        yield _sse({'event': 'route_decided', 'run_id': run_id, **data})
+                    elif name == "rag":
+                        yield _sse({'event': 'rag_context', 'run_id': run_id, **data})
+                    elif name == "delta":
+                        streamed += data["content"]
+                        yield _sse({'event': 'run_response', 'content': data["content"]})
+                    elif name == "failed":
+                        yield _sse({'event': 'run_response', 'content': 'Desculpe, ocorreu um erro ao processar sua mensagem.'})
+                        break
+                    elif name == "done":
+                        result = data["result"]
+                        response_text = result.reply_text or "Desculpe, não consegui processar sua mensagem."
+                        log.info(f"Route: {result.route or 'unknown'}, Response generated")
+                        # Resposta sem tokens (fallback) ou com sufixo (Fontes) ainda não enviado
+                        base = streamed.rstrip()
+                        if not streamed:
+                            yield _sse({'event': 'run_response', 'content': response_text})
+                        elif response_text.startswith(base) and response_text[len(base):].strip():
+                            yield _sse({'event': 'run_response', 'content': response_text[len(base):]})
+                        yield _sse({'event': 'workflow_completed', 'content': response_text, 'messages': [{'role': 'user', 'content': message}, {'role': 'assistant', 'content': response_text}]})
+                        break
+            finally:
+                # cliente desconectou: não segue gerando a resposta
+                if not task.done():
+                    task.cancel()
+
+        return StreamingResponse(
+            response_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
             
     except Exception as e:
         log.error(f"Erro em agent_run: {e}")
         import traceback
         traceback.print_exc()
         async def error_stream():
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield _sse({'error': str(e)})
         return StreamingResponse(error_stream(), media_type="text/event-stream")
 
 
@@ -1063,10 +2043,6 @@ def auth_debug(_tok: str = Depends(require_auth)):
     return {"tok": _tok}
 
 
-import logging
-import os
-from collections.abc import Mapping
-
 from dotenv import load_dotenv  # pyright: ignore[reportMissingImports]
 
 try:
@@ -1128,36 +2104,20 @@ def validate_gitlab_webhook_token(authorization: str = Header(None)) -> bool:
 
 async def send_whatsapp_notification(message: str, event_type: str = "gitlab_webhook") -> dict[str, Any]:
     """Envia notificação via WhatsApp usando Mindchat API"""
-    try:
-        whatsapp_data = {
-            "to": WHATSAPP_NUMBER,
-            "message": f"🤖 ARIA Notification ({event_type}):\n{message}",
-            "source": "gitlab_webhook",
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {MINDCHAT_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            f"{MINDCHAT_API_BASE_URL}/webhook/whatsapp",
-            json=whatsapp_data,
-            headers=headers,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            log.info(f"Notificação WhatsApp enviada: {message}")
-            return {"status": "success", "response": response.json()}
-        else:
-            log.error(f"Erro ao enviar WhatsApp: {response.status_code} - {response.text}")
-            return {"status": "error", "error": response.text}
-            
-    except Exception as e:
-        log.error(f"Erro ao enviar notificação WhatsApp: {e}")
-        return {"status": "error", "error": str(e)}
+    whatsapp_data = {
+        "to": WHATSAPP_NUMBER,
+        "message": f"🤖 ARIA Notification ({event_type}):\n{message}",
+        "source": "gitlab_webhook",
+        "timestamp": datetime.now().isoformat()
+    }
+    
+    result = await send_via_outbound(WHATSAPP_NUMBER, "/webhook/whatsapp", whatsapp_data)
+    
+    if result["status"] == "error":
+        log.error(f"Erro ao enviar notificação WhatsApp: {result['error']}")
+    else:
+        log.info(f"Notificação WhatsApp {'enfileirada' if result['status'] == 'queued' else 'enviada'}: {message}")
+    return result
 
 # GitLab Webhook Endpoints
 @app.post("/webhook/gitlab/aria")
@@ -1293,9 +2253,9 @@ import hashlib
 from dataclasses import dataclass
 from typing import Optional, List, Dict, Any
 
-@dataclass
+@dataclass(slots=True)
 class WhatsAppMessage:
-    """Representa uma mensagem do WhatsApp"""
+    """Representa uma mensagem do WhatsApp (com __slots__: lotes grandes ocupam menos memória)"""
     message_id: str
     from_number: str
     timestamp: str
@@ -1304,6 +2264,9 @@ class WhatsAppMessage:
     contact_name: Optional[str] = None
     context_id: Optional[str] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
 def verify_mindchat_webhook_signature(payload: bytes, signature: str) -> bool:
     """Verifica a assinatura do webhook do Mindchat"""
     if not MINDCHAT_WEBHOOK_SECRET:
@@ -1318,105 +2281,81 @@ def verify_mindchat_webhook_signature(payload: bytes, signature: str) -> bool:
     
     return hmac.compare_digest(f"sha256={expected_signature}", signature)
 
+def _message_text(message_data: Dict[str, Any], message_type: str) -> str:
+    if message_type == "text":
+        return (message_data.get("text") or {}).get("body", "")
+    if message_type == "interactive":
+        interactive = message_data.get("interactive") or {}
+        if interactive.get("type") == "button_reply":
+            return (interactive.get("button_reply") or {}).get("title", "")
+        if interactive.get("type") == "list_reply":
+            return (interactive.get("list_reply") or {}).get("title", "")
+    return ""
+
+
+def parse_whatsapp_payload(payload: Dict[str, Any]) -> List[WhatsAppMessage]:
+    """Converte todas as mensagens de um payload do Mindchat numa passada só.
+
+    O nome do contato vem do `contacts` com o mesmo `wa_id` do remetente
+    (ou do primeiro contato, quando o payload não traz `wa_id`).
+    """
+    contacts = payload.get("contacts") or []
+    names = {
+        c.get("wa_id"): (c.get("profile") or {}).get("name")
+        for c in contacts
+        if isinstance(c, dict) and c.get("wa_id")
+    }
+    default_name = (contacts[0].get("profile") or {}).get("name") if contacts and isinstance(contacts[0], dict) else None
+    
+    parsed: List[WhatsAppMessage] = []
+    for message_data in payload.get("messages") or []:
+        try:
+            message_type = message_data.get("type", "text")
+            sender = message_data.get("from", "")
+            parsed.append(WhatsAppMessage(
+                message_id=message_data.get("id", ""),
+                from_number=sender,
+                timestamp=message_data.get("timestamp", ""),
+                text=_message_text(message_data, message_type),
+                message_type=message_type,
+                contact_name=names.get(sender) if names else default_name,
+                context_id=(message_data.get("context") or {}).get("id")
+            ))
+        except Exception as e:
+            log.error(f"Erro ao processar mensagem WhatsApp: {e}")
+    return parsed
+
+
 def parse_whatsapp_message(payload: Dict[str, Any]) -> Optional[WhatsAppMessage]:
-    """Converte payload do Mindchat para objeto WhatsAppMessage"""
-    try:
-        if "messages" not in payload:
-            return None
-        
-        message_data = payload["messages"][0]
-        contact_data = payload.get("contacts", [{}])[0]
-        
-        # Extrair texto da mensagem
-        text = ""
-        message_type = message_data.get("type", "text")
-        
-        if message_type == "text":
-            text = message_data.get("text", {}).get("body", "")
-        elif message_type == "interactive":
-            interactive = message_data.get("interactive", {})
-            if interactive.get("type") == "button_reply":
-                text = interactive.get("button_reply", {}).get("title", "")
-            elif interactive.get("type") == "list_reply":
-                text = interactive.get("list_reply", {}).get("title", "")
-        
-        return WhatsAppMessage(
-            message_id=message_data.get("id", ""),
-            from_number=message_data.get("from", ""),
-            timestamp=message_data.get("timestamp", ""),
-            text=text,
-            message_type=message_type,
-            contact_name=contact_data.get("profile", {}).get("name"),
-            context_id=message_data.get("context", {}).get("id")
-        )
-        
-    except Exception as e:
-        log.error(f"Erro ao processar mensagem WhatsApp: {e}")
-        return None
+    """Converte payload do Mindchat para objeto WhatsAppMessage (primeira mensagem)"""
+    parsed = parse_whatsapp_payload(payload)
+    return parsed[0] if parsed else None
 
 async def send_mindchat_message(to: str, message: str, message_type: str = "text") -> Dict[str, Any]:
-    """Envia mensagem via API do Mindchat"""
-    try:
-        payload = {
-            "messaging_product": "whatsapp",
-            "to": to,
-            "type": message_type,
-            "text": {"body": message}
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {MINDCHAT_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            f"{MINDCHAT_API_BASE_URL}/messages",
-            json=payload,
-            headers=headers,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            log.info(f"Mensagem Mindchat enviada para {to}: {message[:50]}...")
-            return {"status": "success", "response": result}
-        else:
-            log.error(f"Erro ao enviar mensagem Mindchat: {response.status_code} - {response.text}")
-            return {"status": "error", "error": response.text}
-            
-    except Exception as e:
-        log.error(f"Exceção ao enviar mensagem Mindchat: {e}")
-        return {"status": "error", "error": str(e)}
+    """Envia mensagem via API do Mindchat (pela fila de envio, quando ativa)"""
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": message_type,
+        "text": {"body": message}
+    }
+    
+    result = await send_via_outbound(to, "/messages", payload)
+    
+    if result["status"] == "error":
+        log.error(f"Erro ao enviar mensagem Mindchat: {result['error']}")
+    else:
+        log.info(f"Mensagem Mindchat {'enfileirada' if result['status'] == 'queued' else 'enviada'} para {to}: {message[:50]}...")
+    return result
 
 async def process_message_with_rag(message: WhatsAppMessage) -> str:
     """Processa mensagem usando RAG para gerar resposta inteligente"""
     try:
-        # Chamar API de RAG da ARIA
-        rag_payload = {
-            "query": message.text,
-            "source": "faq",
-            "user_id": message.from_number,
-            "context": {
-                "contact_name": message.contact_name,
-                "message_type": message.message_type,
-                "timestamp": message.timestamp
-            }
-        }
-        
-        response = requests.post(
-            f"{os.getenv('ARIA_API_BASE_URL', 'http://localhost:8000')}/rag/query",
-            json=rag_payload,
-            headers={"Authorization": f"Bearer {API_TOKEN}"},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            rag_result = response.json()
-            return rag_result.get("answer", "Desculpe, não consegui processar sua mensagem.")
-        else:
-            log.error(f"Erro na API RAG: {response.status_code}")
+        rag_ctx = await fetch_rag_context_local_async(message.text, k=5, filter_source="faq")
+        if not rag_ctx:
             return "Desculpe, estou com dificuldades técnicas. Tente novamente em alguns minutos."
-            
+        reply = await _chat_reply_async(message.text, rag_ctx)
+        return reply or "Desculpe, não consegui processar sua mensagem."
     except Exception as e:
         log.error(f"Erro ao processar RAG: {e}")
         return "Desculpe, ocorreu um erro interno. Tente novamente mais tarde."
@@ -1424,7 +2363,6 @@ async def process_message_with_rag(message: WhatsAppMessage) -> str:
 async def route_mindchat_message(message: WhatsAppMessage) -> Dict[str, Any]:
     """Roteia mensagem para o fluxo apropriado"""
     try:
-        # Chamar API de roteamento da ARIA
         routing_payload = {
             "message": message.text,
             "user_id": message.from_number,
@@ -1433,29 +2371,186 @@ async def route_mindchat_message(message: WhatsAppMessage) -> Dict[str, Any]:
             "timestamp": message.timestamp
         }
         
-        response = requests.post(
-            f"{os.getenv('ARIA_API_BASE_URL', 'http://localhost:8000')}/assist/routing",
-            json=routing_payload,
-            headers={"Authorization": f"Bearer {API_TOKEN}"},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            routing_result = response.json()
-            return {
-                "status": "success",
-                "routing": routing_result,
-                "action": routing_result.get("action", "chat"),
-                "confidence": routing_result.get("confidence", 0.0)
-            }
-        else:
-            log.error(f"Erro na API de roteamento: {response.status_code}")
-            return {"status": "error", "action": "chat", "confidence": 0.0}
+        routing_result = (await run_routing(routing_payload)).model_dump()
+        return {
+            "status": "success",
+            "routing": routing_result,
+            "action": routing_result.get("action", "chat"),
+            "confidence": routing_result.get("confidence", 0.0)
+        }
             
     except Exception as e:
         log.error(f"Erro ao rotear mensagem: {e}")
         return {"status": "error", "action": "chat", "confidence": 0.0}
 
+async def handle_mindchat_message(whatsapp_msg: WhatsAppMessage) -> Dict[str, Any]:
+    """Roteia, gera a resposta e envia para uma mensagem recebida do Mindchat"""
+    # Roteamento inteligente
+    routing_result = await route_mindchat_message(whatsapp_msg)
+
+    # Processar baseado no roteamento
+    if routing_result["action"] == "faq":
+        # Usar RAG para responder FAQ
+        response_text = await process_message_with_rag(whatsapp_msg)
+
+    elif routing_result["action"] == "schedule":
+        # Fluxo de agendamento
+        response_text = "📅 Entendi que você gostaria de agendar algo. Vou te conectar com nossa equipe de agendamentos."
+
+    elif routing_result["action"] == "buy_credits":
+        # Fluxo de compra de créditos
+        response_text = "💳 Perfeito! Vou te ajudar com a compra de créditos. Deixe-me conectar você com nossa equipe comercial."
+
+    else:
+        # Chat padrão com RAG
+        response_text = await process_message_with_rag(whatsapp_msg)
+
+    # Enviar resposta
+    send_result = await send_mindchat_message(
+        whatsapp_msg.from_number,
+        response_text
+    )
+    if send_result.get("status") not in ("success", "queued"):
+        log.warning(f"Resposta não enviada para {whatsapp_msg.from_number}: {send_result.get('error')}")
+
+    return {
+        "status": "processed",
+        "message_id": whatsapp_msg.message_id,
+        "response_text": response_text,
+        "routing_action": routing_result["action"],
+        "confidence": routing_result["confidence"],
+        "processed_at": datetime.now().isoformat()
+    }
+
+
+def merge_whatsapp_messages(messages: List[WhatsAppMessage]) -> WhatsAppMessage:
+    """Junta mensagens seguidas de um remetente numa só entrada para o roteamento"""
+    if len(messages) == 1:
+        return messages[0]
+    last = messages[-1]
+    return WhatsAppMessage(
+        message_id=last.message_id,
+        from_number=last.from_number,
+        timestamp=last.timestamp,
+        text="\n".join(m.text for m in messages if m.text),
+        message_type=last.message_type,
+        contact_name=next((m.contact_name for m in messages if m.contact_name), None),
+        context_id=next((m.context_id for m in messages if m.context_id), None),
+    )
+
+
+async def _handle_coalesced_mindchat(from_number: str, messages: List[WhatsAppMessage]) -> Dict[str, Any]:
+    if len(messages) > 1:
+        log.info(f"Mindchat: {len(messages)} mensagens de {from_number} respondidas juntas")
+    return await handle_mindchat_message(merge_whatsapp_messages(messages))
+
+
+# Debounce por remetente: rajadas de mensagens curtas viram uma resposta; ver coalescer.py
+WEBHOOK_COALESCE_ENABLE = os.getenv("WEBHOOK_COALESCE_ENABLE", "true").lower() == "true"
+_message_coalescer = None
+
+
+def get_message_coalescer():
+    global _message_coalescer
+    if _message_coalescer is None and WEBHOOK_COALESCE_ENABLE:
+        from coalescer import MessageCoalescer
+
+        _message_coalescer = MessageCoalescer(
+            _handle_coalesced_mindchat,
+            window_s=float(os.getenv("WEBHOOK_COALESCE_WINDOW_MS", "1500")) / 1000,
+            max_wait_s=float(os.getenv("WEBHOOK_COALESCE_MAX_WAIT_MS", "5000")) / 1000,
+            max_messages=int(os.getenv("WEBHOOK_COALESCE_MAX_MESSAGES", "5")),
+            max_chars=int(os.getenv("WEBHOOK_COALESCE_MAX_CHARS", "1000")),
+            max_buffers=int(os.getenv("WEBHOOK_COALESCE_MAX_SENDERS", "10000")),
+        )
+    return _message_coalescer
+
+
+async def _process_queued_mindchat_message(item: Dict[str, Any]) -> Any:
+    """Worker da fila: item = {"message": WhatsAppMessage.to_dict()}
+
+    Com o coalescer ativo devolve o future do lote do remetente; a fila só
+    limpa o item do spool quando a resposta agrupada for enviada.
+    """
+    if "message" in item:
+        whatsapp_msg = WhatsAppMessage(**item["message"])
+    else:
+        # itens gravados no spool antes do parse em uma passada
+        whatsapp_msg = parse_whatsapp_message(item)
+    if not whatsapp_msg:
+        return None
+    coalescer = get_message_coalescer()
+    if coalescer is None:
+        return await handle_mindchat_message(whatsapp_msg)
+    return coalescer.add(whatsapp_msg.from_number, whatsapp_msg, size=len(whatsapp_msg.text))
+
+
+# Remetentes diferentes de um mesmo payload são respondidos em paralelo (até este limite)
+MINDCHAT_BATCH_CONCURRENCY = int(os.getenv("MINDCHAT_BATCH_CONCURRENCY", "8"))
+
+
+async def handle_mindchat_batch(
+    messages: List[WhatsAppMessage], concurrency: int | None = None
+) -> List[Any]:
+    """Responde as mensagens de um payload: remetentes diferentes em paralelo,
+    as de um mesmo remetente em ordem.
+
+    Devolve um resultado por mensagem, na ordem de entrada; a posição de uma
+    mensagem não processada traz a exceção que interrompeu o seu remetente
+    (ou None, se ela nem chegou a ser tentada).
+    """
+    by_sender: Dict[str, List[int]] = {}
+    for i, msg in enumerate(messages):
+        by_sender.setdefault(msg.from_number, []).append(i)
+    results: List[Any] = [None] * len(messages)
+    limit = asyncio.Semaphore(max(1, concurrency or MINDCHAT_BATCH_CONCURRENCY))
+
+    async def run_sender(indexes: List[int]) -> None:
+        async with limit:
+            for i in indexes:
+                try:
+                    results[i] = await handle_mindchat_message(messages[i])
+                except Exception as e:
+                    # as seguintes do remetente ficam sem resposta para não sair de ordem
+                    results[i] = e
+                    return
+
+    await asyncio.gather(*(run_sender(indexes) for indexes in by_sender.values()))
+    return results
+
+
+# Fila ack-then-process do webhook Mindchat (spool SQLite; ver webhook_queue.py)
+WEBHOOK_QUEUE_ENABLE = os.getenv("WEBHOOK_QUEUE_ENABLE", "true").lower() == "true"
+_webhook_queue = None
+
+
+def get_webhook_queue():
+    global _webhook_queue
+    if _webhook_queue is None and WEBHOOK_QUEUE_ENABLE:
+        from webhook_queue import MemorySpool, SqliteSpool, WebhookQueue
+
+        spool_path = os.getenv("WEBHOOK_QUEUE_SPOOL", "tmp/aria_webhook_spool.db")
+        _webhook_queue = WebhookQueue(
+            _process_queued_mindchat_message,
+            workers=int(os.getenv("WEBHOOK_QUEUE_WORKERS", "8")),
+            max_size=int(os.getenv("WEBHOOK_QUEUE_MAX", "1000")),
+            spool=SqliteSpool(spool_path) if spool_path else MemorySpool(),
+            max_attempts=int(os.getenv("WEBHOOK_QUEUE_MAX_ATTEMPTS", "3")),
+        )
+    return _webhook_queue
+
+
+@app.get("/metrics/webhook-queue")
+def webhook_queue_metrics(_tok: str = Depends(require_auth)):
+    """Fila do webhook Mindchat: profundidade, idade do item mais antigo e latências"""
+    if _webhook_queue is None:
+        return {"running": False}
+    stats = _webhook_queue.stats()
+    if _message_coalescer is not None:
+        stats["coalescer"] = _message_coalescer.stats()
+    return stats
+
+
 # Mindchat Webhook Endpoints
 @app.post("/webhook/mindchat/whatsapp")
 async def mindchat_whatsapp_webhook(
@@ -1464,73 +2559,75 @@ async def mindchat_whatsapp_webhook(
     x_mindchat_signature: str = Header(None),
     x_mindchat_timestamp: str = Header(None)
 ) -> JSONResponse:
-    """Endpoint principal para receber webhooks do Mindchat"""
+    """Endpoint principal para receber webhooks do Mindchat.
+
+    Com a fila ativa, só verifica, enfileira e responde; o processamento
+    (roteamento, RAG e envio) acontece nos workers de webhook_queue.py.
+    """
     
     # Verificar assinatura
     body = await request.body()
     if not verify_mindchat_webhook_signature(body, x_mindchat_signature or ""):
         raise HTTPException(status_code=401, detail="Invalid signature")
     
-    log.info(f"Webhook Mindchat recebido: {len(payload.get('messages', []))} mensagens")
-    
-    try:
-        # Processar cada mensagem
-        responses = []
-        
-        for message_data in payload.get("messages", []):
-            # Converter para objeto WhatsAppMessage
-            whatsapp_msg = parse_whatsapp_message({
-                "messages": [message_data],
-                "contacts": payload.get("contacts", [])
-            })
-            
-            if not whatsapp_msg:
-                continue
-            
-            # Roteamento inteligente
-            routing_result = await route_mindchat_message(whatsapp_msg)
-            
-            # Processar baseado no roteamento
-            if routing_result["action"] == "faq":
-                # Usar RAG para responder FAQ
-                response_text = await process_message_with_rag(whatsapp_msg)
-                
-            elif routing_result["action"] == "schedule":
-                # Fluxo de agendamento
-                response_text = "📅 Entendi que você gostaria de agendar algo. Vou te conectar com nossa equipe de agendamentos."
-                
-            elif routing_result["action"] == "buy_credits":
-                # Fluxo de compra de créditos
-                response_text = "💳 Perfeito! Vou te ajudar com a compra de créditos. Deixe-me conectar você com nossa equipe comercial."
-                
+    messages = parse_whatsapp_payload(payload)
+    log.info(f"Webhook Mindchat recebido: {len(messages)} mensagens")
+
+    # Reenvios (mesmo message_id) são descartados antes de qualquer roteamento
+    dedup = get_webhook_dedup()
+    duplicates = 0
+    if dedup is not None:
+        fresh = []
+        for whatsapp_msg in messages:
+            if await dedup.ais_duplicate(whatsapp_msg.message_id):
+                duplicates += 1
             else:
-                # Chat padrão com RAG
-                response_text = await process_message_with_rag(whatsapp_msg)
-            
-            # Enviar resposta
-            send_result = await send_mindchat_message(
-                whatsapp_msg.from_number,
-                response_text
+                fresh.append(whatsapp_msg)
+        if duplicates:
+            log.info(f"Webhook Mindchat: {duplicates} mensagens duplicadas ignoradas")
+        messages = fresh
+
+    queue = _webhook_queue
+    if queue is not None and queue.running:
+        from webhook_queue import QueueFull
+
+        items = [(m.from_number, {"message": m.to_dict()}) for m in messages]
+        try:
+            queue.enqueue_many(items)
+        except QueueFull as e:
+            log.warning(f"Webhook Mindchat recusado: {e}")
+            # o Mindchat vai reenviar: os ids não podem ficar marcados como vistos
+            if dedup is not None:
+                for whatsapp_msg in messages:
+                    await dedup.aforget(whatsapp_msg.message_id)
+            return JSONResponse(
+                status_code=503,
+                content={"status": "busy", "detail": "queue_full"},
+                headers={"Retry-After": "5"},
             )
-            
-            responses.append({
-                "status": "processed",
-                "message_id": whatsapp_msg.message_id,
-                "response_text": response_text,
-                "routing_action": routing_result["action"],
-                "confidence": routing_result["confidence"],
-                "processed_at": datetime.now().isoformat()
-            })
-        
-        return JSONResponse(content={
-            "status": "success",
-            "processed_messages": len(responses),
-            "responses": responses
-        })
-        
-    except Exception as e:
-        log.error(f"Erro ao processar webhook Mindchat: {e}")
-        raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
+        return JSONResponse(
+            content={"status": "accepted", "queued_messages": len(items), "duplicates": duplicates}
+        )
+
+    # Sem fila (desativada ou app sem lifespan): responde o payload inline
+    results = await handle_mindchat_batch(messages)
+    responses = [r for r in results if isinstance(r, dict)]
+    failed = [r for r in results if isinstance(r, Exception)]
+    if failed:
+        log.error(f"Erro ao processar webhook Mindchat: {failed[0]}")
+        # as que ainda não foram respondidas voltam a valer no reenvio
+        if dedup is not None:
+            for whatsapp_msg, result in zip(messages, results, strict=True):
+                if not isinstance(result, dict):
+                    await dedup.aforget(whatsapp_msg.message_id)
+        raise HTTPException(status_code=500, detail=f"Erro interno: {str(failed[0])}")
+    
+    return JSONResponse(content={
+        "status": "success",
+        "processed_messages": len(responses),
+        "duplicates": duplicates,
+        "responses": responses
+    })
 
 @app.post("/webhook/mindchat/status")
 async def mindchat_status_webhook(
@@ -1607,11 +2704,12 @@ async def get_mindchat_messages(
             "pageSize": page_size
         }
         
-        response = requests.get(
+        response = await get_http_clients().arequest(
+            "mindchat",
+            "GET",
             f"{MINDCHAT_API_BASE_URL}/api/messages",
             headers=headers,
             params=params,
-            timeout=10
         )
         
         if response.status_code == 200:
@@ -1634,36 +2732,19 @@ async def send_mindchat_message_real(
 ) -> JSONResponse:
     """Endpoint para envio de mensagem via Mindchat real"""
     
-    try:
-        headers = {
-            "Authorization": f"Bearer {MINDCHAT_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "phone": phone,
-            "message": message,
-            "type": message_type
-        }
-        
-        response = requests.post(
-            f"{MINDCHAT_API_BASE_URL}/api/send",
-            json=payload,
-            headers=headers,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            log.info(f"Mensagem Mindchat enviada para {phone}: {message[:50]}...")
-            return JSONResponse(content={"status": "success", "response": data})
-        else:
-            log.error(f"Erro ao enviar mensagem Mindchat: {response.status_code} - {response.text}")
-            return JSONResponse(content={"status": "error", "error": response.text})
-            
-    except Exception as e:
-        log.error(f"Exceção ao enviar mensagem Mindchat: {e}")
-        return JSONResponse(content={"status": "error", "error": str(e)})
+    payload = {
+        "phone": phone,
+        "message": message,
+        "type": message_type
+    }
+    
+    result = await send_via_outbound(phone, "/api/send", payload)
+    
+    if result["status"] == "error":
+        log.error(f"Erro ao enviar mensagem Mindchat: {result['error']}")
+    else:
+        log.info(f"Mensagem Mindchat {'enfileirada' if result['status'] == 'queued' else 'enviada'} para {phone}: {message[:50]}...")
+    return JSONResponse(content=result)
 
 @app.post("/mindchat/webhook/create")
 async def create_mindchat_webhook_real(
@@ -1689,11 +2770,12 @@ async def create_mindchat_webhook_real(
             "description": "ARIA-SDR Webhook Integration Real"
         }
         
-        response = requests.post(
+        response = await get_http_clients().arequest(
+            "mindchat",
+            "POST",
             f"{MINDCHAT_API_BASE_URL}/webhook",
             json=payload,
             headers=headers,
-            timeout=10
         )
         
         if response.status_code in [200, 201]:
@@ -1718,10 +2800,11 @@ async def get_mindchat_conversations_real() -> JSONResponse:
             "Content-Type": "application/json"
         }
         
-        response = requests.get(
+        response = await get_http_clients().arequest(
+            "mindchat",
+            "GET",
             f"{MINDCHAT_API_BASE_URL}/api/conversations",
             headers=headers,
-            timeout=10
         )
         
         if response.status_code == 200:
@@ -1750,6 +2833,76 @@ async def verify_mindchat_webhook_real(
     else:
         raise HTTPException(status_code=403, detail="Verification failed")
 
+# ————————————————————————————————————————————————————————————————————————————————————————————————
+# Lifecycle
+# ————————————————————————————————————————————————————————————————————————————————————————————————
+async def _on_startup() -> None:
+    """Cria os pools compartilhados (HTTP e, no backend pg, Postgres) e carrega os índices locais."""
+    global _main_loop
+    _main_loop = asyncio.get_running_loop()
+    get_http_clients()
+    if RAG_BACKEND == "lexical" or RAG_LEXICAL_FALLBACK:
+        await asyncio.to_thread(get_lexical_index)
+    if RAG_BACKEND == "local":
+        try:
+            await asyncio.to_thread(get_local_index().load)
+        except Exception as e:
+            log.warning("Índice local indisponível no startup: %s", e)
+    if RAG_BACKEND == "pg" and DATABASE_URL:
+        try:
+            await get_pg_async_pool()
+        except Exception as e:
+            log.warning("Pool Postgres indisponível no startup: %s", e)
+    sender = get_outbound_sender()
+    if sender is not None:
+        try:
+            await sender.start()
+        except Exception as e:
+            log.warning("Fila de envio indisponível no startup: %s", e)
+    queue = get_webhook_queue()
+    if queue is not None:
+        try:
+            await queue.start()
+        except Exception as e:
+            log.warning("Fila de webhooks indisponível no startup: %s", e)
+
+
+async def _on_shutdown() -> None:
+    """Drena as filas de webhooks e de envio e fecha os spools, clientes e pools compartilhados."""
+    global _pg_pool, _pg_async_pool, _main_loop, _webhook_queue, _outbound_sender
+    if _webhook_queue is not None:
+        await _webhook_queue.stop(timeout=float(os.getenv("WEBHOOK_QUEUE_DRAIN_S", "10")))
+    if _message_coalescer is not None:
+        await _message_coalescer.close()
+    # depois da fila de webhooks (que ainda gera respostas) e antes dos clientes HTTP
+    if _outbound_sender is not None:
+        await _outbound_sender.stop(timeout=float(os.getenv("OUTBOUND_DRAIN_S", "10")))
+    # spools SQLite: fila e sender são recriados (com conexão nova) no próximo startup
+    if _webhook_queue is not None:
+        await asyncio.to_thread(_webhook_queue.spool.close)
+        _webhook_queue = None
+    if _outbound_sender is not None:
+        await asyncio.to_thread(_outbound_sender.spool.close)
+        await asyncio.to_thread(_outbound_sender.dead_letter.close)
+        _outbound_sender = None
+    if _webhook_dedup is not None:
+        await asyncio.to_thread(_webhook_dedup.close)
+    _main_loop = None
+    await close_http_clients()
+    if _pg_async_pool is not None:
+        await _pg_async_pool.close()
+        _pg_async_pool = None
+    if _pg_pool is not None:
+        await asyncio.to_thread(_pg_pool.close)
+        _pg_pool = None
+    for cli in (client_assistant_async, _openai_async_client):
+        if cli is not None:
+            try:
+                await cli.close()
+            except Exception:
+                pass
+
+
 # ————————————————————————————————————————————————————————————————————————————————————————————————
 # Server startup
 # ————————————————————————————————————————————————————————————————————————————————————————————————
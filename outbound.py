@@ -0,0 +1,360 @@
+"""
+Envio de mensagens (Mindchat/WhatsApp) com limite de taxa, ordem por
+destinatário, retentativas persistidas e dead letter
+
+`send_mindchat_message`, `send_mindchat_message_real`, `send_whatsapp_response`
+e `send_whatsapp_notification` faziam um POST direto cada; uma falha só
+aparecia no log e picos estouravam a cota da API. Agora elas entregam o envio
+ao `OutboundSender` e seguem sem esperar a resposta do Mindchat.
+
+- Token bucket global (OUTBOUND_RATE_PER_S / OUTBOUND_BURST) ajustado à cota
+  do Mindchat/WhatsApp
+- Uma fila por destinatário: mensagens para o mesmo número saem na ordem em
+  que foram pedidas, mesmo com retentativas; números diferentes em paralelo
+- Retentativas com backoff exponencial (429, 5xx e erros de rede); a fila
+  fica no spool SQLite (mesmo formato de webhook_queue.py) e é retomada
+  após um restart
+- Esgotadas as tentativas, ou em erro definitivo (4xx), o envio vai para a
+  dead letter, de onde pode ser reenfileirado
+- Métricas: latência de envio, profundidade da fila, taxa de falha e
+  espera no limitador
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from webhook_queue import MemorySpool, QueueFull
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[dict[str, Any]], Awaitable[Any]]
+
+
+class DeliveryError(Exception):
+    """Falha de envio; `retryable=False` manda direto para a dead letter"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+class TokenBucket:
+    """Limitador assíncrono: `rate` envios por segundo com rajada de `burst`"""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = max(0.001, float(rate))
+        self.capacity = float(max(1, int(burst if burst is not None else rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock: asyncio.Lock | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.waited_s = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._lock = loop, asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+                self.waited_s += wait
+                await asyncio.sleep(wait)
+
+
+class _Job:
+    __slots__ = ("item_id", "recipient", "payload", "attempts", "enqueued_at", "next_at", "future")
+
+    def __init__(self, item_id, recipient, payload, attempts, enqueued_at, future):
+        self.item_id = item_id
+        self.recipient = recipient
+        self.payload = payload
+        self.attempts = attempts
+        self.enqueued_at = enqueued_at
+        self.next_at = 0.0
+        self.future = future
+
+
+class OutboundSender:
+    """Fila de saída por destinatário com token bucket, backoff e dead letter"""
+
+    def __init__(
+        self,
+        deliver: Deliver,
+        rate_per_s: float = 20.0,
+        burst: int | None = None,
+        workers: int = 4,
+        max_queue: int = 10_000,
+        max_attempts: int = 5,
+        backoff_s: float = 1.0,
+        max_backoff_s: float = 60.0,
+        spool: MemorySpool | None = None,
+        dead_letter: MemorySpool | None = None,
+    ):
+        self._deliver = deliver
+        self.bucket = TokenBucket(rate_per_s, burst)
+        self.workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_s = max(0.0, float(backoff_s))
+        self.max_backoff_s = max(self.backoff_s, float(max_backoff_s))
+        self.spool = spool if spool is not None else MemorySpool()
+        self.dead_letter = dead_letter if dead_letter is not None else MemorySpool()
+        self._lanes: dict[str, deque[_Job]] = {}
+        self._ready: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._timers: set[asyncio.TimerHandle] = set()
+        self._idle: asyncio.Event | None = None
+        self._running = False
+        self._depth = 0
+        # métricas
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=1024)
+        self._delays: deque[float] = deque(maxlen=1024)
+        self.submitted = 0
+        self.sent = 0
+        self.attempts = 0
+        self.failures = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.rejected = 0
+        self.recovered = 0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    async def start(self) -> None:
+        """Cria os workers e retoma os envios que ficaram no spool"""
+        if self._running:
+            return
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._lanes, self._depth = {}, 0
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        pending = await asyncio.to_thread(self.spool.pending)
+        for item_id, recipient, payload, enqueued_at, attempts in pending:
+            self._push(_Job(item_id, recipient, payload, attempts, enqueued_at, None))
+        with self._lock:
+            self.recovered += len(pending)
+        if pending:
+            logger.info("Envios pendentes recuperados do spool: %d", len(pending))
+        self._running = True
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Para de aceitar, tenta esvaziar a fila até `timeout` e encerra os workers.
+
+        O que não saiu continua no spool e é retomado no próximo start.
+        """
+        self._running = False
+        if self._idle is not None and self._depth:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Envios pendentes ficam no spool: %d", self._depth)
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for lane in self._lanes.values():
+            for job in lane:
+                if job.future is not None and not job.future.done():
+                    job.future.cancel()
+        self._tasks, self._lanes, self._depth = [], {}, 0
+
+    def submit(self, recipient: str, payload: dict[str, Any]) -> asyncio.Future:
+        """Grava o envio no spool e agenda; não espera a entrega.
+
+        O future devolvido termina com o retorno de `deliver` ou com o erro
+        final (após a dead letter); aguardá-lo é opcional.
+        """
+        if not self._running:
+            raise RuntimeError("Envio de mensagens não iniciado")
+        if self._depth >= self.max_queue:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFull(f"Fila de envio cheia ({self._depth}/{self.max_queue})")
+        item_id = self.spool.add(recipient, payload)
+        fut = asyncio.get_running_loop().create_future()
+        # quem não aguarda o future não deve gerar "exception was never retrieved"
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._push(_Job(item_id, recipient, payload, 0, time.time(), fut))
+        with self._lock:
+            self.submitted += 1
+        return fut
+
+    def _push(self, job: _Job) -> None:
+        self._depth += 1
+        self._idle.clear()
+        lane = self._lanes.get(job.recipient)
+        if lane is None:
+            self._lanes[job.recipient] = deque([job])
+            self._ready.put_nowait(job.recipient)
+        else:
+            lane.append(job)
+
+    def _schedule(self, recipient: str, at: float) -> None:
+        loop = asyncio.get_running_loop()
+        delay = max(0.0, at - time.monotonic())
+        if delay == 0:
+            self._ready.put_nowait(recipient)
+            return
+
+        def wake() -> None:
+            self._timers.discard(timer)
+            self._ready.put_nowait(recipient)
+
+        timer = loop.call_later(delay, wake)
+        self._timers.add(timer)
+
+    async def _worker(self) -> None:
+        while True:
+            recipient = await self._ready.get()
+            lane = self._lanes.get(recipient)
+            if not lane:
+                continue
+            job = lane[0]
+            done = await self._attempt(job)
+            if done:
+                lane.popleft()
+                self._depth -= 1
+            if lane:
+                # o próximo do destinatário só sai depois do atual (ou do seu backoff)
+                self._schedule(recipient, lane[0].next_at)
+            else:
+                del self._lanes[recipient]
+                if not self._depth:
+                    self._idle.set()
+
+    async def _attempt(self, job: _Job) -> bool:
+        """Tenta um envio; True quando o job saiu da fila (entregue ou dead letter)"""
+        await self.bucket.acquire()
+        started = time.perf_counter()
+        if job.attempts == 0:
+            with self._lock:
+                self._delays.append(max(0.0, time.time() - job.enqueued_at) * 1000)
+        try:
+            result = await self._deliver(job.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.attempts += 1
+            retryable = getattr(e, "retryable", True)
+            with self._lock:
+                self.attempts += 1
+                self.failures += 1
+            if retryable and job.attempts < self.max_attempts:
+                await asyncio.to_thread(self.spool.bump, job.item_id)
+                backoff = min(self.max_backoff_s, self.backoff_s * 2 ** (job.attempts - 1))
+                job.next_at = time.monotonic() + backoff
+                with self._lock:
+                    self.retried += 1
+                logger.warning(
+                    "Envio para %s falhou (tentativa %d), nova tentativa em %.1fs: %s",
+                    job.recipient, job.attempts, backoff, e,
+                )
+                return False
+            await self._to_dead_letter(job, e)
+            return True
+        with self._lock:
+            self.attempts += 1
+            self.sent += 1
+            self._latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.to_thread(self.spool.remove, job.item_id)
+        if job.future is not None and not job.future.done():
+            job.future.set_result(result)
+        return True
+
+    async def _to_dead_letter(self, job: _Job, error: Exception) -> None:
+        logger.error("Envio para %s descartado após %d tentativas: %s", job.recipient, job.attempts, error)
+        entry = {"payload": job.payload, "error": str(error), "attempts": job.attempts}
+        await asyncio.to_thread(self.dead_letter.add, job.recipient, entry)
+        await asyncio.to_thread(self.spool.remove, job.item_id)
+        with self._lock:
+            self.dead_lettered += 1
+        if job.future is not None and not job.future.done():
+            job.future.set_exception(error)
+
+    def dead_letters(self, limit: int = 100) -> list[dict[str, Any]]:
+        rows = self.dead_letter.pending()[:limit]
+        return [
+            {"id": item_id, "recipient": recipient, "failed_at": failed_at, **entry}
+            for item_id, recipient, entry, failed_at, _ in rows
+        ]
+
+    async def requeue_dead_letters(self) -> int:
+        """Devolve os envios da dead letter à fila (ex.: após corrigir o token).
+
+        Para na primeira recusa por fila cheia; o restante fica na dead letter
+        para uma próxima chamada. Retorna quantos foram devolvidos.
+        """
+        rows = await asyncio.to_thread(self.dead_letter.pending)
+        requeued = 0
+        for item_id, recipient, entry, _, _ in rows:
+            try:
+                self.submit(recipient, entry["payload"])
+            except QueueFull:
+                logger.warning(
+                    "Fila de envio cheia: %d de %d envios devolvidos da dead letter", requeued, len(rows)
+                )
+                break
+            await asyncio.to_thread(self.dead_letter.remove, item_id)
+            requeued += 1
+        return requeued
+
+    def stats(self) -> dict[str, Any]:
+        oldest = min((lane[0].enqueued_at for lane in self._lanes.values() if lane), default=None)
+        with self._lock:
+            latencies = sorted(self._latencies)
+            delays = sorted(self._delays)
+            out: dict[str, Any] = {
+                "running": self._running,
+                "depth": self._depth,
+                "recipients": len(self._lanes),
+                "oldest_age_s": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                "submitted": self.submitted,
+                "sent": self.sent,
+                "attempts": self.attempts,
+                "failures": self.failures,
+                "retried": self.retried,
+                "dead_lettered": self.dead_lettered,
+                "rejected": self.rejected,
+                "recovered": self.recovered,
+                "failure_rate": round(self.failures / self.attempts, 4) if self.attempts else 0.0,
+                "rate_per_s": self.bucket.rate,
+                "rate_limit_wait_s": round(self.bucket.waited_s, 3),
+            }
+        out["dead_letter_size"] = len(self.dead_letter)
+        if latencies:
+            out["send_ms_avg"] = round(sum(latencies) / len(latencies), 2)
+            out["send_ms_p95"] = round(latencies[int(0.95 * (len(latencies) - 1))], 2)
+        if delays:
+            out["queue_delay_ms_avg"] = round(sum(delays) / len(delays), 2)
+            out["queue_delay_ms_p95"] = round(delays[int(0.95 * (len(delays) - 1))], 2)
+        return out
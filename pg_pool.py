@@ -0,0 +1,232 @@
+"""
+Pool de conexões Postgres para o RAG_BACKEND=pg do ARIA-SDR
+
+Evita TCP + TLS + autenticação a cada pergunta e limita o número de conexões
+abertas contra o Supabase em picos. Requer `psycopg[pool]` (opcional).
+
+- Variantes síncrona (`PgPool`) e assíncrona (`AsyncPgPool`)
+- min/max de conexões, checagem de saúde ao emprestar, reciclagem por idade
+- statement_timeout por conexão e prepared statements (prepare_threshold)
+- `on_connect` opcional por conexão nova (ex.: registrar tipos do pgvector)
+- Métricas: conexões em uso, fila de espera e latência de aquisição
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PgPoolConfig:
+    min_size: int = 1
+    max_size: int = 10
+    acquire_timeout: float = 5.0
+    max_idle: float = 300.0
+    max_lifetime: float = 1800.0
+    statement_timeout_ms: int = 5000
+    # 0 = prepara já na 1ª execução; None desativa (PgBouncer em modo transaction)
+    prepare_threshold: int | None = 0
+
+    @classmethod
+    def from_env(cls) -> PgPoolConfig:
+        prepare = os.getenv("PG_PREPARE_THRESHOLD", "0").strip().lower()
+        return cls(
+            min_size=int(os.getenv("PG_POOL_MIN", "1")),
+            max_size=int(os.getenv("PG_POOL_MAX", "10")),
+            acquire_timeout=float(os.getenv("PG_POOL_TIMEOUT", "5")),
+            max_idle=float(os.getenv("PG_POOL_MAX_IDLE", "300")),
+            max_lifetime=float(os.getenv("PG_POOL_MAX_LIFETIME", "1800")),
+            statement_timeout_ms=int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "5000")),
+            prepare_threshold=None if prepare in ("", "off", "none") else int(prepare),
+        )
+
+    def connection_kwargs(self) -> dict[str, Any]:
+        return {"autocommit": True, "prepare_threshold": self.prepare_threshold}
+
+
+class _AcquireStats:
+    """Latência de aquisição (janela das últimas N) e contadores"""
+
+    def __init__(self, window: int = 1024):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.acquired = 0
+        self.timeouts = 0
+
+    def acquire(self, ms: float) -> None:
+        with self._lock:
+            self._samples.append(ms)
+            self.acquired += 1
+            self.in_use += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_use -= 1
+
+    def timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def summary(self) -> dict[str, Any]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {"acquired": self.acquired, "in_use": self.in_use, "timeouts": self.timeouts}
+        return {
+            "acquired": self.acquired,
+            "in_use": self.in_use,
+            "timeouts": self.timeouts,
+            "acquire_ms_avg": round(sum(samples) / len(samples), 2),
+            "acquire_ms_p95": round(samples[int(0.95 * (len(samples) - 1))], 2),
+            "acquire_ms_max": round(samples[-1], 2),
+        }
+
+
+def _statement_timeout_sql(ms: int) -> str:
+    return f"SET statement_timeout = {int(ms)}"
+
+
+class PgPool:
+    """`psycopg_pool.ConnectionPool` com statement_timeout e métricas"""
+
+    def __init__(
+        self,
+        dsn: str,
+        config: PgPoolConfig | None = None,
+        on_connect: Callable[[Any], None] | None = None,
+    ):
+        from psycopg_pool import ConnectionPool  # type: ignore
+
+        self.config = config or PgPoolConfig()
+        self._stats = _AcquireStats()
+        cfg = self.config
+
+        def configure(conn) -> None:
+            conn.execute(_statement_timeout_sql(cfg.statement_timeout_ms))
+            if on_connect is not None:
+                on_connect(conn)
+
+        self._pool = ConnectionPool(
+            dsn,
+            min_size=cfg.min_size,
+            max_size=cfg.max_size,
+            timeout=cfg.acquire_timeout,
+            max_idle=cfg.max_idle,
+            max_lifetime=cfg.max_lifetime,
+            kwargs=cfg.connection_kwargs(),
+            configure=configure,
+            check=ConnectionPool.check_connection,
+            open=False,
+            name="aria-rag",
+        )
+
+    def open(self, wait: bool = False) -> None:
+        self._pool.open(wait=wait)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        from psycopg_pool import PoolTimeout  # type: ignore
+
+        t0 = time.perf_counter()
+        try:
+            with self._pool.connection() as conn:
+                self._stats.acquire((time.perf_counter() - t0) * 1000)
+                try:
+                    yield conn
+                finally:
+                    self._stats.release()
+        except PoolTimeout:
+            self._stats.timeout()
+            raise
+
+    def stats(self) -> dict[str, Any]:
+        return {**_pool_stats(self._pool), **self._stats.summary()}
+
+    def close(self) -> None:
+        self._pool.close()
+
+
+class AsyncPgPool:
+    """Variante assíncrona (`psycopg_pool.AsyncConnectionPool`)"""
+
+    def __init__(
+        self,
+        dsn: str,
+        config: PgPoolConfig | None = None,
+        on_connect: Callable[[Any], Awaitable[None]] | None = None,
+    ):
+        from psycopg_pool import AsyncConnectionPool  # type: ignore
+
+        self.config = config or PgPoolConfig()
+        self._stats = _AcquireStats()
+        cfg = self.config
+
+        async def configure(conn) -> None:
+            await conn.execute(_statement_timeout_sql(cfg.statement_timeout_ms))
+            if on_connect is not None:
+                await on_connect(conn)
+
+        self._pool = AsyncConnectionPool(
+            dsn,
+            min_size=cfg.min_size,
+            max_size=cfg.max_size,
+            timeout=cfg.acquire_timeout,
+            max_idle=cfg.max_idle,
+            max_lifetime=cfg.max_lifetime,
+            kwargs=cfg.connection_kwargs(),
+            configure=configure,
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+            name="aria-rag-async",
+        )
+
+    async def open(self, wait: bool = False) -> None:
+        await self._pool.open(wait=wait)
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Any]:
+        from psycopg_pool import PoolTimeout  # type: ignore
+
+        t0 = time.perf_counter()
+        try:
+            async with self._pool.connection() as conn:
+                self._stats.acquire((time.perf_counter() - t0) * 1000)
+                try:
+                    yield conn
+                finally:
+                    self._stats.release()
+        except PoolTimeout:
+            self._stats.timeout()
+            raise
+
+    def stats(self) -> dict[str, Any]:
+        return {**_pool_stats(self._pool), **self._stats.summary()}
+
+    async def close(self) -> None:
+        await self._pool.close()
+
+
+def _pool_stats(pool: Any) -> dict[str, Any]:
+    raw = pool.get_stats()
+    return {
+        "pool_min": raw.get("pool_min"),
+        "pool_max": raw.get("pool_max"),
+        "pool_size": raw.get("pool_size", 0),
+        "pool_available": raw.get("pool_available", 0),
+        "requests_waiting": raw.get("requests_waiting", 0),
+        "requests_num": raw.get("requests_num", 0),
+        "requests_wait_ms": raw.get("requests_wait_ms", 0),
+        "connections_errors": raw.get("connections_errors", 0),
+        "connections_lost": raw.get("connections_lost", 0),
+    }
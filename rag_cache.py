@@ -0,0 +1,346 @@
+"""
+Cache de resultados do RAG para ARIA-SDR
+
+O corpus de FAQ só muda quando os scripts de ingestão rodam, então
+`RagResponse` e os pares `(context, refs)` podem ser reaproveitados enquanto
+a versão do corpus não mudar.
+
+- Chave: (tipo, pergunta normalizada, filter_source, k, versão do corpus)
+- Despejo por tamanho (LRU) e por TTL
+- Versão do corpus: carimbo gravado por scripts/ingest_*.py (Supabase ou arquivo)
+- Modo semântico opcional: reaproveita a resposta de uma pergunta cujo
+  embedding esteja acima do limiar de similaridade de cosseno (requer numpy)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+import requests
+
+from embedding_cache import normalize_query
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+CORPUS_META_TABLE = "aria_corpus_meta"
+CORPUS_VERSION_KEY = "corpus_version"
+
+
+# ---------------------------
+# Versão do corpus
+# ---------------------------
+
+
+def supabase_version_fetcher(
+    base_url: str, key: str, table: str = CORPUS_META_TABLE, timeout: float = 5
+) -> Callable[[], str | None]:
+    """Lê o carimbo `corpus_version` da tabela `aria_corpus_meta` via REST"""
+    url = f"{base_url.rstrip('/')}/rest/v1/{table}"
+    headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+    session = requests.Session()
+
+    def fetch() -> str | None:
+        r = session.get(
+            url,
+            headers=headers,
+            params={"key": f"eq.{CORPUS_VERSION_KEY}", "select": "value"},
+            timeout=timeout,
+        )
+        if r.status_code >= 300:
+            raise RuntimeError(f"corpus version lookup failed: {r.status_code} -> {r.text}")
+        rows = r.json() or []
+        return str(rows[0]["value"]) if rows else None
+
+    return fetch
+
+
+def file_version_fetcher(path: str) -> Callable[[], str | None]:
+    """Lê o carimbo de um arquivo local (deploy de réplica única)"""
+
+    def fetch() -> str | None:
+        try:
+            with open(path, encoding="utf-8") as fh:
+                return fh.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    return fetch
+
+
+class CorpusVersion:
+    """Versão atual do corpus, relida no máximo a cada `refresh_seconds`.
+
+    Se a fonte falhar, mantém a última versão conhecida.
+    """
+
+    def __init__(self, fetch: Callable[[], str | None] | None, refresh_seconds: float = 30):
+        self._fetch = fetch
+        self.refresh_seconds = refresh_seconds
+        self._value = "0"
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def stale(self) -> bool:
+        return self._fetch is not None and (
+            time.monotonic() - self._checked_at >= self.refresh_seconds
+        )
+
+    def current(self) -> str:
+        if not self.stale():
+            return self._value
+        with self._lock:
+            if self.stale():
+                try:
+                    self._value = (self._fetch() if self._fetch else None) or self._value
+                except Exception as e:
+                    logger.warning(f"Versão do corpus indisponível: {e}")
+                self._checked_at = time.monotonic()
+        return self._value
+
+    async def acurrent(self) -> str:
+        if not self.stale():
+            return self._value
+        return await asyncio.to_thread(self.current)
+
+
+# ---------------------------
+# Cache de resultados
+# ---------------------------
+
+
+@dataclass
+class _Entry:
+    value: Any
+    created_at: float
+    question: str
+    # linha do embedding na matriz do modo semântico (-1: sem embedding)
+    slot: int = -1
+    hits: int = field(default=0)
+
+
+class RagResultCache:
+    """LRU + TTL para resultados do RAG, invalidado pela versão do corpus"""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600,
+        semantic: bool = False,
+        semantic_threshold: float = 0.95,
+    ):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        if semantic and np is None:
+            logger.warning("RAG_CACHE_SEMANTIC requer numpy; modo semântico desativado")
+        self.semantic = bool(semantic and np is not None)
+        self.semantic_threshold = semantic_threshold
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: str | None = None
+        # modo semântico: uma linha por entrada, alocada uma vez (max_entries x dim)
+        self._matrix: Any = None
+        self._slot_keys: list[tuple | None] = []
+        self._free: list[int] = []
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(kind: str, question: str, filter_source: str | None, k: int, version: str) -> tuple:
+        return (kind, normalize_query(question), filter_source or "", int(k), version)
+
+    def _check_version(self, version: str) -> None:
+        # chamado com o lock: versão nova invalida tudo de uma vez
+        if self._version != version:
+            if self._version is not None and self._entries:
+                self.invalidations += 1
+                self._reset()
+            self._version = version
+
+    def _expired(self, entry: _Entry) -> bool:
+        return self.ttl_seconds > 0 and time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def _release(self, entry: _Entry) -> None:
+        if entry.slot >= 0:
+            self._matrix[entry.slot] = 0.0
+            self._slot_keys[entry.slot] = None
+            self._free.append(entry.slot)
+            entry.slot = -1
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._release(entry)
+
+    def _reset(self) -> None:
+        for entry in self._entries.values():
+            self._release(entry)
+        self._entries.clear()
+
+    def get(
+        self,
+        kind: str,
+        question: str,
+        filter_source: str | None,
+        k: int,
+        version: str,
+        embedding: list[float] | None = None,
+    ) -> Any:
+        """Busca pela pergunta normalizada.
+
+        No modo semântico sem `embedding` a falta não é contada: o chamador só
+        calcula o embedding depois dela e completa a busca com `similar()`.
+        """
+        key = self._key(kind, question, filter_source, k, version)
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.hits += 1
+                self.hits += 1
+                return copy.deepcopy(entry.value)
+            if self.semantic and embedding is None:
+                return None
+            return self._similar(key, embedding)
+
+    def similar(
+        self,
+        kind: str,
+        question: str,
+        filter_source: str | None,
+        k: int,
+        version: str,
+        embedding: list[float] | None,
+    ) -> Any:
+        """Segunda etapa do modo semântico, depois de uma falta em `get()`"""
+        key = self._key(kind, question, filter_source, k, version)
+        with self._lock:
+            self._check_version(version)
+            return self._similar(key, embedding)
+
+    def _similar(self, key: tuple, embedding: list[float] | None) -> Any:
+        if self.semantic and embedding is not None:
+            found = self._semantic_lookup(key, embedding)
+            if found is not None:
+                found.hits += 1
+                self.semantic_hits += 1
+                return copy.deepcopy(found.value)
+        self.misses += 1
+        return None
+
+    def _semantic_lookup(self, key: tuple, embedding: list[float]) -> _Entry | None:
+        if self._matrix is None:
+            return None
+        q = _unit(embedding)
+        if q.shape != (self._matrix.shape[1],):
+            return None
+        # linhas livres são zero e ficam abaixo de qualquer limiar positivo
+        scores = self._matrix @ q
+        above = np.flatnonzero(scores >= self.semantic_threshold)
+        kind, _q, source, k, version = key
+        for slot in above[np.argsort(-scores[above])]:
+            ck = self._slot_keys[slot]
+            if ck is None or ck[0] != kind or ck[2:] != (source, k, version):
+                continue
+            entry = self._entries.get(ck)
+            if entry is not None and not self._expired(entry):
+                return entry
+        return None
+
+    def _store_embedding(self, key: tuple, entry: _Entry, embedding: list[float]) -> None:
+        vec = _unit(embedding)
+        if self._matrix is None:
+            self._matrix = np.zeros((self.max_entries, vec.shape[0]), dtype=np.float32)
+            self._slot_keys = [None] * self.max_entries
+            self._free = list(range(self.max_entries - 1, -1, -1))
+        if vec.shape != (self._matrix.shape[1],) or not self._free:
+            # dimensão diferente (troca de modelo): a entrada fica só com a busca exata
+            return
+        entry.slot = self._free.pop()
+        self._matrix[entry.slot] = vec
+        self._slot_keys[entry.slot] = key
+
+    def put(
+        self,
+        kind: str,
+        question: str,
+        filter_source: str | None,
+        k: int,
+        version: str,
+        value: Any,
+        embedding: list[float] | None = None,
+    ) -> None:
+        key = self._key(kind, question, filter_source, k, version)
+        with self._lock:
+            self._check_version(version)
+            self._drop(key)
+            # despeja antes de inserir: a matriz nunca precisa de mais que max_entries linhas
+            while len(self._entries) >= self.max_entries:
+                self._drop(next(iter(self._entries)))
+            entry = _Entry(value=copy.deepcopy(value), created_at=time.monotonic(), question=question)
+            if self.semantic and embedding is not None:
+                self._store_embedding(key, entry, embedding)
+            self._entries[key] = entry
+
+    def clear(self) -> int:
+        with self._lock:
+            n = len(self._entries)
+            self._reset()
+            return n
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "corpus_version": self._version,
+            "semantic": self.semantic,
+            "semantic_threshold": self.semantic_threshold,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+    def inspect(self, limit: int = 50) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._entries.items())[-max(0, limit):]
+        return [
+            {
+                "kind": key[0],
+                "question": entry.question,
+                "filter_source": key[2] or None,
+                "k": key[3],
+                "corpus_version": key[4],
+                "age_seconds": round(now - entry.created_at, 1),
+                "hits": entry.hits,
+            }
+            for key, entry in reversed(items)
+        ]
+
+
+def _unit(vec: list[float]):
+    arr = np.asarray(vec, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    return arr / norm if norm > 0 else arr
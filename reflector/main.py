@@ -6,7 +6,6 @@ Servidor principal com RAG Supabase e regras determinísticas
 from __future__ import annotations
 
 import os
-import requests
 from dotenv import load_dotenv
 import numpy as np
 
@@ -25,6 +24,27 @@ HEADERS_JSON = {
     "Content-Type": "application/json",
 }
 
+_engine = None
+
+
+def get_similarity_engine():
+    """Índice em memória dos chunks (carregado na primeira busca)"""
+    global _engine
+    if _engine is None:
+        from similarity_engine import SimilarityEngine
+
+        _engine = SimilarityEngine(
+            SUPABASE_URL,
+            HEADERS_JSON,
+            dim=EMBEDDING_DIM,
+            page_size=int(os.getenv("RAG_PAGE_SIZE", "500")),
+            refresh_seconds=float(os.getenv("RAG_REFRESH_SECONDS", "60")),
+            full_refresh_seconds=float(os.getenv("RAG_FULL_REFRESH_SECONDS", "3600")),
+            timestamp_column=os.getenv("RAG_TIMESTAMP_COLUMN", "updated_at"),
+        )
+    return _engine
+
+
 def search_supabase_rag(question: str, k: int = 3) -> str:
     """Busca conhecimento no Supabase RAG usando busca vetorial local"""
     print(f"RAG: Buscando por: '{question}'")
@@ -42,49 +62,18 @@ def search_supabase_rag(question: str, k: int = 3) -> str:
             input=question,
             model=EMBEDDING_MODEL
         )
-        query_embedding = np.array(response.data[0].embedding)
+        query_embedding = np.asarray(response.data[0].embedding, dtype=np.float32)
         
-        # Fetch all chunks from Supabase
-        chunks_url = f"{SUPABASE_URL}/rest/v1/rag_chunks?select=id,content,embedding,metadata"
-        response = requests.get(chunks_url, headers=HEADERS_JSON)
+        # Top-k no índice em memória (matriz normalizada + argpartition)
+        top_k_results = get_similarity_engine().search(query_embedding, k)
         
-        if response.status_code == 200:
-            all_chunks = response.json()
-            
-            if not all_chunks:
-                return ""
-
-            # Calculate similarities locally
-            similarities = []
-            query_norm = np.linalg.norm(query_embedding)
-            
-            for chunk in all_chunks:
-                embedding_str = chunk.get("embedding")
-                if embedding_str:
-                    try:
-                        embedding_array = np.array(eval(embedding_str))
-                        
-                        if embedding_array.shape[0] != query_embedding.shape[0]:
-                            continue
-
-                        chunk_norm = np.linalg.norm(embedding_array)
-                        if query_norm > 0 and chunk_norm > 0:
-                            similarity = np.dot(query_embedding, embedding_array) / (query_norm * chunk_norm)
-                            similarities.append((similarity, chunk))
-                    except Exception as e:
-                        continue
-            
-            # Sort by similarity and get top k
-            similarities.sort(key=lambda x: x[0], reverse=True)
-            top_k_results = similarities[:k]
+        if top_k_results:
+            context_parts = []
+            for similarity, hit in top_k_results:
+                context_parts.append(f"Fonte: {hit.get('metadata', {}).get('source', 'N/A')}\nConteúdo: {hit['content']}")
             
-            if top_k_results:
-                context_parts = []
-                for similarity, hit in top_k_results:
-                    context_parts.append(f"Fonte: {hit.get('metadata', {}).get('source', 'N/A')}\nConteúdo: {hit['content']}")
-                
-                context = "\n\n".join(context_parts)
-                return f"Contexto relevante:\n{context}"
+            context = "\n\n".join(context_parts)
+            return f"Contexto relevante:\n{context}"
             
     except Exception as e:
         print(f"RAG: Erro ao buscar: {e}")
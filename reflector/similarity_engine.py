@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+ARIA-SDR Reflector - Motor de similaridade do RAG
+
+Mantém os chunks da tabela `rag_chunks` em memória em vez de baixar a tabela
+inteira a cada pergunta:
+- Carga paginada via REST do Supabase (uma vez), depois atualização
+  incremental pela coluna de data (`updated_at`/`created_at`)
+- Embeddings pgvector ("[0.1,0.2,...]") convertidos em lote com parser
+  vetorizado do NumPy (sem eval)
+- Matriz float32 normalizada: ranking com um único produto matriz-vetor e
+  `argpartition` para o top-k
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Sequence
+from typing import Any
+
+import numpy as np
+import requests
+
+
+def parse_pgvectors(values: Sequence[str], dim: int) -> tuple[np.ndarray, list[int]]:
+    """Converte textos pgvector em uma matriz (n, dim) float32.
+
+    Devolve a matriz e os índices (em `values`) das linhas válidas; linhas
+    vazias ou com dimensão diferente de `dim` são descartadas.
+    """
+    texts = [v.strip()[1:-1] if isinstance(v, str) else "" for v in values]
+    valid = [i for i, t in enumerate(texts) if t]
+    if not valid:
+        return np.zeros((0, dim), dtype=np.float32), []
+    # caminho rápido: tudo numa única chamada do parser em C
+    flat = np.fromstring(",".join(texts[i] for i in valid), sep=",", dtype=np.float32)
+    if flat.size == len(valid) * dim:
+        return flat.reshape(len(valid), dim), valid
+    # alguma linha com dimensão diferente: separa linha a linha
+    rows, keep = [], []
+    for i in valid:
+        vec = np.fromstring(texts[i], sep=",", dtype=np.float32)
+        if vec.size == dim:
+            rows.append(vec)
+            keep.append(i)
+    if not rows:
+        return np.zeros((0, dim), dtype=np.float32), []
+    return np.vstack(rows), keep
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class SimilarityEngine:
+    """Índice em memória dos chunks do Supabase com atualização incremental"""
+
+    def __init__(
+        self,
+        base_url: str,
+        headers: dict[str, str],
+        dim: int,
+        table: str = "rag_chunks",
+        page_size: int = 500,
+        refresh_seconds: float = 60,
+        full_refresh_seconds: float = 3600,
+        timestamp_column: str = "updated_at",
+        timeout: float = 30,
+    ):
+        self.url = f"{base_url.rstrip('/')}/rest/v1/{table}"
+        self.headers = {k: v for k, v in headers.items() if k.lower() != "content-type"}
+        self.dim = int(dim)
+        self.page_size = max(1, int(page_size))
+        self.refresh_seconds = refresh_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+        self.timestamp_column: str | None = timestamp_column or None
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+        self._chunks: list[dict[str, Any]] = []
+        self._pos: dict[Any, int] = {}
+        self._watermark: str | None = None
+        self._refreshed_at = float("-inf")
+        self._full_at = float("-inf")
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    # ---------------------------
+    # Carga
+    # ---------------------------
+
+    def _fetch(self, since: str | None) -> list[dict[str, Any]]:
+        columns = "id,content,embedding,metadata"
+        params = {"select": columns, "order": "id.asc"}
+        if self.timestamp_column:
+            params["select"] = f"{columns},{self.timestamp_column}"
+            params["order"] = f"{self.timestamp_column}.asc,id.asc"
+            if since:
+                # gte + dedupe por id: não perde linhas com o mesmo carimbo
+                params[self.timestamp_column] = f"gte.{since}"
+        rows: list[dict[str, Any]] = []
+        offset = 0
+        while True:
+            page_params = dict(params, limit=str(self.page_size), offset=str(offset))
+            r = self._session.get(self.url, headers=self.headers, params=page_params, timeout=self.timeout)
+            if r.status_code >= 400 and self.timestamp_column and offset == 0:
+                # tabela sem a coluna de data: segue só com recargas completas
+                print(f"RAG: coluna {self.timestamp_column} indisponível ({r.status_code}); atualização completa")
+                self.timestamp_column = None
+                return self._fetch(None)
+            r.raise_for_status()
+            page = r.json() or []
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+            offset += self.page_size
+
+    def _apply(self, rows: list[dict[str, Any]], full: bool) -> None:
+        matrix, keep = parse_pgvectors([row.get("embedding") for row in rows], self.dim)
+        matrix = _normalize(matrix) if len(keep) else matrix
+        chunks = [
+            {"id": rows[i].get("id"), "content": rows[i].get("content") or "", "metadata": rows[i].get("metadata") or {}}
+            for i in keep
+        ]
+        watermark = self._watermark
+        if self.timestamp_column:
+            stamps = [rows[i].get(self.timestamp_column) for i in range(len(rows))]
+            stamps = [s for s in stamps if s]
+            if stamps:
+                watermark = max(stamps) if watermark is None or full else max(max(stamps), watermark)
+
+        with self._lock:
+            if full:
+                self._matrix = matrix
+                self._chunks = chunks
+                self._pos = {c["id"]: i for i, c in enumerate(chunks)}
+            elif chunks:
+                # copia e troca: buscas em andamento seguem com a matriz anterior
+                new_matrix = self._matrix.copy()
+                new_chunks = list(self._chunks)
+                pos = dict(self._pos)
+                appended = []
+                for row_vec, chunk in zip(matrix, chunks, strict=True):
+                    i = pos.get(chunk["id"])
+                    if i is None:
+                        pos[chunk["id"]] = len(new_chunks) + len(appended)
+                        appended.append((row_vec, chunk))
+                    else:
+                        new_matrix[i] = row_vec
+                        new_chunks[i] = chunk
+                if appended:
+                    new_matrix = np.vstack([new_matrix, np.stack([v for v, _ in appended])])
+                    new_chunks.extend(c for _, c in appended)
+                self._matrix, self._chunks, self._pos = new_matrix, new_chunks, pos
+            self._watermark = watermark
+
+    def refresh(self, force_full: bool = False) -> int:
+        """Carga completa (primeira vez / periódica) ou incremental; devolve linhas lidas"""
+        now = time.monotonic()
+        full = force_full or not self._chunks or now - self._full_at >= self.full_refresh_seconds
+        since = None if full or not self.timestamp_column else self._watermark
+        rows = self._fetch(since)
+        self._apply(rows, full=full or not self.timestamp_column)
+        self._refreshed_at = now
+        if full:
+            self._full_at = now
+        return len(rows)
+
+    def _ensure_fresh(self) -> None:
+        if time.monotonic() - self._refreshed_at < self.refresh_seconds:
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            # mantém o índice anterior; tenta de novo no próximo intervalo
+            self._refreshed_at = time.monotonic()
+            if not self._chunks:
+                raise
+            print(f"RAG: atualização do índice falhou, usando versão anterior: {e}")
+
+    # ---------------------------
+    # Busca
+    # ---------------------------
+
+    def search(self, query_embedding: Sequence[float], k: int = 3) -> list[tuple[float, dict[str, Any]]]:
+        """Top-k por similaridade de cosseno: [(score, chunk), ...]"""
+        self._ensure_fresh()
+        with self._lock:
+            matrix, chunks = self._matrix, self._chunks
+        q = np.asarray(query_embedding, dtype=np.float32)
+        if not chunks or k <= 0 or q.shape != (self.dim,):
+            return []
+        norm = float(np.linalg.norm(q))
+        if norm == 0:
+            return []
+        scores = matrix @ (q / norm)
+        k = min(int(k), len(chunks))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(chunks) else np.arange(len(chunks))
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), chunks[int(i)]) for i in top]
@@ -0,0 +1,86 @@
+"""
+Grafo de etapas do /assist/routing para ARIA-SDR
+
+Cada etapa declara de quais outras depende e começa assim que elas terminam;
+etapas independentes (RAG e preparação da thread do Assistant) rodam em
+paralelo. Cada etapa tem prazo próprio: se estourar ou falhar, devolve o
+valor `default` e o pipeline segue (degradação em vez de erro 500).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """Etapa do pipeline: `fn` recebe os resultados das dependências"""
+
+    name: str
+    fn: Callable[[dict[str, Any]], Awaitable[Any]]
+    deps: tuple[str, ...] = ()
+    timeout: float | None = None
+    default: Any = None
+
+
+async def run_stages(
+    stages: Iterable[Stage],
+    timings: dict[str, int] | None = None,
+    errors: dict[str, str] | None = None,
+) -> dict[str, Any]:
+    """Executa o grafo e devolve {nome: resultado}.
+
+    `timings` recebe a duração (ms) de cada etapa, sem contar a espera pelas
+    dependências; `errors` recebe "timeout" ou o tipo da exceção por etapa.
+    Se o chamador for cancelado, todas as etapas pendentes são canceladas.
+    """
+    stages = list(stages)
+    timings = timings if timings is not None else {}
+    errors = errors if errors is not None else {}
+    # dependências precisam vir antes na lista (garante que não há ciclo)
+    seen: set[str] = set()
+    for s in stages:
+        missing = [d for d in s.deps if d not in seen]
+        if missing:
+            raise ValueError(f"Etapa {s.name} depende de etapas não declaradas antes: {missing}")
+        seen.add(s.name)
+
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def _run(stage: Stage) -> Any:
+        inputs: dict[str, Any] = {}
+        for dep in stage.deps:
+            inputs[dep] = await tasks[dep]
+        t0 = time.perf_counter()
+        try:
+            if stage.timeout and stage.timeout > 0:
+                return await asyncio.wait_for(stage.fn(inputs), stage.timeout)
+            return await stage.fn(inputs)
+        except asyncio.TimeoutError:
+            errors[stage.name] = "timeout"
+            logger.warning("Etapa %s excedeu %ss", stage.name, stage.timeout)
+            return stage.default
+        except Exception as e:
+            errors[stage.name] = type(e).__name__
+            logger.warning("Etapa %s falhou: %s", stage.name, e)
+            return stage.default
+        finally:
+            timings[stage.name] = int((time.perf_counter() - t0) * 1000)
+
+    # todas as tasks existem antes de qualquer uma rodar (create_task não executa)
+    for s in stages:
+        tasks[s.name] = asyncio.create_task(_run(s), name=f"stage:{s.name}")
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for t in tasks.values():
+            if not t.done():
+                t.cancel()
+    return {name: t.result() for name, t in tasks.items()}
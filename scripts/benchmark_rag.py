@@ -0,0 +1,336 @@
+"""
+Benchmark offline de qualidade e latência da recuperação do RAG
+
+Roda os backends de recuperação sobre o corpus distribuído
+(docs/aria_vector_store/chunks.jsonl) e os conjuntos de avaliação
+(aria_evaluation*.jsonl e ARIA-FAQ-PTBR-v1 (baseline).jsonl), sem rede:
+- rpc: cosseno exato, a mesma conta do match_rag_chunks/pgvector (via
+  local_index.LocalVectorIndex sem quantização)
+- local-float16 / local-int8: RAG_BACKEND=local com quantização
+- pg: busca híbrida com a fusão RRF do hybrid_search (vetor + léxico), uma
+  variante por valor de --rrf-k
+- reflector: reflector/similarity_engine.py (parser pgvector + cosseno)
+- tfidf: lexical_index.LexicalIndex (RAG_BACKEND=lexical)
+
+Embeddings: por padrão um embedder determinístico por hashing de termos
+(não semântico, mas estável entre execuções); com --embeddings usa vetores
+gravados antes com --record (OpenAI, uma única vez).
+
+Relevância: um chunk é relevante quando cobre ao menos --threshold dos
+termos da resposta ideal (chunking.answer_coverage). Métricas por backend:
+recall@k, hit@k, MRR, latência p50/p95/p99 da busca e pico de memória.
+
+Uso:
+    python scripts/benchmark_rag.py --out benchmark_rag.json
+    python scripts/benchmark_rag.py --rrf-k 20 --rrf-k 60 --candidates 20
+    python scripts/benchmark_rag.py --record data/bench_embeddings.npz   # grava (rede)
+    python scripts/benchmark_rag.py --embeddings data/bench_embeddings.npz
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from collections.abc import Callable, Sequence
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from chunking import answer_coverage, load_eval_cases
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from hybrid_search import HybridSearchConfig, rrf_fuse  # noqa: E402
+from lexical_index import LexicalIndex, analyze, read_chunks  # noqa: E402
+from local_index import LocalVectorIndex  # noqa: E402
+
+STORE = ROOT / "docs" / "aria_vector_store"
+DEFAULT_SETS = [
+    *sorted(glob.glob(str(STORE / "aria_evaluation*.jsonl"))),
+    str(ROOT / "docs" / "ARIA-FAQ-PTBR-v1 (baseline).jsonl"),
+]
+
+# backend: (build(corpus, matrix) -> search(question, qvec, k) -> [linha])
+Search = Callable[[str, np.ndarray, int], list[int]]
+
+
+# ---------------------------
+# Embeddings sem rede
+# ---------------------------
+
+
+class HashingEmbedder:
+    """Termos (unigramas + bigramas) espalhados por hashing em `dim` posições"""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _slot(self, term: str) -> tuple[int, float]:
+        h = int.from_bytes(hashlib.blake2b(term.encode(), digest_size=8).digest(), "little")
+        return h % self.dim, (1.0 if (h >> 63) & 1 else -1.0)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term, tf in Counter(analyze(text)).items():
+                slot, sign = self._slot(term)
+                out[row, slot] += sign * (1.0 + math.log(tf))
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+class RecordedEmbedder:
+    """Vetores gravados com --record (npz: texts + vectors)"""
+
+    def __init__(self, path: str):
+        data = np.load(path, allow_pickle=False)
+        self._rows = {str(t): i for i, t in enumerate(data["texts"])}
+        self._vectors = data["vectors"].astype(np.float32)
+        self.dim = int(self._vectors.shape[1])
+        self.name = f"recorded:{os.path.basename(path)}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        missing = [t for t in texts if t not in self._rows]
+        if missing:
+            raise SystemExit(f"{len(missing)} textos sem embedding gravado; rode --record de novo")
+        return self._vectors[[self._rows[t] for t in texts]]
+
+
+def record_embeddings(path: str, texts: Sequence[str], model: str, batch: int = 256) -> None:
+    from openai import OpenAI  # type: ignore
+
+    client = OpenAI()
+    unique = list(dict.fromkeys(texts))
+    vectors: list[list[float]] = []
+    for start in range(0, len(unique), batch):
+        resp = client.embeddings.create(model=model, input=unique[start : start + batch])
+        vectors.extend(d.embedding for d in sorted(resp.data, key=lambda d: d.index))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.savez(path, texts=np.array(unique), vectors=np.asarray(vectors, dtype=np.float32))
+    print(f"{len(unique)} embeddings ({model}) gravados em {path}")
+
+
+# ---------------------------
+# Backends
+# ---------------------------
+
+
+def _records(chunks: list[dict[str, Any]], matrix: np.ndarray) -> list[dict[str, Any]]:
+    return [
+        {"id": str(i), "content": c.get("text") or "", "metadata": {}, "embedding": matrix[i]}
+        for i, c in enumerate(chunks)
+    ]
+
+
+def vector_backend(quantize: str = "none") -> Callable[[list[dict], np.ndarray], Search]:
+    def build(chunks: list[dict], matrix: np.ndarray) -> Search:
+        index = LocalVectorIndex.build(_records(chunks, matrix), quantize=quantize)
+        return lambda question, qvec, k: [int(r["id"]) for r in index.search(qvec, k)]
+
+    return build
+
+
+def pg_hybrid_backend(rrf_k: int, candidates: int) -> Callable[[list[dict], np.ndarray], Search]:
+    """vetor (cosseno exato) + léxico (no lugar do ts_rank), fundidos por RRF"""
+
+    def build(chunks: list[dict], matrix: np.ndarray) -> Search:
+        vectors = LocalVectorIndex.build(_records(chunks, matrix))
+        lexical = LexicalIndex.build(chunks)
+
+        def search(question: str, qvec: np.ndarray, k: int) -> list[int]:
+            n = max(candidates, k)
+            vec = [int(r["id"]) for r in vectors.search(qvec, n)]
+            fts = [row for row, _ in lexical.top_rows(question, n, min_score=0.0)]
+            return [row for row, _ in rrf_fuse([vec, fts], rrf_k=rrf_k, k=k)]
+
+        return search
+
+    return build
+
+
+def reflector_backend(chunks: list[dict], matrix: np.ndarray) -> Search:
+    from reflector.similarity_engine import SimilarityEngine
+
+    engine = SimilarityEngine("http://offline", {}, dim=matrix.shape[1], refresh_seconds=float("inf"))
+    rows = [
+        {"id": i, "content": c.get("text") or "", "embedding": "[" + ",".join(f"{x:.7g}" for x in matrix[i]) + "]"}
+        for i, c in enumerate(chunks)
+    ]
+    engine._apply(rows, full=True)
+    engine._refreshed_at = time.monotonic()
+    return lambda question, qvec, k: [int(chunk["id"]) for _, chunk in engine.search(qvec, k)]
+
+
+def tfidf_backend(chunks: list[dict], matrix: np.ndarray) -> Search:
+    index = LexicalIndex.build(chunks)
+    return lambda question, qvec, k: [row for row, _ in index.top_rows(question, k)]
+
+
+def backends(rrf_ks: Sequence[int], candidates: int) -> dict[str, Callable[[list[dict], np.ndarray], Search]]:
+    out: dict[str, Callable[[list[dict], np.ndarray], Search]] = {
+        "rpc": vector_backend("none"),
+        "local-float16": vector_backend("float16"),
+        "local-int8": vector_backend("int8"),
+    }
+    for rrf_k in rrf_ks:
+        out[f"pg(rrf_k={rrf_k})"] = pg_hybrid_backend(rrf_k, candidates)
+    out["reflector"] = reflector_backend
+    out["tfidf"] = tfidf_backend
+    return out
+
+
+# ---------------------------
+# Execução
+# ---------------------------
+
+
+def _percentiles(values_ms: list[float]) -> dict[str, float]:
+    if not values_ms:
+        return {}
+    arr = np.asarray(values_ms)
+    return {f"p{p}_ms": round(float(np.percentile(arr, p)), 4) for p in (50, 95, 99)}
+
+
+def run_benchmark(
+    chunks: list[dict[str, Any]],
+    cases: list[dict[str, str]],
+    embedder: Any,
+    k: int = 5,
+    threshold: float = 0.5,
+    rrf_ks: Sequence[int] = (60,),
+    candidates: int = 50,
+    repeat: int = 3,
+    only: Sequence[str] | None = None,
+) -> dict[str, Any]:
+    texts = [c.get("text") or "" for c in chunks]
+    relevant = [
+        {i for i, t in enumerate(texts) if answer_coverage(case["ideal"], t) >= threshold} for case in cases
+    ]
+    evaluated = [i for i, rel in enumerate(relevant) if rel]
+    matrix = embedder.embed(texts)
+    qvecs = embedder.embed([c["question"] for c in cases]) if cases else np.zeros((0, matrix.shape[1]))
+
+    report: dict[str, Any] = {
+        "generated_at": datetime.now(UTC).isoformat(),
+        "embedder": embedder.name,
+        "dim": int(matrix.shape[1]),
+        "chunks": len(chunks),
+        "cases": len(cases),
+        "evaluated": len(evaluated),
+        "k": k,
+        "threshold": threshold,
+        "candidates": candidates,
+        "backends": {},
+    }
+    for name, build in backends(rrf_ks, candidates).items():
+        if only and name not in only and name.split("(")[0] not in only:
+            continue
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        search = build(chunks, matrix)
+        build_ms = (time.perf_counter() - t0) * 1000
+        latencies: list[float] = []
+        recall = hits = rr = 0.0
+        per_set: dict[str, list[float]] = {}
+        for rep in range(max(1, repeat)):
+            for i in evaluated:
+                t = time.perf_counter()
+                top = search(cases[i]["question"], qvecs[i], k)
+                latencies.append((time.perf_counter() - t) * 1000)
+                if rep:
+                    continue  # repetições só medem latência
+                rel = relevant[i]
+                found = [rank for rank, row in enumerate(top, 1) if row in rel]
+                case_recall = len(set(top) & rel) / min(len(rel), k)
+                recall += case_recall
+                hits += 1.0 if found else 0.0
+                rr += 1.0 / found[0] if found else 0.0
+                per_set.setdefault(cases[i]["set"], []).append(case_recall)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        n = len(evaluated) or 1
+        report["backends"][name] = {
+            f"recall@{k}": round(recall / n, 4),
+            f"hit@{k}": round(hits / n, 4),
+            "mrr": round(rr / n, 4),
+            **_percentiles(latencies),
+            "build_ms": round(build_ms, 2),
+            "peak_memory_mb": round(peak / 2**20, 3),
+            "recall_by_set": {s: round(sum(v) / len(v), 4) for s, v in sorted(per_set.items())},
+        }
+    return report
+
+
+def _print_table(report: dict[str, Any]) -> None:
+    k = report["k"]
+    print(
+        f"{report['chunks']} chunks, {report['evaluated']}/{report['cases']} casos com chunk relevante, "
+        f"embedder {report['embedder']}"
+    )
+    print(f"{'backend':<18}{'recall@' + str(k):>10}{'mrr':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'pico MB':>10}")
+    for name, m in report["backends"].items():
+        print(
+            f"{name:<18}{m[f'recall@{k}']:>10.3f}{m['mrr']:>8.3f}{m.get('p50_ms', 0):>10.3f}"
+            f"{m.get('p95_ms', 0):>10.3f}{m.get('p99_ms', 0):>10.3f}{m['peak_memory_mb']:>10.2f}"
+        )
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark offline da recuperação do RAG")
+    parser.add_argument("--chunks", default=str(STORE / "chunks.jsonl"), help="Corpus (formato chunks.jsonl)")
+    parser.add_argument("--eval", nargs="*", default=None, help="Conjuntos de avaliação (jsonl)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.5, help="Cobertura mínima da resposta ideal")
+    parser.add_argument("--rrf-k", type=int, action="append", default=None, help="Constante da RRF (repetível)")
+    parser.add_argument("--candidates", type=int, default=HybridSearchConfig.from_env().candidates)
+    parser.add_argument("--repeat", type=int, default=3, help="Repetições para as latências")
+    parser.add_argument("--backends", default="", help="Lista separada por vírgula (padrão: todos)")
+    parser.add_argument("--dim", type=int, default=256, help="Dimensão do embedder por hashing")
+    parser.add_argument("--embeddings", default=None, help="Embeddings gravados (.npz) em vez do hashing")
+    parser.add_argument("--record", default=None, help="Grava embeddings OpenAI do corpus e perguntas (.npz)")
+    parser.add_argument("--out", default=None, help="Relatório JSON")
+    args = parser.parse_args()
+
+    chunks = read_chunks(args.chunks)
+    cases = load_eval_cases(args.eval or [p for p in DEFAULT_SETS if os.path.exists(p)])
+    if args.record:
+        model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+        texts = [c.get("text") or "" for c in chunks] + [c["question"] for c in cases]
+        record_embeddings(args.record, texts, model)
+        return
+
+    embedder = RecordedEmbedder(args.embeddings) if args.embeddings else HashingEmbedder(args.dim)
+    report = run_benchmark(
+        chunks,
+        cases,
+        embedder,
+        k=args.k,
+        threshold=args.threshold,
+        rrf_ks=args.rrf_k or [HybridSearchConfig.from_env().rrf_k],
+        candidates=args.candidates,
+        repeat=args.repeat,
+        only=[b.strip() for b in args.backends.split(",") if b.strip()] or None,
+    )
+    report["corpus"] = args.chunks
+    _print_table(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"Relatório gravado em {args.out}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,591 @@
+"""
+Chunking compartilhado pelos scripts de ingestão do RAG
+
+Um único chunker para ingest_faqs.py, ingest_rag_supabase.py e o
+chunks.jsonl do índice léxico (lexical_index.py --from-pdfs):
+- Orçamento em tokens reais do tiktoken (cl100k_base, o mesmo dos modelos
+  text-embedding-3); sem o arquivo do encoding (ambiente offline) usa uma
+  estimativa e avisa
+- Respeita a estrutura: pares "P:" / "R:" nunca são divididos nem misturados,
+  títulos abrem um novo chunk e chunks não atravessam páginas
+- Ids determinísticos `doc_id|pN|cM` (mesmo formato do chunks.jsonl)
+- Em fluxo: consome página a página / linha a linha, sem montar o texto
+  inteiro do documento
+
+Benchmark (contagem de chunks, desperdício de tokens e acerto de recuperação
+contra docs/aria_vector_store/aria_evaluation_*.jsonl):
+    python scripts/chunking.py --benchmark
+Regerar o chunks.jsonl a partir dos PDFs:
+    python scripts/chunking.py --pdfs docs/aria_vector_store --out docs/aria_vector_store/chunks.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+DEFAULT_ENCODING = "cl100k_base"
+
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+_QUESTION_RE = re.compile(r"^(?:P|Pergunta|Q)\s*:\s*\S")
+_APPROX_RE = re.compile(r"\w+|[^\w\s]")
+
+
+# ---------------------------
+# Tokens
+# ---------------------------
+
+
+class _ApproxEncoding:
+    """Estimativa sem tiktoken: cada palavra ~ 1 token a cada 4 caracteres"""
+
+    name = "approx"
+
+    def count(self, text: str) -> int:
+        return sum(max(1, math.ceil(len(p) / 4)) for p in _APPROX_RE.findall(text))
+
+    def windows(self, text: str, size: int) -> list[str]:
+        out: list[str] = []
+        buf: list[str] = []
+        used = 0
+        for word in text.split():
+            n = self.count(word)
+            if buf and used + n > size:
+                out.append(" ".join(buf))
+                buf, used = [], 0
+            buf.append(word)
+            used += n
+        if buf:
+            out.append(" ".join(buf))
+        return out
+
+
+class _TiktokenEncoding:
+    def __init__(self, enc: Any):
+        self._enc = enc
+        self.name = enc.name
+
+    def count(self, text: str) -> int:
+        return len(self._enc.encode(text, disallowed_special=()))
+
+    def windows(self, text: str, size: int) -> list[str]:
+        ids = self._enc.encode(text, disallowed_special=())
+        return [self._enc.decode(ids[i : i + size]).strip() for i in range(0, len(ids), size)]
+
+
+@lru_cache(maxsize=4)
+def get_encoding(name: str | None = DEFAULT_ENCODING) -> _ApproxEncoding | _TiktokenEncoding:
+    """Encoding do tiktoken; None (ou falha ao carregar) -> estimativa"""
+    if not name:
+        return _ApproxEncoding()
+    try:
+        import tiktoken  # type: ignore
+
+        return _TiktokenEncoding(tiktoken.get_encoding(name))
+    except Exception as e:
+        print(f"Aviso: tiktoken/{name} indisponível ({type(e).__name__}); contagem de tokens estimada")
+        return _ApproxEncoding()
+
+
+# ---------------------------
+# Estrutura do texto
+# ---------------------------
+
+
+def is_question(line: str) -> bool:
+    return bool(_QUESTION_RE.match(line))
+
+
+def is_heading(line: str) -> bool:
+    """Linha curta, sem pontuação final, começando com maiúscula/número ou `#`"""
+    if line.startswith("#"):
+        return True
+    if len(line) > 80 or len(line.split()) > 10 or line[-1] in ".,;:!?":
+        return False
+    return line[0].isupper() or line[0].isdigit()
+
+
+def iter_blocks(lines: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """(tipo, texto) com tipo em heading | qa | text, a partir de linhas.
+
+    Título só é reconhecido no início de um bloco ou após uma linha que
+    termina uma frase, e só se a linha seguinte não continuar a frase
+    (PDFs que quebram o texto palavra a palavra).
+    """
+    kind = ""
+    buf: list[str] = []
+    held = ""  # candidato a título, decidido pela próxima linha não vazia
+
+    def flush() -> Iterator[tuple[str, str]]:
+        nonlocal kind, buf
+        if buf:
+            yield kind, " ".join(buf)
+        kind, buf = "", []
+
+    def append(line: str) -> None:
+        nonlocal kind
+        if not buf:
+            kind = "text"
+        buf.append(line)
+
+    for raw in lines:
+        line = " ".join(raw.split())
+        if held:
+            if not line:
+                continue
+            if line[0].islower() or line[0] in ",;.)":
+                append(held)
+            else:
+                yield from flush()
+                yield "heading", held
+            held = ""
+        if not line:
+            yield from flush()
+            continue
+        if is_question(line):
+            yield from flush()
+            kind, buf = "qa", [line]
+            continue
+        if (not buf or (kind != "qa" and buf[-1][-1] in ".!?:")) and is_heading(line):
+            held = line.lstrip("#").strip()
+            continue
+        append(line)
+    if held:
+        yield from flush()
+        yield "heading", held
+    yield from flush()
+
+
+def split_sentences(text: str) -> list[str]:
+    return [s.strip() for s in _SENTENCE_SPLIT_RE.split(text) if s.strip()]
+
+
+# ---------------------------
+# Chunker
+# ---------------------------
+
+
+@dataclass(frozen=True)
+class Chunk:
+    id: str
+    doc_id: str
+    chunk_index: int
+    page: int | None
+    text: str
+    tokens: int
+    heading: str = ""
+    kind: str = "text"
+
+
+class Chunker:
+    """Empacota blocos em chunks de até `max_tokens` tokens"""
+
+    def __init__(
+        self,
+        max_tokens: int = 450,
+        overlap_tokens: int = 60,
+        encoding: str | None = DEFAULT_ENCODING,
+    ):
+        self.max_tokens = max(16, int(max_tokens))
+        self.overlap_tokens = max(0, min(int(overlap_tokens), self.max_tokens // 2))
+        # abaixo disso um título/texto curto não vira chunk próprio
+        self.min_tokens = self.max_tokens // 4
+        self.encoding = get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return self.encoding.count(text)
+
+    def split(self, text: str) -> list[str]:
+        """Divide um bloco grande por frases; frase grande demais, por tokens"""
+        if self.count(text) <= self.max_tokens:
+            return [text]
+        parts: list[str] = []
+        buf: list[str] = []
+        used = 0
+        for sentence in split_sentences(text):
+            n = self.count(sentence)
+            if n > self.max_tokens:
+                if buf:
+                    parts.append(" ".join(buf))
+                    buf, used = [], 0
+                parts.extend(self.encoding.windows(sentence, self.max_tokens))
+                continue
+            if buf and used + n > self.max_tokens:
+                parts.append(" ".join(buf))
+                buf, used = [], 0
+            buf.append(sentence)
+            used += n
+        if buf:
+            parts.append(" ".join(buf))
+        return parts
+
+    def _tail(self, text: str) -> list[str]:
+        """Frases finais de `text` que cabem no overlap"""
+        if not self.overlap_tokens:
+            return []
+        tail: list[str] = []
+        used = 0
+        for sentence in reversed(split_sentences(text)):
+            n = self.count(sentence)
+            if used + n > self.overlap_tokens:
+                break
+            tail.insert(0, sentence)
+            used += n
+        return tail
+
+    def chunk_pages(self, pages: Iterable[tuple[int | None, str]], doc_id: str) -> Iterator[Chunk]:
+        """Chunks de um documento a partir de (página, texto), em fluxo.
+
+        Trechos seguidos com o mesmo número de página continuam a mesma página.
+        Título e texto curto antes de um par P/R entram no mesmo chunk do par;
+        texto logo após a resposta (listas) é continuação dela.
+        """
+        index = 0
+        per_page = 0
+        heading = ""
+        current: int | None = None
+        started = False
+        pending: list[str] = []
+        pending_tokens = 0
+        pending_kind = "text"
+
+        def emit() -> Chunk:
+            nonlocal index, per_page, pending, pending_tokens, pending_kind
+            per_page += 1
+            body = " ".join(pending)
+            chunk = Chunk(
+                id=f"{doc_id}|p{current or 1}|c{per_page}",
+                doc_id=doc_id,
+                chunk_index=index,
+                page=current,
+                text=body,
+                tokens=self.count(body),
+                heading=heading,
+                kind=pending_kind,
+            )
+            index += 1
+            pending, pending_tokens, pending_kind = [], 0, "text"
+            return chunk
+
+        def add(block: str, n: int, kind: str) -> Iterator[Chunk]:
+            """Acrescenta ao chunk corrente, fechando-o (com overlap) se estourar"""
+            nonlocal pending, pending_tokens, pending_kind
+            if pending and pending_tokens + n > self.max_tokens:
+                overlap = self._tail(" ".join(pending)) if pending_kind == "text" else []
+                yield emit()
+                tail_tokens = self.count(" ".join(overlap)) if overlap else 0
+                if overlap and kind == "text" and tail_tokens + n <= self.max_tokens:
+                    pending, pending_tokens = overlap, tail_tokens
+            if not pending:
+                pending_kind = kind
+            if n > self.max_tokens:
+                *full, block = self.split(block)
+                for part in full:
+                    pending.append(part)
+                    yield emit()
+                    pending_kind = kind
+                n = self.count(block)
+            pending.append(block)
+            pending_tokens += n
+
+        for page, text in pages:
+            if not started or page != current:
+                # chunks não atravessam páginas; título solto no fim da página
+                # segue para a próxima
+                if pending and pending != [heading]:
+                    yield emit()
+                current, per_page, started = page, 0, True
+            for kind, block in iter_blocks(text.splitlines()):
+                n = self.count(block)
+                # novo par P/R ou título: fecha o chunk, salvo um preâmbulo curto
+                if (
+                    kind in ("qa", "heading")
+                    and pending
+                    and (pending_kind == "qa" or pending_tokens >= self.min_tokens)
+                ):
+                    yield emit()
+                if kind == "qa":
+                    pending_kind = "qa"
+                    yield from add(block, n, "qa")
+                    continue
+                if kind == "heading":
+                    heading = block
+                # texto logo após uma resposta é continuação dela
+                yield from add(block, n, pending_kind if pending else "text")
+        if pending:
+            yield emit()
+
+    def chunk_lines(self, lines: Iterable[str], doc_id: str) -> Iterator[Chunk]:
+        """Texto em linhas (ex.: arquivo aberto); form feed (\\f) separa páginas"""
+        return self.chunk_pages(_pages_from_lines(lines), doc_id)
+
+    def chunk_text(self, text: str, doc_id: str = "doc") -> list[Chunk]:
+        # split("\n"), não splitlines(): preserva o \f entre páginas
+        return list(self.chunk_lines(text.split("\n"), doc_id))
+
+
+def _pages_from_lines(lines: Iterable[str]) -> Iterator[tuple[int | None, str]]:
+    page = 1
+    buf: list[str] = []
+    paged = False
+    for line in lines:
+        while "\f" in line:
+            before, line = line.split("\f", 1)
+            buf.append(before)
+            yield page, "\n".join(buf)
+            page, buf, paged = page + 1, [], True
+        buf.append(line)
+        if len(buf) >= 200 and not buf[-1].strip():
+            # parágrafo fechado: entrega sem esperar o fim da página
+            yield (page if paged else None), "\n".join(buf)
+            buf = []
+    if buf:
+        yield (page if paged else None), "\n".join(buf)
+
+
+def iter_pdf_pages(path: str | Path) -> Iterator[tuple[int, str]]:
+    """(página, texto) lendo um PDF uma página por vez"""
+    from PyPDF2 import PdfReader  # type: ignore
+
+    reader = PdfReader(str(path))
+    for page_no, page in enumerate(reader.pages, 1):
+        yield page_no, page.extract_text() or ""
+
+
+def pdf_title(path: str | Path) -> str:
+    from PyPDF2 import PdfReader  # type: ignore
+
+    reader = PdfReader(str(path))
+    info_title = getattr(reader.metadata, "title", None) if reader.metadata else None
+    return (info_title or Path(path).stem).strip()
+
+
+def chunk_records_from_pdfs(
+    directory: str,
+    max_tokens: int = 200,
+    overlap_tokens: int = 30,
+    tags: Iterable[str] = (),
+    encoding: str | None = DEFAULT_ENCODING,
+) -> list[dict[str, Any]]:
+    """Registros no formato do chunks.jsonl para todos os PDFs da pasta"""
+    chunker = Chunker(max_tokens, overlap_tokens, encoding)
+    now = datetime.now(UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    records: list[dict[str, Any]] = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(".pdf"):
+            continue
+        path = os.path.join(directory, name)
+        title = pdf_title(path)
+        for c in chunker.chunk_pages(iter_pdf_pages(path), doc_id=title):
+            records.append(
+                {
+                    "id": c.id,
+                    "text": c.text,
+                    "source_file": name,
+                    "title": title,
+                    "page": c.page,
+                    "heading": c.heading,
+                    "created_at": now,
+                    "tags": list(tags),
+                }
+            )
+    return records
+
+
+# ---------------------------
+# Benchmark
+# ---------------------------
+
+_WORD_RE = re.compile(r"\w{4,}")
+
+
+def _terms(text: str) -> set[str]:
+    decomposed = unicodedata.normalize("NFKD", (text or "").lower())
+    return set(_WORD_RE.findall("".join(c for c in decomposed if not unicodedata.combining(c))))
+
+
+def answer_coverage(ideal: str, text: str) -> float:
+    """Fração dos termos (4+ letras) da resposta ideal presentes no chunk"""
+    wanted = _terms(ideal)
+    if not wanted:
+        return 0.0
+    return len(wanted & _terms(text)) / len(wanted)
+
+
+def load_eval_cases(paths: Iterable[str]) -> list[dict[str, str]]:
+    """(pergunta, resposta ideal) dos conjuntos de avaliação, sem repetições"""
+    cases: list[dict[str, str]] = []
+    seen: set[str] = set()
+    for path in paths:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                users = [m.get("content") or "" for m in row.get("input") or [] if m.get("role") == "user"]
+                question, ideal = (users[-1] if users else "").strip(), (row.get("ideal") or "").strip()
+                if question and ideal and question not in seen:
+                    seen.add(question)
+                    cases.append({"question": question, "ideal": ideal, "set": os.path.basename(path)})
+    return cases
+
+
+def _legacy_words(pages: list[tuple[int, str]], size: int, overlap: int) -> list[str]:
+    """Chunker antigo do ingest_faqs/lexical_index: janelas de palavras"""
+    out: list[str] = []
+    step = max(1, size - overlap)
+    for _, text in pages:
+        words = text.split()
+        for start in range(0, len(words), step):
+            out.append(" ".join(words[start : start + size]))
+            if start + size >= len(words):
+                break
+    return out
+
+
+def _legacy_chars(pages: list[tuple[int, str]], max_tokens: int, overlap_tokens: int) -> list[str]:
+    """Chunker antigo do ingest_rag_supabase: frases, ~4 caracteres por token"""
+    max_chars, overlap_chars = max_tokens * 4, overlap_tokens * 4
+    chunks: list[str] = []
+    for _, text in pages:
+        buf: list[str] = []
+        cur = 0
+        for s in split_sentences(" ".join(text.split())):
+            if cur + len(s) + 1 > max_chars and buf:
+                joined = " ".join(buf)
+                chunks.append(joined)
+                tail = joined[-overlap_chars:]
+                buf, cur = [tail], len(tail)
+            buf.append(s)
+            cur += len(s) + 1
+        if buf:
+            chunks.append(" ".join(buf))
+    return [c for c in chunks if c]
+
+
+def benchmark(
+    directory: str,
+    eval_paths: list[str],
+    max_tokens: int = 200,
+    overlap_tokens: int = 30,
+    k: int = 5,
+    threshold: float = 0.5,
+    encoding: str | None = DEFAULT_ENCODING,
+) -> dict[str, Any]:
+    """Compara os chunkers: chunks, tokens, desperdício e acerto@k (TF-IDF)"""
+    root = str(Path(__file__).resolve().parent.parent)
+    if root not in sys.path:
+        sys.path.append(root)
+    from lexical_index import LexicalIndex, read_chunks
+
+    enc = get_encoding(encoding)
+    pdfs = sorted(glob.glob(os.path.join(directory, "*.pdf")))
+    pages = {p: list(iter_pdf_pages(p)) for p in pdfs}
+    source_tokens = sum(enc.count(" ".join(text.split())) for pp in pages.values() for _, text in pp)
+
+    variants: dict[str, list[str]] = {}
+    legacy = os.path.join(directory, "chunks.jsonl")
+    if os.path.exists(legacy):
+        variants["chunks.jsonl"] = [c["text"] for c in read_chunks(legacy)]
+    variants["palavras (antigo)"] = [t for pp in pages.values() for t in _legacy_words(pp, 120, 20)]
+    variants["caracteres (antigo)"] = [
+        t for pp in pages.values() for t in _legacy_chars(pp, max_tokens, overlap_tokens)
+    ]
+    chunker = Chunker(max_tokens, overlap_tokens, encoding)
+    t0 = time.perf_counter()
+    variants["compartilhado"] = [
+        c.text for p, pp in pages.items() for c in chunker.chunk_pages(pp, doc_id=Path(p).stem)
+    ]
+    chunk_seconds = time.perf_counter() - t0
+
+    cases = load_eval_cases(eval_paths)
+    report: dict[str, Any] = {
+        "encoding": enc.name,
+        "max_tokens": max_tokens,
+        "overlap_tokens": overlap_tokens,
+        "k": k,
+        "threshold": threshold,
+        "cases": len(cases),
+        "source_tokens": source_tokens,
+        "shared_chunking_seconds": round(chunk_seconds, 3),
+        "variants": {},
+    }
+    for name, texts in variants.items():
+        tokens = [enc.count(t) for t in texts]
+        index = LexicalIndex.build([{"id": str(i), "text": t} for i, t in enumerate(texts)])
+        hits = answerable = 0
+        rr = 0.0
+        for case in cases:
+            if any(answer_coverage(case["ideal"], t) >= threshold for t in texts):
+                answerable += 1
+            for rank, (row, _score) in enumerate(index.top_rows(case["question"], k), 1):
+                if answer_coverage(case["ideal"], texts[row]) >= threshold:
+                    hits += 1
+                    rr += 1 / rank
+                    break
+        total = sum(tokens)
+        report["variants"][name] = {
+            "chunks": len(texts),
+            "embed_tokens": total,
+            "waste_pct": round(100 * (total / source_tokens - 1), 1) if source_tokens else 0.0,
+            "mean_tokens": round(total / len(texts), 1) if texts else 0.0,
+            "over_budget": sum(1 for n in tokens if n > max_tokens),
+            "answerable": answerable,
+            f"hit_rate@{k}": round(hits / len(cases), 3) if cases else 0.0,
+            "mrr": round(rr / len(cases), 3) if cases else 0.0,
+        }
+    return report
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(description="Chunker compartilhado da ingestão do RAG")
+    parser.add_argument("--benchmark", action="store_true", help="Compara os chunkers nos PDFs da pasta")
+    parser.add_argument("--pdfs", default="docs/aria_vector_store", help="Pasta com os PDFs")
+    parser.add_argument(
+        "--eval",
+        nargs="*",
+        default=None,
+        help="Conjuntos de avaliação (padrão: <pdfs>/aria_evaluation_*.jsonl)",
+    )
+    parser.add_argument("--out", default=None, help="Grava chunks.jsonl (ou o relatório, com --benchmark)")
+    parser.add_argument("--max-tokens", type=int, default=int(os.getenv("CHUNK_TOKENS", "200")))
+    parser.add_argument("--overlap-tokens", type=int, default=int(os.getenv("OVERLAP_TOKENS", "30")))
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--encoding", default=os.getenv("CHUNK_ENCODING", DEFAULT_ENCODING))
+    args = parser.parse_args()
+
+    if args.benchmark:
+        eval_paths = args.eval or sorted(glob.glob(os.path.join(args.pdfs, "aria_evaluation_*.jsonl")))
+        report = benchmark(
+            args.pdfs, eval_paths, args.max_tokens, args.overlap_tokens, args.k, encoding=args.encoding
+        )
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as fh:
+                fh.write(text + "\n")
+        print(text)
+        return
+
+    records = chunk_records_from_pdfs(args.pdfs, args.max_tokens, args.overlap_tokens, encoding=args.encoding)
+    out = args.out or os.path.join(args.pdfs, "chunks.jsonl")
+    with open(out, "w", encoding="utf-8") as fh:
+        for r in records:
+            fh.write(json.dumps(r, ensure_ascii=False) + "\n")
+    print(f"{len(records)} chunks -> {out}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,273 @@
+"""
+Utilitários compartilhados pelos scripts de ingestão do RAG
+
+- bump_corpus_version: grava um novo carimbo de versão do corpus ao final de
+  uma ingestão, invalidando o cache de resultados do RAG da API (rag_cache.py)
+- supabase_session: `requests.Session` com pool de conexões para os upserts
+- RateBudget: orçamento de requisições/tokens por minuto para embeddings
+- Checkpoint: chunks já gravados, para retomar uma ingestão interrompida
+- content_hash / fetch_existing_hashes / delete_stale_chunks: ingestão
+  incremental, só chunks novos ou alterados vão para o embedding (requer
+  ingestao_incremental_aria_chunks.sql)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections.abc import Iterable
+from datetime import UTC, datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CORPUS_META_TABLE = "aria_corpus_meta"
+CORPUS_VERSION_KEY = "corpus_version"
+# chave única de aria_chunks usada no upsert (ingestao_incremental_aria_chunks.sql)
+UPSERT_KEY = "source,doc_id,chunk_index"
+UPSERT_PREFER = "resolution=merge-duplicates,return=minimal"
+
+
+def new_corpus_version() -> str:
+    return datetime.now(UTC).strftime("%Y%m%dT%H%M%S.%fZ")
+
+
+def bump_corpus_version(version: str | None = None, timeout: float = 10) -> str:
+    """Publica a nova versão do corpus no Supabase e/ou em RAG_CORPUS_VERSION_FILE.
+
+    Falhas apenas são reportadas: o corpus já foi gravado, e o cache da API
+    expira pelo TTL de qualquer forma.
+    """
+    version = version or new_corpus_version()
+
+    url = (os.getenv("SUPABASE_URL", "") or "").rstrip("/")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "") or ""
+    if url and key:
+        try:
+            r = requests.post(
+                f"{url}/rest/v1/{CORPUS_META_TABLE}",
+                headers={
+                    "apikey": key,
+                    "Authorization": f"Bearer {key}",
+                    "Content-Type": "application/json",
+                    "Prefer": "resolution=merge-duplicates,return=minimal",
+                },
+                json={
+                    "key": CORPUS_VERSION_KEY,
+                    "value": version,
+                    "updated_at": datetime.now(UTC).isoformat(),
+                },
+                timeout=timeout,
+            )
+            if r.status_code >= 300:
+                print(f"Aviso: versão do corpus não gravada ({r.status_code}): {r.text}")
+        except requests.RequestException as e:
+            print(f"Aviso: versão do corpus não gravada: {e}")
+
+    path = os.getenv("RAG_CORPUS_VERSION_FILE", "")
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(version + "\n")
+
+    print(f"Versão do corpus: {version}")
+    return version
+
+
+def supabase_session(pool_size: int = 8, retries: int = 3) -> requests.Session:
+    """Sessão com keep-alive para o REST do Supabase.
+
+    POST só é repetido em falha de conexão (a requisição não saiu); GET e
+    DELETE também em 429/5xx.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "DELETE"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa barata (~4 caracteres por token) para o orçamento de TPM"""
+    return max(1, len(text) // 4)
+
+
+def content_hash(content: str, model: str = "") -> str:
+    """sha256 do texto (espaços normalizados) e do modelo de embedding.
+
+    O modelo entra no hash: trocar EMBEDDING_MODEL reembeda todos os chunks.
+    """
+    text = " ".join((content or "").split())
+    return hashlib.sha256(f"{model}\n{text}".encode()).hexdigest()
+
+
+def _in_filter(values: Iterable[str]) -> str:
+    quoted = ('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values)
+    return "in.(" + ",".join(quoted) + ")"
+
+
+def fetch_existing_hashes(
+    session: requests.Session,
+    base_url: str,
+    headers: dict[str, str],
+    table: str,
+    source: str,
+    doc_ids: Iterable[str],
+    page_size: int = 1000,
+    ids_per_request: int = 50,
+    timeout: float = 60,
+) -> dict[str, dict[int, str]] | None:
+    """{doc_id: {chunk_index: content_hash}} dos chunks já gravados.
+
+    Consulta em lote (vários doc_id por requisição, paginada). Devolve None
+    se a tabela não tem as colunas da ingestão incremental.
+    """
+    url = f"{base_url}/rest/v1/{table}"
+    headers = {k: v for k, v in headers.items() if k.lower() not in ("content-type", "prefer")}
+    ids = sorted(set(doc_ids))
+    existing: dict[str, dict[int, str]] = {}
+    for start in range(0, len(ids), ids_per_request):
+        offset = 0
+        while True:
+            params = {
+                "select": "doc_id,chunk_index,content_hash",
+                "source": f"eq.{source}",
+                "doc_id": _in_filter(ids[start : start + ids_per_request]),
+                "order": "doc_id.asc,chunk_index.asc",
+                "limit": str(page_size),
+                "offset": str(offset),
+            }
+            r = session.get(url, headers=headers, params=params, timeout=timeout)
+            if r.status_code in (400, 404) and not existing and offset == 0:
+                print(
+                    f"Aviso: ingestão incremental indisponível em {table} ({r.status_code}); "
+                    "rode ingestao_incremental_aria_chunks.sql. Todos os chunks serão enviados."
+                )
+                return None
+            if r.status_code >= 300:
+                raise RuntimeError(f"Supabase select failed: {r.status_code} -> {r.text}")
+            page = r.json() or []
+            for row in page:
+                if row.get("chunk_index") is not None:
+                    existing.setdefault(row["doc_id"], {})[int(row["chunk_index"])] = row.get("content_hash") or ""
+            if len(page) < page_size:
+                break
+            offset += page_size
+    return existing
+
+
+def delete_stale_chunks(
+    session: requests.Session,
+    base_url: str,
+    headers: dict[str, str],
+    table: str,
+    source: str,
+    doc_id: str,
+    keep: int,
+    timeout: float = 60,
+) -> None:
+    """Remove os chunks do doc_id com chunk_index >= keep (o documento encolheu)"""
+    headers = {k: v for k, v in headers.items() if k.lower() != "content-type"}
+    headers["Prefer"] = "return=minimal"
+    params = {"source": f"eq.{source}", "doc_id": f"eq.{doc_id}", "chunk_index": f"gte.{int(keep)}"}
+    r = session.delete(f"{base_url}/rest/v1/{table}", headers=headers, params=params, timeout=timeout)
+    if r.status_code >= 300:
+        raise RuntimeError(f"Supabase delete failed: {r.status_code} -> {r.text}")
+
+
+class RateBudget:
+    """Baldes de requisições e tokens por minuto, compartilhados entre threads"""
+
+    def __init__(self, max_rpm: int, max_tpm: int):
+        self.max_rpm = max(1, int(max_rpm))
+        self.max_tpm = max(1, int(max_tpm))
+        self._req = float(self.max_rpm)
+        self._tok = float(self.max_tpm)
+        self._at = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_s = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._at
+        self._at = now
+        self._req = min(self.max_rpm, self._req + elapsed * self.max_rpm / 60)
+        self._tok = min(self.max_tpm, self._tok + elapsed * self.max_tpm / 60)
+
+    def acquire(self, tokens: int) -> None:
+        tokens = min(max(1, tokens), self.max_tpm)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._req >= 1 and self._tok >= tokens:
+                    self._req -= 1
+                    self._tok -= tokens
+                    return
+                wait = max(
+                    (1 - self._req) * 60 / self.max_rpm,
+                    (tokens - self._tok) * 60 / self.max_tpm,
+                )
+            wait = max(wait, 0.01)
+            self.waited_s += wait
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """Arquivo JSONL com as chaves dos chunks já gravados (append-only)"""
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self._done: set[str] = set()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                for line in fh:
+                    line = line.strip()
+                    if line:
+                        try:
+                            self._done.add(json.loads(line)["key"])
+                        except (ValueError, KeyError):
+                            continue  # linha truncada por interrupção
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._done
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def mark(self, keys: Iterable[str]) -> None:
+        keys = [k for k in keys if k not in self._done]
+        if not keys:
+            return
+        with self._lock:
+            self._done.update(keys)
+            if not self.path:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as fh:
+                for k in keys:
+                    fh.write(json.dumps({"key": k}, ensure_ascii=False) + "\n")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._done.clear()
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
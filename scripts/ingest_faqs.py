@@ -3,13 +3,37 @@ from __future__ import annotations
 import argparse
 import json
 import os
-from collections.abc import Iterable
-from dataclasses import dataclass
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from dataclasses import dataclass, field
 from datetime import UTC, datetime
 from pathlib import Path
 from typing import Any
 
+import requests
+from chunking import Chunker
 from dotenv import load_dotenv
+from ingest_common import (
+    UPSERT_KEY,
+    UPSERT_PREFER,
+    Checkpoint,
+    RateBudget,
+    bump_corpus_version,
+    content_hash,
+    delete_stale_chunks,
+    estimate_tokens,
+    fetch_existing_hashes,
+    supabase_session,
+)
 
 
 def _lazy_imports():
@@ -69,13 +93,23 @@ def _supabase_headers() -> dict[str, str]:
     }
 
 
-def upsert_chunks(rows: list[dict[str, Any]], table: str = "aria_chunks") -> list[dict[str, Any]]:
-    import requests
-
+def upsert_chunks(
+    rows: list[dict[str, Any]],
+    table: str = "aria_chunks",
+    session: requests.Session | None = None,
+    on_conflict: str | None = None,
+) -> list[dict[str, Any]]:
     headers = _supabase_headers()
     base_url = headers.pop("_base_url")
     url = f"{base_url}/rest/v1/{table}"
-    r = requests.post(url, headers=headers, data=json.dumps(rows), timeout=60)
+    params = None
+    if on_conflict:
+        # upsert idempotente na chave única; sem eco das linhas (embeddings)
+        params = {"on_conflict": on_conflict}
+        headers["Prefer"] = UPSERT_PREFER
+    r = (session or requests).post(
+        url, headers=headers, params=params, data=json.dumps(rows), timeout=60
+    )
     if r.status_code >= 300:
         raise RuntimeError(f"Supabase upsert failed: {r.status_code} -> {r.text}")
     try:
@@ -84,24 +118,6 @@ def upsert_chunks(rows: list[dict[str, Any]], table: str = "aria_chunks") -> lis
         return []
 
 
-def chunk_text_words(text: str, size: int, overlap: int) -> list[str]:
-    words = text.split()
-    out: list[str] = []
-    i = 0
-    n = len(words)
-    if size <= 0:
-        return [text.strip()]
-    while i < n:
-        j = min(n, i + size)
-        out.append(" ".join(words[i:j]))
-        if j == n:
-            break
-        # move by size-overlap tokens; ensure progress
-        step = max(1, size - max(0, overlap))
-        i += step
-    return out
-
-
 @dataclass
 class PdfChunk:
     source: str
@@ -110,6 +126,7 @@ class PdfChunk:
     chunk_index: int
     content: str
     metadata: dict[str, Any]
+    content_hash: str = ""
 
 
 def extract_pdf_chunks(
@@ -118,38 +135,38 @@ def extract_pdf_chunks(
     PdfReader, slugify, unidecode, _tqdm = _lazy_imports()
     reader = PdfReader(pdf_path.as_posix())
     base = slugify(pdf_path.stem)
+    # páginas lidas uma a uma pelo chunker compartilhado (P/R, títulos, páginas);
+    # chunk_index corre pelo documento todo: (source, doc_id, chunk_index) é a chave única
+    pages = ((p, unidecode(page.extract_text() or "")) for p, page in enumerate(reader.pages, start=1))
+    chunker = Chunker(max_tokens=chunk_tokens, overlap_tokens=overlap_tokens)
     chunks: list[PdfChunk] = []
-    for p, page in enumerate(reader.pages, start=1):
-        txt = (page.extract_text() or "").strip()
-        if not txt:
-            continue
-        cleaned = unidecode(" ".join(txt.split()))
-        parts = chunk_text_words(cleaned, chunk_tokens, overlap_tokens)
-        for k, part in enumerate(parts):
-            meta: dict[str, Any] = {
-                "page": p,
-                "tags": [source],
-                "updated_at": datetime.now(UTC).isoformat(),
-            }
-            if namespace:
-                meta["namespace"] = namespace
-            chunks.append(
-                PdfChunk(
-                    source=source,
-                    doc_id=f"{base}.pdf",
-                    page=p,
-                    chunk_index=k,
-                    content=part,
-                    metadata=meta,
-                )
+    for c in chunker.chunk_pages(pages, doc_id=f"{base}.pdf"):
+        meta: dict[str, Any] = {
+            "page": c.page,
+            "tags": [source],
+            "updated_at": datetime.now(UTC).isoformat(),
+        }
+        if c.heading:
+            meta["heading"] = c.heading
+        if namespace:
+            meta["namespace"] = namespace
+        chunks.append(
+            PdfChunk(
+                source=source,
+                doc_id=c.doc_id,
+                page=c.page or 1,
+                chunk_index=c.chunk_index,
+                content=c.text,
+                metadata=meta,
             )
+        )
     return chunks
 
 
-def embed_texts(texts: list[str], model: str) -> list[list[float]]:
-    client = _get_openai_client()
+def embed_texts(texts: list[str], model: str, client: Any = None) -> list[list[float]]:
+    client = client or _get_openai_client()
     resp = client.embeddings.create(model=model, input=texts)
-    return [d.embedding for d in resp.data]
+    return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
 
 
 def batched(iterable: Iterable[Any], batch_size: int) -> Iterable[list[Any]]:
@@ -163,6 +180,126 @@ def batched(iterable: Iterable[Any], batch_size: int) -> Iterable[list[Any]]:
         yield batch
 
 
+def chunk_key(c: PdfChunk) -> str:
+    """Chave do checkpoint: (source, doc_id, page, chunk_index) + hash do conteúdo"""
+    return f"{c.source}|{c.doc_id}|{c.page}|{c.chunk_index}|{c.content_hash[:16]}"
+
+
+def _save_group(
+    group: list[PdfChunk],
+    vectors: list[list[float]],
+    *,
+    namespace: str | None,
+    table: str,
+    session: requests.Session | None,
+    incremental: bool = False,
+) -> list[dict[str, Any]]:
+    # Default row shape (aria_chunks schema)
+    rows = []
+    for c, emb in zip(group, vectors, strict=False):
+        row = {
+            "source": c.source,
+            "doc_id": c.doc_id,
+            "chunk_index": c.chunk_index,
+            "content": c.content,
+            "metadata": c.metadata,
+            "embedding": emb,
+        }
+        if incremental:
+            row["content_hash"] = c.content_hash
+        rows.append(row)
+
+    # Try upsert; if table lacks doc_id/chunk_index (e.g., rag_chunks),
+    # fallback to a reduced schema and stash identifiers in metadata.
+    try:
+        return upsert_chunks(
+            rows, table=table, session=session, on_conflict=UPSERT_KEY if incremental else None
+        )
+    except RuntimeError as e:
+        msg = str(e)
+        missing_doc = "doc_id" in msg.lower()
+        missing_chunk = "chunk_index" in msg.lower()
+        if not (missing_doc or missing_chunk):
+            raise
+    rows_min: list[dict[str, Any]] = []
+    for c, emb in zip(group, vectors, strict=False):
+        meta2 = dict(c.metadata or {})
+        # Preserve identifiers in metadata when table lacks columns
+        if missing_doc:
+            meta2.setdefault("doc_id", c.doc_id)
+        if missing_chunk:
+            meta2.setdefault("chunk_index", c.chunk_index)
+        rows_min.append(
+            {
+                "source": c.source,
+                "content": c.content,
+                "metadata": meta2,
+                **({"namespace": namespace} if namespace else {}),
+                "embedding": emb,
+            }
+        )
+    try:
+        return upsert_chunks(rows_min, table=table, session=session)
+    except RuntimeError as e2:
+        # If table also lacks 'metadata', drop it and retry once more
+        if "metadata" not in str(e2).lower():
+            raise
+    rows_min2: list[dict[str, Any]] = []
+    for c, emb in zip(group, vectors, strict=False):
+        rows_min2.append(
+            {
+                "source": c.source,
+                "content": c.content,
+                **({"namespace": namespace} if namespace else {}),
+                "embedding": emb,
+            }
+        )
+    return upsert_chunks(rows_min2, table=table, session=session)
+
+
+@dataclass
+class IngestStats:
+    extracted: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    skipped: int = 0
+    saved: int = 0
+    failed: int = 0
+    tokens: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **deltas: int) -> None:
+        with self._lock:
+            for name, value in deltas.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (
+            f"{self.saved} chunks gravados, {self.unchanged} inalterados, {self.deleted} removidos, "
+            f"{self.skipped} já no checkpoint, {self.failed} com falha "
+            f"em {elapsed:.1f}s: {self.saved / elapsed:.1f} chunks/s, {self.tokens / elapsed:.0f} tokens/s"
+        )
+
+
+def _extract_streaming(
+    paths: list[Path], workers: int, **kwargs: Any
+) -> Iterator[list[PdfChunk]]:
+    """Chunks de cada PDF assim que a extração dele termina (pool de processos)"""
+    if workers <= 1 or len(paths) <= 1:
+        for p in paths:
+            yield extract_pdf_chunks(p, **kwargs)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        futures = {pool.submit(extract_pdf_chunks, p, **kwargs): p for p in paths}
+        for fut in as_completed(futures):
+            try:
+                yield fut.result()
+            except Exception as e:
+                print(f"Falha ao ler {futures[fut]}: {e}")
+
+
 def ingest_pdfs(
     paths: list[Path],
     *,
@@ -173,94 +310,114 @@ def ingest_pdfs(
     overlap_tokens: int,
     batch: int,
     table: str,
-) -> None:
-    _, _, _, tqdm = _lazy_imports()
-    all_chunks: list[PdfChunk] = []
-    for p in tqdm(paths, desc="Reading PDFs"):
-        all_chunks.extend(
-            extract_pdf_chunks(
-                p,
-                source=source,
-                namespace=namespace,
-                chunk_tokens=chunk_tokens,
-                overlap_tokens=overlap_tokens,
-            )
-        )
-
-    if not all_chunks:
-        print("No chunks extracted.")
-        return
+    workers: int = 1,
+    concurrency: int = 4,
+    max_rpm: int = 3000,
+    max_tpm: int = 1_000_000,
+    checkpoint_path: str | None = None,
+    restart: bool = False,
+) -> IngestStats:
+    """Pipeline em fluxo: extração (processos) -> embeddings concorrentes -> upsert.
+
+    Só chunks novos ou alterados (hash de conteúdo diferente do gravado) vão
+    para o embedding; chunks além do novo tamanho do documento são removidos.
+    Cada lote gravado entra no checkpoint; rodar de novo retoma de onde parou.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    if restart:
+        checkpoint.reset()
+    budget = RateBudget(max_rpm, max_tpm)
+    client = _get_openai_client()
+    session = supabase_session(pool_size=max(2, concurrency))
+    headers = _supabase_headers()
+    base_url = headers.pop("_base_url")
+    incremental = True
+    stats = IngestStats()
 
-    # Embed and upsert in batches
-    total = len(all_chunks)
-    idx = 0
-    for group in tqdm(list(batched(all_chunks, batch)), desc="Embedding + Upsert"):
+    def process(group: list[PdfChunk]) -> None:
         texts = [c.content for c in group]
-        vectors = embed_texts(texts, model=model)
-        # Default row shape (aria_chunks schema)
-        rows = []
-        for c, emb in zip(group, vectors, strict=False):
-            rows.append(
-                {
-                    "source": c.source,
-                    "doc_id": c.doc_id,
-                    "chunk_index": c.chunk_index,
-                    "content": c.content,
-                    "metadata": c.metadata,
-                    "embedding": emb,
-                }
-            )
-
-        # Try upsert; if table lacks doc_id/chunk_index (e.g., rag_chunks),
-        # fallback to a reduced schema and stash identifiers in metadata.
-        try:
-            saved = upsert_chunks(rows, table=table)
-        except RuntimeError as e:
-            msg = str(e)
-            missing_doc = "doc_id" in msg.lower()
-            missing_chunk = "chunk_index" in msg.lower()
-            if missing_doc or missing_chunk:
-                rows_min: list[dict[str, Any]] = []
-                for c, emb in zip(group, vectors, strict=False):
-                    meta2 = dict(c.metadata or {})
-                    # Preserve identifiers in metadata when table lacks columns
-                    if missing_doc:
-                        meta2.setdefault("doc_id", c.doc_id)
-                    if missing_chunk:
-                        meta2.setdefault("chunk_index", c.chunk_index)
-                    rows_min.append(
-                        {
-                            "source": c.source,
-                            "content": c.content,
-                            "metadata": meta2,
-                            **({"namespace": namespace} if namespace else {}),
-                            "embedding": emb,
-                        }
-                    )
-                try:
-                    saved = upsert_chunks(rows_min, table=table)
-                except RuntimeError as e2:
-                    # If table also lacks 'metadata', drop it and retry once more
-                    if "metadata" in str(e2).lower():
-                        rows_min2: list[dict[str, Any]] = []
-                        for c, emb in zip(group, vectors, strict=False):
-                            rows_min2.append(
-                                {
-                                    "source": c.source,
-                                    "content": c.content,
-                                    **({"namespace": namespace} if namespace else {}),
-                                    "embedding": emb,
-                                }
-                            )
-                        saved = upsert_chunks(rows_min2, table=table)
-                    else:
-                        raise
-            else:
-                raise
-        idx += len(saved) if saved else len(rows)
-        print(f"Progress: {idx}/{total} saved")
-
-    print(f"Upsert concluido: {total} chunks (source={source}, namespace={namespace or '-'})")
+        budget.acquire(sum(estimate_tokens(t) for t in texts))
+        resp = client.embeddings.create(model=model, input=texts)
+        vectors = [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+        usage = getattr(resp, "usage", None)
+        tokens = getattr(usage, "total_tokens", None) or sum(estimate_tokens(t) for t in texts)
+        saved = _save_group(
+            group, vectors, namespace=namespace, table=table, session=session, incremental=incremental
+        )
+        checkpoint.mark(chunk_key(c) for c in group)
+        stats.add(saved=len(saved) if saved else len(group), tokens=int(tokens))
+        print(f"Progress: {stats.saved}/{stats.extracted} saved")
+
+    in_flight: dict[Future, list[PdfChunk]] = {}
+
+    def settle(done: Iterable[Future]) -> None:
+        for fut in done:
+            group = in_flight.pop(fut)
+            try:
+                fut.result()
+            except Exception as e:
+                stats.add(failed=len(group))
+                print(f"Falha no lote {chunk_key(group[0])}..: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        pending: list[PdfChunk] = []
+        extracted = _extract_streaming(
+            paths,
+            workers,
+            source=source,
+            namespace=namespace,
+            chunk_tokens=chunk_tokens,
+            overlap_tokens=overlap_tokens,
+        )
+        for chunks in extracted:
+            stats.add(extracted=len(chunks))
+            if not chunks:
+                continue
+            for c in chunks:
+                c.content_hash = content_hash(c.content, model)
+            if incremental:
+                doc_id = chunks[0].doc_id
+                existing = fetch_existing_hashes(session, base_url, headers, table, source, [doc_id])
+                if existing is None:
+                    incremental = False
+                else:
+                    stored = existing.get(doc_id, {})
+                    stale = sum(1 for i in stored if i >= len(chunks))
+                    if stale:
+                        delete_stale_chunks(session, base_url, headers, table, source, doc_id, len(chunks))
+                        stats.add(deleted=stale)
+                    changed = [c for c in chunks if stored.get(c.chunk_index) != c.content_hash]
+                    stats.add(unchanged=len(chunks) - len(changed))
+                    chunks = changed
+            todo = [c for c in chunks if chunk_key(c) not in checkpoint]
+            stats.add(skipped=len(chunks) - len(todo))
+            pending.extend(todo)
+            while len(pending) >= batch:
+                group, pending = pending[:batch], pending[batch:]
+                in_flight[pool.submit(process, group)] = group
+                # backpressure: no máximo 2 lotes por worker em voo
+                if len(in_flight) >= 2 * max(1, concurrency):
+                    done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    settle(done)
+        if pending:
+            in_flight[pool.submit(process, pending)] = pending
+        settle(list(in_flight))
+    session.close()
+
+    if not stats.extracted:
+        print("No chunks extracted.")
+        return stats
+    print(f"Upsert concluido: {stats.report()} (source={source}, namespace={namespace or '-'})")
+    if budget.waited_s:
+        print(f"Espera pelo limite de taxa: {budget.waited_s:.1f}s")
+    if stats.saved or stats.deleted:
+        bump_corpus_version()
+    if not stats.failed:
+        # execução completa: o hash de conteúdo já cobre a próxima rodada
+        checkpoint.reset()
+    else:
+        raise SystemExit(f"{stats.failed} chunks falharam; rode de novo para retomar pelo checkpoint.")
+    return stats
 
 
 def parse_args() -> argparse.Namespace:
@@ -293,6 +450,26 @@ def parse_args() -> argparse.Namespace:
         default=os.getenv("ARIA_TABLE", "aria_chunks"),
         help="Target table name (can be schema-qualified, e.g. rag.aria_chunks)",
     )
+    p.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1))),
+        help="Processes for PDF extraction",
+    )
+    p.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("INGEST_CONCURRENCY", "4")),
+        help="Embedding/upsert batches in flight",
+    )
+    p.add_argument("--max-rpm", type=int, default=int(os.getenv("EMBED_MAX_RPM", "3000")))
+    p.add_argument("--max-tpm", type=int, default=int(os.getenv("EMBED_MAX_TPM", "1000000")))
+    p.add_argument(
+        "--checkpoint",
+        default=os.getenv("INGEST_CHECKPOINT", "tmp/ingest_faqs.checkpoint.jsonl"),
+        help="Checkpoint file for resumable runs (empty to disable)",
+    )
+    p.add_argument("--restart", action="store_true", help="Ignore and clear the checkpoint")
     return p.parse_args()
 
 
@@ -329,6 +506,12 @@ def main() -> None:
         overlap_tokens=max(0, args.overlap_tokens),
         batch=max(1, args.batch),
         table=args.table,
+        workers=max(1, args.workers),
+        concurrency=max(1, args.concurrency),
+        max_rpm=args.max_rpm,
+        max_tpm=args.max_tpm,
+        checkpoint_path=args.checkpoint or None,
+        restart=args.restart,
     )
 
 
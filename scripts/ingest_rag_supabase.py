@@ -7,9 +7,11 @@ para montar o contexto do RAG da ARIA.
 
 ✅ O que ele faz
 - Lê texto (arquivo único, pasta com .txt/.md, ou JSONL com registros)
-- Quebra em *chunks* determinísticos
+- Quebra em *chunks* determinísticos (tokens do tiktoken, respeitando P/R e títulos)
 - Gera embeddings com OpenAI (`text-embedding-3-small` por padrão)
-- Sobe para a tabela `aria_chunks` via REST
+- Sobe para a tabela `aria_chunks` via REST (upsert em source/doc_id/chunk_index)
+- Incremental: só gera embedding de chunks novos ou alterados (hash do
+  conteúdo) e remove os que sobraram de versões maiores do documento
 - Consulta semântica (kNN) via função RPC `match_aria_chunks` (sugerida abaixo)
 
 ⚙️ Pré‑requisitos
@@ -20,7 +22,8 @@ para montar o contexto do RAG da ARIA.
    4. Cole o bloco SQL abaixo **inteiro** e clique em **Run**.
    5. Verifique no **Table Editor** se a tabela `aria_chunks` foi criada e o índice `ivfflat` existe.
    6. (Opcional) **RLS**: mantenha **desativado** por enquanto; se ativar, o **Service Role** (chave usada pelo backend) ignora políticas, mas recomenda‑se criar políticas explícitas para outros papéis.
-   7. (Opcional) Teste rápido do RPC: depois de ingerir dados, chame a função `match_aria_chunks` via **SQL** ou **REST**.
+   7. Tabela já existente? Rode `ingestao_incremental_aria_chunks.sql` (hash + chave única).
+   8. (Opcional) Teste rápido do RPC: depois de ingerir dados, chame a função `match_aria_chunks` via **SQL** ou **REST**.
 
 ```
 create extension if not exists vector;
@@ -34,7 +37,9 @@ create table if not exists aria_chunks (
   content text,
   metadata jsonb,
   embedding vector(1536),
-  created_at timestamptz default now()
+  content_hash text,
+  created_at timestamptz default now(),
+  unique (source, doc_id, chunk_index)
 );
 create index if not exists aria_chunks_embedding_idx on aria_chunks using ivfflat (embedding vector_cosine_ops) with (lists = 100);
 
@@ -99,13 +104,22 @@ from __future__ import annotations
 import argparse
 import json
 import os
-import re
 from collections.abc import Iterable
 from dataclasses import dataclass
 from typing import Any
 
 import requests
+from chunking import Chunker
 from dotenv import load_dotenv
+from ingest_common import (
+    UPSERT_KEY,
+    UPSERT_PREFER,
+    bump_corpus_version,
+    content_hash,
+    delete_stale_chunks,
+    fetch_existing_hashes,
+    supabase_session,
+)
 
 try:
     # OpenAI SDK (>=1.0)
@@ -137,54 +151,14 @@ if not OPENAI_API_KEY:
     raise SystemExit("⚠️ Defina OPENAI_API_KEY no ambiente.")
 
 # ---------------------------
-# Chunking (determinístico e simples)
+# Chunking (chunker compartilhado: tokens do tiktoken, P/R e títulos)
 # ---------------------------
-SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
-
 
-def split_sentences(text: str) -> list[str]:
-    text = re.sub(r"\s+", " ", text.strip())
-    if not text:
-        return []
-    # split básico por pontuação
-    parts = SENTENCE_SPLIT_RE.split(text)
-    # garante que nenhuma sentença escapa vazia
-    return [p.strip() for p in parts if p.strip()]
 
-
-def chunk_text(text: str, max_tokens: int = 350, overlap_tokens: int = 50) -> list[str]:
-    """Chunking aproximado por contagem de caracteres (proxy de tokens).
-    Para uso em FAQ/documentação funciona bem e é estável.
-    """
-    approx_token_ratio = 4  # ~4 chars por token (aprox.)
-    max_chars = max_tokens * approx_token_ratio
-    overlap_chars = overlap_tokens * approx_token_ratio
-
-    sents = split_sentences(text)
-    chunks: list[str] = []
-    buf: list[str] = []
-    cur_len = 0
-
-    def flush():
-        nonlocal buf, cur_len
-        if buf:
-            chunks.append(" ".join(buf).strip())
-            # prepara overlap
-            joined = " ".join(buf)
-            tail = joined[-overlap_chars:]
-            buf = [tail] if tail else []
-            cur_len = len(tail)
-
-    for s in sents:
-        s_len = len(s)
-        if cur_len + s_len + 1 > max_chars:
-            flush()
-        buf.append(s)
-        cur_len += s_len + 1
-    if buf:
-        chunks.append(" ".join(buf).strip())
-    # drop possíveis vazios
-    return [c for c in chunks if c]
+def chunk_text(text: str, max_tokens: int = 350, overlap_tokens: int = 50, doc_id: str = "doc") -> list[str]:
+    """Textos dos chunks de um documento (ver scripts/chunking.py)"""
+    chunker = Chunker(max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+    return [c.text for c in chunker.chunk_text(text, doc_id)]
 
 
 # ---------------------------
@@ -218,12 +192,19 @@ def embed_texts(texts: list[str], model: str = EMBEDDING_MODEL) -> list[list[flo
 # ---------------------------
 
 
-def supabase_upsert_chunks(rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+def supabase_upsert_chunks(
+    rows: list[dict[str, Any]],
+    session: requests.Session | None = None,
+    on_conflict: str | None = None,
+) -> list[dict[str, Any]]:
     url = f"{SUPABASE_URL}/rest/v1/{ARIA_TABLE}"
-    r = requests.post(url, headers=HEADERS_JSON, data=json.dumps(rows))
+    headers, params = HEADERS_JSON, None
+    if on_conflict:
+        headers, params = {**HEADERS_JSON, "Prefer": UPSERT_PREFER}, {"on_conflict": on_conflict}
+    r = (session or requests).post(url, headers=headers, params=params, data=json.dumps(rows))
     if r.status_code >= 300:
         raise RuntimeError(f"Erro upsert: {r.status_code} -> {r.text}")
-    return r.json()
+    return r.json() if r.content else []
 
 
 def supabase_match(
@@ -315,25 +296,49 @@ def ingest(
     if explicit_doc_id and len(items) == 1:
         items[0].doc_id = explicit_doc_id
 
+    # Hashes já gravados de todos os documentos, numa consulta em lote
+    session = supabase_session()
+    existing = fetch_existing_hashes(
+        session, SUPABASE_URL, HEADERS_JSON, ARIA_TABLE, source, [it.doc_id for it in items]
+    )
+    incremental = existing is not None
+
+    changed_docs = 0
     for it in items:
-        chunks = chunk_text(it.content, max_tokens=max_tokens)
-        if not chunks:
+        chunks = chunk_text(it.content, max_tokens=max_tokens, doc_id=it.doc_id)
+        hashes = [content_hash(ch, EMBEDDING_MODEL) for ch in chunks]
+        todo = list(range(len(chunks)))
+        if incremental:
+            stored = existing.get(it.doc_id, {})
+            if any(idx >= len(chunks) for idx in stored):
+                delete_stale_chunks(
+                    session, SUPABASE_URL, HEADERS_JSON, ARIA_TABLE, source, it.doc_id, len(chunks)
+                )
+                changed_docs += 1
+            todo = [idx for idx in todo if stored.get(idx) != hashes[idx]]
+        if not todo:
+            print(f"= Inalterado: {it.doc_id} | chunks: {len(chunks)}")
             continue
-        vectors = embed_texts(chunks)
+        vectors = embed_texts([chunks[idx] for idx in todo])
         rows = []
-        for idx, (ch, emb) in enumerate(zip(chunks, vectors, strict=False)):
-            rows.append(
-                {
-                    "source": source,
-                    "doc_id": it.doc_id,
-                    "chunk_index": idx,
-                    "content": ch,
-                    "metadata": it.metadata,
-                    "embedding": emb,
-                }
-            )
-        saved = supabase_upsert_chunks(rows)
-        print(f"✔ Ingestado: {it.doc_id} | chunks: {len(saved)}")
+        for idx, emb in zip(todo, vectors, strict=False):
+            row = {
+                "source": source,
+                "doc_id": it.doc_id,
+                "chunk_index": idx,
+                "content": chunks[idx],
+                "metadata": it.metadata,
+                "embedding": emb,
+            }
+            if incremental:
+                row["content_hash"] = hashes[idx]
+            rows.append(row)
+        supabase_upsert_chunks(rows, session=session, on_conflict=UPSERT_KEY if incremental else None)
+        changed_docs += 1
+        print(f"✔ Ingestado: {it.doc_id} | chunks: {len(rows)} de {len(chunks)} (novos/alterados)")
+
+    if changed_docs:
+        bump_corpus_version()
 
 
 # ---------------------------
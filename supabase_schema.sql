@@ -34,9 +34,13 @@ CREATE TABLE IF NOT EXISTS aria_sessions (
     channel VARCHAR(50) DEFAULT 'web',
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    metadata JSONB DEFAULT '{}'
+    metadata JSONB DEFAULT '{}',
+    assistant_thread_id TEXT          -- thread do OpenAI Assistant (thread_store.py)
 );
 
+-- Bancos criados antes da coluna assistant_thread_id
+ALTER TABLE aria_sessions ADD COLUMN IF NOT EXISTS assistant_thread_id TEXT;
+
 -- Índice para buscar sessões por usuário
 CREATE INDEX IF NOT EXISTS aria_sessions_user_id_idx 
 ON aria_sessions(user_id);
@@ -63,6 +67,13 @@ ON aria_messages(session_id);
 CREATE INDEX IF NOT EXISTS aria_messages_created_at_idx 
 ON aria_messages(created_at);
 
+-- Versão do corpus do RAG (gravada pelos scripts de ingestão; invalida o cache da API)
+CREATE TABLE IF NOT EXISTS aria_corpus_meta (
+    key VARCHAR(100) PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- Função para atualizar updated_at automaticamente
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -88,6 +99,7 @@ CREATE TRIGGER update_aria_chunks_updated_at
 ALTER TABLE aria_chunks ENABLE ROW LEVEL SECURITY;
 ALTER TABLE aria_sessions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE aria_messages ENABLE ROW LEVEL SECURITY;
+ALTER TABLE aria_corpus_meta ENABLE ROW LEVEL SECURITY;
 
 -- Política para permitir acesso com service_role
 CREATE POLICY "Service role has full access to aria_chunks"
@@ -105,6 +117,11 @@ CREATE POLICY "Service role has full access to aria_messages"
     USING (true)
     WITH CHECK (true);
 
+CREATE POLICY "Service role has full access to aria_corpus_meta"
+    ON aria_corpus_meta FOR ALL
+    USING (true)
+    WITH CHECK (true);
+
 -- ============================================================
 -- Dados de teste (opcional - pode comentar se não quiser)
 -- ============================================================
@@ -37,9 +37,13 @@ CREATE TABLE IF NOT EXISTS aria_sessions (
     channel VARCHAR(50) DEFAULT 'web',
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    metadata JSONB DEFAULT '{}'
+    metadata JSONB DEFAULT '{}',
+    assistant_thread_id TEXT          -- thread do OpenAI Assistant (thread_store.py)
 );
 
+-- Bancos criados antes da coluna assistant_thread_id
+ALTER TABLE aria_sessions ADD COLUMN IF NOT EXISTS assistant_thread_id TEXT;
+
 CREATE INDEX IF NOT EXISTS aria_sessions_user_id_idx ON aria_sessions(user_id);
 CREATE INDEX IF NOT EXISTS aria_sessions_channel_idx ON aria_sessions(channel);
 
@@ -1,6 +1,8 @@
 import os
+from unittest.mock import MagicMock, patch
+
 import pytest
-from unittest.mock import patch, MagicMock
+
 
 # Mock das variáveis de ambiente para testes
 @pytest.fixture(autouse=True)
@@ -48,4 +50,74 @@ def mock_requests():
         mock_post.return_value.json.return_value = {'status': 'ok'}
         mock_get.return_value.status_code = 200
         mock_get.return_value.json.return_value = {'status': 'ok'}
-        yield mock_post, mock_get
\ No newline at end of file
+        yield mock_post, mock_get
+
+class FakeAssistantStream:
+    """Imita o AsyncStream de eventos de um run do Assistants API"""
+
+    def __init__(self, events, delay: float = 0.0):
+        self._events = list(events)
+        self._delay = delay
+        self.closed = False
+
+    def __aiter__(self):
+        return self._gen()
+
+    async def _gen(self):
+        import asyncio
+
+        for ev in self._events:
+            if self._delay:
+                await asyncio.sleep(self._delay)
+            yield ev
+
+    async def close(self):
+        self.closed = True
+
+
+def assistant_stream_events(text: str, run_id: str = 'test-run-id') -> list:
+    """Sequência mínima de eventos: run criado, deltas, mensagem e run concluídos"""
+    def _text_block(value: str) -> MagicMock:
+        block = MagicMock(type='text')
+        block.text.value = value
+        return block
+
+    created = MagicMock(event='thread.run.created')
+    created.data.id = run_id
+    deltas = []
+    for word in text.split(' '):
+        ev = MagicMock(event='thread.message.delta')
+        ev.data.delta.content = [_text_block(word + ' ')]
+        deltas.append(ev)
+    completed = MagicMock(event='thread.message.completed')
+    completed.data.content = [_text_block(text)]
+    run_completed = MagicMock(event='thread.run.completed')
+    return [created, *deltas, completed, run_completed]
+
+
+# Mock do AsyncOpenAI client (pipeline assíncrono do /assist/routing)
+@pytest.fixture
+def mock_async_openai_client():
+    from unittest.mock import AsyncMock
+
+    async def _runs_create(*, thread_id, assistant_id, stream=False, **_):
+        if stream:
+            return FakeAssistantStream(assistant_stream_events('Resposta do assistente'))
+        return MagicMock(id='test-run-id')
+
+    from thread_store import MemoryThreadBackend, ThreadStore
+
+    with patch('main.client_assistant_async') as mock_client, \
+         patch('main.ASSISTANT_ID', 'test-assistant-id'), \
+         patch('main._thread_store', ThreadStore(MemoryThreadBackend())):
+        mock_client.beta.threads.create = AsyncMock(return_value=MagicMock(id='test-thread-id'))
+        mock_client.beta.threads.messages.create = AsyncMock(return_value=MagicMock())
+        mock_client.beta.threads.runs.create = AsyncMock(side_effect=_runs_create)
+        mock_client.beta.threads.runs.cancel = AsyncMock(return_value=MagicMock())
+        mock_client.beta.threads.runs.retrieve = AsyncMock(
+            return_value=MagicMock(status='completed')
+        )
+        reply = MagicMock(role='assistant', run_id='test-run-id')
+        reply.content[0].text.value = 'Resposta do assistente'
+        mock_client.beta.threads.messages.list = AsyncMock(return_value=MagicMock(data=[reply]))
+        yield mock_client
@@ -0,0 +1,253 @@
+"""
+Testes do pipeline assíncrono do /assist/routing
+"""
+import asyncio
+import inspect
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from conftest import FakeAssistantStream, assistant_stream_events
+from fastapi.testclient import TestClient
+
+import main
+from thread_store import MemoryThreadBackend, ThreadStore
+
+
+def _client_and_headers() -> tuple[TestClient, dict[str, str]]:
+    return TestClient(main.app), {"Authorization": "Bearer test-token"}
+
+
+def test_routing_handlers_are_async():
+    """Handlers de routing não devem ocupar o threadpool"""
+    assert inspect.iscoroutinefunction(main.assist_routing)
+    assert inspect.iscoroutinefunction(main.webhook_assist_routing)
+    assert inspect.iscoroutinefunction(main.agno_webhook_routing)
+
+
+def test_routing_uses_async_assistant(mock_async_openai_client):
+    """Resposta vem do Assistant via AsyncOpenAI, mantendo o contrato AssistResponse"""
+    client, headers = _client_and_headers()
+    with patch("main.API_TOKEN", "test-token"), patch("main.RAG_ENABLE", False):
+        resp = client.post(
+            "/assist/routing",
+            json={"user_text": "Quero enviar 1500 mensagens", "thread_id": "thr_abc"},
+            headers=headers,
+        )
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["reply_text"] == "Resposta do assistente"
+    assert data["route"] == "envio"
+    assert data["thread_id"] == "thr_abc"
+    assert data["variables"]["assistant_thread_id"] == "test-thread-id"
+    mock_async_openai_client.beta.threads.runs.create.assert_awaited_once()
+
+
+def test_poll_mode_still_supported(mock_async_openai_client):
+    """ASSISTANT_RUN_MODE=poll mantém o fluxo runs.retrieve + messages.list"""
+    with patch("main.ASSISTANT_RUN_MODE", "poll"):
+        reply, th_id = asyncio.run(main._assistant_reply_async("oi", None, "thread_x"))
+    assert reply == "Resposta do assistente"
+    assert th_id == "thread_x"
+    mock_async_openai_client.beta.threads.runs.retrieve.assert_awaited()
+    mock_async_openai_client.beta.threads.messages.list.assert_awaited()
+
+
+def test_stream_mode_returns_on_message_completed(mock_async_openai_client):
+    """Modo streaming usa o texto do message.completed, sem polling nem messages.list"""
+    timings: dict[str, int] = {}
+    with patch("main.ASSISTANT_RUN_MODE", "stream"):
+        reply, _ = asyncio.run(main._assistant_reply_async("oi", None, None, timings))
+    assert reply == "Resposta do assistente"
+    assert {"create_thread_ms", "post_message_ms", "first_token_ms", "completion_ms"} <= set(timings)
+    mock_async_openai_client.beta.threads.runs.retrieve.assert_not_awaited()
+    mock_async_openai_client.beta.threads.messages.list.assert_not_awaited()
+
+
+def test_stream_timeout_cancels_run(mock_async_openai_client):
+    """Em timeout o run é cancelado no servidor e a resposta fica vazia"""
+    slow = FakeAssistantStream(assistant_stream_events("resposta lenta demais"), delay=0.05)
+
+    async def _slow_create(**_):
+        return slow
+
+    mock_async_openai_client.beta.threads.runs.create.side_effect = _slow_create
+    reply = asyncio.run(main.stream_run_async("thread_x", timeout_seconds=0.08))
+    assert reply == ""
+    assert slow.closed
+    mock_async_openai_client.beta.threads.runs.cancel.assert_awaited_once_with(
+        thread_id="thread_x", run_id="test-run-id"
+    )
+
+
+def test_stream_timeout_before_run_created_cancels_latest_run(mock_async_openai_client):
+    """Timeout antes de thread.run.created: o run é localizado por runs.list e cancelado"""
+    slow = FakeAssistantStream(assistant_stream_events("oi"), delay=0.2)
+
+    async def _slow_create(**_):
+        return slow
+
+    threads = mock_async_openai_client.beta.threads
+    threads.runs.create.side_effect = _slow_create
+    threads.runs.list = AsyncMock(return_value=MagicMock(data=[MagicMock(id="run_x", status="queued")]))
+    assert asyncio.run(main.stream_run_async("thread_x", timeout_seconds=0.05)) == ""
+    threads.runs.cancel.assert_awaited_once_with(thread_id="thread_x", run_id="run_x")
+
+
+def test_thread_lock_held_until_run_completes(mock_async_openai_client):
+    """O stream é lido até thread.run.completed com o lock da thread ainda ativo"""
+    store = ThreadStore(MemoryThreadBackend())
+    held = []
+
+    class _Probe(FakeAssistantStream):
+        async def _gen(self):
+            async for ev in super()._gen():
+                if ev.event == "thread.run.completed":
+                    held.append(store.lock("app").locked())
+                yield ev
+
+    async def _create(**_):
+        return _Probe(assistant_stream_events("Resposta do assistente"))
+
+    mock_async_openai_client.beta.threads.runs.create.side_effect = _create
+    with patch("main.RAG_ENABLE", False), patch("main._thread_store", store), \
+         patch("main.ASSISTANT_RUN_MODE", "stream"):
+        result = asyncio.run(main.run_routing({"message": "oi", "thread_id": "app"}))
+    assert result.reply_text == "Resposta do assistente"
+    assert held == [True]
+    assert not store.lock("app").locked()
+
+
+def test_rag_context_fetched_async():
+    """fetch_rag_bundle_async usa o cliente HTTP assíncrono no backend remoto"""
+
+    async def fake_fetch(question, k=5, **_):
+        return f"[1] contexto para {question}"
+
+    with patch("main.RAG_BACKEND", "http"), patch("main.fetch_rag_context_async", fake_fetch):
+        ctx, refs = asyncio.run(main.fetch_rag_bundle_async("como funciona", k=3))
+    assert ctx == "[1] contexto para como funciona"
+    assert refs == []
+
+
+def test_rag_bundle_in_process_by_default():
+    """Backend rpc não faz chamada HTTP ao próprio /rag/query"""
+    rows = [{"content": "Somos a AR Online", "metadata": {}, "similarity": 0.9}]
+
+    async def fake_embed(q):
+        return [0.1, 0.2]
+
+    async def fake_rpc(vec, k, filter_source):
+        assert filter_source == main.RAG_DEFAULT_SOURCE
+        return rows
+
+    with patch("main.RAG_BACKEND", "rpc"), \
+         patch("main._rag_cache", None), patch("main.RAG_CACHE_ENABLE", False), \
+         patch("main._embed_async", fake_embed), \
+         patch("main._rpc_match_async", fake_rpc), \
+         patch("main.fetch_rag_context_async") as remote:
+        ctx, refs = asyncio.run(main.fetch_rag_bundle_async("o que é a AR Online", k=3))
+    assert ctx == "[1] Somos a AR Online"
+    assert refs == []
+    remote.assert_not_called()
+
+
+def test_whatsapp_message_routed_in_process(mock_async_openai_client):
+    """process_aria_message chama o núcleo de routing sem TestClient/HTTP"""
+    with patch("main.RAG_ENABLE", False), \
+         patch("fastapi.testclient.TestClient", side_effect=AssertionError("TestClient")):
+        data = asyncio.run(
+            main.process_aria_message({"from": "5511999999999", "message": "Oi, tudo bem?"})
+        )
+    assert data["reply_text"] == "Resposta do assistente"
+    assert data["thread_id"].startswith("thrd_")
+
+
+def test_mindchat_route_keeps_chat_action():
+    """next_action do routing (ex.: "envio") não troca o fluxo de chat do WhatsApp"""
+    routed = main.AssistResponse(reply_text="ok", next_action="envio", confidence=0.9)
+    msg = main.WhatsAppMessage("w1", "5511999999999", "1", "Quero 50 envios", "text")
+    with patch("main.run_routing", return_value=routed):
+        result = asyncio.run(main.route_mindchat_message(msg))
+    assert result["status"] == "success" and result["action"] == "chat"
+    assert result["routing"]["next_action"] == "envio"
+
+
+def test_agent_run_routes_without_loopback(mock_async_openai_client):
+    """agent_run não faz requests.post para localhost"""
+    client = TestClient(main.app)
+    with patch("main.RAG_ENABLE", False), \
+         patch("requests.post", side_effect=AssertionError("loopback")):
+        resp = client.post("/agents/aria-sdr/runs", json={"message": "Quero 50 envios"})
+    assert resp.status_code == 200
+    assert "Resposta do assistente" in resp.text
+    assert "workflow_completed" in resp.text
+
+
+def test_run_routing_reads_thread_header_case_insensitively(mock_async_openai_client):
+    with patch("main.RAG_ENABLE", False):
+        resp = asyncio.run(main.run_routing({"user_text": "oi"}, {"X-Thread-Id": "thr_hdr"}))
+    assert resp.thread_id == "thr_hdr"
+
+
+def _sse_events(text: str) -> list[dict]:
+    import json
+
+    return [
+        json.loads(line[len("data: "):])
+        for line in text.splitlines()
+        if line.startswith("data: ")
+    ]
+
+
+def test_agent_run_streams_tokens_as_they_arrive(mock_async_openai_client):
+    """run_response chega em deltas, com a rota antes do primeiro token"""
+    client = TestClient(main.app)
+    with patch("main.RAG_ENABLE", False):
+        resp = client.post("/agents/aria-sdr/runs", json={"message": "Quero enviar 1500 mensagens"})
+    events = _sse_events(resp.text)
+    kinds = [e.get("event") for e in events]
+    assert kinds[0] == "workflow_started"
+    assert kinds[1] == "route_decided" and events[1]["route"] == "envio"
+    deltas = [e["content"] for e in events if e.get("event") == "run_response"]
+    assert deltas == ["Resposta ", "do ", "assistente "]
+    assert events[-1]["event"] == "workflow_completed"
+    assert events[-1]["content"] == "Resposta do assistente"
+
+
+def test_agent_run_sends_heartbeats_while_waiting(mock_async_openai_client):
+    async def slow_runs_create(*, thread_id, assistant_id, stream=False, **_):
+        return FakeAssistantStream(assistant_stream_events("ok"), delay=0.05)
+
+    mock_async_openai_client.beta.threads.runs.create.side_effect = slow_runs_create
+    client = TestClient(main.app)
+    with patch("main.RAG_ENABLE", False), patch("main.SSE_HEARTBEAT_SECONDS", 0.01):
+        resp = client.post("/agents/aria-sdr/runs", json={"message": "oi"})
+    assert ": heartbeat" in resp.text
+    assert _sse_events(resp.text)[-1]["content"] == "ok"
+
+
+def test_chat_reply_streams_deltas():
+    """Chat Completions com stream=True repassa cada trecho ao callback"""
+    from unittest.mock import AsyncMock, MagicMock
+
+    def chunk(text):
+        c = MagicMock()
+        c.choices = [MagicMock()]
+        c.choices[0].delta.content = text
+        return c
+
+    async def fake_stream():
+        for piece in ("Olá", ", tudo", " certo"):
+            yield chunk(piece)
+
+    fake = MagicMock()
+    fake.chat.completions.create = AsyncMock(return_value=fake_stream())
+    received: list[str] = []
+
+    async def on_delta(piece):
+        received.append(piece)
+
+    with patch("main.OPENAI_API_KEY", "sk-test"), patch("main.get_openai_async_client", return_value=fake):
+        text = asyncio.run(main._chat_reply_async("oi", "ctx", on_delta))
+    assert text == "Olá, tudo certo"
+    assert received == ["Olá", ", tudo", " certo"]
+    assert fake.chat.completions.create.await_args.kwargs["stream"] is True
@@ -0,0 +1,65 @@
+"""
+Testes do benchmark offline de recuperação (scripts/benchmark_rag.py)
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+
+CHUNKS = [
+    {"id": "a", "text": "O Carimbo do Tempo ICP-Brasil garante a validade jurídica da notificação."},
+    {"id": "b", "text": "O AR-WhatsApp envia mensagens com dossiê probatório e confirmação de leitura."},
+    {"id": "c", "text": "Créditos podem ser comprados na Loja da AR Online com cartão ou boleto."},
+    {"id": "d", "text": "O time comercial atende volumes altos com plano personalizado e contrato."},
+] * 2  # min_df=2 do índice léxico
+CASES = [
+    {"question": "Qual a validade jurídica do carimbo do tempo?", "ideal": "Carimbo do Tempo garante validade jurídica", "set": "s1"},
+    {"question": "Como comprar créditos na Loja?", "ideal": "Créditos comprados na Loja com cartão ou boleto", "set": "s2"},
+    {"question": "contato@empresa.com", "ideal": "Quantos envios você pretende realizar?", "set": "s2"},
+]
+
+
+@pytest.fixture
+def bench(monkeypatch):
+    monkeypatch.syspath_prepend(str(SCRIPTS))
+    import benchmark_rag
+
+    return benchmark_rag
+
+
+def test_hashing_embedder_is_deterministic(bench):
+    emb = bench.HashingEmbedder(dim=64)
+    a = emb.embed(["validade jurídica", "outro texto"])
+    assert a.shape == (2, 64) and a.dtype == np.float32
+    np.testing.assert_array_equal(a, bench.HashingEmbedder(dim=64).embed(["validade jurídica", "outro texto"]))
+    assert np.linalg.norm(a[0]) == pytest.approx(1.0)
+
+
+def test_run_benchmark_reports_every_backend(bench):
+    report = bench.run_benchmark(CHUNKS, CASES, bench.HashingEmbedder(128), k=2, rrf_ks=[20, 60], repeat=2)
+    assert report["evaluated"] == 2  # o caso sem chunk relevante fica de fora
+    assert set(report["backends"]) == {
+        "rpc", "local-float16", "local-int8", "pg(rrf_k=20)", "pg(rrf_k=60)", "reflector", "tfidf"
+    }
+    for metrics in report["backends"].values():
+        assert {"recall@2", "hit@2", "mrr", "p50_ms", "p95_ms", "p99_ms", "peak_memory_mb"} <= set(metrics)
+        assert 0.0 <= metrics["recall@2"] <= 1.0
+    assert report["backends"]["tfidf"]["recall@2"] == 1.0
+    # cosseno exato idêntico entre o RPC simulado e o motor do reflector
+    assert report["backends"]["rpc"]["mrr"] == report["backends"]["reflector"]["mrr"]
+
+
+def test_backend_filter(bench):
+    report = bench.run_benchmark(CHUNKS, CASES, bench.HashingEmbedder(32), k=1, only=["tfidf", "pg"])
+    assert set(report["backends"]) == {"tfidf", "pg(rrf_k=60)"}
+
+
+def test_recorded_embedder_roundtrip(bench, tmp_path):
+    path = tmp_path / "emb.npz"
+    np.savez(path, texts=np.array(["x", "y"]), vectors=np.eye(2, dtype=np.float32))
+    emb = bench.RecordedEmbedder(str(path))
+    np.testing.assert_array_equal(emb.embed(["y", "x"]), [[0, 1], [1, 0]])
+    with pytest.raises(SystemExit):
+        emb.embed(["z"])
@@ -0,0 +1,112 @@
+"""
+Testes do chunker compartilhado da ingestão (scripts/chunking.py)
+"""
+from pathlib import Path
+
+import pytest
+
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+STORE = Path(__file__).resolve().parent.parent / "docs" / "aria_vector_store"
+
+FAQ = """Perguntas Frequentes
+
+Sobre a AR Online
+P: O que é a AR Online? R: Uma empresa de notificação digital
+com validade jurídica.
+P: Como funciona o Carimbo do Tempo? R: Ele associa data e hora
+a um documento eletrônico.
+
+Canais
+Oferecemos AR-Email, AR-SMS e AR-WhatsApp. Todos com dossiê probatório.
+"""
+
+
+@pytest.fixture
+def chunking(monkeypatch):
+    monkeypatch.syspath_prepend(str(SCRIPTS))
+    import chunking
+
+    return chunking
+
+
+class TestBlocks:
+    def test_questions_headings_and_text(self, chunking):
+        blocks = list(chunking.iter_blocks(FAQ.splitlines()))
+        assert [k for k, _ in blocks] == ["heading", "heading", "qa", "qa", "heading", "text"]
+        assert blocks[2][1] == "P: O que é a AR Online? R: Uma empresa de notificação digital com validade jurídica."
+
+    def test_short_line_continuing_sentence_is_not_heading(self, chunking):
+        blocks = list(chunking.iter_blocks(["Contexto geral.", "A", "missão para 2025 é crescer."]))
+        assert blocks == [("text", "Contexto geral. A missão para 2025 é crescer.")]
+
+
+class TestChunker:
+    def test_qa_pairs_are_never_merged(self, chunking):
+        chunks = chunking.Chunker(max_tokens=200, encoding=None).chunk_text(FAQ, doc_id="faq")
+        qa = [c for c in chunks if c.kind == "qa"]
+        assert len(qa) == 2
+        assert all(c.text.count("P:") == 1 for c in qa)
+        # título curto entra no chunk do par seguinte, sem virar chunk próprio
+        assert qa[0].text.startswith("Perguntas Frequentes Sobre a AR Online P:")
+        assert qa[0].heading == "Sobre a AR Online"
+        assert chunks[-1].text.startswith("Canais Oferecemos")
+
+    def test_token_budget_and_overlap(self, chunking):
+        sentence = "A plataforma registra a entrega com carimbo do tempo. "
+        text = "\n".join(sentence * 3 for _ in range(20))
+        chunker = chunking.Chunker(max_tokens=64, overlap_tokens=16, encoding=None)
+        chunks = chunker.chunk_text(text, doc_id="d")
+        assert len(chunks) > 1
+        assert all(c.tokens <= 64 for c in chunks)
+        assert all(c.tokens == chunker.count(c.text) for c in chunks)
+        # a última frase de um chunk abre o seguinte
+        assert chunks[1].text.startswith(chunks[0].text.split(". ")[-1].rstrip("."))
+
+    def test_deterministic_ids_per_page(self, chunking):
+        chunker = chunking.Chunker(max_tokens=200, encoding=None)
+        pages = [(1, FAQ), (2, "Outro assunto.\n\nMais texto aqui.")]
+        first = list(chunker.chunk_pages(pages, doc_id="faq.pdf"))
+        again = list(chunker.chunk_pages(iter(pages), doc_id="faq.pdf"))
+        assert [c.id for c in first] == [c.id for c in again]
+        assert [c.chunk_index for c in first] == list(range(len(first)))
+        assert first[-1].id == "faq.pdf|p2|c1" and first[-1].page == 2
+        assert len({c.id for c in first}) == len(first)
+
+    def test_streams_lines(self, chunking):
+        consumed = []
+
+        def lines():
+            for i in range(10_000):
+                consumed.append(i)
+                yield f"Parágrafo {i} com algumas palavras para contar tokens."
+                yield ""
+
+        chunker = chunking.Chunker(max_tokens=100, encoding=None)
+        first = next(iter(chunker.chunk_lines(lines(), "big")))
+        assert first.tokens <= 100
+        assert len(consumed) < 1000
+
+    def test_form_feed_splits_pages(self, chunking):
+        chunks = chunking.Chunker(encoding=None).chunk_text("Página um.\fPágina dois.", doc_id="d")
+        assert [(c.page, c.text) for c in chunks] == [(1, "Página um."), (2, "Página dois.")]
+
+
+class TestBenchmark:
+    def test_answer_coverage(self, chunking):
+        assert chunking.answer_coverage("Validade jurídica garantida", "a VALIDADE juridica") == pytest.approx(2 / 3)
+        assert chunking.answer_coverage("", "x") == 0.0
+
+    def test_load_eval_cases(self, chunking):
+        cases = chunking.load_eval_cases([str(STORE / "aria_evaluation_v2.jsonl")] * 2)
+        assert cases and len({c["question"] for c in cases}) == len(cases)
+        assert all(c["ideal"] for c in cases)
+
+    def test_benchmark_over_shipped_pdfs(self, chunking):
+        pytest.importorskip("PyPDF2")
+        report = chunking.benchmark(
+            str(STORE), [str(STORE / "aria_evaluation_v3.jsonl")], max_tokens=200, encoding=None
+        )
+        shared = report["variants"]["compartilhado"]
+        assert shared["chunks"] > 0 and shared["over_budget"] == 0
+        assert {"chunks.jsonl", "palavras (antigo)", "caracteres (antigo)"} <= set(report["variants"])
+        assert "hit_rate@5" in shared
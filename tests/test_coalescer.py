@@ -0,0 +1,187 @@
+"""
+Testes do agrupamento de mensagens por remetente (coalescer.py)
+"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+from fastapi.testclient import TestClient
+
+import main
+from coalescer import MessageCoalescer
+from dedup import MessageDeduplicator
+from webhook_queue import MemorySpool, WebhookQueue
+
+
+def _recorder(batches):
+    async def flush(key, items):
+        batches.append((key, list(items)))
+        return len(items)
+
+    return flush
+
+
+def test_burst_from_one_sender_becomes_one_batch():
+    batches = []
+    coalescer = MessageCoalescer(_recorder(batches), window_s=0.05)
+
+    async def scenario():
+        futs = []
+        for text in ("oi", "tudo bem?", "quero enviar 2000 emails"):
+            futs.append(coalescer.add("551", text))
+            await asyncio.sleep(0.01)
+        futs.append(coalescer.add("552", "olá"))
+        return await asyncio.gather(*futs)
+
+    results = asyncio.run(scenario())
+    assert sorted(batches) == [("551", ["oi", "tudo bem?", "quero enviar 2000 emails"]), ("552", ["olá"])]
+    assert results == [3, 3, 3, 1]
+    stats = coalescer.stats()
+    assert (stats["messages"], stats["batches"], stats["calls_saved"]) == (4, 2, 2)
+    assert stats["flush_reasons"]["window"] == 2
+
+
+def test_flush_on_max_messages_and_chars():
+    batches = []
+    coalescer = MessageCoalescer(_recorder(batches), window_s=10, max_messages=2, max_chars=10)
+
+    async def scenario():
+        await asyncio.wait_for(asyncio.gather(coalescer.add("a", 1), coalescer.add("a", 2)), timeout=1)
+        await asyncio.wait_for(coalescer.add("b", "x" * 20, size=20), timeout=1)
+
+    asyncio.run(scenario())
+    assert batches == [("a", [1, 2]), ("b", ["x" * 20])]
+    assert coalescer.stats()["flush_reasons"]["size"] == 2
+
+
+def test_max_wait_caps_a_steady_stream():
+    batches = []
+    coalescer = MessageCoalescer(_recorder(batches), window_s=0.05, max_wait_s=0.12, max_messages=100)
+
+    async def scenario():
+        for i in range(10):
+            coalescer.add("a", i)
+            await asyncio.sleep(0.03)
+        await coalescer.close()
+
+    asyncio.run(scenario())
+    assert len(batches) >= 2
+    assert [i for _, items in batches for i in items] == list(range(10))
+    assert coalescer.stats()["flush_reasons"]["max_wait"] >= 1
+
+
+def test_bounded_buffers_flush_oldest():
+    batches = []
+    coalescer = MessageCoalescer(_recorder(batches), window_s=10, max_buffers=2)
+
+    async def scenario():
+        first = coalescer.add("a", 1)
+        coalescer.add("b", 2)
+        coalescer.add("c", 3)
+        await asyncio.wait_for(first, timeout=1)
+        assert coalescer.stats()["buffered_senders"] == 2
+        await coalescer.close()
+
+    asyncio.run(scenario())
+    assert batches[0] == ("a", [1])
+    assert {k for k, _ in batches} == {"a", "b", "c"}
+
+
+def test_errors_reach_every_message():
+    async def failing(key, items):
+        raise RuntimeError("llm offline")
+
+    coalescer = MessageCoalescer(failing, window_s=0.01)
+
+    async def scenario():
+        return await asyncio.gather(coalescer.add("a", 1), coalescer.add("a", 2), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert coalescer.stats()["errors"] == 1
+
+
+def test_merge_keeps_last_id_and_joins_text():
+    msgs = [
+        main.WhatsAppMessage("w1", "551", "1", "oi", "text", contact_name="Ana"),
+        main.WhatsAppMessage("w2", "551", "2", "", "image"),
+        main.WhatsAppMessage("w3", "551", "3", "quero enviar 2000 emails", "text"),
+    ]
+    merged = main.merge_whatsapp_messages(msgs)
+    assert (merged.message_id, merged.text, merged.contact_name) == ("w3", "oi\nquero enviar 2000 emails", "Ana")
+    assert main.merge_whatsapp_messages(msgs[:1]) is msgs[0]
+
+
+def test_queue_keeps_spool_until_batch_is_answered(monkeypatch):
+    """Rajada no webhook: uma resposta só, spool limpo só depois dela"""
+    monkeypatch.setattr(main, "MINDCHAT_WEBHOOK_SECRET", "")
+    spool = MemorySpool()
+    queue = WebhookQueue(main._process_queued_mindchat_message, workers=2, spool=spool)
+    coalescer = MessageCoalescer(main._handle_coalesced_mindchat, window_s=0.2)
+    dedup = MessageDeduplicator()
+    monkeypatch.setattr(main, "_webhook_queue", queue)
+    monkeypatch.setattr(main, "get_webhook_queue", lambda: queue)
+    monkeypatch.setattr(main, "_message_coalescer", coalescer)
+    monkeypatch.setattr(main, "get_message_coalescer", lambda: coalescer)
+    monkeypatch.setattr(main, "get_webhook_dedup", lambda: dedup)
+    handled = AsyncMock(return_value={"status": "processed"})
+    with patch("main.handle_mindchat_message", handled), TestClient(main.app) as client:
+        for i, text in enumerate(("oi", "tudo bem?", "quero enviar 2000 emails")):
+            payload = {
+                "messages": [{"id": f"w{i}", "from": "551", "type": "text", "text": {"body": text}}],
+                "contacts": [{"profile": {"name": "Ana"}}],
+            }
+            assert client.post("/webhook/mindchat/whatsapp", json=payload).status_code == 200
+        assert len(spool) == 3
+    assert handled.await_count == 1
+    assert handled.await_args.args[0].text == "oi\ntudo bem?\nquero enviar 2000 emails"
+    assert len(spool) == 0 and queue.processed == 3 and queue.deferred == 3
+
+
+def test_batches_from_same_sender_run_in_order():
+    """Lote enviado por tamanho termina antes do lote seguinte do mesmo remetente"""
+    events = []
+
+    async def flush(key, items):
+        events.append(("start", key, list(items)))
+        await asyncio.sleep(0.05 if items == [1, 2] else 0)
+        events.append(("end", key, list(items)))
+
+    coalescer = MessageCoalescer(flush, window_s=0.01, max_messages=2)
+
+    async def scenario():
+        futs = [coalescer.add("a", 1), coalescer.add("a", 2), coalescer.add("a", 3), coalescer.add("b", 9)]
+        await asyncio.gather(*futs)
+
+    asyncio.run(scenario())
+    mine = [e for e in events if e[1] == "a"]
+    assert mine == [("start", "a", [1, 2]), ("end", "a", [1, 2]), ("start", "a", [3]), ("end", "a", [3])]
+    # outro remetente não espera
+    assert events.index(("start", "b", [9])) < events.index(("end", "a", [1, 2]))
+    assert coalescer._chains == {}
+
+
+def test_failed_batch_is_retried_by_the_queue():
+    calls = []
+
+    async def flush(key, items):
+        calls.append(list(items))
+        if len(calls) == 1:
+            raise RuntimeError("mindchat offline")
+
+    coalescer = MessageCoalescer(flush, window_s=0.01)
+
+    async def handler(item):
+        return coalescer.add(item["from"], item["n"])
+
+    async def scenario():
+        queue = WebhookQueue(handler, workers=1, max_attempts=3, retry_backoff_s=0)
+        await queue.start()
+        queue.enqueue_many([("a", {"from": "a", "n": 1}), ("a", {"from": "a", "n": 2})])
+        await asyncio.sleep(0.2)
+        await queue.stop(timeout=5)
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert calls[0] == [1, 2] and sorted(n for batch in calls[1:] for n in batch) == [1, 2]
+    assert (queue.retried, queue.failed, queue.processed) == (2, 0, 2)
+    assert len(queue.spool) == 0
@@ -0,0 +1,125 @@
+"""
+Testes da deduplicação de webhooks por message_id (dedup.py)
+"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from dedup import MessageDeduplicator, build_deduplicator_from_env
+
+
+class FakeSharedBackend:
+    """Imita a tabela aria_webhook_dedup compartilhada entre réplicas"""
+
+    def __init__(self, fail=False):
+        self.ids = set()
+        self.fail = fail
+
+    def claim(self, message_id):
+        if self.fail:
+            raise RuntimeError("supabase offline")
+        first = message_id not in self.ids
+        self.ids.add(message_id)
+        return first
+
+    def release(self, message_id):
+        self.ids.discard(message_id)
+
+
+def test_repeated_ids_are_suppressed():
+    dedup = MessageDeduplicator()
+    assert [dedup.is_duplicate(i) for i in ("a", "b", "a", "", None, "")] == [
+        False, False, True, False, False, False
+    ]
+    stats = dedup.stats()
+    assert stats["suppressed"] == 1 and stats["checked"] == 3
+
+
+def test_memory_is_bounded_and_window_is_exact():
+    dedup = MessageDeduplicator(window_s=3600, max_entries=10)
+    for i in range(100):
+        dedup.is_duplicate(f"id{i}")
+    assert dedup.stats()["entries"] <= 10
+    assert dedup.is_duplicate("id99")
+
+    clock = [1000.0]
+    with patch("dedup.time.monotonic", lambda: clock[0]):
+        dedup = MessageDeduplicator(window_s=60)
+        dedup.is_duplicate("x")
+        clock[0] += 59
+        assert dedup.is_duplicate("x")
+        clock[0] += 61
+        assert not dedup.is_duplicate("x")
+
+
+def test_shared_backend_across_replicas():
+    shared = FakeSharedBackend()
+    replica_a = MessageDeduplicator(backend=shared)
+    replica_b = MessageDeduplicator(backend=shared)
+    assert not replica_a.is_duplicate("wamid.1")
+    assert asyncio.run(replica_b.ais_duplicate("wamid.1"))
+    replica_a.forget("wamid.2")
+    assert replica_b.stats()["suppressed"] == 1
+
+
+def test_backend_failure_fails_open():
+    dedup = MessageDeduplicator(backend=FakeSharedBackend(fail=True))
+    assert not dedup.is_duplicate("a")
+    assert dedup.is_duplicate("a")  # a janela local continua valendo
+    assert dedup.stats()["backend_errors"] == 1
+
+
+def test_build_from_env(monkeypatch):
+    monkeypatch.setenv("WEBHOOK_DEDUP_BACKEND", "supabase")
+    monkeypatch.setenv("WEBHOOK_DEDUP_MAX", "500")
+    dedup = build_deduplicator_from_env()
+    assert dedup.stats()["backend"] == "SupabaseDedupBackend" and dedup.max_entries == 500
+    monkeypatch.setenv("WEBHOOK_DEDUP_BACKEND", "pg")
+    assert build_deduplicator_from_env(None).backend is None
+
+
+@pytest.fixture
+def dedup(monkeypatch):
+    dedup = MessageDeduplicator()
+    monkeypatch.setattr(main, "_webhook_dedup", dedup)
+    monkeypatch.setattr(main, "get_webhook_dedup", lambda: dedup)
+    monkeypatch.setattr(main, "_webhook_queue", None)
+    monkeypatch.setattr(main, "MINDCHAT_WEBHOOK_SECRET", "")
+    return dedup
+
+
+def test_mindchat_retry_is_not_reprocessed(dedup):
+    payload = {
+        "messages": [
+            {"id": "wamid.A", "from": "551", "type": "text", "text": {"body": "oi"}},
+            {"id": "wamid.A", "from": "551", "type": "text", "text": {"body": "oi"}},
+        ],
+        "contacts": [{"profile": {"name": "Cliente"}}],
+    }
+    handled = AsyncMock(return_value={"status": "processed"})
+    client = TestClient(main.app)
+    with patch("main.handle_mindchat_message", handled), patch("main.route_mindchat_message") as route:
+        first = client.post("/webhook/mindchat/whatsapp", json=payload).json()
+        retry = client.post("/webhook/mindchat/whatsapp", json=payload).json()
+    assert (first["processed_messages"], first["duplicates"]) == (1, 1)
+    assert (retry["processed_messages"], retry["duplicates"]) == (0, 2)
+    assert handled.await_count == 1
+    route.assert_not_called()
+    assert dedup.stats()["suppressed"] == 3
+
+
+def test_whatsapp_webhook_retry_and_failure(dedup):
+    client = TestClient(main.app)
+    headers = {"Authorization": "Bearer test-token"}
+    payload = {"from": "551", "message": "oi", "id": "msg-1"}
+    aria = AsyncMock(return_value={"reply_text": "Olá"})
+    with patch("main.API_TOKEN", "test-token"), patch("main.process_aria_message", aria), \
+            patch("main.send_whatsapp_response", AsyncMock(side_effect=[RuntimeError("down"), None])):
+        assert client.post("/whatsapp/webhook", json=payload, headers=headers).json()["status"] == "error"
+        # a falha libera o id: o reenvio é processado, o seguinte não
+        assert client.post("/whatsapp/webhook", json=payload, headers=headers).json()["status"] == "processed"
+        assert client.post("/whatsapp/webhook", json=payload, headers=headers).json()["status"] == "duplicate"
+    assert aria.await_count == 2
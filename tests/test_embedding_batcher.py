@@ -0,0 +1,86 @@
+"""
+Testes do micro-batching de embeddings
+"""
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import main
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+
+
+def _fake_embed_many(calls):
+    async def embed_many(texts):
+        calls.append(list(texts))
+        await asyncio.sleep(0)
+        return [[float(len(t)), 1.0] for t in texts]
+
+    return embed_many
+
+
+def test_concurrent_requests_share_one_call():
+    calls = []
+    batcher = EmbeddingBatcher(_fake_embed_many(calls), max_batch=64, window_ms=20)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.embed(q) for q in ["a", "bb", "ccc", "bb"]))
+
+    results = asyncio.run(scenario())
+    assert results == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0], [2.0, 1.0]]
+    assert calls == [["a", "bb", "ccc"]]
+    stats = batcher.stats()
+    assert (stats["requests"], stats["batches"], stats["calls_saved"]) == (4, 1, 3)
+    assert stats["fill_rate"] == pytest.approx(3 / 64, abs=1e-3)
+    assert "queue_delay_ms_p95" in stats
+
+
+def test_full_batch_flushes_without_waiting_for_window():
+    calls = []
+    batcher = EmbeddingBatcher(_fake_embed_many(calls), max_batch=2, window_ms=10_000)
+
+    async def scenario():
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.embed(str(i)) for i in range(4))), timeout=2
+        )
+
+    asyncio.run(scenario())
+    assert calls == [["0", "1"], ["2", "3"]]
+
+
+def test_errors_reach_every_waiter():
+    async def failing(texts):
+        raise RuntimeError("rate limit")
+
+    batcher = EmbeddingBatcher(failing, window_ms=1)
+
+    async def scenario():
+        return await asyncio.gather(batcher.embed("a"), batcher.embed("b"), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert batcher.stats()["errors"] == 1
+
+
+def test_embed_async_goes_through_batcher():
+    fake = MagicMock()
+
+    async def create(model, input):
+        resp = MagicMock()
+        resp.data = [MagicMock(index=i, embedding=[0.1 * (i + 1), 0.2]) for i in range(len(input))]
+        fake.calls.append(list(input))
+        return resp
+
+    fake.calls = []
+    fake.embeddings.create = create
+    batcher = EmbeddingBatcher(main._embed_many_async, window_ms=20)
+    with patch("main._embedding_cache", EmbeddingCache("m", 2)), patch("main.EMBEDDING_DIM", 2), \
+         patch("main._embedding_batcher", batcher), patch("main.get_openai_async_client", return_value=fake):
+        vecs = asyncio.run(_gather(main._embed_async("qual o preço?"), main._embed_async("como funciona?")))
+    assert fake.calls == [["qual o preço?", "como funciona?"]]
+    assert vecs[0] == pytest.approx([0.1, 0.2]) and vecs[1] == pytest.approx([0.2, 0.2])
+
+
+async def _gather(*aws):
+    return await asyncio.gather(*aws)
@@ -0,0 +1,64 @@
+"""
+Testes do cache de embeddings de consulta
+"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import main
+from embedding_cache import EmbeddingCache, normalize_query
+
+
+class TestEmbeddingCache:
+    """Testes do LRU float32 + tier em disco"""
+
+    def test_near_identical_questions_share_key(self):
+        cache = EmbeddingCache("text-embedding-3-small", 4)
+        assert normalize_query("  Como   FUNCIONA? ") == "como funciona"
+        assert cache.key("Como funciona?") == cache.key("como funciona")
+        assert cache.key("como funciona") != EmbeddingCache("text-embedding-3-large", 4).key(
+            "como funciona"
+        )
+
+    def test_vectors_stored_as_float32(self):
+        cache = EmbeddingCache("m", 3)
+        cache.put("qual o preço", [0.1, 0.2, 0.3])
+        vec = cache.get("Qual o preço?")
+        assert vec is not None
+        assert [round(x, 6) for x in vec] == [0.1, 0.2, 0.3]
+        assert cache.stats()["memory_bytes"] == 12
+
+    def test_wrong_dimension_not_cached(self):
+        cache = EmbeddingCache("m", 3)
+        cache.put("x", [0.1, 0.2])
+        assert cache.get("x") is None
+
+    def test_lru_eviction_and_counters(self):
+        cache = EmbeddingCache("m", 2, max_entries=2)
+        cache.put("a", [1.0, 0.0])
+        cache.put("b", [0.0, 1.0])
+        cache.put("c", [1.0, 1.0])
+        assert cache.get("a") is None
+        assert cache.get("c") == [1.0, 1.0]
+        stats = cache.stats()
+        assert stats["entries"] == 2
+        assert stats["hits"] == 1 and stats["misses"] == 1
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        path = str(tmp_path / "emb.db")
+        EmbeddingCache("m", 2, disk_path=path).put("oi", [0.5, 0.25])
+        reopened = EmbeddingCache("m", 2, disk_path=path)
+        assert reopened.get("oi") == [0.5, 0.25]
+        assert reopened.stats()["disk_hits"] == 1
+
+
+def test_embed_calls_openai_once_per_question():
+    """_embed reutiliza o cliente compartilhado e só chama a API no miss"""
+    fake = MagicMock()
+    fake.embeddings.create.return_value.data = [MagicMock(embedding=[0.1, 0.2])]
+    with patch("main._embedding_cache", EmbeddingCache("m", 2)), \
+         patch("main.EMBEDDING_DIM", 2), \
+         patch("main.get_openai_client", return_value=fake):
+        first = main._embed("Como funciona?")
+        assert main._embed("como funciona") == pytest.approx(first)
+    assert fake.embeddings.create.call_count == 1
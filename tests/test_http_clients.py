@@ -0,0 +1,113 @@
+"""
+Testes do registro de clientes HTTP compartilhados
+"""
+import asyncio
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from http_clients import HttpClientRegistry, HttpPolicy
+
+
+def _registry_with(handler, **policy) -> HttpClientRegistry:
+    registry = HttpClientRegistry({"svc": HttpPolicy(backoff_factor=0, **policy)})
+    registry._async_clients["svc"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return registry
+
+
+class TestAsyncRetryPolicy:
+    """Retry/backoff por método e status"""
+
+    def test_get_retried_on_transient_status(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503 if len(calls) == 1 else 200, json={"ok": True})
+
+        registry = _registry_with(handler)
+        resp = asyncio.run(registry.arequest("svc", "GET", "https://api.test/x"))
+        assert resp.status_code == 200
+        assert len(calls) == 2
+        stats = registry.stats()["svc"]
+        assert stats["retries"] == 1 and stats["by_status"] == {"200": 1}
+
+    def test_post_not_retried_on_status(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503)
+
+        registry = _registry_with(handler)
+        resp = asyncio.run(registry.arequest("svc", "POST", "https://api.test/send", json={}))
+        assert resp.status_code == 503
+        assert len(calls) == 1
+
+    def test_post_retried_when_connection_fails(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                raise httpx.ConnectError("refused", request=request)
+            return httpx.Response(200)
+
+        registry = _registry_with(handler)
+        resp = asyncio.run(registry.arequest("svc", "POST", "https://api.test/send"))
+        assert resp.status_code == 200
+        assert len(calls) == 2
+
+    def test_gives_up_after_retries(self):
+        def handler(request):
+            raise httpx.ConnectError("refused", request=request)
+
+        registry = _registry_with(handler, retries=1)
+        with pytest.raises(httpx.ConnectError):
+            asyncio.run(registry.arequest("svc", "GET", "https://api.test/x"))
+        assert registry.stats()["svc"]["errors"] == 1
+
+    def test_retries_override_disables_retry(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            raise httpx.ConnectError("refused", request=request)
+
+        registry = _registry_with(handler)
+        with pytest.raises(httpx.ConnectError):
+            asyncio.run(registry.arequest("svc", "POST", "https://api.test/send", retries=0))
+        assert len(calls) == 1
+
+
+def test_policy_from_env(monkeypatch):
+    monkeypatch.setenv("HTTP_MINDCHAT_TIMEOUT", "3.5")
+    monkeypatch.setenv("HTTP_MINDCHAT_POOL_SIZE", "4")
+    monkeypatch.setenv("HTTP_MINDCHAT_HTTP2", "false")
+    registry = HttpClientRegistry()
+    pol = registry.policy("mindchat")
+    assert (pol.timeout, pol.pool_size, pol.keepalive, pol.http2) == (3.5, 4, 4, False)
+    adapter = registry.session("mindchat").get_adapter("https://api.mindchat.test")
+    assert adapter._pool_maxsize == 4
+    assert "POST" not in adapter.max_retries.allowed_methods
+
+
+def test_sessions_are_shared_and_closed():
+    registry = HttpClientRegistry()
+    assert registry.session("rag") is registry.session("rag")
+    client = registry.async_client("rag")
+    assert registry.async_client("rag") is client
+    asyncio.run(registry.aclose())
+    assert client.is_closed
+
+
+def test_http_metrics_endpoint_requires_auth():
+    with patch("main.API_TOKEN", "test-token"):
+        client = TestClient(main.app)
+        assert client.get("/metrics/http").status_code == 401
+        resp = client.get("/metrics/http", headers={"Authorization": "Bearer test-token"})
+    assert resp.status_code == 200
+    assert isinstance(resp.json(), dict)
@@ -0,0 +1,68 @@
+"""
+Testes da busca híbrida com RRF no Postgres (RAG_BACKEND=pg)
+"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import hybrid_search
+from hybrid_search import HybridSearchConfig, format_results, hybrid_query, vector_literal
+
+
+def test_sql_fuses_on_ids_and_reads_content_only_for_top_k():
+    sql = hybrid_search.HYBRID_SQL_TEXT
+    assert sql.count("with ") == 1
+    assert "content_tsv @@ query" in sql and "to_tsvector" not in sql
+    fused = sql.split("fused as (")[1].split("select c.id")[0]
+    assert "content" not in fused.replace("content_tsv", "")
+    assert sql.rstrip().endswith("order by fused.score desc, c.id")
+    assert "%(emb)b" in hybrid_search.HYBRID_SQL_BINARY and "%(emb)s" not in hybrid_search.HYBRID_SQL_BINARY
+
+
+def test_embedding_is_sent_as_single_parameter():
+    pytest.importorskip("psycopg")
+    from psycopg._queries import PostgresQuery
+    from psycopg.adapt import Transformer
+
+    conn = MagicMock()
+    with patch("hybrid_search._binary_vector_ready", return_value=False):
+        sql, params = hybrid_query(
+            conn, "preço", [0.5, 0.25], k=3, config=HybridSearchConfig(candidates=20, rrf_k=60)
+        )
+    assert params["emb"] == "[0.5,0.25]"
+    assert (params["candidates"], params["rrf_k"], params["k"]) == (20, 60, 3)
+
+    query = PostgresQuery(Transformer())
+    query.convert(sql.encode(), params)
+    assert len(query.params) == 5
+    assert query.query.decode().count("$1::vector") == 2
+
+
+def test_binary_vector_when_pgvector_registered():
+    pgvector = pytest.importorskip("pgvector")
+    with patch("hybrid_search._binary_vector_ready", return_value=True):
+        sql, params = hybrid_query(MagicMock(), "q", [1.0, 2.0], k=2)
+    assert sql is hybrid_search.HYBRID_SQL_BINARY
+    assert isinstance(params["emb"], pgvector.Vector)
+
+
+def test_vector_literal_and_format_results():
+    assert vector_literal([1, 0.1]) == "[1,0.1]"
+    ctx, refs = format_results([(7, "doc-b", "B", "texto b", 0.03), (3, "doc-a", None, "texto a", 0.01)])
+    assert ctx == "[1] B\ntexto b\n---\n[2] \ntexto a\n---\n"
+    assert refs == [{"i": 1, "title": "doc-b", "uri": ""}, {"i": 2, "title": "doc-a", "uri": ""}]
+    assert format_results([]) == (None, [])
+
+
+def test_config_from_env(monkeypatch):
+    monkeypatch.setenv("RAG_PG_CANDIDATES", "80")
+    monkeypatch.setenv("RAG_RRF_K", "30")
+    cfg = HybridSearchConfig.from_env()
+    assert (cfg.candidates, cfg.rrf_k) == (80, 30)
+
+
+def test_rrf_fuse_matches_sql_formula():
+    fused = hybrid_search.rrf_fuse([["a", "b", "c"], ["c", "a"]], rrf_k=60, k=2)
+    assert [item for item, _ in fused] == ["a", "c"]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    assert hybrid_search.rrf_fuse([[], []], k=3) == []
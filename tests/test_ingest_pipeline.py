@@ -0,0 +1,230 @@
+"""
+Testes do pipeline de ingestão paralelo e retomável (scripts/ingest_faqs.py)
+"""
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+
+
+@pytest.fixture
+def ingest(monkeypatch):
+    monkeypatch.syspath_prepend(str(SCRIPTS))
+    import ingest_faqs
+
+    return ingest_faqs
+
+
+def _chunks(ingest, doc_id, n):
+    return [
+        ingest.PdfChunk(
+            source="faq",
+            doc_id=doc_id,
+            chunk_index=i,
+            content=f"{doc_id} trecho {i}",
+            metadata={"page": 1},
+            page=1,
+        )
+        for i in range(n)
+    ]
+
+
+class FakeClient:
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    def create(self, model, input):
+        with self.lock:
+            self.calls.append(list(input))
+        if self.fail_on and any(self.fail_on in t for t in input):
+            raise RuntimeError("rate limited")
+        data = [SimpleNamespace(index=i, embedding=[float(i)]) for i in range(len(input))]
+        return SimpleNamespace(data=data, usage=SimpleNamespace(total_tokens=10 * len(input)))
+
+
+@pytest.fixture
+def pipeline(ingest, monkeypatch):
+    saved = []
+    table = {}  # (doc_id, chunk_index) -> content_hash
+
+    def fake_upsert(rows, **_):
+        saved.extend(rows)
+        for row in rows:
+            table[(row["doc_id"], row["chunk_index"])] = row.get("content_hash")
+        return rows
+
+    def fake_fetch(session, base_url, headers, table_name, source, doc_ids, **_):
+        out = {}
+        for (doc_id, idx), h in table.items():
+            if doc_id in doc_ids:
+                out.setdefault(doc_id, {})[idx] = h
+        return out
+
+    def fake_delete(session, base_url, headers, table_name, source, doc_id, keep, **_):
+        for key in [k for k in table if k[0] == doc_id and k[1] >= keep]:
+            del table[key]
+
+    docs = {"a.pdf": _chunks(ingest, "a", 5), "b.pdf": _chunks(ingest, "b", 3)}
+    monkeypatch.setenv("SUPABASE_URL", "http://supabase.test")
+    monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "key")
+    monkeypatch.setattr(ingest, "extract_pdf_chunks", lambda p, **_: docs[Path(p).name])
+    monkeypatch.setattr(ingest, "upsert_chunks", fake_upsert)
+    monkeypatch.setattr(ingest, "fetch_existing_hashes", fake_fetch)
+    monkeypatch.setattr(ingest, "delete_stale_chunks", fake_delete)
+    monkeypatch.setattr(ingest, "bump_corpus_version", lambda *a, **k: "v")
+    client = FakeClient()
+    monkeypatch.setattr(ingest, "_get_openai_client", lambda: client)
+    return SimpleNamespace(
+        saved=saved, table=table, docs=docs, client=client, paths=[Path("a.pdf"), Path("b.pdf")]
+    )
+
+
+def _run(ingest, paths, checkpoint, **kwargs):
+    opts = dict(
+        source="faq",
+        namespace=None,
+        model="m",
+        chunk_tokens=100,
+        overlap_tokens=10,
+        batch=2,
+        table="aria_chunks",
+        workers=1,
+        concurrency=3,
+        checkpoint_path=str(checkpoint),
+    )
+    opts.update(kwargs)
+    return ingest.ingest_pdfs(paths, **opts)
+
+
+class TestIngestPipeline:
+    def test_embeds_in_batches_and_reports_throughput(self, ingest, pipeline, tmp_path):
+        stats = _run(ingest, pipeline.paths, tmp_path / "ck.jsonl")
+        assert stats.saved == 8 and stats.failed == 0
+        assert stats.tokens == 80
+        assert all(len(call) <= 2 for call in pipeline.client.calls)
+        assert sorted(sum(pipeline.client.calls, [])) == sorted(r["content"] for r in pipeline.saved)
+        assert "chunks/s" in stats.report() and "tokens/s" in stats.report()
+
+    def test_unchanged_rerun_makes_no_embedding_calls(self, ingest, pipeline, tmp_path):
+        checkpoint = tmp_path / "ck.jsonl"
+        _run(ingest, pipeline.paths, checkpoint)
+        assert not checkpoint.exists()  # execução completa limpa o checkpoint
+        pipeline.client.calls.clear()
+        stats = _run(ingest, pipeline.paths, checkpoint)
+        assert stats.unchanged == 8 and stats.saved == 0
+        assert pipeline.client.calls == []
+
+    def test_changed_and_shrunk_documents(self, ingest, pipeline, tmp_path):
+        _run(ingest, pipeline.paths, tmp_path / "ck.jsonl")
+        pipeline.client.calls.clear()
+        pipeline.docs["a.pdf"] = pipeline.docs["a.pdf"][:3]
+        pipeline.docs["a.pdf"][1].content = "a trecho 1 revisado"
+        stats = _run(ingest, pipeline.paths, tmp_path / "ck.jsonl")
+        assert pipeline.client.calls == [["a trecho 1 revisado"]]
+        assert stats.saved == 1 and stats.unchanged == 5 and stats.deleted == 2
+        assert sorted(k for k in pipeline.table if k[0] == "a") == [("a", 0), ("a", 1), ("a", 2)]
+
+    def test_upsert_uses_unique_key(self, ingest, pipeline, tmp_path, monkeypatch):
+        conflicts = []
+
+        def upsert(rows, table="aria_chunks", session=None, on_conflict=None):
+            conflicts.append(on_conflict)
+            assert all(len(r["content_hash"]) == 64 for r in rows)
+            return rows
+
+        monkeypatch.setattr(ingest, "upsert_chunks", upsert)
+        _run(ingest, pipeline.paths, tmp_path / "ck.jsonl")
+        assert set(conflicts) == {"source,doc_id,chunk_index"}
+
+    def test_failed_batches_are_retried_on_next_run(self, ingest, pipeline, tmp_path, monkeypatch):
+        checkpoint = tmp_path / "ck.jsonl"
+        failing = FakeClient(fail_on="b trecho")
+        monkeypatch.setattr(ingest, "_get_openai_client", lambda: failing)
+        with pytest.raises(SystemExit):
+            _run(ingest, pipeline.paths, checkpoint, batch=5)
+        assert {r["doc_id"] for r in pipeline.saved} == {"a"}
+
+        monkeypatch.setattr(ingest, "_get_openai_client", lambda: pipeline.client)
+        assert checkpoint.exists()
+
+        monkeypatch.setattr(ingest, "fetch_existing_hashes", lambda *a, **k: None)  # sem coluna de hash
+        stats = _run(ingest, pipeline.paths, checkpoint, batch=5)
+        assert stats.skipped == 5 and stats.saved == 3
+
+    def test_missing_columns_fallback(self, ingest, pipeline, tmp_path, monkeypatch):
+        calls = []
+
+        def picky_upsert(rows, table="aria_chunks", session=None, on_conflict=None):
+            calls.append(rows)
+            if "doc_id" in rows[0]:
+                raise RuntimeError("Supabase upsert error 400: column doc_id does not exist")
+            return rows
+
+        monkeypatch.setattr(ingest, "upsert_chunks", picky_upsert)
+        monkeypatch.setattr(ingest, "fetch_existing_hashes", lambda *a, **k: None)
+        stats = _run(ingest, pipeline.paths[:1], tmp_path / "ck.jsonl", batch=5)
+        assert stats.saved == 5
+        assert calls[-1][0]["metadata"]["doc_id"] == "a"
+
+
+class TestRateBudget:
+    def test_token_budget_blocks_until_refill(self, ingest):
+        from ingest_common import RateBudget
+
+        budget = RateBudget(max_rpm=6000, max_tpm=6000)  # 100 tokens/s
+        budget.acquire(6000)
+        t0 = time.perf_counter()
+        budget.acquire(10)
+        assert time.perf_counter() - t0 >= 0.05
+        assert budget.waited_s > 0
+
+    def test_within_budget_does_not_wait(self, ingest):
+        from ingest_common import RateBudget
+
+        budget = RateBudget(max_rpm=3000, max_tpm=1_000_000)
+        for _ in range(100):
+            budget.acquire(10_000)
+        assert budget.waited_s == 0
+
+
+class TestIncrementalHelpers:
+    def test_content_hash_is_stable(self, ingest):
+        from ingest_common import content_hash
+
+        assert content_hash("a  b\n c", "m") == content_hash("a b c", "m")
+        assert content_hash("a b c", "m") != content_hash("a b c", "outro")
+        assert content_hash("a b c", "m") != content_hash("a b d", "m")
+
+    def test_fetch_existing_hashes_pages_and_quotes(self, ingest):
+        from ingest_common import fetch_existing_hashes
+
+        pages = [
+            [{"doc_id": 'x,"1"', "chunk_index": 0, "content_hash": "h0"}, {"doc_id": "y", "chunk_index": 0}],
+            [{"doc_id": 'x,"1"', "chunk_index": 1, "content_hash": "h1"}],
+        ]
+        session = SimpleNamespace(calls=[])
+
+        def get(url, headers, params, timeout):
+            session.calls.append(params)
+            return SimpleNamespace(status_code=200, json=lambda: pages[len(session.calls) - 1])
+
+        session.get = get
+        out = fetch_existing_hashes(session, "http://s", {}, "aria_chunks", "faq", ['x,"1"', "y"], page_size=2)
+        assert out == {'x,"1"': {0: "h0", 1: "h1"}, "y": {0: ""}}
+        assert session.calls[0]["doc_id"] == 'in.("x,\\"1\\"","y")'
+        assert [c["offset"] for c in session.calls] == ["0", "2"]
+
+    def test_fetch_existing_hashes_without_columns(self, ingest):
+        from ingest_common import fetch_existing_hashes
+
+        session = SimpleNamespace(
+            get=lambda *a, **k: SimpleNamespace(status_code=400, text="column content_hash does not exist")
+        )
+        assert fetch_existing_hashes(session, "http://s", {}, "rag_chunks", "faq", ["a"]) is None
@@ -0,0 +1,93 @@
+"""
+Testes do índice léxico TF-IDF (RAG_BACKEND=lexical e fallback)
+"""
+import asyncio
+import os
+from unittest.mock import patch
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import main  # noqa: E402
+from lexical_index import LexicalIndex, analyze  # noqa: E402
+
+SHIPPED = os.path.join(os.path.dirname(__file__), "..", "docs", "aria_vector_store")
+
+CHUNKS = [
+    {"id": "a|p1|c1", "title": "FAQ", "page": 1, "text": "Validade jurídica com Carimbo do Tempo"},
+    {"id": "a|p1|c2", "title": "FAQ", "page": 1, "text": "Preço e planos da notificação digital"},
+    {"id": "b|p2|c1", "title": "Guia", "page": 2, "text": "Carimbo do tempo garante integridade jurídica"},
+]
+
+
+def test_analyze_strips_accents_and_adds_bigrams():
+    assert analyze("Validade Jurídica é a") == ["validade", "juridica", "validade juridica"]
+
+
+def test_build_scores_are_cosine_and_roundtrip(tmp_path):
+    index = LexicalIndex.build(CHUNKS, min_df=1, max_df=1.0)
+    hits = index.search("carimbo do tempo jurídica", k=2)
+    assert {h["id"] for h in hits} == {"a|p1|c1", "b|p2|c1"}
+    assert hits[0]["score"] >= hits[1]["score"]
+    assert 0 < hits[0]["score"] <= 1.0001
+    assert index.search("xyz inexistente") == []
+
+    index.save(str(tmp_path))
+    assert not any(name.endswith(".pkl") for name in os.listdir(tmp_path))
+    loaded = LexicalIndex.load(str(tmp_path))
+    assert isinstance(loaded.weights, np.memmap)
+    np.testing.assert_allclose(loaded.scores("preço planos"), index.scores("preço planos"), atol=1e-5)
+
+
+def test_bundle_format():
+    index = LexicalIndex.build(CHUNKS, min_df=1, max_df=1.0)
+    ctx, refs = index.bundle("preço dos planos", k=1)
+    assert ctx == "[1] FAQ (p. 1)\nPreço e planos da notificação digital\n---\n"
+    assert refs[0]["i"] == 1 and refs[0]["title"] == "FAQ"
+
+
+def test_shipped_store_loads_without_pickle():
+    if not LexicalIndex.exists(SHIPPED):
+        pytest.skip("artefatos léxicos não gerados")
+    index = LexicalIndex.load(SHIPPED)
+    assert len(index) == 72 and len(index.vocabulary) == 2230
+    assert "Carimbo do Tempo" in index.search("validade jurídica e Carimbo do Tempo", k=1)[0]["text"]
+
+
+def test_bundle_async_falls_back_to_lexical_on_slow_backend():
+    index = LexicalIndex.build(CHUNKS, min_df=1, max_df=1.0)
+
+    async def slow_rag(question, k=5, filter_source=None, **_):
+        await asyncio.sleep(5)
+
+    with patch("main.RAG_BACKEND", "rpc"), patch("main.RAG_LEXICAL_FALLBACK", True), \
+         patch("main.RAG_LEXICAL_FALLBACK_TIMEOUT", 0.05), \
+         patch("main._lexical_index", index), patch("main._lexical_index_loaded", True), \
+         patch("main.fetch_rag_context_local_async", slow_rag):
+        ctx, refs = asyncio.run(main.fetch_rag_bundle_async("qual o preço dos planos?", k=1))
+    assert ctx.startswith("[1] FAQ (p. 1)\nPreço e planos")
+    assert refs
+
+
+def test_fallback_only_when_backend_fails():
+    """Backend saudável sem resultado não é trocado pelo índice léxico"""
+    index = LexicalIndex.build(CHUNKS, min_df=1, max_df=1.0)
+    empty = main.RagResponse(hits=[], context="")
+    with patch("main.RAG_BACKEND", "rpc"), patch("main.RAG_LEXICAL_FALLBACK", True), \
+         patch("main._lexical_index", index), patch("main._lexical_index_loaded", True), \
+         patch("main._rag_cache", None), patch("main.RAG_CACHE_ENABLE", False):
+        with patch("main.rag_search", return_value=empty):
+            assert main.fetch_rag_bundle("qual o preço dos planos?", k=1) == (None, [])
+        with patch("main.rag_search", side_effect=RuntimeError("supabase offline")):
+            ctx, refs = main.fetch_rag_bundle("qual o preço dos planos?", k=1)
+    assert ctx.startswith("[1] FAQ (p. 1)\nPreço e planos") and refs
+
+
+def test_lexical_backend_needs_no_network():
+    index = LexicalIndex.build(CHUNKS, min_df=1, max_df=1.0)
+    with patch("main.RAG_BACKEND", "lexical"), patch("main._lexical_index", index), \
+         patch("main._lexical_index_loaded", True), patch("main._embed") as embed:
+        ctx, _ = main.fetch_rag_bundle("carimbo do tempo", k=1)
+    embed.assert_not_called()
+    assert "Carimbo" in ctx
@@ -0,0 +1,131 @@
+"""
+Testes do índice vetorial local (RAG_BACKEND=local)
+"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import main  # noqa: E402
+from local_index import LocalIndexManager, LocalVectorIndex  # noqa: E402
+
+
+def _records(n=40, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    vecs = rng.normal(size=(n, dim)).astype(np.float32)
+    return [
+        {
+            "id": i,
+            "content": f"chunk {i}",
+            "metadata": {"title": f"doc {i}"},
+            "source": "faq" if i % 2 == 0 else "guia",
+            "embedding": "[" + ",".join(str(float(x)) for x in vecs[i]) + "]",
+        }
+        for i in range(n)
+    ], vecs
+
+
+def test_search_matches_brute_force_cosine():
+    records, vecs = _records()
+    index = LocalVectorIndex.build(records, version="v1")
+    q = vecs[7] + 0.1
+    expected = np.argsort(-(vecs @ q) / np.linalg.norm(vecs, axis=1))[:5]
+    hits = index.search(q, k=5)
+    assert [h["id"] for h in hits] == list(expected)
+    assert hits[0]["similarity"] == pytest.approx(
+        float(vecs[expected[0]] @ q / np.linalg.norm(vecs[expected[0]]) / np.linalg.norm(q)), rel=1e-5
+    )
+    assert set(hits[0]) == {"id", "content", "metadata", "similarity"}
+
+
+def test_filter_source_and_small_k():
+    records, vecs = _records()
+    index = LocalVectorIndex.build(records)
+    hits = index.search(vecs[3], k=3, filter_source="guia")
+    assert hits[0]["id"] == 3 and all(h["id"] % 2 == 1 for h in hits)
+    assert index.search(vecs[3], k=3, filter_source="outro") == []
+    assert len(index.search(vecs[3], k=100)) == 40
+
+
+@pytest.mark.parametrize("quantize", ["float16", "int8"])
+def test_quantized_index_keeps_ranking(quantize):
+    records, vecs = _records()
+    exact = LocalVectorIndex.build(records)
+    quant = LocalVectorIndex.build(records, quantize=quantize)
+    assert quant.quantize == quantize
+    assert quant.matrix.nbytes < exact.matrix.nbytes
+    q = vecs[11]
+    assert quant.search(q, k=1)[0]["id"] == 11
+    np.testing.assert_allclose(quant.scores(q), exact.scores(q), atol=0.02)
+
+
+def test_snapshot_roundtrip_with_mmap(tmp_path):
+    records, vecs = _records()
+    path = str(tmp_path / "idx")
+    LocalVectorIndex.build(records, version="v9", quantize="int8").save(path)
+    loaded = LocalVectorIndex.load(path, mmap=True)
+    assert isinstance(loaded.matrix, np.memmap)
+    assert (loaded.version, loaded.quantize, len(loaded)) == ("v9", "int8", 40)
+    assert loaded.search(vecs[5], k=1, filter_source="guia")[0]["id"] == 5
+    assert LocalVectorIndex.snapshot_version(path) == "v9"
+
+
+def test_manager_hot_reloads_on_new_corpus_version(tmp_path):
+    records, vecs = _records()
+    version = {"v": "v1"}
+    fetch = MagicMock(return_value=records)
+    manager = LocalIndexManager(
+        snapshot_path=str(tmp_path / "idx"), fetch_rows=fetch, version=lambda: version["v"]
+    )
+    assert manager.search(vecs[2], k=1)[0]["id"] == 2
+    assert manager.reload() is False
+    assert fetch.call_count == 1
+
+    version["v"] = "v2"
+    fetch.return_value = records[:10]
+    assert manager.reload() is True
+    assert manager.stats()["chunks"] == 10 and manager.stats()["version"] == "v2"
+
+    # nova instância (restart) parte do snapshot gravado, sem Supabase
+    restarted = LocalIndexManager(snapshot_path=str(tmp_path / "idx"), version=lambda: "v2")
+    assert restarted.load().version == "v2" and len(restarted.load()) == 10
+
+
+def test_concurrent_snapshots_do_not_delete_each_other(tmp_path):
+    """save() só remove os arquivos do meta.json que substituiu"""
+    records, _ = _records()
+    path = tmp_path / "idx"
+    LocalVectorIndex.build(records, version="v1").save(str(path))
+    # arquivo de outro worker ainda sem meta.json apontando para ele
+    np.save(path / "vectors-outro-worker.npy", np.zeros((1, 16), dtype=np.float32))
+    old = {p.name for p in path.glob("*.npy")} - {"vectors-outro-worker.npy"}
+    with patch("local_index.time.time", return_value=10**10):
+        LocalVectorIndex.build(records, version="v2").save(str(path))
+    names = {p.name for p in path.glob("*.npy")}
+    assert "vectors-outro-worker.npy" in names and not (old & names)
+
+
+def test_unreadable_snapshot_falls_back_to_supabase(tmp_path):
+    records, vecs = _records()
+    path = tmp_path / "idx"
+    LocalVectorIndex.build(records, version="v1").save(str(path))
+    for npy in path.glob("*.npy"):
+        npy.unlink()
+    fetch = MagicMock(return_value=records)
+    manager = LocalIndexManager(snapshot_path=str(path), fetch_rows=fetch, version=lambda: "v1")
+    assert manager.load().search(vecs[4], k=1)[0]["id"] == 4
+    assert fetch.call_count == 1
+
+
+def test_rag_search_uses_local_backend():
+    records, vecs = _records()
+    manager = LocalIndexManager(fetch_rows=lambda: records, dim=len(vecs[0]))
+    with patch("main.RAG_BACKEND", "local"), patch("main._local_index", manager), \
+         patch("main._rag_cache", None), patch("main.RAG_CACHE_ENABLE", False), \
+         patch("main._embed", return_value=list(vecs[4])), \
+         patch("main._rpc_match") as rpc:
+        resp = main.rag_search("pergunta", k=2, filter_source="faq")
+    rpc.assert_not_called()
+    assert resp.hits[0].content == "chunk 4"
+    assert resp.context.startswith("[1] chunk 4")
@@ -0,0 +1,106 @@
+"""
+Testes do processamento em lote de um payload Mindchat com várias mensagens
+"""
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from dedup import MessageDeduplicator
+
+PAYLOAD = {
+    "contacts": [
+        {"wa_id": "551", "profile": {"name": "Ana"}},
+        {"wa_id": "552", "profile": {"name": "Bruno"}},
+    ],
+    "messages": [
+        {"id": "w1", "from": "551", "type": "text", "text": {"body": "oi"}},
+        {"id": "w2", "from": "552", "type": "interactive",
+         "interactive": {"type": "button_reply", "button_reply": {"title": "Comprar créditos"}}},
+        {"id": "w3", "from": "551", "type": "text", "text": {"body": "quero enviar 2000 emails"},
+         "context": {"id": "w0"}},
+        {"id": "w4", "from": "553", "type": "image"},
+    ],
+}
+
+
+def test_parse_whole_payload_in_one_pass():
+    msgs = main.parse_whatsapp_payload(PAYLOAD)
+    assert [(m.message_id, m.from_number, m.text, m.contact_name) for m in msgs] == [
+        ("w1", "551", "oi", "Ana"),
+        ("w2", "552", "Comprar créditos", "Bruno"),
+        ("w3", "551", "quero enviar 2000 emails", "Ana"),
+        ("w4", "553", "", None),
+    ]
+    assert msgs[2].context_id == "w0"
+    assert not hasattr(msgs[0], "__dict__")
+    assert main.WhatsAppMessage(**msgs[2].to_dict()) == msgs[2]
+    assert main.parse_whatsapp_message({"messages": PAYLOAD["messages"][:1]}).contact_name is None
+    assert main.parse_whatsapp_payload({}) == []
+
+
+def _slow_handler(log, delay=0.05):
+    async def handle(msg):
+        log.append(("start", msg.message_id))
+        await asyncio.sleep(delay)
+        log.append(("end", msg.message_id))
+        return {"status": "processed", "message_id": msg.message_id}
+
+    return handle
+
+
+def test_senders_run_concurrently_in_order():
+    log = []
+    msgs = main.parse_whatsapp_payload(PAYLOAD)
+    with patch("main.handle_mindchat_message", _slow_handler(log)):
+        t0 = time.perf_counter()
+        results = asyncio.run(main.handle_mindchat_batch(msgs, concurrency=8))
+        elapsed = time.perf_counter() - t0
+    assert [r["message_id"] for r in results] == ["w1", "w2", "w3", "w4"]
+    # 551 tem duas mensagens em sequência; os outros remetentes correm junto
+    assert elapsed < 0.15
+    assert log.index(("end", "w1")) < log.index(("start", "w3"))
+
+
+def test_concurrency_limit():
+    log = []
+    msgs = main.parse_whatsapp_payload(PAYLOAD)
+    with patch("main.handle_mindchat_message", _slow_handler(log, delay=0.01)):
+        asyncio.run(main.handle_mindchat_batch(msgs, concurrency=1))
+    assert [e for e, _ in log] == ["start", "end"] * 4
+
+
+@pytest.fixture
+def client(monkeypatch):
+    dedup = MessageDeduplicator()
+    monkeypatch.setattr(main, "MINDCHAT_WEBHOOK_SECRET", "")
+    monkeypatch.setattr(main, "_webhook_queue", None)
+    monkeypatch.setattr(main, "get_webhook_dedup", lambda: dedup)
+    return TestClient(main.app), dedup
+
+
+def test_inline_webhook_failure_releases_only_unanswered(client):
+    client, dedup = client
+
+    async def handle(msg):
+        if msg.message_id == "w1":
+            raise RuntimeError("llm offline")
+        return {"status": "processed", "message_id": msg.message_id}
+
+    with patch("main.handle_mindchat_message", handle):
+        resp = client.post("/webhook/mindchat/whatsapp", json=PAYLOAD)
+    assert resp.status_code == 500
+    # w1 falhou e w3 (mesmo remetente) não foi tentada: as duas valem no reenvio
+    assert [dedup.is_duplicate(i) for i in ("w1", "w2", "w3", "w4")] == [False, True, False, True]
+
+
+def test_inline_webhook_answers_all(client):
+    client, _ = client
+    log = []
+    with patch("main.handle_mindchat_message", _slow_handler(log, delay=0)):
+        data = client.post("/webhook/mindchat/whatsapp", json=PAYLOAD).json()
+    assert data["processed_messages"] == 4
+    assert [r["message_id"] for r in data["responses"]] == ["w1", "w2", "w3", "w4"]
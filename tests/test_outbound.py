@@ -0,0 +1,203 @@
+"""
+Testes do envio de mensagens com limite de taxa, retentativas e dead letter (outbound.py)
+"""
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import main
+from outbound import DeliveryError, OutboundSender, TokenBucket
+from webhook_queue import MemorySpool, QueueFull, SqliteSpool
+
+
+class FakeMindchat:
+    """Falha `fail[to]` vezes por destinatário antes de aceitar"""
+
+    def __init__(self, fail=None, retryable=True, delay=0.0):
+        self.fail = dict(fail or {})
+        self.retryable = retryable
+        self.delay = delay
+        self.delivered = []
+        self.calls = 0
+
+    async def deliver(self, job):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        to = job["json"]["to"]
+        if self.fail.get(to, 0) > 0:
+            self.fail[to] -= 1
+            raise DeliveryError("503 - indisponível", retryable=self.retryable)
+        self.delivered.append((to, job["json"]["n"]))
+        return {"status": "success"}
+
+
+def _job(to, n):
+    return {"path": "/messages", "json": {"to": to, "n": n}}
+
+
+def _run(sender, jobs, timeout=5):
+    async def scenario():
+        await sender.start()
+        futs = [sender.submit(to, _job(to, n)) for to, n in jobs]
+        results = await asyncio.gather(*futs, return_exceptions=True)
+        await sender.stop(timeout=timeout)
+        return results
+
+    return asyncio.run(scenario())
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, burst=5)
+
+    async def scenario():
+        t0 = time.perf_counter()
+        for _ in range(15):
+            await bucket.acquire()
+        return time.perf_counter() - t0
+
+    assert asyncio.run(scenario()) >= 0.18
+    assert bucket.waited_s > 0
+
+
+def test_per_recipient_order_survives_retries():
+    mindchat = FakeMindchat(fail={"a": 2})
+    sender = OutboundSender(mindchat.deliver, rate_per_s=1000, workers=4, backoff_s=0.01)
+    jobs = [(to, n) for n in range(3) for to in ("a", "b")]
+    results = _run(sender, jobs)
+    assert all(r == {"status": "success"} for r in results)
+    assert [n for to, n in mindchat.delivered if to == "a"] == [0, 1, 2]
+    # "b" não espera o backoff de "a"
+    assert mindchat.delivered.index(("b", 2)) < mindchat.delivered.index(("a", 0))
+    stats = sender.stats()
+    assert (stats["sent"], stats["retried"], stats["dead_lettered"]) == (6, 2, 0)
+    assert stats["failure_rate"] == pytest.approx(2 / 8)
+    assert "send_ms_p95" in stats and stats["depth"] == 0
+
+
+def test_dead_letter_and_requeue():
+    mindchat = FakeMindchat(fail={"a": 3})
+    sender = OutboundSender(mindchat.deliver, rate_per_s=1000, max_attempts=2, backoff_s=0.01)
+    results = _run(sender, [("a", 0), ("b", 0)])
+    assert isinstance(results[0], DeliveryError) and results[1] == {"status": "success"}
+    assert [d["recipient"] for d in sender.dead_letters()] == ["a"]
+    assert sender.dead_letters()[0]["attempts"] == 2
+
+    async def requeue():
+        await sender.start()
+        assert await sender.requeue_dead_letters() == 1
+        await sender.stop(timeout=5)
+
+    asyncio.run(requeue())
+    assert ("a", 0) in mindchat.delivered and len(sender.dead_letter) == 0
+
+
+def test_requeue_stops_when_queue_is_full():
+    dead_letter = MemorySpool()
+    for n in range(3):
+        dead_letter.add("a", {"payload": _job("a", n), "error": "503"})
+
+    async def scenario():
+        sender = OutboundSender(FakeMindchat(delay=1).deliver, max_queue=2, dead_letter=dead_letter)
+        await sender.start()
+        requeued = await sender.requeue_dead_letters()
+        await sender.stop(timeout=0.01)
+        return requeued
+
+    assert asyncio.run(scenario()) == 2
+    assert [entry["payload"]["json"]["n"] for _, _, entry, _, _ in dead_letter.pending()] == [2]
+
+
+def test_permanent_errors_skip_retries():
+    mindchat = FakeMindchat(fail={"a": 1}, retryable=False)
+    sender = OutboundSender(mindchat.deliver, rate_per_s=1000, max_attempts=5)
+    _run(sender, [("a", 0)])
+    assert mindchat.calls == 1 and sender.dead_lettered == 1
+
+
+def test_pending_sends_survive_restart(tmp_path):
+    path = str(tmp_path / "outbound.db")
+    slow = FakeMindchat(fail={"a": 99})
+
+    async def first_run():
+        sender = OutboundSender(slow.deliver, rate_per_s=1000, backoff_s=60, spool=SqliteSpool(path, "outbound_spool"))
+        await sender.start()
+        sender.submit("a", _job("a", 0))
+        sender.submit("a", _job("a", 1))
+        await asyncio.sleep(0.05)
+        await sender.stop(timeout=0.05)
+
+    asyncio.run(first_run())
+    spool = SqliteSpool(path, "outbound_spool")
+    assert len(spool) == 2 and spool.pending()[0][4] == 1  # tentativa registrada
+
+    ok = FakeMindchat()
+
+    async def second_run():
+        sender = OutboundSender(ok.deliver, rate_per_s=1000, spool=SqliteSpool(path, "outbound_spool"))
+        await sender.start()
+        await sender.stop(timeout=5)
+        return sender
+
+    sender = asyncio.run(second_run())
+    assert ok.delivered == [("a", 0), ("a", 1)] and sender.recovered == 2
+    assert len(SqliteSpool(path, "outbound_spool")) == 0
+
+
+def test_bounded_queue():
+    async def scenario():
+        sender = OutboundSender(FakeMindchat(delay=1).deliver, max_queue=2)
+        await sender.start()
+        sender.submit("a", _job("a", 0))
+        sender.submit("b", _job("b", 0))
+        with pytest.raises(QueueFull):
+            sender.submit("c", _job("c", 0))
+        await sender.stop(timeout=0.01)
+        return sender
+
+    assert asyncio.run(scenario()).rejected == 1
+
+
+def test_send_functions_go_through_sender(monkeypatch):
+    sender = OutboundSender(AsyncMock(return_value={"status": "success"}), rate_per_s=1000, spool=MemorySpool())
+    monkeypatch.setattr(main, "_outbound_sender", sender)
+    monkeypatch.setattr(main, "get_outbound_sender", lambda: sender)
+
+    async def scenario():
+        await sender.start()
+        results = [
+            await main.send_mindchat_message("551", "Olá"),
+            await main.send_whatsapp_notification("Deploy ok", "deployment"),
+        ]
+        await main.send_whatsapp_response({"reply_text": "Oi"}, "552")
+        await sender.stop(timeout=5)
+        return results
+
+    results = asyncio.run(scenario())
+    assert results == [{"status": "queued"}, {"status": "queued"}]
+    jobs = [c.args[0] for c in sender._deliver.await_args_list]
+    assert [j["path"] for j in jobs] == ["/messages", "/webhook/whatsapp", "/api/whatsapp/send"]
+    assert sender.stats()["sent"] == 3
+
+
+def test_direct_send_without_sender(monkeypatch):
+    monkeypatch.setattr(main, "_outbound_sender", None)
+    response = MagicMock(status_code=429, text="rate limited")
+    clients = MagicMock()
+    clients.arequest = AsyncMock(return_value=response)
+    with patch("main.get_http_clients", return_value=clients):
+        result = asyncio.run(main.send_mindchat_message("551", "Olá"))
+    assert result == {"status": "error", "error": "429 - rate limited"}
+    # sem o sender, vale a política de retentativas do http_clients
+    assert clients.arequest.await_args.kwargs["retries"] is None
+
+
+def test_sender_disables_inner_http_retries():
+    response = MagicMock(status_code=200, json=MagicMock(return_value={"ok": True}))
+    clients = MagicMock()
+    clients.arequest = AsyncMock(return_value=response)
+    with patch("main.get_http_clients", return_value=clients):
+        result = asyncio.run(main._deliver_mindchat_once(_job("a", 0)))
+    assert result == {"status": "success", "response": {"ok": True}}
+    assert clients.arequest.await_args.kwargs["retries"] == 0
@@ -0,0 +1,102 @@
+"""
+Testes do pool Postgres do RAG_BACKEND=pg
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import main
+from pg_pool import AsyncPgPool, PgPool, PgPoolConfig
+
+pytest.importorskip("psycopg_pool")
+
+
+def test_config_from_env(monkeypatch):
+    monkeypatch.setenv("PG_POOL_MIN", "2")
+    monkeypatch.setenv("PG_POOL_MAX", "8")
+    monkeypatch.setenv("PG_STATEMENT_TIMEOUT_MS", "1500")
+    monkeypatch.setenv("PG_PREPARE_THRESHOLD", "off")
+    cfg = PgPoolConfig.from_env()
+    assert (cfg.min_size, cfg.max_size, cfg.statement_timeout_ms) == (2, 8, 1500)
+    assert cfg.connection_kwargs() == {"autocommit": True, "prepare_threshold": None}
+
+
+def test_pool_configures_statement_timeout_and_health_check():
+    with patch("psycopg_pool.ConnectionPool") as cls:
+        PgPool("postgresql://x", PgPoolConfig(min_size=1, max_size=3, statement_timeout_ms=900))
+    kwargs = cls.call_args.kwargs
+    assert (kwargs["min_size"], kwargs["max_size"], kwargs["open"]) == (1, 3, False)
+    assert kwargs["check"] is not None
+    conn = MagicMock()
+    kwargs["configure"](conn)
+    conn.execute.assert_called_once_with("SET statement_timeout = 900")
+
+
+def test_pool_runs_on_connect_hook():
+    hook = MagicMock()
+    with patch("psycopg_pool.ConnectionPool") as cls:
+        PgPool("postgresql://x", PgPoolConfig(), on_connect=hook)
+    conn = MagicMock()
+    cls.call_args.kwargs["configure"](conn)
+    hook.assert_called_once_with(conn)
+
+
+def test_async_pool_tracks_acquisition():
+    class FakeAsyncPool:
+        def __init__(self, *a, **kw):
+            pass
+
+        @asynccontextmanager
+        async def connection(self):
+            yield "conn"
+
+        def get_stats(self):
+            return {"pool_size": 1, "pool_available": 0, "requests_waiting": 0}
+
+    FakeAsyncPool.check_connection = staticmethod(lambda conn: None)
+
+    async def scenario():
+        with patch("psycopg_pool.AsyncConnectionPool", FakeAsyncPool):
+            pool = AsyncPgPool("postgresql://x")
+        async with pool.connection() as conn:
+            assert conn == "conn"
+            assert pool.stats()["in_use"] == 1
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["in_use"] == 0 and stats["acquired"] == 1
+    assert "acquire_ms_p95" in stats
+
+
+def test_pg_hybrid_search_async_reuses_pool():
+    cur = MagicMock()
+    cur.execute = AsyncMock()
+    cur.fetchall = AsyncMock(return_value=[(1, "doc", "H", "conteúdo", 0.016)])
+
+    @asynccontextmanager
+    async def cursor():
+        yield cur
+
+    conn = MagicMock()
+    conn.cursor = cursor
+
+    @asynccontextmanager
+    async def connection():
+        yield conn
+
+    pool = MagicMock()
+    pool.connection = connection
+
+    async def fake_embed(q):
+        return [0.1, 0.2]
+
+    with patch("main.DATABASE_URL", "postgresql://x"), patch("main.OPENAI_API_KEY", "sk"), \
+         patch("main.get_pg_async_pool", AsyncMock(return_value=pool)), \
+         patch("main._embed_async", fake_embed):
+        ctx, refs = asyncio.run(main._pg_hybrid_search_async("como funciona", k=3))
+    assert ctx == "[1] H\nconteúdo\n---\n"
+    # uma única ida ao banco por pergunta
+    assert cur.execute.await_count == 1
+    assert cur.execute.await_args.kwargs.get("prepare") is True
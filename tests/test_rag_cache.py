@@ -0,0 +1,121 @@
+"""
+Testes do cache de resultados do RAG
+"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from rag_cache import CorpusVersion, RagResultCache, file_version_fetcher
+
+
+class TestRagResultCache:
+    """LRU + TTL + invalidação por versão do corpus"""
+
+    def test_hit_on_normalized_question(self):
+        cache = RagResultCache()
+        cache.put("response", "Como funciona?", "faq", 5, "v1", {"context": "x"})
+        assert cache.get("response", "  como FUNCIONA ", "faq", 5, "v1") == {"context": "x"}
+        assert cache.get("response", "como funciona", "faq", 3, "v1") is None
+        assert cache.get("bundle:rpc", "como funciona", "faq", 5, "v1") is None
+
+    def test_values_are_copied(self):
+        cache = RagResultCache()
+        value = {"refs": [1]}
+        cache.put("response", "q", None, 5, "v1", value)
+        value["refs"].append(2)
+        got = cache.get("response", "q", None, 5, "v1")
+        got["refs"].append(3)
+        assert cache.get("response", "q", None, 5, "v1") == {"refs": [1]}
+
+    def test_new_corpus_version_invalidates_everything(self):
+        cache = RagResultCache()
+        cache.put("response", "a", None, 5, "v1", "A")
+        cache.put("response", "b", None, 5, "v1", "B")
+        assert cache.get("response", "a", None, 5, "v2") is None
+        assert cache.stats()["entries"] == 0
+        assert cache.stats()["invalidations"] == 1
+
+    def test_size_and_ttl_eviction(self):
+        cache = RagResultCache(max_entries=2)
+        for q in ("a", "b", "c"):
+            cache.put("response", q, None, 5, "v1", q)
+        assert cache.get("response", "a", None, 5, "v1") is None
+        assert cache.get("response", "c", None, 5, "v1") == "c"
+
+        expiring = RagResultCache(ttl_seconds=10)
+        expiring.put("response", "a", None, 5, "v1", "A")
+        with patch("rag_cache.time.monotonic", return_value=10**9):
+            assert expiring.get("response", "a", None, 5, "v1") is None
+
+    def test_semantic_mode_matches_close_embeddings(self):
+        pytest.importorskip("numpy")
+        cache = RagResultCache(semantic=True, semantic_threshold=0.95)
+        cache.put("response", "qual o preço", None, 5, "v1", "P", embedding=[1.0, 0.0])
+        assert cache.get("response", "quanto custa", None, 5, "v1", embedding=[0.99, 0.05]) == "P"
+        assert cache.get("response", "oi", None, 5, "v1", embedding=[0.0, 1.0]) is None
+        assert cache.stats()["semantic_hits"] == 1
+
+    def test_semantic_matrix_reuses_rows_on_eviction(self):
+        pytest.importorskip("numpy")
+        cache = RagResultCache(max_entries=2, semantic=True)
+        cache.put("response", "a", None, 5, "v1", "A", embedding=[1.0, 0.0])
+        cache.put("response", "b", None, 5, "v1", "B", embedding=[0.0, 1.0])
+        cache.put("response", "c", None, 5, "v1", "C", embedding=[0.0, 1.0])
+        assert cache._matrix.shape == (2, 2)
+        # "a" foi despejado junto com a sua linha da matriz
+        assert cache.similar("response", "x", None, 5, "v1", [1.0, 0.0]) is None
+        assert cache.similar("response", "y", None, 5, "v1", [0.0, 1.0]) in ("B", "C")
+        assert cache.get("response", "z", None, 5, "v1") is None
+        assert (cache.stats()["misses"], cache.stats()["semantic_hits"]) == (1, 1)
+
+
+def test_corpus_version_keeps_last_value_on_error(tmp_path):
+    path = tmp_path / "version.txt"
+    version = CorpusVersion(file_version_fetcher(str(path)), refresh_seconds=0)
+    assert version.current() == "0"
+    path.write_text("20260101T000000Z\n", encoding="utf-8")
+    assert version.current() == "20260101T000000Z"
+
+    failing = CorpusVersion(MagicMock(side_effect=[" v7", RuntimeError("down")]), refresh_seconds=0)
+    assert failing.current() == " v7"
+    assert failing.current() == " v7"
+
+
+def test_rag_query_served_from_cache():
+    """Segunda consulta idêntica não chama o RPC do Supabase"""
+    rows = [{"content": "Somos a AR Online", "metadata": {"source": "faq"}, "similarity": 0.9}]
+    with patch("main._rag_cache", RagResultCache()), \
+         patch("main._corpus_version", CorpusVersion(None)), \
+         patch("main._embed", return_value=[0.1, 0.2]), \
+         patch("main._rpc_match", return_value=rows) as rpc:
+        first = main.rag_query(main.RagQueryIn(question="O que é a AR Online?"), MagicMock())
+        second = main.rag_query(main.RagQueryIn(question="o que é a ar online"), MagicMock())
+    assert rpc.call_count == 1
+    assert second.context == first.context
+
+
+def test_rag_cache_hit_skips_embedding():
+    """Hit exato não calcula embedding (modo semântico desligado)"""
+    rows = [{"content": "Somos a AR Online", "metadata": {"source": "faq"}, "similarity": 0.9}]
+    with patch("main._rag_cache", RagResultCache()), \
+         patch("main._corpus_version", CorpusVersion(None)), \
+         patch("main._embed", return_value=[0.1, 0.2]) as embed, \
+         patch("main._rpc_match", return_value=rows):
+        main.rag_search("O que é a AR Online?")
+        main.rag_search("o que é a ar online")
+    assert embed.call_count == 1
+
+
+def test_rag_cache_admin_endpoints():
+    cache = RagResultCache()
+    cache.put("response", "q", None, 5, "v1", "x")
+    headers = {"Authorization": "Bearer test-token"}
+    with patch("main.API_TOKEN", "test-token"), patch("main._rag_cache", cache):
+        client = TestClient(main.app)
+        body = client.get("/rag/cache", headers=headers).json()
+        assert body["enabled"] is True
+        assert body["entries_recent"][0]["question"] == "q"
+        assert client.delete("/rag/cache", headers=headers).json() == {"flushed": 1}
+        assert client.get("/rag/cache").status_code == 401
@@ -0,0 +1,70 @@
+"""
+Testes do motor de similaridade do reflector (reflector/similarity_engine.py)
+"""
+from unittest.mock import MagicMock
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from reflector.similarity_engine import SimilarityEngine, parse_pgvectors  # noqa: E402
+
+
+def _pgtext(vec):
+    return "[" + ",".join(repr(float(x)) for x in vec) + "]"
+
+
+def _row(i, vec, stamp="2026-01-01T00:00:00"):
+    return {"id": i, "content": f"chunk {i}", "metadata": {"source": "faq"}, "embedding": _pgtext(vec), "updated_at": stamp}
+
+
+def _response(rows, status=200):
+    resp = MagicMock(status_code=status)
+    resp.json.return_value = rows
+    return resp
+
+
+def test_parse_pgvectors_skips_bad_rows():
+    matrix, keep = parse_pgvectors(["[1,2,3]", None, "[4, 5, 6]", "[7,8]"], dim=3)
+    assert keep == [0, 2]
+    np.testing.assert_array_equal(matrix, np.array([[1, 2, 3], [4, 5, 6]], dtype=np.float32))
+    assert matrix.dtype == np.float32
+
+
+def test_search_matches_python_cosine_and_pages():
+    rng = np.random.default_rng(1)
+    vecs = rng.normal(size=(7, 4))
+    rows = [_row(i, v) for i, v in enumerate(vecs)]
+    engine = SimilarityEngine("https://x.supabase.co", {"apikey": "k"}, dim=4, page_size=3)
+    engine._session.get = MagicMock(side_effect=[_response(rows[:3]), _response(rows[3:6]), _response(rows[6:])])
+
+    q = vecs[2] + 0.05
+    hits = engine.search(q, k=3)
+    cos = vecs @ q / (np.linalg.norm(vecs, axis=1) * np.linalg.norm(q))
+    assert [h[1]["id"] for h in hits] == list(np.argsort(-cos)[:3])
+    assert hits[0][0] == pytest.approx(cos.max(), rel=1e-5)
+    assert engine._session.get.call_count == 3
+    # dentro do intervalo de refresh não volta ao Supabase
+    engine.search(q, k=1)
+    assert engine._session.get.call_count == 3
+
+
+def test_incremental_refresh_updates_and_appends():
+    engine = SimilarityEngine("https://x.supabase.co", {}, dim=2, refresh_seconds=0)
+    engine._session.get = MagicMock(return_value=_response([_row(1, [1, 0]), _row(2, [0, 1])]))
+    engine.refresh()
+    engine._session.get = MagicMock(
+        return_value=_response([_row(2, [1, 0.1], "2026-02-01T00:00:00"), _row(3, [-1, 0], "2026-02-01T00:00:00")])
+    )
+    assert engine.refresh() == 2
+    params = engine._session.get.call_args.kwargs["params"]
+    assert params["updated_at"] == "gte.2026-01-01T00:00:00"
+    assert len(engine) == 3
+    assert [c["id"] for _, c in engine.search([1, 0.1], k=2)] == [2, 1]
+
+
+def test_missing_timestamp_column_falls_back_to_full_load():
+    engine = SimilarityEngine("https://x.supabase.co", {}, dim=2)
+    engine._session.get = MagicMock(side_effect=[_response([], status=400), _response([_row(1, [1, 0])])])
+    engine.refresh()
+    assert engine.timestamp_column is None and len(engine) == 1
@@ -0,0 +1,113 @@
+"""
+Testes do grafo de etapas do /assist/routing
+"""
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import main
+from routing_pipeline import Stage, run_stages
+
+
+def _sleep_then(value, delay):
+    async def fn(_inputs):
+        await asyncio.sleep(delay)
+        return value
+
+    return fn
+
+
+class TestRunStages:
+    """Execução concorrente, dependências e prazos"""
+
+    def test_independent_stages_overlap(self):
+        stages = [
+            Stage("a", _sleep_then("A", 0.1)),
+            Stage("b", _sleep_then("B", 0.1)),
+            Stage("c", lambda inputs: _sleep_then(inputs["a"] + inputs["b"], 0)(inputs), deps=("a", "b")),
+        ]
+        t0 = time.perf_counter()
+        results = asyncio.run(run_stages(stages))
+        assert time.perf_counter() - t0 < 0.18
+        assert results == {"a": "A", "b": "B", "c": "AB"}
+
+    def test_timeout_returns_default_and_records_error(self):
+        timings, errors = {}, {}
+        stages = [
+            Stage("slow", _sleep_then("x", 1), timeout=0.02, default="fallback"),
+            Stage("next", lambda inputs: _sleep_then(inputs["slow"], 0)(inputs), deps=("slow",)),
+        ]
+        results = asyncio.run(run_stages(stages, timings=timings, errors=errors))
+        assert results["next"] == "fallback"
+        assert errors == {"slow": "timeout"}
+        assert set(timings) == {"slow", "next"}
+
+    def test_failure_returns_default(self):
+        async def boom(_):
+            raise RuntimeError("down")
+
+        errors = {}
+        results = asyncio.run(run_stages([Stage("x", boom, default=0)], errors=errors))
+        assert results == {"x": 0}
+        assert errors == {"x": "RuntimeError"}
+
+    def test_dependencies_must_be_declared_first(self):
+        with pytest.raises(ValueError):
+            asyncio.run(run_stages([Stage("b", _sleep_then(1, 0), deps=("a",)), Stage("a", _sleep_then(1, 0))]))
+
+    def test_cancellation_propagates_to_pending_stages(self):
+        cancelled = asyncio.Event()
+
+        async def long(_):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def scenario():
+            task = asyncio.create_task(run_stages([Stage("long", long)]))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return cancelled.is_set()
+
+        assert asyncio.run(scenario()) is True
+
+
+def test_rag_and_thread_setup_run_concurrently(mock_async_openai_client):
+    """Busca RAG e criação da thread se sobrepõem antes do LLM"""
+
+    async def slow_create():
+        await asyncio.sleep(0.15)
+        return MagicMock(id="thread_new")
+
+    async def slow_rag(question, k=5):
+        await asyncio.sleep(0.15)
+        return "[1] contexto", []
+
+    mock_async_openai_client.beta.threads.create = AsyncMock(side_effect=slow_create)
+    with patch("main.RAG_ENABLE", True), patch("main.fetch_rag_bundle_async", slow_rag), \
+         patch("main.log") as log:
+        t0 = time.perf_counter()
+        resp = asyncio.run(main.run_routing({"user_text": "como funciona o envio?"}))
+        elapsed = time.perf_counter() - t0
+    assert elapsed < 0.28
+    assert resp.variables["rag_context"] == "[1] contexto"
+    assert resp.variables["assistant_thread_id"] == "thread_new"
+    logged = [c.args[0] for c in log.info.call_args_list if '"event": "routing"' in str(c.args[0])]
+    assert '"stages_ms"' in logged[0]
+
+
+def test_rag_stage_deadline_degrades_gracefully(mock_async_openai_client):
+    async def hanging_rag(question, k=5):
+        await asyncio.sleep(5)
+
+    with patch("main.RAG_ENABLE", True), patch("main.fetch_rag_bundle_async", hanging_rag), \
+         patch("main.RAG_STAGE_TIMEOUT_SECONDS", 0.05):
+        resp = asyncio.run(main.run_routing({"user_text": "como funciona?"}))
+    assert resp.reply_text == "Resposta do assistente"
+    assert "rag_context" not in (resp.variables or {})
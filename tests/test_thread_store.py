@@ -0,0 +1,117 @@
+"""
+Testes do mapeamento persistente app_thread_id -> assistant_thread_id
+"""
+import asyncio
+import time
+from unittest.mock import MagicMock, patch
+
+from fastapi.testclient import TestClient
+
+import main
+from thread_store import (
+    MemoryThreadBackend,
+    SqliteThreadBackend,
+    SupabaseSessionsBackend,
+    ThreadStore,
+)
+
+
+class TestThreadStore:
+    """Testes do LRU + TTL na frente do backend"""
+
+    def test_sqlite_survives_restart(self, tmp_path):
+        path = str(tmp_path / "threads.db")
+        store = ThreadStore(SqliteThreadBackend(path))
+        store.set("thrd_abc", "thread_openai_1", user_id="5516999999999", channel="whatsapp")
+
+        reopened = ThreadStore(SqliteThreadBackend(path))
+        assert reopened.get("thrd_abc") == "thread_openai_1"
+        assert reopened.get("thrd_unknown") is None
+
+    def test_lru_eviction_falls_back_to_backend(self):
+        backend = MemoryThreadBackend()
+        store = ThreadStore(backend, max_entries=2)
+        for i in range(3):
+            store.set(f"app_{i}", f"th_{i}")
+        assert store.stats()["entries"] == 2
+        # app_0 saiu do LRU mas continua no backend
+        assert store.get("app_0") == "th_0"
+        assert store.misses == 1
+
+    def test_cache_ttl_rereads_backend(self):
+        backend = MemoryThreadBackend()
+        store = ThreadStore(backend, cache_ttl=0)
+        store.set("app", "th_1")
+        backend.set("app", "th_2")
+        assert store.get("app") == "th_2"
+
+    def test_idle_threads_expire(self):
+        backend = MemoryThreadBackend()
+        backend._data["app"] = ("th_old", time.time() - 100)
+        store = ThreadStore(backend, max_idle=10)
+        assert store.get("app") is None
+
+
+def test_same_sender_reuses_assistant_thread(mock_async_openai_client):
+    """Mensagens seguintes do mesmo remetente reutilizam a thread do Assistant"""
+    store = ThreadStore(MemoryThreadBackend())
+    client = TestClient(main.app)
+    payload = {
+        "message": "oi",
+        "variables": {"remetente": "5516999999999", "canal": "whatsapp"},
+    }
+    with patch("main.API_TOKEN", "test-token"), patch("main.RAG_ENABLE", False), \
+         patch("main._thread_store", store):
+        for _ in range(2):
+            resp = client.post(
+                "/assist/routing", json=payload, headers={"Authorization": "Bearer test-token"}
+            )
+            assert resp.status_code == 200
+            assert resp.json()["variables"]["assistant_thread_id"] == "test-thread-id"
+
+    assert mock_async_openai_client.beta.threads.create.await_count == 1
+    assert mock_async_openai_client.beta.threads.messages.create.await_count == 2
+
+
+def test_failed_assistant_step_drops_mapping(mock_async_openai_client):
+    """Resposta vazia do Assistant (falha/timeout) não deixa a thread mapeada"""
+    store = ThreadStore(MemoryThreadBackend())
+    store.set("app", "thread_busy")
+    mock_async_openai_client.beta.threads.messages.create.side_effect = RuntimeError("run is active")
+    with patch("main.RAG_ENABLE", False), patch("main._thread_store", store):
+        asyncio.run(main.run_routing({"message": "oi", "thread_id": "app"}))
+    assert store.get("app") is None
+
+
+def test_poll_timeout_cancels_run_and_ignores_previous_turn(mock_async_openai_client):
+    """Timeout no modo poll cancela o run e não devolve a resposta do turno anterior"""
+    old = MagicMock(role="assistant", run_id="run_anterior")
+    old.content[0].text.value = "Resposta antiga"
+    threads = mock_async_openai_client.beta.threads
+    threads.messages.list.return_value = MagicMock(data=[old])
+    threads.runs.retrieve.return_value = MagicMock(status="in_progress")
+    with patch("main.ASSISTANT_RUN_MODE", "poll"), patch("main.ASSISTANT_TIMEOUT_SECONDS", 0.01):
+        reply, _ = asyncio.run(main._assistant_reply_async("oi", None, "thread_x"))
+    assert reply == ""
+    threads.runs.cancel.assert_awaited_once_with(thread_id="thread_x", run_id="test-run-id")
+
+    # run concluído sem mensagem própria: também não reaproveita a antiga
+    threads.runs.retrieve.return_value = MagicMock(status="completed")
+    assert asyncio.run(main.last_assistant_message_async("thread_x", "test-run-id")) == ""
+
+
+def test_supabase_backend_keeps_session_metadata():
+    """Upsert grava a coluna própria e não sobrescreve `metadata`"""
+    backend = SupabaseSessionsBackend("https://x.supabase.co", "key")
+    backend._session = MagicMock()
+    backend._session.post.return_value = MagicMock(status_code=201)
+    backend.set("thrd_abc", "thread_openai_1", user_id="551", channel="whatsapp")
+    row = backend._session.post.call_args.kwargs["json"]
+    assert row["assistant_thread_id"] == "thread_openai_1" and "metadata" not in row
+
+    # linhas antigas: id só em metadata
+    backend._session.get.return_value = MagicMock(
+        status_code=200,
+        json=MagicMock(return_value=[{"metadata": {"assistant_thread_id": "thread_old"}, "updated_at": None}]),
+    )
+    assert backend.get("thrd_old")[0] == "thread_old"
@@ -0,0 +1,173 @@
+"""
+Testes da fila ack-then-process do webhook Mindchat (webhook_queue.py)
+"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from dedup import MessageDeduplicator
+from webhook_queue import MemorySpool, QueueFull, SqliteSpool, WebhookQueue
+
+
+@pytest.fixture(autouse=True)
+def fresh_dedup(monkeypatch):
+    dedup = MessageDeduplicator()
+    monkeypatch.setattr(main, "_webhook_dedup", dedup)
+    monkeypatch.setattr(main, "get_webhook_dedup", lambda: dedup)
+    monkeypatch.setattr(main, "get_message_coalescer", lambda: None)
+    return dedup
+
+
+def _payload(sender, text, mid="wamid.1"):
+    return {
+        "messages": [{"id": mid, "from": sender, "type": "text", "text": {"body": text}}],
+        "contacts": [{"profile": {"name": "Cliente"}}],
+    }
+
+
+def test_same_sender_in_order_other_senders_in_parallel():
+    seen = []
+    active = {"now": 0, "max": 0}
+
+    async def handler(item):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.01)
+        seen.append((item["from"], item["n"]))
+        active["now"] -= 1
+
+    async def scenario():
+        queue = WebhookQueue(handler, workers=4)
+        await queue.start()
+        queue.enqueue_many([(s, {"from": s, "n": n}) for n in range(3) for s in ("a", "b", "c", "d")])
+        await queue.stop(timeout=5)
+        return queue
+
+    queue = asyncio.run(scenario())
+    for sender in "abcd":
+        assert [n for s, n in seen if s == sender] == [0, 1, 2]
+    assert active["max"] > 1
+    stats = queue.stats()
+    assert stats["processed"] == 12 and stats["depth"] == 0
+    assert "queue_wait_ms_p95" in stats and "process_ms_avg" in stats
+    assert len(queue.spool) == 0
+
+
+def test_backpressure_rejects_whole_payload():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def handler(item):
+            await gate.wait()
+
+        queue = WebhookQueue(handler, workers=1, max_size=3)
+        await queue.start()
+        queue.enqueue_many([("a", {}), ("a", {})])
+        with pytest.raises(QueueFull):
+            queue.enqueue_many([("b", {}), ("b", {})])
+        depth = queue.depth
+        gate.set()
+        await queue.stop(timeout=5)
+        return queue, depth
+
+    queue, depth = asyncio.run(scenario())
+    assert depth == 2
+    assert queue.rejected == 2 and queue.processed == 2
+
+
+def test_failures_are_retried_then_dropped():
+    calls = []
+
+    async def handler(item):
+        calls.append(item["n"])
+        if item["n"] == 0:
+            raise RuntimeError("mindchat offline")
+
+    async def scenario():
+        queue = WebhookQueue(handler, workers=1, max_attempts=3, retry_backoff_s=0)
+        await queue.start()
+        queue.enqueue_many([("a", {"n": 0}), ("a", {"n": 1})])
+        await queue.stop(timeout=5)
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert calls == [0, 0, 0, 1]
+    assert (queue.retried, queue.failed, queue.processed) == (2, 1, 1)
+    assert len(queue.spool) == 0
+
+
+def test_spool_survives_restart(tmp_path):
+    path = str(tmp_path / "spool.db")
+    done = []
+
+    async def never(item):
+        await asyncio.sleep(60)
+
+    async def record(item):
+        done.append(item["n"])
+
+    async def first_run():
+        queue = WebhookQueue(never, workers=2, spool=SqliteSpool(path))
+        await queue.start()
+        queue.enqueue_many([("a", {"n": 1}), ("b", {"n": 2})])
+        await queue.stop(timeout=0.05)
+
+    async def second_run():
+        queue = WebhookQueue(record, workers=2, spool=SqliteSpool(path))
+        await queue.start()
+        await queue.stop(timeout=5)
+        return queue
+
+    asyncio.run(first_run())
+    assert len(SqliteSpool(path)) == 2
+    queue = asyncio.run(second_run())
+    assert sorted(done) == [1, 2] and queue.recovered == 2
+    assert len(SqliteSpool(path)) == 0
+
+
+def test_webhook_acks_before_processing(monkeypatch):
+    monkeypatch.setattr(main, "MINDCHAT_WEBHOOK_SECRET", "")
+    queue = WebhookQueue(main._process_queued_mindchat_message, workers=2, spool=MemorySpool())
+    monkeypatch.setattr(main, "_webhook_queue", queue)
+    monkeypatch.setattr(main, "get_webhook_queue", lambda: queue)
+    handled = AsyncMock(return_value={"status": "processed"})
+    with patch("main.handle_mindchat_message", handled), TestClient(main.app) as client:
+        resp = client.post("/webhook/mindchat/whatsapp", json=_payload("5516999999999", "oi"))
+        assert resp.status_code == 200
+        assert resp.json() == {"status": "accepted", "queued_messages": 1, "duplicates": 0}
+    # shutdown drena a fila
+    assert handled.await_count == 1
+    msg = handled.await_args.args[0]
+    assert (msg.from_number, msg.text, msg.contact_name) == ("5516999999999", "oi", "Cliente")
+
+
+def test_webhook_returns_503_when_full(monkeypatch, fresh_dedup):
+    monkeypatch.setattr(main, "MINDCHAT_WEBHOOK_SECRET", "")
+
+    async def slow(item):
+        await asyncio.sleep(60)
+
+    queue = WebhookQueue(slow, workers=1, max_size=1)
+    monkeypatch.setattr(main, "_webhook_queue", queue)
+    monkeypatch.setattr(main, "get_webhook_queue", lambda: queue)
+    monkeypatch.setenv("WEBHOOK_QUEUE_DRAIN_S", "0.05")
+    with TestClient(main.app) as client:
+        assert client.post("/webhook/mindchat/whatsapp", json=_payload("1", "a")).status_code == 200
+        resp = client.post("/webhook/mindchat/whatsapp", json=_payload("2", "b", mid="wamid.2"))
+        assert resp.status_code == 503 and resp.headers["Retry-After"] == "5"
+    # recusada: o reenvio do Mindchat não pode ser tratado como duplicado
+    assert not fresh_dedup.is_duplicate("wamid.2")
+
+
+def test_shutdown_closes_sqlite_spools(monkeypatch, tmp_path):
+    queue = WebhookQueue(main._process_queued_mindchat_message, spool=SqliteSpool(str(tmp_path / "spool.db")))
+    monkeypatch.setattr(main, "_webhook_queue", queue)
+    monkeypatch.setattr(main, "get_webhook_queue", lambda: queue)
+    with TestClient(main.app):
+        pass
+    assert main._webhook_queue is None
+    with pytest.raises(Exception, match="closed"):
+        len(queue.spool)
@@ -0,0 +1,342 @@
+"""
+Mapeamento persistente de threads para ARIA-SDR
+
+Associa o `app_thread_id` estável (header X-Thread-Id, payload.thread_id ou
+hash remetente+canal) ao `assistant_thread_id` da OpenAI, para que mensagens
+seguintes do mesmo remetente reutilizem a thread do Assistant.
+
+Camadas:
+- LRU em memória com TTL (evita I/O no caminho quente)
+- Backend durável: SQLite (padrão), tabela `aria_sessions` do Supabase ou memória
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Protocol
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadBackend(Protocol):
+    """Contrato mínimo de um backend durável de mapeamento"""
+
+    def get(self, app_thread_id: str) -> tuple[str, float] | None:
+        """Retorna (assistant_thread_id, updated_at_epoch) ou None"""
+        ...
+
+    def set(
+        self,
+        app_thread_id: str,
+        assistant_thread_id: str,
+        user_id: str | None = None,
+        channel: str | None = None,
+    ) -> None: ...
+
+    def delete(self, app_thread_id: str) -> None: ...
+
+
+class MemoryThreadBackend:
+    """Backend volátil (testes ou quando não há persistência)"""
+
+    def __init__(self):
+        self._data: dict[str, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, app_thread_id: str) -> tuple[str, float] | None:
+        with self._lock:
+            return self._data.get(app_thread_id)
+
+    def set(self, app_thread_id, assistant_thread_id, user_id=None, channel=None) -> None:
+        with self._lock:
+            self._data[app_thread_id] = (assistant_thread_id, time.time())
+
+    def delete(self, app_thread_id: str) -> None:
+        with self._lock:
+            self._data.pop(app_thread_id, None)
+
+
+class SqliteThreadBackend:
+    """Backend padrão: arquivo SQLite local (WAL)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS aria_thread_map (
+                app_thread_id TEXT PRIMARY KEY,
+                assistant_thread_id TEXT NOT NULL,
+                user_id TEXT,
+                channel TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    def get(self, app_thread_id: str) -> tuple[str, float] | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT assistant_thread_id, updated_at FROM aria_thread_map WHERE app_thread_id = ?",
+                (app_thread_id,),
+            ).fetchone()
+        return (row[0], float(row[1])) if row else None
+
+    def set(self, app_thread_id, assistant_thread_id, user_id=None, channel=None) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO aria_thread_map
+                    (app_thread_id, assistant_thread_id, user_id, channel, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(app_thread_id) DO UPDATE SET
+                    assistant_thread_id = excluded.assistant_thread_id,
+                    updated_at = excluded.updated_at
+                """,
+                (app_thread_id, assistant_thread_id, user_id, channel, now, now),
+            )
+
+    def delete(self, app_thread_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM aria_thread_map WHERE app_thread_id = ?", (app_thread_id,)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SupabaseSessionsBackend:
+    """Usa a tabela `aria_sessions` (supabase_schema.sql) via REST.
+
+    O `assistant_thread_id` tem coluna própria (o upsert não toca em
+    `metadata`, usado por outros fluxos); `id` é o app_thread_id. Linhas
+    antigas, com o id só em `metadata`, continuam sendo lidas.
+    """
+
+    def __init__(self, base_url: str, key: str, table: str = "aria_sessions", timeout: float = 5):
+        self.url = f"{base_url.rstrip('/')}/rest/v1/{table}"
+        self.timeout = timeout
+        self.headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        }
+        self._session = requests.Session()
+
+    def get(self, app_thread_id: str) -> tuple[str, float] | None:
+        r = self._session.get(
+            self.url,
+            headers=self.headers,
+            params={"id": f"eq.{app_thread_id}", "select": "assistant_thread_id,metadata,updated_at"},
+            timeout=self.timeout,
+        )
+        if r.status_code >= 300:
+            raise RuntimeError(f"aria_sessions lookup failed: {r.status_code} -> {r.text}")
+        rows = r.json() or []
+        if not rows:
+            return None
+        row = rows[0]
+        assistant_thread_id = row.get("assistant_thread_id") or (row.get("metadata") or {}).get("assistant_thread_id")
+        if not assistant_thread_id:
+            return None
+        return assistant_thread_id, _parse_ts(row.get("updated_at"))
+
+    def set(self, app_thread_id, assistant_thread_id, user_id=None, channel=None) -> None:
+        row: dict[str, Any] = {
+            "id": app_thread_id,
+            "assistant_thread_id": assistant_thread_id,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if user_id:
+            row["user_id"] = user_id
+        if channel:
+            row["channel"] = channel
+        r = self._session.post(
+            self.url,
+            headers={**self.headers, "Prefer": "resolution=merge-duplicates"},
+            json=row,
+            timeout=self.timeout,
+        )
+        if r.status_code >= 300:
+            raise RuntimeError(f"aria_sessions upsert failed: {r.status_code} -> {r.text}")
+
+    def delete(self, app_thread_id: str) -> None:
+        self._session.delete(
+            self.url,
+            headers=self.headers,
+            params={"id": f"eq.{app_thread_id}"},
+            timeout=self.timeout,
+        )
+
+
+def _parse_ts(value: Any) -> float:
+    if not value:
+        return time.time()
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return time.time()
+
+
+class ThreadStore:
+    """LRU + TTL em memória na frente de um backend durável.
+
+    - `cache_ttl`: por quanto tempo uma entrada do LRU é confiável sem reler o backend
+    - `max_idle`: threads sem uso há mais que isso são descartadas (nova thread OpenAI)
+    """
+
+    def __init__(
+        self,
+        backend: ThreadBackend,
+        max_entries: int = 10_000,
+        cache_ttl: float = 3600,
+        max_idle: float | None = None,
+    ):
+        self.backend = backend
+        self.max_entries = max(1, int(max_entries))
+        self.cache_ttl = cache_ttl
+        self.max_idle = max_idle
+        self._cache: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._mutex = threading.Lock()
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.backend_errors = 0
+
+    def _cache_get(self, key: str) -> str | None:
+        with self._mutex:
+            item = self._cache.get(key)
+            if item is None:
+                return None
+            value, cached_at = item
+            if time.monotonic() - cached_at > self.cache_ttl:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, key: str, value: str) -> None:
+        with self._mutex:
+            self._cache[key] = (value, time.monotonic())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def get(self, app_thread_id: str) -> str | None:
+        cached = self._cache_get(app_thread_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        try:
+            found = self.backend.get(app_thread_id)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning(f"Thread store indisponível (get): {e}")
+            return None
+        if found is None:
+            return None
+        assistant_thread_id, updated_at = found
+        if self.max_idle and time.time() - updated_at > self.max_idle:
+            return None
+        self._cache_put(app_thread_id, assistant_thread_id)
+        return assistant_thread_id
+
+    def set(
+        self,
+        app_thread_id: str,
+        assistant_thread_id: str,
+        user_id: str | None = None,
+        channel: str | None = None,
+    ) -> None:
+        self._cache_put(app_thread_id, assistant_thread_id)
+        try:
+            self.backend.set(app_thread_id, assistant_thread_id, user_id=user_id, channel=channel)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning(f"Thread store indisponível (set): {e}")
+
+    def delete(self, app_thread_id: str) -> None:
+        with self._mutex:
+            self._cache.pop(app_thread_id, None)
+        try:
+            self.backend.delete(app_thread_id)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning(f"Thread store indisponível (delete): {e}")
+
+    async def aget(self, app_thread_id: str) -> str | None:
+        cached = self._cache_get(app_thread_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        return await asyncio.to_thread(self.get, app_thread_id)
+
+    async def aset(self, app_thread_id: str, assistant_thread_id: str, **kwargs: Any) -> None:
+        await asyncio.to_thread(self.set, app_thread_id, assistant_thread_id, **kwargs)
+
+    async def adelete(self, app_thread_id: str) -> None:
+        await asyncio.to_thread(self.delete, app_thread_id)
+
+    def lock(self, app_thread_id: str) -> asyncio.Lock:
+        """Lock por thread: a OpenAI rejeita mensagens novas enquanto um run está ativo"""
+        lk = self._locks.get(app_thread_id)
+        if lk is None:
+            lk = asyncio.Lock()
+            self._locks[app_thread_id] = lk
+        return lk
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self._cache),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "backend_errors": self.backend_errors,
+        }
+
+
+def build_thread_store_from_env() -> ThreadStore:
+    """Cria o ThreadStore a partir de THREAD_STORE_* (sqlite | supabase | memory)"""
+    kind = os.getenv("THREAD_STORE_BACKEND", "sqlite").strip().lower()
+    backend: ThreadBackend
+    if kind == "supabase":
+        url = os.getenv("SUPABASE_URL", "")
+        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+        if url and key:
+            backend = SupabaseSessionsBackend(url, key)
+        else:
+            logger.warning("THREAD_STORE_BACKEND=supabase sem SUPABASE_URL/KEY; usando SQLite")
+            backend = SqliteThreadBackend(os.getenv("THREAD_STORE_PATH", "tmp/aria_threads.db"))
+    elif kind == "memory":
+        backend = MemoryThreadBackend()
+    else:
+        backend = SqliteThreadBackend(os.getenv("THREAD_STORE_PATH", "tmp/aria_threads.db"))
+    max_idle = float(os.getenv("THREAD_MAX_IDLE_SECONDS", str(7 * 24 * 3600)))
+    return ThreadStore(
+        backend,
+        max_entries=int(os.getenv("THREAD_CACHE_SIZE", "10000")),
+        cache_ttl=float(os.getenv("THREAD_CACHE_TTL_SECONDS", "3600")),
+        max_idle=max_idle if max_idle > 0 else None,
+    )
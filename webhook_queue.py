@@ -0,0 +1,399 @@
+"""
+Fila de processamento dos webhooks do WhatsApp/Mindchat para o ARIA-SDR
+
+O webhook `/webhook/mindchat/whatsapp` roteava, consultava o RAG, chamava o
+LLM e enviava a resposta antes de devolver o 200; o Mindchat/Meta reenviava
+as entregas lentas e multiplicava a carga. Agora o endpoint só verifica a
+assinatura, grava cada mensagem no spool e responde; um grupo de workers
+asyncio processa a fila em segundo plano.
+
+- Spool durável em SQLite (WAL): itens só saem do spool depois de
+  processados, então um restart retoma o que ficou pendente
+- Fila particionada por chave (remetente): mensagens do mesmo número são
+  processadas em ordem, remetentes diferentes em paralelo
+- Backpressure: acima de WEBHOOK_QUEUE_MAX itens pendentes o enfileiramento
+  é recusado (o endpoint devolve 503 e o Mindchat reenvia depois)
+- Falhas são tentadas de novo com backoff até WEBHOOK_QUEUE_MAX_ATTEMPTS
+- Confirmação adiada: se o handler devolve um `asyncio.Future` (ex.: a
+  mensagem ficou no buffer do coalescer.py), o worker segue para o próximo
+  item e o spool só é limpo quando o future terminar
+- Métricas: profundidade, idade do item mais antigo, espera na fila e
+  tempo de processamento
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict[str, Any]], Awaitable[Any]]
+
+
+class QueueFull(Exception):
+    """Fila no limite: o chamador deve pedir reenvio (503/Retry-After)"""
+
+
+class MemorySpool:
+    """Spool volátil (testes ou WEBHOOK_QUEUE_SPOOL vazio)"""
+
+    def __init__(self):
+        self._rows: dict[int, tuple[str, str, float, int]] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def add(self, key: str, payload: dict[str, Any]) -> int:
+        with self._lock:
+            item_id = self._next_id
+            self._next_id += 1
+            self._rows[item_id] = (key, json.dumps(payload), time.time(), 0)
+        return item_id
+
+    def remove(self, item_id: int) -> None:
+        with self._lock:
+            self._rows.pop(item_id, None)
+
+    def bump(self, item_id: int) -> None:
+        with self._lock:
+            row = self._rows.get(item_id)
+            if row:
+                self._rows[item_id] = (*row[:3], row[3] + 1)
+
+    def pending(self) -> list[tuple[int, str, dict[str, Any], float, int]]:
+        with self._lock:
+            rows = sorted(self._rows.items())
+        return [(i, k, json.loads(p), t, a) for i, (k, p, t, a) in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteSpool(MemorySpool):
+    """Spool durável: arquivo SQLite local (WAL), uma linha por item pendente.
+
+    `table` permite vários spools no mesmo arquivo (ex.: outbound.py).
+    """
+
+    def __init__(self, path: str, table: str = "webhook_spool"):
+        if not table.isidentifier():
+            raise ValueError(f"Nome de tabela inválido: {table!r}")
+        self.path = path
+        self.table = table
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                attempts INT NOT NULL DEFAULT 0
+            )
+            """
+        )
+
+    def add(self, key: str, payload: dict[str, Any]) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                f"INSERT INTO {self.table} (key, payload, enqueued_at) VALUES (?, ?, ?)",
+                (key, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            return int(cur.lastrowid)
+
+    def remove(self, item_id: int) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE id = ?", (item_id,))
+
+    def bump(self, item_id: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE {self.table} SET attempts = attempts + 1 WHERE id = ?", (item_id,)
+            )
+
+    def pending(self) -> list[tuple[int, str, dict[str, Any], float, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, key, payload, enqueued_at, attempts FROM {self.table} ORDER BY id"
+            ).fetchall()
+        return [(int(i), k, json.loads(p), float(t), int(a)) for i, k, p, t, a in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self._conn.execute(f"SELECT count(*) FROM {self.table}").fetchone()[0])
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class WebhookQueue:
+    """Fila assíncrona com spool durável, particionada por remetente"""
+
+    def __init__(
+        self,
+        handler: Handler,
+        workers: int = 4,
+        max_size: int = 1000,
+        spool: MemorySpool | None = None,
+        max_attempts: int = 3,
+        retry_backoff_s: float = 1.0,
+    ):
+        self._handler = handler
+        self.workers = max(1, int(workers))
+        self.max_size = max(1, int(max_size))
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_backoff_s = max(0.0, float(retry_backoff_s))
+        self.spool = spool if spool is not None else MemorySpool()
+        self._shards: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        # item_id -> enqueued_at (epoch) dos itens ainda não concluídos
+        self._inflight: dict[int, float] = {}
+        self._deferred: set[asyncio.Task] = set()
+        self._accepting = False
+        # métricas
+        self._lock = threading.Lock()
+        self._waits: deque[float] = deque(maxlen=1024)
+        self._durations: deque[float] = deque(maxlen=1024)
+        self.enqueued = 0
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+        self.recovered = 0
+        self.deferred = 0
+
+    @property
+    def running(self) -> bool:
+        return self._accepting
+
+    @property
+    def depth(self) -> int:
+        return len(self._inflight)
+
+    async def start(self) -> None:
+        """Cria os workers e reenfileira o que ficou no spool"""
+        if self._accepting:
+            return
+        self._shards = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._shards]
+        pending = await asyncio.to_thread(self.spool.pending)
+        for item_id, key, payload, enqueued_at, attempts in pending:
+            self._put(item_id, key, payload, enqueued_at, attempts)
+        with self._lock:
+            self.recovered += len(pending)
+        if pending:
+            logger.info("Fila de webhooks: %d itens recuperados do spool", len(pending))
+        self._accepting = True
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Para de aceitar, espera drenar até `timeout` e encerra os workers.
+
+        O que não terminar continua no spool e é retomado no próximo start.
+        """
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        if self._shards:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(q.join() for q in self._shards)), timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+        # itens adiados (coalescer) terminam fora dos workers, às vezes com retentativa
+        while self._deferred and time.monotonic() < deadline:
+            await asyncio.wait(set(self._deferred), timeout=max(0.0, deadline - time.monotonic()))
+        for task in self._deferred:
+            task.cancel()
+        if self.depth:
+            logger.warning("Fila de webhooks: %d itens pendentes ficam no spool", self.depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks, self._shards = [], []
+        self._inflight.clear()
+        self._deferred.clear()
+
+    def enqueue(self, key: str, payload: dict[str, Any]) -> int:
+        """Grava no spool e agenda o processamento; levanta QueueFull no limite"""
+        return self.enqueue_many([(key, payload)])[0]
+
+    def enqueue_many(self, items: list[tuple[str, dict[str, Any]]]) -> list[int]:
+        """Enfileira todos os itens ou nenhum (um payload não é aceito pela metade)"""
+        if not self._accepting:
+            raise RuntimeError("Fila de webhooks não iniciada")
+        if self.depth + len(items) > self.max_size:
+            with self._lock:
+                self.rejected += len(items)
+            raise QueueFull(f"Fila de webhooks cheia ({self.depth}/{self.max_size})")
+        ids = []
+        for key, payload in items:
+            item_id = self.spool.add(key, payload)
+            self._put(item_id, key, payload, time.time(), 0)
+            ids.append(item_id)
+        with self._lock:
+            self.enqueued += len(ids)
+        return ids
+
+    def _put(self, item_id: int, key: str, payload: dict[str, Any], enqueued_at: float, attempts: int) -> None:
+        self._inflight[item_id] = enqueued_at
+        self._shard(key).put_nowait((item_id, key, payload, enqueued_at, attempts))
+
+    def _shard(self, key: str) -> asyncio.Queue:
+        return self._shards[zlib.crc32(key.encode("utf-8")) % len(self._shards)]
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            item_id, key, payload, enqueued_at, attempts = await queue.get()
+            deferred = False
+            try:
+                deferred = await self._process(item_id, key, payload, enqueued_at, attempts)
+            finally:
+                if not deferred:
+                    self._inflight.pop(item_id, None)
+                queue.task_done()
+
+    async def _process(
+        self, item_id: int, key: str, payload: dict[str, Any], enqueued_at: float, attempts: int
+    ) -> bool:
+        """Processa um item; True se a conclusão ficou adiada para um future"""
+        with self._lock:
+            self._waits.append(max(0.0, time.time() - enqueued_at) * 1000)
+        while True:
+            started = time.perf_counter()
+            try:
+                result = await self._handler(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                attempts += 1
+                if not await self._failed_attempt(item_id, attempts, e):
+                    break
+                # mesmo worker: mensagens seguintes do remetente esperam a retentativa
+                await asyncio.sleep(self._backoff(attempts))
+                continue
+            if isinstance(result, asyncio.Future):
+                self._defer(item_id, key, payload, enqueued_at, attempts, result, started)
+                return True
+            with self._lock:
+                self.processed += 1
+                self._durations.append((time.perf_counter() - started) * 1000)
+            break
+        await asyncio.to_thread(self.spool.remove, item_id)
+        return False
+
+    def _backoff(self, attempts: int) -> float:
+        return self.retry_backoff_s * 2 ** (attempts - 1)
+
+    async def _failed_attempt(self, item_id: int, attempts: int, error: Exception) -> bool:
+        """Registra uma tentativa falha; True se o item ainda pode ser tentado de novo"""
+        await asyncio.to_thread(self.spool.bump, item_id)
+        if attempts >= self.max_attempts:
+            logger.error("Webhook descartado após %d tentativas: %s", attempts, error)
+            with self._lock:
+                self.failed += 1
+            return False
+        logger.warning("Falha ao processar webhook (tentativa %d): %s", attempts, error)
+        with self._lock:
+            self.retried += 1
+        return True
+
+    def _defer(
+        self,
+        item_id: int,
+        key: str,
+        payload: dict[str, Any],
+        enqueued_at: float,
+        attempts: int,
+        fut: asyncio.Future,
+        started: float,
+    ) -> None:
+        with self._lock:
+            self.deferred += 1
+        task = asyncio.ensure_future(
+            self._await_deferred(item_id, key, payload, enqueued_at, attempts, fut, started)
+        )
+        self._deferred.add(task)
+        task.add_done_callback(self._deferred.discard)
+
+    async def _await_deferred(
+        self,
+        item_id: int,
+        key: str,
+        payload: dict[str, Any],
+        enqueued_at: float,
+        attempts: int,
+        fut: asyncio.Future,
+        started: float,
+    ) -> None:
+        """Conclui um item adiado: limpa o spool ou devolve o item à fila com backoff"""
+        try:
+            await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            # cancelado no shutdown: o item continua no spool
+            self._inflight.pop(item_id, None)
+            raise
+        except Exception as e:
+            attempts += 1
+            if await self._failed_attempt(item_id, attempts, e):
+                await asyncio.sleep(self._backoff(attempts))
+                if self._shards:
+                    # volta ao shard do remetente, como qualquer outra retentativa
+                    self._shard(key).put_nowait((item_id, key, payload, enqueued_at, attempts))
+                    return
+                # fila parada durante o backoff: o item fica no spool para o próximo start
+                self._inflight.pop(item_id, None)
+                return
+        else:
+            with self._lock:
+                self.processed += 1
+                self._durations.append((time.perf_counter() - started) * 1000)
+        self._inflight.pop(item_id, None)
+        await asyncio.to_thread(self.spool.remove, item_id)
+
+    def stats(self) -> dict[str, Any]:
+        oldest = min(self._inflight.values(), default=None)
+        with self._lock:
+            waits = sorted(self._waits)
+            durations = sorted(self._durations)
+            out: dict[str, Any] = {
+                "running": self._accepting,
+                "workers": self.workers,
+                "max_size": self.max_size,
+                "depth": self.depth,
+                "shard_depth": [q.qsize() for q in self._shards],
+                "oldest_age_s": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "retried": self.retried,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "recovered": self.recovered,
+                "deferred": self.deferred,
+            }
+        if waits:
+            out["queue_wait_ms_avg"] = round(sum(waits) / len(waits), 2)
+            out["queue_wait_ms_p95"] = round(waits[int(0.95 * (len(waits) - 1))], 2)
+        if durations:
+            out["process_ms_avg"] = round(sum(durations) / len(durations), 2)
+            out["process_ms_p95"] = round(durations[int(0.95 * (len(durations) - 1))], 2)
+        return out